@@ -6,15 +6,33 @@ Week 2: 完整 MLB Assistant
 1. 自動分類 query 類型
 2. 根據類型使用不同檢索策略
 3. 生成自然語言回答
+
+需要 LLM 分類時，檢索會與分類並行（延遲 = max(分類, 檢索) + 生成）
 """
 
 import json
 import os
-import pandas as pd
 import re
-from typing import Dict, List
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
 import requests
 
+from week6_player_index import PlayerTimelineIndex
+from week6_corpus_store import load_or_build_corpus
+from week6_derived_metrics import load_derived_metrics, get_derived_values, derived_value_columns
+from week6_ranking_engine import RankingEngine, parse_ranking_query
+from week6_team_cube import TeamCube, build_team_cube, load_team_cube, is_team_query
+from week6_prompt_builder import PromptBuilder
+from week6_llm_singleflight import SingleFlight, request_key
+from week6_llm_scheduler import LLMScheduler, LLMUnavailable, PRIORITY_INTERACTIVE
+from week6_llm_cassette import CassetteMiss, get_cassette
+from week6_stream_verifier import CONSTRAINED_SUFFIX, FactViolation, StreamingFactVerifier, verify_stream
+from week6_template_answers import FALLBACK_NOTE, factual_template, ranking_template, analysis_template
+from week6_embedding_sidecar import load_embedding_model
+from week6_ollama_stub import ollama_base_url
+
 print("=" * 80)
 print("MLB Team Manager Assistant")
 print("=" * 80)
@@ -25,7 +43,12 @@ print("=" * 80)
 
 DATA_DIR = "./mlb_data"
 OLLAMA_MODEL = "llama3.2"
-OLLAMA_BASE_URL = "http://localhost:11434"
+# OLLAMA_HOST 與 ollama 套件一致（可指向 week6_ollama_stub.py 替身伺服器）
+OLLAMA_BASE_URL = ollama_base_url()
+OLLAMA_KEEP_ALIVE = "30m"  # 模型與 KV cache 常駐，system prompt 前綴可跨請求重用
+LLM_MAX_CONCURRENCY = 1   # CPU 上的 Ollama 一次處理一個請求
+LLM_MAX_QUEUE = 16
+STREAM_FACT_CHECK = True  # 串流生成時即時驗證數字，錯誤時中止並重新生成
 
 print(f"\n配置：")
 print(f"  資料目錄：{DATA_DIR}")
@@ -40,64 +63,206 @@ print(f"\n[初始化] 載入組件...")
 # 載入 LanceDB
 try:
     import lancedb
-    from sentence_transformers import SentenceTransformer
     
     config_file = os.path.join(DATA_DIR, "search_config.json")
     with open(config_file, 'r') as f:
         config = json.load(f)
-    
-    db = lancedb.connect(config['db_path'])
-    table = db.open_table(config['table_name'])
-    model = SentenceTransformer(config['embedding_model'])
-    
-    print(f"  ✅ Vector Search 系統已載入")
 except Exception as e:
     print(f"  ❌ Vector Search 載入失敗：{e}")
     exit(1)
 
-# 載入原始數據
+# LanceDB 連線與 embedding 模型屬於開啟它們的程序：
+# LanceDB 的 async runtime 與 torch 的執行緒池不能跨 fork，fork 出來的 worker 各自開啟
+_vector_search = {'pid': None, 'table': None, 'model': None}
+_vector_search_lock = threading.Lock()
+
+def open_vector_search():
+    """
+    取得本程序的 (LanceDB table, embedding 模型)，第一次呼叫時開啟
+    
+    有 EMBEDDING_SOCKET → 共用 embedding sidecar（week6_embedding_sidecar.py），否則本機載入
+    """
+    with _vector_search_lock:
+        if _vector_search['pid'] != os.getpid():
+            db = lancedb.connect(config['db_path'])
+            _vector_search['table'] = db.open_table(config['table_name'])
+            _vector_search['model'] = load_embedding_model(config['embedding_model'])
+            _vector_search['pid'] = os.getpid()
+        return _vector_search['table'], _vector_search['model']
+
+# VECTOR_SEARCH_LAZY=1：延遲到第一次查詢（查詢服務多 worker 時在 fork 之後才開啟）
+if os.environ.get("VECTOR_SEARCH_LAZY") != "1":
+    try:
+        open_vector_search()
+        print(f"  ✅ Vector Search 系統已載入")
+    except Exception as e:
+        print(f"  ❌ Vector Search 載入失敗：{e}")
+        exit(1)
+
+# 載入原始數據（欄式語料陣列，mmap 載入：多個 worker 共用同一份，不保留逐列的 Python dict）
 docs_file = os.path.join(DATA_DIR, "mlb_documents.json")
-with open(docs_file, 'r', encoding='utf-8') as f:
-    all_documents = json.load(f)
-docs_df = pd.DataFrame(all_documents)
+corpus = load_or_build_corpus(docs_file)
+
+print(f"  ✅ 資料庫已載入：{len(corpus)} 筆記錄（語料陣列 {corpus.memory_report()['total_mb']} MB）")
 
-print(f"  ✅ 資料庫已載入：{len(docs_df)} 筆記錄")
+# 載入衍生指標（排名 / 百分位 / 逐年變化，由 week6_derived_metrics.py 建置）
+derived_df = load_derived_metrics(os.path.join(DATA_DIR, "mlb_derived_metrics.parquet"), expected_rows=len(corpus))
+if derived_df is not None:
+    print(f"  ✅ 衍生指標已載入：{derived_df.shape[1]} 個欄位")
+else:
+    print(f"  ⚠️  未載入衍生指標（執行 week6_derived_metrics.py 建置）")
+
+# 建立球員時間軸索引（Analysis 查詢用）
+player_index = PlayerTimelineIndex(derived=derived_df, corpus=corpus)
+print(f"  ✅ 球員時間軸索引已建立：{len(player_index)} 位球員")
+
+# 建立排名引擎（Ranking 查詢用，直接使用語料陣列：stat 欄位為統計矩陣的 view，字串欄位為字典代碼）
+ranking_engine = RankingEngine(corpus=corpus)
+print(f"  ✅ 排名引擎已建立")
+
+# 衍生指標只保留數值欄位（Ranking 附上百分位 / 逐年變化用），不保留含字串欄位的完整表
+derived_df = derived_value_columns(derived_df)
+
+# 球隊聚合立方體（球隊層級排名用，未建置時由語料即時聚合）
+cube_df = load_team_cube(os.path.join(DATA_DIR, "mlb_team_cube.parquet"), expected_rows=len(corpus))
+team_cube = TeamCube(cube_df if cube_df is not None else build_team_cube(corpus.to_wide()))
+print(f"  ✅ 球隊聚合立方體已載入：{len(team_cube)} 列")
+
+# Prompt 組裝器（相關統計挑選 + 各路由 token 預算）
+prompt_builder = PromptBuilder()
+
+# 合併相同的進行中 LLM 請求
+llm_singleflight = SingleFlight()
+
+# LLM 准入控制（有界優先佇列 + 截止時間 + 熔斷器）
+llm_scheduler = LLMScheduler(max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE)
+
+# 先行檢索執行緒池（LLM 分類時並行執行 embedding + 向量搜尋 / 排名）
+retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mlb-retrieval")
+
+# LLM 錄製 / 重播（LLM_CASSETTE_MODE=record / replay / auto，評估用）
+llm_cassette = get_cassette()
+if llm_cassette.active:
+    print(f"  ✅ {llm_cassette.report()}")
 
 # ============================================
 # LLM 接口
 # ============================================
 
-def call_llm(prompt: str, max_tokens: int = 500) -> str:
-    """調用 Ollama LLM"""
-    try:
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": OLLAMA_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": max_tokens,
-                }
-            },
-            timeout=60
+def _generate_payload(prompt: str, max_tokens: int, system: str = None, stream: bool = False) -> Dict:
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {
+            "temperature": 0.7,
+            "num_predict": max_tokens,
+        }
+    }
+    if system:
+        payload["system"] = system
+    return payload
+
+def _payload_key(payload: Dict) -> str:
+    return request_key(payload["model"], payload["prompt"], payload["options"], payload.get("system"))
+
+def _post_generate(payload: Dict, timeout: float = 60) -> Dict:
+    response = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"LLM 錯誤：{response.status_code}")
+    return response.json()
+
+def _stream_generate(payload: Dict, priority: int, deadline: float, route: str = None):
+    """
+    逐段產生 Ollama 串流輸出（每行一個 JSON），整段串流期間持有排程名額
+    
+    最後一段（done）帶有 prompt_eval_count → 記錄到 prompt_builder（與 call_llm 相同的校正）
+    """
+    with llm_scheduler.slot(priority, deadline) as timeout:
+        with requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"LLM 錯誤：{response.status_code}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('response'):
+                    yield chunk['response']
+                if chunk.get('done'):
+                    if route:
+                        prompt_builder.record_actual(route, chunk.get('prompt_eval_count'))
+                    break
+
+def call_llm(prompt: str, max_tokens: int = 500, system: str = None, route: str = None) -> str:
+    """
+    調用 Ollama LLM
+    
+    system：固定的 system prompt（每個路由內容不變，Ollama 可重用 KV cache）
+    route：用於記錄 Ollama 回報的實際 prompt token 數
+    相同 (model, prompt, options) 的進行中請求會合併成一次上游呼叫；
+    上游呼叫經過准入控制（優先序 / 截止時間來自 llm_scheduler.request_context）
+    cassette 啟用時先查錄製的回應（重播不經過排程器）
+    
+    Raises:
+        LLMUnavailable：被排程器拒絕或 Ollama 錯誤，呼叫端改用模板回答
+        CassetteMiss：replay 模式下沒有錄製這個請求（不改用模板，避免評估結果失真）
+    """
+    payload = _generate_payload(prompt, max_tokens, system)
+    key = _payload_key(payload)
+    
+    def live_call():
+        result, shared = llm_singleflight.do(
+            key,
+            lambda: llm_scheduler.run(lambda timeout: _post_generate(payload, timeout))
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['response'].strip()
-        else:
-            return f"LLM 錯誤：{response.status_code}"
+        if route and not shared:
+            prompt_builder.record_actual(route, result.get('prompt_eval_count'))
+        return {'response': result['response'], 'prompt_eval_count': result.get('prompt_eval_count')}
+    
+    try:
+        result = llm_cassette.call(key, 'generate', live_call) if llm_cassette.active else live_call()
+    except (LLMUnavailable, CassetteMiss):
+        raise
     except Exception as e:
-        return f"LLM 調用失敗：{e}"
+        raise LLMUnavailable('error', f"LLM 調用失敗：{e}") from e
+    
+    return result['response'].strip()
+
+def call_llm_stream(prompt: str, max_tokens: int = 500, system: str = None, route: str = None):
+    """
+    串流調用 Ollama LLM（逐段 yield 文字）
+    
+    相同請求共用一條上游串流：後加入者先取得已產生的內容，再跟著即時輸出
+    route：同 call_llm（只有實際開啟上游串流的請求會記錄）
+    
+    Raises:
+        LLMUnavailable：同 call_llm
+    """
+    payload = _generate_payload(prompt, max_tokens, system, stream=True)
+    
+    # 上游在 single-flight 的背景執行緒讀取，優先序 / 截止時間需先取出
+    priority = llm_scheduler.current_priority()
+    deadline = llm_scheduler.current_deadline()
+    
+    key = _payload_key(payload)
+    
+    def live_stream():
+        return llm_singleflight.stream(key, lambda: _stream_generate(payload, priority, deadline, route))
+    
+    try:
+        yield from (llm_cassette.stream(key, 'generate_stream', live_stream) if llm_cassette.active else live_stream())
+    except (LLMUnavailable, CassetteMiss):
+        raise
+    except Exception as e:
+        raise LLMUnavailable('error', f"LLM 調用失敗：{e}") from e
 
 # ============================================
 # Query 分類器
 # ============================================
 
-def classify_query(query: str) -> str:
-    """分類 query 類型"""
+def classify_by_rules(query: str) -> Optional[str]:
+    """規則分類（關鍵詞比對）；無法判斷時回傳 None，交由 LLM 分類"""
     
     query_lower = query.lower()
     
@@ -130,21 +295,17 @@ def classify_query(query: str) -> str:
         if keyword in query_lower:
             return 'analysis'
     
-    # 規則 3：如果沒有明確關鍵詞，使用 LLM 分類
-    prompt = f"""You are a query classifier for a baseball statistics system.
+    return None
 
-Classify the following query into ONE of these types:
-
-1. **factual**: Query asks for specific data about a specific player
-2. **ranking**: Query asks for top/best/worst players or comparisons
-3. **analysis**: Query asks for explanation, reasoning, or deep analysis
-
-Query: "{query}"
-
-CRITICAL: Respond with ONLY ONE WORD: factual, ranking, or analysis
-"""
+def classify_by_llm(query: str) -> str:
+    """LLM 分類（規則無法判斷時使用）"""
     
-    response = call_llm(prompt, max_tokens=10)
+    system, prompt = prompt_builder.classify(query)
+    try:
+        response = call_llm(prompt, max_tokens=10, system=system, route='classify')
+    except LLMUnavailable as e:
+        print(f"    ⚠️  LLM 分類不可用（{e.reason}），使用預設類型")
+        response = ""
     response_lower = response.lower().strip()
     
     if 'factual' in response_lower:
@@ -156,185 +317,104 @@ CRITICAL: Respond with ONLY ONE WORD: factual, ranking, or analysis
     else:
         return 'factual'  # 預設
 
+def classify_query(query: str) -> str:
+    """分類 query 類型"""
+    
+    # 規則 1-2：關鍵詞；規則 3：如果沒有明確關鍵詞，使用 LLM 分類
+    return classify_by_rules(query) or classify_by_llm(query)
+
 # ============================================
 # 檢索函數
 # ============================================
 
 def vector_search(query: str, k: int = 3) -> List[Dict]:
     """Vector Search"""
+    table, model = open_vector_search()
     query_embedding = model.encode(query).tolist()
     results = table.search(query_embedding).limit(k).to_list()
     return results
 
 def ranking_search(query: str, top_n: int = 5) -> Dict:
-    """Ranking Search with 門檻過濾"""
-    
-    query_lower = query.lower()
-    
-    # 統計項目映射
-    batter_stats = {
-        'wrc+': ('stat_wRC+', False),
-        'wrc plus': ('stat_wRC+', False),
-        'woba': ('stat_wOBA', False),
-        'ops': ('stat_OPS', False),
-        'home run': ('stat_HR', False),
-        'hr': ('stat_HR', False),
-        'avg': ('stat_AVG', False),
-        'average': ('stat_AVG', False),
-        'obp': ('stat_OBP', False),
-        'slg': ('stat_SLG', False),
-    }
-    
-    pitcher_stats = {
-        'era': ('stat_ERA', True),
-        'whip': ('stat_WHIP', True),
-        'fip': ('stat_FIP', True),
-        'k/9': ('stat_K_9', False),
-        'strikeout': ('stat_K_9', False),
-    }
-    
-    # 識別統計項目
-    stat_col = None
-    player_type = None
-    ascending = True
-    
-    for keyword, (col, is_ascending) in batter_stats.items():
-        if keyword in query_lower:
-            stat_col = col
-            player_type = 'batter'
-            ascending = is_ascending
-            break
-    
-    if not stat_col:
-        for keyword, (col, is_ascending) in pitcher_stats.items():
-            if keyword in query_lower:
-                stat_col = col
-                player_type = 'pitcher'
-                ascending = is_ascending
-                break
-    
-    if not stat_col:
-        stat_col = 'stat_WAR'
-        ascending = False
-        player_type = 'batter' if 'batter' in query_lower or 'hitter' in query_lower else 'pitcher'
-    
-    # 過濾和排序
-    filtered_df = docs_df[docs_df['type'] == player_type].copy()
-    
-    # 年份過濾（動態）
-    year_pattern = r'\b(202[0-9])\b'
-    match = re.search(year_pattern, query)
-    
-    if match:
-        target_year = int(match.group(1))
-        filtered_df = filtered_df[filtered_df['season'] == target_year]
-    else:
-        # 如果沒指定年份，使用最新賽季
-        max_season = filtered_df['season'].max()
-        filtered_df = filtered_df[filtered_df['season'] == max_season]
-    
-    filtered_df['sort_stat'] = filtered_df['stats'].apply(
-        lambda x: x.get(stat_col.replace('stat_', ''), 0) if isinstance(x, dict) else 0
-    )
+    """Ranking Search（統計註冊表 + 排名引擎：支援球隊 / 位置 / 年齡 / 多賽季）"""
     
-    filtered_df = filtered_df[filtered_df['sort_stat'] > 0]
-    
-    # 樣本門檻
-    if player_type == 'batter':
-        filtered_df['pa'] = filtered_df['stats'].apply(
-            lambda x: x.get('PA', 0) if isinstance(x, dict) else 0
-        )
-        filtered_df = filtered_df[filtered_df['pa'] >= 100]
-    elif player_type == 'pitcher':
-        filtered_df['ip'] = filtered_df['stats'].apply(
-            lambda x: x.get('IP', 0) if isinstance(x, dict) else 0
-        )
-        filtered_df = filtered_df[filtered_df['ip'] >= 20]
+    # 球隊層級排名（"Which team hit the most home runs"）→ 聚合立方體
+    if is_team_query(query):
+        return team_cube.rank(parse_ranking_query(query, top_n))
     
-    sorted_df = filtered_df.sort_values('sort_stat', ascending=ascending)
-    top_players = sorted_df.head(top_n)
+    ranking_results = ranking_engine.rank(query, top_n=top_n)
     
-    results = []
-    for idx, row in top_players.iterrows():
-        results.append({
-            'rank': len(results) + 1,
-            'name': row['player_name'],
-            'team': row['team'],
-            'stat_value': row['sort_stat'],
-            'stat_name': stat_col.replace('stat_', ''),
-            'type': row['type']
-        })
+    # 單一賽季：附上預先計算的聯盟百分位 / 逐年變化
+    for r in ranking_results['results']:
+        if 'doc_idx' in r:
+            derived = get_derived_values(derived_df, r['doc_idx'], r['stat_name'])
+            r['percentile'] = derived.get('pct')
+            r['yoy'] = derived.get('yoy')
     
-    return {
-        'stat_name': stat_col.replace('stat_', ''),
-        'player_type': player_type,
-        'results': results
-    }
+    return ranking_results
 
 # ============================================
 # LLM 回答生成
 # ============================================
 
-def generate_factual_answer(query: str, search_results: List[Dict]) -> str:
-    """生成 Factual 查詢的回答"""
-    
-    if not search_results:
-        return "抱歉，我找不到相關的球員數據。"
+# 即時事實驗證統計
+fact_check_stats = {'generations': 0, 'aborted': 0, 'reprompt_ok': 0, 'template': 0}
+
+def generate_verified(prompt: str, max_tokens: int, system: str, route: str, data: Optional[Dict] = None) -> str:
+    """
+    串流生成並即時驗證數字（資料與 prompt 中沒有的數字 → 立即中止生成）
     
-    player = search_results[0]
+    中止後以限制 prompt 重新生成一次（非串流，完整驗證）
     
-    # 提取所有統計數據
-    stats_dict = {}
-    for key, value in player.items():
-        if key.startswith('stat_'):
-            stat_name = key.replace('stat_', '')
-            stats_dict[stat_name] = value
+    Raises:
+        LLMUnavailable：同 call_llm
+        FactViolation：重新生成仍有不一致的數字（呼叫端改用模板回答）
+    """
     
-    # 格式化為易讀的文字
-    stats_lines = []
-    for stat_name, value in stats_dict.items():
-        if value > 0:
-            if isinstance(value, float):
-                stats_lines.append(f"  - {stat_name}: {value:.3f}")
-            else:
-                stats_lines.append(f"  - {stat_name}: {value}")
+    if not STREAM_FACT_CHECK:
+        return call_llm(prompt, max_tokens=max_tokens, system=system, route=route)
     
-    stats_text = "\n".join(stats_lines[:15])  # 前15個統計
+    fact_check_stats['generations'] += 1
+    verifier = StreamingFactVerifier(data, reference_texts=[prompt])
+    try:
+        return "".join(verify_stream(call_llm_stream(prompt, max_tokens, system, route), verifier)).strip()
+    except FactViolation as e:
+        fact_check_stats['aborted'] += 1
+        print(f"    ⚠️  {e}，中止生成並以限制 prompt 重新生成")
     
-    prompt = f"""You are a baseball statistics assistant. Answer the query in a structured way.
-
-Query: {query}
-
-Player Information:
-- Name: {player['player_name']}
-- Team: {player['team']}
-- Season: {player['season']}
-- Position: {player['position']}
-- Type: {player['type']}
-
-Statistics:
-{stats_text}
-
-CRITICAL INSTRUCTIONS:
-1. ALWAYS start with the direct answer to the question (the specific number)
-2. Keep the first sentence SHORT and DIRECT
-3. Then provide brief context if helpful (1-2 sentences)
-4. Use the exact statistics provided above
-5. Do NOT say data is unavailable
-
-Response Structure:
-[Direct Answer with Number] + [Optional Brief Context]
+    return regenerate_constrained(prompt, max_tokens, system, route, data)
 
-Examples:
-Query: "What is Aaron Judge's wRC+?"
-Answer: "Aaron Judge's wRC+ is 220.0 in the 2024 season. This indicates he is performing exceptionally well, creating runs at more than twice the league average rate."
-
-Query: "How many home runs did Juan Soto hit?"
-Answer: "Juan Soto hit 41 home runs in the 2024 season."
+def regenerate_constrained(prompt: str, max_tokens: int, system: str, route: str, data: Optional[Dict] = None) -> str:
+    """
+    串流驗證中止後的重新生成：附加「只能使用資料中的數字」限制，完整驗證後回傳
+    
+    Raises:
+        LLMUnavailable：同 call_llm
+        FactViolation：仍有不一致的數字
+    """
+    
+    answer = call_llm(prompt + CONSTRAINED_SUFFIX, max_tokens=max_tokens, system=system, route=route)
+    violation = StreamingFactVerifier(data, reference_texts=[prompt]).verify_text(answer)
+    if violation:
+        fact_check_stats['template'] += 1
+        raise FactViolation(violation['number'], violation['context'])
+    fact_check_stats['reprompt_ok'] += 1
+    return answer
 
-Now answer the query:"""
+def generate_factual_answer(query: str, search_results: List[Dict]) -> str:
+    """生成 Factual 查詢的回答（只放入與查詢相關的統計）"""
     
-    return call_llm(prompt, max_tokens=150)
+    if not search_results:
+        return "抱歉，我找不到相關的球員數據。"
+    
+    system, prompt = prompt_builder.factual(query, search_results[0])
+    try:
+        return generate_verified(prompt, 150, system, 'factual', {'top_result': search_results[0]})
+    except LLMUnavailable as e:
+        print(f"    ⚠️  LLM 不可用（{e.reason}），改用資料摘要")
+        return factual_template(query, search_results[0])
+    except FactViolation as e:
+        print(f"    ⚠️  重新生成仍有錯誤數字（{e.number:g}），改用資料摘要")
+        return factual_template(query, search_results[0])
 
 def generate_ranking_answer(query: str, ranking_results: Dict) -> str:
     """生成 Ranking 查詢的回答"""
@@ -342,191 +422,174 @@ def generate_ranking_answer(query: str, ranking_results: Dict) -> str:
     if not ranking_results['results']:
         return "抱歉，找不到符合條件的球員。"
     
-    # 建立排名列表
-    ranking_text = []
-    for r in ranking_results['results']:
-        ranking_text.append(
-            f"{r['rank']}. {r['name']} ({r['team']}) - {r['stat_name']}: {r['stat_value']:.3f}"
-        )
-    
-    ranking_str = "\n".join(ranking_text)
-    
-    prompt = f"""Based on the following baseball statistics ranking, provide a structured answer.
-
-Query: {query}
-
-Top Players by {ranking_results['stat_name']}:
-{ranking_str}
-
-CRITICAL INSTRUCTIONS:
-1. ALWAYS start with a brief introduction using "根據 [stat] 數據，排名如下："
-2. Then list the top 3-5 players concisely
-3. THEN provide optional analysis (2-3 sentences)
-4. Be OBJECTIVE - all listed players are performing excellently
-5. Do NOT make negative comments about ANY player on the list
-6. Use ONLY Chinese or English - NO other languages (no Thai, Japanese, etc.)
-7. Keep the language natural and professional
-
-Response Structure:
-[Brief Introduction: "根據...數據，排名如下："]
-[Rankings 1-5]
-[Brief Analysis]
-
-Good Example:
-"根據 2024 賽季 wRC+ 數據，排名如下：
-1. Aaron Judge (NYY) - 220.0
-2. Juan Soto (NYY) - 181.0
-3. Shohei Ohtani (LAD) - 180.0
-4. Kyle Tucker (HOU) - 179.0
-5. Bobby Witt Jr. (KCR) - 169.0
+    system, prompt = prompt_builder.ranking(query, ranking_results)
+    try:
+        return generate_verified(prompt, 200, system, 'ranking', ranking_results)
+    except LLMUnavailable as e:
+        print(f"    ⚠️  LLM 不可用（{e.reason}），改用資料摘要")
+        return ranking_template(ranking_results)
+    except FactViolation as e:
+        print(f"    ⚠️  重新生成仍有錯誤數字（{e.number:g}），改用資料摘要")
+        return ranking_template(ranking_results)
 
-Aaron Judge 以 220.0 的 wRC+ 領先全聯盟，展現卓越的打擊能力。Juan Soto 和 Shohei Ohtani 也都有優異的表現，證明他們是聯盟中的頂尖打者。"
+def generate_analysis_answer(query: str, player_name: str, stats_over_time: List[Dict]) -> str:
+    """生成 Analysis 查詢的回答（附上預先計算的排名 / 百分位 / 逐年變化）"""
+    
+    system, prompt = prompt_builder.analysis(query, player_name, stats_over_time)
+    try:
+        # 分析回答的數字都來自 prompt 中的逐季數據
+        return generate_verified(prompt, 250, system, 'analysis')
+    except LLMUnavailable as e:
+        print(f"    ⚠️  LLM 不可用（{e.reason}），改用資料摘要")
+        return analysis_template(player_name, stats_over_time)
+    except FactViolation as e:
+        print(f"    ⚠️  重新生成仍有錯誤數字（{e.number:g}），改用資料摘要")
+        return analysis_template(player_name, stats_over_time)
 
-IMPORTANT: Use simple Chinese words. Avoid rare or foreign characters.
+# ============================================
+# 主要 Assistant 函數
+# ============================================
 
-Now answer the query:"""
+def speculative_retrieve(query: str) -> Dict[str, Future]:
+    """
+    在 LLM 分類進行時，先行啟動各路由可能需要的檢索
     
-    return call_llm(prompt, max_tokens=200)
+    - vector：Factual（k=3）與 Analysis（取第 1 筆）共用
+    - ranking：排名引擎 / 球隊立方體（毫秒等級）
+    """
+    return {
+        'vector': retrieval_executor.submit(vector_search, query, 3),
+        'ranking': retrieval_executor.submit(ranking_search, query, 5),
+    }
 
-def generate_analysis_answer(query: str, player_name: str, stats_over_time: List[Dict]) -> str:
-    """生成 Analysis 查詢的回答"""
+def classify_and_retrieve(query: str) -> Dict:
+    """
+    分類 + 檢索
     
-    # 整理多賽季數據
-    seasons_text = []
-    for season_data in stats_over_time:
-        season = season_data['season']
-        stats = season_data['stats']
-        
-        # 選擇關鍵統計
-        if season_data['type'] == 'batter':
-            key_stats = f"wRC+: {stats.get('wRC+', 'N/A')}, OPS: {stats.get('OPS', 'N/A')}, HR: {stats.get('HR', 'N/A')}"
-        else:
-            key_stats = f"ERA: {stats.get('ERA', 'N/A')}, WHIP: {stats.get('WHIP', 'N/A')}, K/9: {stats.get('K/9', 'N/A')}"
-        
-        seasons_text.append(f"{season}: {key_stats}")
+    規則可判斷 → 只執行該路由的檢索
+    需要 LLM 分類 → 分類與檢索並行，延遲 = max(分類, 檢索)；
+                    未使用的分支若尚未開始則取消，已開始則捨棄結果
     
-    seasons_str = "\n".join(seasons_text)
+    Returns:
+        {'query_type', 'vector_results', 'ranking_results', 'speculative', 'classify_ms', 'retrieve_ms'}
+    """
     
-    prompt = f"""Based on multi-season baseball statistics, provide an analytical answer.
-
-Query: {query}
-
-Player: {player_name}
-Performance Over Time:
-{seasons_str}
-
-CRITICAL INSTRUCTIONS:
-1. ALWAYS start with a brief conclusion (1 sentence)
-2. THEN provide detailed analysis with specific data (2-3 sentences)
-3. Focus on trends, improvements, or patterns
-4. Use the actual statistics provided
-5. Be objective and data-driven
-
-Response Structure:
-[Brief Conclusion] + [Detailed Analysis with Data]
-
-Good Example:
-"Aaron Judge's exceptional performance is driven by his elite power and plate discipline. His wRC+ improved from 173 in 2023 to 220 in 2024, while his home run total jumped from 37 to 58, demonstrating significant growth in power production. Combined with his improved OPS from 1.019 to 1.159, these metrics show he has refined his approach to become one of baseball's most dominant hitters."
-
-Now answer the query:"""
+    start_time = time.perf_counter()
+    query_type = classify_by_rules(query)
+    speculative = query_type is None
     
-    return call_llm(prompt, max_tokens=250)
-
-# ============================================
-# 主要 Assistant 函數
-# ============================================
+    if speculative:
+        futures = speculative_retrieve(query)
+        query_type = classify_by_llm(query)
+        classify_ms = (time.perf_counter() - start_time) * 1000
+        
+        needed = 'ranking' if query_type == 'ranking' else 'vector'
+        for name, future in futures.items():
+            if name != needed:
+                future.cancel()
+        result = futures[needed].result()
+    else:
+        classify_ms = (time.perf_counter() - start_time) * 1000
+        result = ranking_search(query, top_n=5) if query_type == 'ranking' else vector_search(query, k=3)
+    
+    return {
+        'query_type': query_type,
+        'vector_results': result if query_type != 'ranking' else None,
+        'ranking_results': result if query_type == 'ranking' else None,
+        'speculative': speculative,
+        'classify_ms': classify_ms,
+        'retrieve_ms': (time.perf_counter() - start_time) * 1000 - classify_ms,
+    }
 
-def mlb_assistant(query: str) -> Dict:
+def mlb_assistant(query: str, priority: int = PRIORITY_INTERACTIVE, deadline_s: float = None) -> Dict:
     """
     MLB Assistant 主函數
     
+    Args:
+        priority: LLM 排程優先序（互動 PRIORITY_INTERACTIVE / 批次評估 PRIORITY_BATCH）
+        deadline_s: 整個請求的 LLM 截止時間（秒），None 使用優先序的預設值；
+                    趕不上時直接回傳純資料的模板回答
+    
     Returns:
         {
             'query': str,
             'query_type': str,
             'answer': str,
-            'data': dict (原始數據)
+            'data': dict (原始數據),
+            'timings': dict (各階段毫秒數),
+            'fallback': bool (是否為模板回答)
         }
     """
     
+    with llm_scheduler.request_context(priority=priority, deadline_s=deadline_s):
+        result = _run_assistant(query)
+    
+    result['fallback'] = result['answer'].startswith(FALLBACK_NOTE)
+    return result
+
+def _run_assistant(query: str) -> Dict:
+    """分類 → 檢索 → 生成"""
+    
     print(f"\n{'='*80}")
     print(f"Query: {query}")
     print(f"{'='*80}")
     
-    # Step 1: 分類
-    print(f"\n[1] 分類查詢類型...")
-    query_type = classify_query(query)
-    print(f"    類型：{query_type}")
-    
-    # Step 2: 檢索
-    print(f"\n[2] 執行檢索...")
+    # Step 1-2: 分類 + 檢索（需要 LLM 分類時並行執行）
+    print(f"\n[1] 分類查詢類型 + 執行檢索...")
+    retrieval = classify_and_retrieve(query)
+    query_type = retrieval['query_type']
+    print(f"    類型：{query_type}（{'LLM 分類，檢索並行' if retrieval['speculative'] else '規則分類'}）")
     
-    if query_type == 'factual':
-        print(f"    策略：Vector Search")
-        search_results = vector_search(query, k=3)
-        print(f"    ✅ 找到 {len(search_results)} 筆結果")
-        
-        # Step 3: 生成回答
-        print(f"\n[3] 生成回答...")
-        answer = generate_factual_answer(query, search_results)
-        
-        return {
-            'query': query,
-            'query_type': query_type,
-            'answer': answer,
-            'data': {
-                'top_result': search_results[0] if search_results else None,
-                'all_results': search_results
-            }
-        }
+    timings = {
+        'classify_ms': retrieval['classify_ms'],
+        'retrieve_ms': retrieval['retrieve_ms'],
+    }
     
-    elif query_type == 'ranking':
+    if query_type == 'ranking':
         print(f"    策略：資料庫排序")
-        ranking_results = ranking_search(query, top_n=5)
+        ranking_results = retrieval['ranking_results']
         print(f"    ✅ 找到 Top {len(ranking_results['results'])}")
         
         # Step 3: 生成回答
-        print(f"\n[3] 生成回答...")
+        print(f"\n[2] 生成回答...")
+        generate_start = time.perf_counter()
         answer = generate_ranking_answer(query, ranking_results)
+        timings['generate_ms'] = (time.perf_counter() - generate_start) * 1000
         
         return {
             'query': query,
             'query_type': query_type,
             'answer': answer,
-            'data': ranking_results
+            'data': ranking_results,
+            'timings': timings
         }
     
     elif query_type == 'analysis':
         print(f"    策略：多維檢索")
-        # Vector search 找主要球員
-        search_results = vector_search(query, k=1)
+        # Vector search 找主要球員（使用第 1 筆結果）
+        search_results = retrieval['vector_results'][:1]
         if not search_results:
             return {
                 'query': query,
                 'query_type': query_type,
                 'answer': '抱歉，找不到相關球員數據。',
-                'data': None
+                'data': None,
+                'timings': timings
             }
         
         player_name = search_results[0]['player_name']
         print(f"    主要球員：{player_name}")
         
-        # 收集多賽季數據
-        player_data = docs_df[docs_df['player_name'] == player_name].sort_values('season')
-        stats_over_time = []
-        for idx, row in player_data.iterrows():
-            stats_over_time.append({
-                'season': row['season'],
-                'team': row['team'],
-                'type': row['type'],
-                'stats': row['stats']
-            })
+        # 收集多賽季數據（時間軸索引 O(1) 查詢）
+        stats_over_time = player_index.get_stats_over_time(player_name)
         
         print(f"    ✅ 收集到 {len(stats_over_time)} 個賽季數據")
         
         # Step 3: 生成回答
-        print(f"\n[3] 生成回答...")
+        print(f"\n[2] 生成回答...")
+        generate_start = time.perf_counter()
         answer = generate_analysis_answer(query, player_name, stats_over_time)
+        timings['generate_ms'] = (time.perf_counter() - generate_start) * 1000
         
         return {
             'query': query,
@@ -535,7 +598,30 @@ def mlb_assistant(query: str) -> Dict:
             'data': {
                 'player_name': player_name,
                 'stats_over_time': stats_over_time
-            }
+            },
+            'timings': timings
+        }
+    
+    else:
+        print(f"    策略：Vector Search")
+        search_results = retrieval['vector_results']
+        print(f"    ✅ 找到 {len(search_results)} 筆結果")
+        
+        # Step 3: 生成回答
+        print(f"\n[2] 生成回答...")
+        generate_start = time.perf_counter()
+        answer = generate_factual_answer(query, search_results)
+        timings['generate_ms'] = (time.perf_counter() - generate_start) * 1000
+        
+        return {
+            'query': query,
+            'query_type': query_type,
+            'answer': answer,
+            'data': {
+                'top_result': search_results[0] if search_results else None,
+                'all_results': search_results
+            },
+            'timings': timings
         }
 
 # ============================================
@@ -575,6 +661,17 @@ if __name__ == "__main__":
     
     print(f"\n💾 測試結果已儲存：{output_file}")
     
+    # Prompt token 使用（估算 / Ollama 實際回報）
+    print("\n📊 Prompt Token 使用：")
+    for route, usage in prompt_builder.report().items():
+        actual = f"{usage['avg_actual_tokens']:.0f}" if usage['avg_actual_tokens'] is not None else "N/A"
+        print(f"  {route}: 平均 {usage['avg_prompt_tokens']:.0f} tokens（預算 {usage['budget']}，"
+              f"system {usage['system_tokens']}，實際 {actual}，刪減 {usage['dropped_lines']} 行）")
+    
+    if fact_check_stats['generations']:
+        print(f"\n🔎 即時事實驗證：{fact_check_stats['generations']} 次生成，中止 {fact_check_stats['aborted']} 次"
+              f"（重新生成通過 {fact_check_stats['reprompt_ok']}，改用模板 {fact_check_stats['template']}）")
+    
     print("\n" + "=" * 80)
     print("✨ MLB Assistant 測試完成！")
     print("=" * 80)
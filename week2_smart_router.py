@@ -6,6 +6,9 @@ Week 2: 智能路由系統
 1. Factual → Vector Search → 提取數據
 2. Ranking → 資料庫排序 → Top N
 3. Analysis → 多維檢索 → LLM 分析
+
+球隊層級的 Factual / Ranking 查詢（"Which team ..."、"Yankees team ERA"）
+改由球隊聚合立方體回答
 """
 
 import json
@@ -14,6 +17,11 @@ import pandas as pd
 import re
 from typing import Dict, List
 
+from week6_player_index import PlayerTimelineIndex
+from week6_derived_metrics import load_derived_metrics, get_derived_values, flatten_documents
+from week6_ranking_engine import RankingEngine, parse_ranking_query, parse_seasons
+from week6_team_cube import TeamCube, build_team_cube, load_team_cube, is_team_query
+
 print("=" * 80)
 print("智能路由系統")
 print("=" * 80)
@@ -55,6 +63,25 @@ with open(docs_file, 'r', encoding='utf-8') as f:
 docs_df = pd.DataFrame(all_documents)
 print(f"  ✅ 原始數據已載入：{len(docs_df)} 筆")
 
+# 載入衍生指標（排名 / 百分位 / 逐年變化，由 week6_derived_metrics.py 建置）
+derived_df = load_derived_metrics(os.path.join(DATA_DIR, "mlb_derived_metrics.parquet"), expected_rows=len(docs_df))
+if derived_df is not None:
+    print(f"  ✅ 衍生指標已載入：{derived_df.shape[1]} 個欄位")
+
+# 建立球員時間軸索引（Analysis 查詢用）
+player_index = PlayerTimelineIndex(docs_df, derived_df)
+print(f"  ✅ 球員時間軸索引已建立：{len(player_index)} 位球員")
+
+# 建立排名引擎（Ranking 查詢用，衍生指標檔已含攤平後的 stat_ 欄位）
+wide_df = derived_df if derived_df is not None else flatten_documents(docs_df)
+ranking_engine = RankingEngine(wide_df)
+print(f"  ✅ 排名引擎已建立")
+
+# 球隊聚合立方體（球隊層級查詢用，未建置時即時聚合）
+cube_df = load_team_cube(os.path.join(DATA_DIR, "mlb_team_cube.parquet"), expected_rows=len(docs_df))
+team_cube = TeamCube(cube_df if cube_df is not None else build_team_cube(wide_df))
+print(f"  ✅ 球隊聚合立方體已載入：{len(team_cube)} 列")
+
 # ============================================
 # 路由策略 1: Factual Query
 # ============================================
@@ -70,6 +97,16 @@ def handle_factual_query(query: str, k: int = 3) -> Dict:
     """
     
     print(f"\n  [Factual 路由]")
+    
+    # 球隊層級查詢 → 聚合立方體
+    if is_team_query(query):
+        seasons = parse_seasons(query)
+        team_result = team_cube.answer_factual(query, seasons[-1] if seasons else None)
+        if team_result:
+            print(f"  策略：球隊聚合立方體")
+            print(f"  ✅ 找到球隊：{team_result['team']['name']} ({team_result['team']['season']})")
+            return team_result
+    
     print(f"  策略：Vector Search → 提取數據")
     
     # 偵測人名
@@ -121,160 +158,46 @@ def handle_ranking_query(query: str, top_n: int = 5) -> Dict:
     處理排序查詢：根據某個統計項目排序
     
     策略：
-    1. 識別統計項目（如 wRC+, ERA）
-    2. 識別球員類型（打者 or 投手）
-    3. 資料庫排序
+    1. 統計註冊表識別統計項目（如 wRC+, ERA）與球員類型
+    2. 解析賽季範圍、球隊、守備位置、年齡條件
+    3. 排名引擎過濾 + 聚合 + 部分排序
     4. 返回 Top N
     """
     
     print(f"\n  [Ranking 路由]")
-    print(f"  策略：資料庫排序 → Top {top_n}")
-    
-    # 識別統計項目
-    query_lower = query.lower()
-    
-    # 打者統計項目
-    batter_stats = {
-        'wrc+': 'stat_wRC+',
-        'wrc plus': 'stat_wRC+',
-        'woba': 'stat_wOBA',
-        'ops': 'stat_OPS',
-        'home run': 'stat_HR',
-        'hr': 'stat_HR',
-        'avg': 'stat_AVG',
-        'average': 'stat_AVG',
-        'obp': 'stat_OBP',
-        'slg': 'stat_SLG',
-    }
+    print(f"  策略：排名引擎 → Top {top_n}")
     
-    # 投手統計項目
-    pitcher_stats = {
-        'era': 'stat_ERA',
-        'whip': 'stat_WHIP',
-        'fip': 'stat_FIP',
-        'k/9': 'stat_K_9',
-        'strikeout': 'stat_K_9',
-    }
+    spec = parse_ranking_query(query, top_n)
     
-    # 判斷統計項目和球員類型
-    stat_col = None
-    player_type = None
-    ascending = True  # ERA, WHIP 越低越好
-    
-    # 檢查打者統計
-    for keyword, col in batter_stats.items():
-        if keyword in query_lower:
-            stat_col = col
-            player_type = 'batter'
-            ascending = False  # wRC+, OPS 越高越好
-            print(f"  偵測到打者統計：{keyword} → {col}")
-            break
-    
-    # 檢查投手統計
-    if not stat_col:
-        for keyword, col in pitcher_stats.items():
-            if keyword in query_lower:
-                stat_col = col
-                player_type = 'pitcher'
-                # ERA, WHIP, FIP 越低越好
-                ascending = True if keyword in ['era', 'whip', 'fip'] else False
-                print(f"  偵測到投手統計：{keyword} → {col}")
-                break
-    
-    # 如果沒有偵測到特定統計，使用通用策略
-    if not stat_col:
-        print(f"  ⚠️  未偵測到特定統計項目，使用 WAR 排序")
-        stat_col = 'stat_WAR'
-        ascending = False
-        
-        # 判斷是打者還是投手
-        if 'pitcher' in query_lower or 'pitching' in query_lower:
-            player_type = 'pitcher'
-        else:
-            player_type = 'batter'
-    
-    print(f"  球員類型：{player_type}")
-    print(f"  排序欄位：{stat_col}")
-    print(f"  排序方向：{'升序 (越低越好)' if ascending else '降序 (越高越好)'}")
-    
-    # 過濾球員類型
-    if player_type:
-        filtered_df = docs_df[docs_df['type'] == player_type].copy()
+    # 球隊層級排名 → 聚合立方體
+    if is_team_query(query):
+        print(f"  策略：球隊聚合立方體（{spec['stat']}）")
+        return team_cube.rank(spec)
+    
+    print(f"  統計項目：{spec['stat']} → {spec['entry']['columns'][0]}")
+    print(f"  球員類型：{spec['player_type']}")
+    print(f"  排序方向：{'降序 (越高越好)' if spec['entry']['higher_is_better'] else '升序 (越低越好)'}")
+    if spec['seasons']:
+        print(f"  🎯 賽季：{spec['seasons']}")
     else:
-        filtered_df = docs_df.copy()
+        print(f"  使用最新賽季：{ranking_engine.latest_season(spec['player_type'])}")
+    if spec['team'] or spec['position'] or spec['min_age'] or spec['max_age']:
+        print(f"  過濾：球隊 {spec['team']}、位置 {spec['position']}、年齡 {spec['min_age']}-{spec['max_age']}")
+    if spec['entry'].get('qualifier') == 'rate':
+        print(f"  樣本門檻：{spec['qualifier'] or '不限'}")
     
-    # 年份過濾（動態）
-    year_pattern = r'\b(202[0-9])\b'
-    match = re.search(year_pattern, query)
+    result = ranking_engine.run(spec)
     
-    if match:
-        target_year = int(match.group(1))
-        filtered_df = filtered_df[filtered_df['season'] == target_year]
-        print(f"  🎯 過濾到 {target_year} 賽季")
-    else:
-        # 如果沒指定年份，使用最新賽季
-        max_season = filtered_df['season'].max()
-        filtered_df = filtered_df[filtered_df['season'] == max_season]
-        print(f"  使用最新賽季：{max_season}")
-    
-    print(f"  過濾後：{len(filtered_df)} 位球員")
-    
-    # 提取統計欄位
-    filtered_df['sort_stat'] = filtered_df['stats'].apply(
-        lambda x: x.get(stat_col.replace('stat_', ''), 0) if isinstance(x, dict) else 0
-    )
-    
-    # 過濾掉 0 值（沒有數據的球員）
-    filtered_df = filtered_df[filtered_df['sort_stat'] > 0]
-    
-    # 設定樣本數門檻（避免小樣本偏差）
-    if player_type == 'batter':
-        # 打者：至少 100 打席
-        filtered_df['pa'] = filtered_df['stats'].apply(
-            lambda x: x.get('PA', 0) if isinstance(x, dict) else 0
-        )
-        before_filter = len(filtered_df)
-        filtered_df = filtered_df[filtered_df['pa'] >= 100]
-        print(f"  打席門檻過濾 (PA >= 100)：{before_filter} → {len(filtered_df)} 位球員")
-    
-    elif player_type == 'pitcher':
-        # 投手：至少 20 投球局數
-        filtered_df['ip'] = filtered_df['stats'].apply(
-            lambda x: x.get('IP', 0) if isinstance(x, dict) else 0
-        )
-        before_filter = len(filtered_df)
-        filtered_df = filtered_df[filtered_df['ip'] >= 20]
-        print(f"  投球局數門檻過濾 (IP >= 20)：{before_filter} → {len(filtered_df)} 位球員")
-    
-    # 排序
-    sorted_df = filtered_df.sort_values('sort_stat', ascending=ascending)
-    
-    # 取 Top N
-    top_players = sorted_df.head(top_n)
-    
-    print(f"  ✅ 找到 Top {len(top_players)} 位球員")
-    
-    # 格式化結果
-    results = []
-    for idx, row in top_players.iterrows():
-        results.append({
-            'rank': len(results) + 1,
-            'name': row['player_name'],
-            'team': row['team'],
-            'season': row['season'],
-            'stat_value': row['sort_stat'],
-            'stat_name': stat_col.replace('stat_', ''),
-            'type': row['type']
-        })
+    # 單一賽季：附上預先計算的聯盟百分位 / 逐年變化
+    for r in result['results']:
+        if 'doc_idx' in r:
+            derived = get_derived_values(derived_df, r['doc_idx'], r['stat_name'])
+            r['percentile'] = derived.get('pct')
+            r['yoy'] = derived.get('yoy')
     
-    return {
-        'success': True,
-        'query_type': 'ranking',
-        'stat_name': stat_col.replace('stat_', ''),
-        'player_type': player_type,
-        'top_n': top_n,
-        'results': results
-    }
+    print(f"  ✅ 找到 Top {len(result['results'])} 位球員（{result['elapsed_ms']:.2f} ms）")
+    
+    return result
 
 # ============================================
 # 路由策略 3: Analysis Query
@@ -308,20 +231,10 @@ def handle_analysis_query(query: str) -> Dict:
     top_player_name = results[0]['player_name']
     print(f"  ✅ 主要球員：{top_player_name}")
     
-    # 收集該球員的所有賽季數據
-    player_data = docs_df[docs_df['player_name'] == top_player_name].sort_values('season')
-    
-    print(f"  收集到 {len(player_data)} 個賽季的數據")
+    # 收集該球員的所有賽季數據（時間軸索引 O(1) 查詢）
+    stats_over_time = player_index.get_stats_over_time(top_player_name)
     
-    # 提取關鍵統計
-    stats_over_time = []
-    for idx, row in player_data.iterrows():
-        stats_over_time.append({
-            'season': row['season'],
-            'team': row['team'],
-            'type': row['type'],
-            'stats': row['stats']
-        })
+    print(f"  收集到 {len(stats_over_time)} 個賽季的數據")
     
     return {
         'success': True,
@@ -383,6 +296,14 @@ test_cases = [
         'query': 'Why is Aaron Judge so good?',
         'type': 'analysis'
     },
+    {
+        'query': 'Which team hit the most home runs in 2024?',
+        'type': 'ranking'
+    },
+    {
+        'query': 'Yankees team ERA 2024',
+        'type': 'factual'
+    },
 ]
 
 results = []
@@ -397,7 +318,15 @@ for test in test_cases:
     
     # 顯示結果摘要
     if result['success']:
-        if test['type'] == 'factual':
+        if test['type'] == 'factual' and result.get('source') == 'team_cube':
+            print(f"\n  📊 結果：{result['team']['name']} ({result['team']['season']})")
+            print(f"  關鍵統計：")
+            for stat, value in list(result['stats'].items())[:5]:
+                print(f"    {stat}: {value:.3f}")
+            if result.get('partial'):
+                print(f"  ⚠️  {result['note']}")
+        
+        elif test['type'] == 'factual':
             print(f"\n  📊 結果：{result['player']['name']} ({result['player']['team']})")
             print(f"  關鍵統計：")
             for stat, value in list(result['stats'].items())[:5]:
@@ -14,6 +14,10 @@ import re
 from typing import Dict, List
 import requests
 
+from week6_llm_singleflight import SingleFlight, request_key
+from week6_embedding_sidecar import load_embedding_model
+from week6_ollama_stub import ollama_base_url
+
 # ============================================
 # 頁面配置
 # ============================================
@@ -33,7 +37,8 @@ st.markdown("---")
 
 DATA_DIR = "./mlb_data"
 OLLAMA_MODEL = "llama3.2"
-OLLAMA_BASE_URL = "http://localhost:11434"
+# OLLAMA_HOST 與 ollama 套件一致（可指向 week6_ollama_stub.py 替身伺服器）
+OLLAMA_BASE_URL = ollama_base_url()
 
 # ============================================
 # 輔助函數
@@ -61,7 +66,6 @@ def load_system():
     
     try:
         import lancedb
-        from sentence_transformers import SentenceTransformer
         
         config_file = os.path.join(DATA_DIR, "search_config.json")
         with open(config_file, 'r') as f:
@@ -69,7 +73,8 @@ def load_system():
         
         db = lancedb.connect(config['db_path'])
         table = db.open_table(config['table_name'])
-        model = SentenceTransformer(config['embedding_model'])
+        # 有 EMBEDDING_SOCKET → 共用 embedding sidecar，不必每個 Streamlit 程序各載入一份模型
+        model = load_embedding_model(config['embedding_model'])
         
         # 載入原始數據（Week 4 更新）
         # 優先使用新的數據文件，如果不存在則使用舊的
@@ -116,28 +121,38 @@ st.success(f"✅ 系統已載入：{len(docs_df)} 筆球員記錄")
 # LLM 接口
 # ============================================
 
+@st.cache_resource
+def get_llm_singleflight() -> SingleFlight:
+    """所有 session 共用同一個 single-flight（相同問題同時送出時只呼叫 Ollama 一次）"""
+    return SingleFlight()
+
 def call_llm(prompt: str, max_tokens: int = 500) -> str:
-    """調用 Ollama LLM"""
-    try:
+    """調用 Ollama LLM（相同的進行中請求會合併）"""
+    options = {
+        "temperature": 0.7,
+        "num_predict": max_tokens,
+    }
+    
+    def generate():
         response = requests.post(
             f"{OLLAMA_BASE_URL}/api/generate",
             json={
                 "model": OLLAMA_MODEL,
                 "prompt": prompt,
                 "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": max_tokens,
-                }
+                "options": options
             },
             timeout=60
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['response'].strip()
-        else:
-            return f"LLM 錯誤：{response.status_code}"
+        if response.status_code != 200:
+            raise RuntimeError(f"LLM 錯誤：{response.status_code}")
+        return response.json()['response'].strip()
+    
+    try:
+        answer, _ = get_llm_singleflight().do(request_key(OLLAMA_MODEL, prompt, options), generate)
+        return answer
+    except RuntimeError as e:
+        return str(e)
     except Exception as e:
         return f"LLM 調用失敗：{e}"
 
@@ -6,11 +6,14 @@ Week 3: 自動評估系統
 import json
 import os
 import sys
-from typing import Dict, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional
 
 # 導入 MLB Assistant
 sys.path.append('.')
-from week2_mlb_assistant import mlb_assistant, classify_query, vector_search
+from week2_mlb_assistant import mlb_assistant, classify_query, vector_search, llm_cassette, llm_scheduler
+from week6_llm_scheduler import PRIORITY_BATCH
 
 print("=" * 80)
 print("Week 3: 自動評估系統")
@@ -25,11 +28,129 @@ def load_test_queries(file_path: str = "./mlb_data/week3_test_queries.json") ->
     with open(file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+# ============================================
+# 並行 / 可續跑執行
+# ============================================
+
+EVAL_WORKERS = int(os.environ.get("EVAL_WORKERS", "4"))
+CHECKPOINT_FILE = "./mlb_data/week3_evaluation_checkpoint.jsonl"
+
+
+def _to_json(value):
+    """numpy 純量 → Python 純量"""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class CaseCheckpoint:
+    """
+    JSONL 檢查點：每完成一個測試案例就附加一行 {stage, test_id, query, outcome}
+    
+    中斷後重新執行會略過已完成的案例；測試集的查詢改變時該案例會重跑
+    完整評估結束後由 run_evaluation 刪除
+    """
+    
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+        self.done: Dict[tuple, Dict] = {}
+        self._lock = threading.Lock()
+        
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 中斷時寫到一半的最後一行
+                    self.done[(record['stage'], record['test_id'], record['query'])] = record['outcome']
+    
+    def get(self, stage: str, test_case: Dict) -> Optional[Dict]:
+        return self.done.get((stage, test_case['id'], test_case['query']))
+    
+    def record(self, stage: str, test_case: Dict, outcome: Dict):
+        line = json.dumps(
+            {'stage': stage, 'test_id': test_case['id'], 'query': test_case['query'], 'outcome': outcome},
+            ensure_ascii=False, default=_to_json
+        )
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.done[(stage, test_case['id'], test_case['query'])] = outcome
+    
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = {}
+
+
+def run_cases(stage: str, test_cases: List[Dict], fn: Callable[[Dict], Dict],
+              checkpoint: Optional[CaseCheckpoint] = None, workers: int = 1) -> Iterator[Dict]:
+    """
+    在執行緒池上執行測試案例，依原順序回傳結果（outcome）
+    
+    已在檢查點中的案例直接取用；每個案例完成就寫入檢查點，
+    因此某個案例拋出例外（或程式中斷）不會遺失其他已完成的案例
+    """
+    
+    outcomes: List[Optional[Dict]] = [checkpoint.get(stage, c) if checkpoint else None for c in test_cases]
+    pending = [i for i, outcome in enumerate(outcomes) if outcome is None]
+    if checkpoint and len(pending) < len(test_cases):
+        print(f"  ↪️  從檢查點續跑：已完成 {len(test_cases) - len(pending)} / {len(test_cases)}")
+    
+    def task(i: int) -> Dict:
+        outcome = fn(test_cases[i])
+        # 失敗的案例不寫入檢查點，續跑時重試
+        if checkpoint and 'error' not in outcome:
+            checkpoint.record(stage, test_cases[i], outcome)
+        return outcome
+    
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for i, outcome in zip(pending, pool.map(task, pending)):
+                outcomes[i] = outcome
+    
+    return iter(outcomes)
+
+
+def _classify_case(test_case: Dict) -> Dict:
+    # 與 _assistant_case 相同以批次優先序排隊，不與互動請求競爭
+    try:
+        with llm_scheduler.request_context(priority=PRIORITY_BATCH):
+            return {'predicted': classify_query(test_case['query'])}
+    except Exception as e:
+        return {'error': str(e), 'predicted': None}
+
+
+def _assistant_case(test_case: Dict) -> Dict:
+    """執行 mlb_assistant，只保留評估需要的欄位（可寫入檢查點）"""
+    
+    # 單一案例失敗只記錄在該案例（不寫入檢查點），不中斷整個 pool.map
+    try:
+        result = mlb_assistant(test_case['query'], priority=PRIORITY_BATCH)
+        
+        # 模板 / 錯誤回答的 data 可能是 None
+        data = result.get('data') or {}
+        top_result = data.get('top_result') or {}
+        expected_stat = test_case.get('expected_stat')
+        results = data.get('results') or []
+        return {
+            'answer': result.get('answer'),
+            'fallback': result.get('fallback', False),
+            'player_name': top_result.get('player_name') or data.get('player_name'),
+            'actual_value': top_result.get(f"stat_{expected_stat}") if expected_stat else None,
+            'stat_name': data.get('stat_name'),
+            'top_1': results[0].get('name') if results else None,
+            'seasons': len(data.get('stats_over_time') or []),
+        }
+    except Exception as e:
+        return {'error': str(e)}
+
 # ============================================
 # 評估 1: Query 分類準確率
 # ============================================
 
-def evaluate_classification(test_queries: Dict) -> Dict:
+def evaluate_classification(test_queries: Dict, checkpoint: Optional[CaseCheckpoint] = None, workers: int = 1) -> Dict:
     """評估 Query 分類準確率"""
     
     print("\n" + "=" * 80)
@@ -47,6 +168,9 @@ def evaluate_classification(test_queries: Dict) -> Dict:
         'errors': []
     }
     
+    all_cases = [c for query_type in ['factual', 'ranking', 'analysis'] for c in test_queries[query_type]]
+    outcomes = run_cases('classification', all_cases, _classify_case, checkpoint, workers)
+    
     for query_type in ['factual', 'ranking', 'analysis']:
         print(f"\n測試 {query_type.upper()} 查詢...")
         
@@ -55,8 +179,11 @@ def evaluate_classification(test_queries: Dict) -> Dict:
             expected_type = test_case['expected_type']
             test_id = test_case['id']
             
-            # 分類
-            predicted_type = classify_query(query)
+            # 分類（已並行執行）
+            outcome = next(outcomes)
+            predicted_type = outcome['predicted']
+            if 'error' in outcome:
+                print(f"  ⚠️  {test_id}: 分類失敗：{outcome['error']}")
             
             # 統計
             results['total'] += 1
@@ -104,7 +231,7 @@ def evaluate_classification(test_queries: Dict) -> Dict:
 # 評估 2: Factual 查詢準確性
 # ============================================
 
-def evaluate_factual_accuracy(test_queries: Dict) -> Dict:
+def evaluate_factual_accuracy(test_queries: Dict, checkpoint: Optional[CaseCheckpoint] = None, workers: int = 1) -> Dict:
     """評估 Factual 查詢的球員識別和數據準確性"""
     
     print("\n" + "=" * 80)
@@ -120,6 +247,7 @@ def evaluate_factual_accuracy(test_queries: Dict) -> Dict:
     }
     
     value_test_count = 0
+    outcomes = run_cases('factual', test_queries['factual'], _assistant_case, checkpoint, workers)
     
     for test_case in test_queries['factual']:
         query = test_case['query']
@@ -131,13 +259,15 @@ def evaluate_factual_accuracy(test_queries: Dict) -> Dict:
         # 執行查詢
         print(f"\n測試 {test_id}: '{query}'")
         try:
-            result = mlb_assistant(query)
+            outcome = next(outcomes)
+            if 'error' in outcome:
+                raise RuntimeError(outcome['error'])
             
             results['total'] += 1
             
             # 檢查球員
-            if result['data'].get('top_result'):
-                player_name = result['data']['top_result']['player_name']
+            if outcome['player_name']:
+                player_name = outcome['player_name']
                 
                 if expected_player and expected_player.lower() in player_name.lower():
                     results['correct_player'] += 1
@@ -154,8 +284,7 @@ def evaluate_factual_accuracy(test_queries: Dict) -> Dict:
                 # 檢查數值（如果有期望值）
                 if expected_stat and expected_value:
                     value_test_count += 1
-                    stat_key = f"stat_{expected_stat}"
-                    actual_value = result['data']['top_result'].get(stat_key)
+                    actual_value = outcome['actual_value']
                     
                     if actual_value and abs(actual_value - expected_value) < 1:
                         results['correct_value'] += 1
@@ -197,7 +326,7 @@ def evaluate_factual_accuracy(test_queries: Dict) -> Dict:
 # 評估 3: Ranking 查詢質量
 # ============================================
 
-def evaluate_ranking_quality(test_queries: Dict) -> Dict:
+def evaluate_ranking_quality(test_queries: Dict, checkpoint: Optional[CaseCheckpoint] = None, workers: int = 1) -> Dict:
     """評估 Ranking 查詢的排序質量"""
     
     print("\n" + "=" * 80)
@@ -212,6 +341,7 @@ def evaluate_ranking_quality(test_queries: Dict) -> Dict:
     }
     
     top_1_test_count = 0
+    outcomes = run_cases('ranking', test_queries['ranking'], _assistant_case, checkpoint, workers)
     
     for test_case in test_queries['ranking']:
         query = test_case['query']
@@ -222,13 +352,15 @@ def evaluate_ranking_quality(test_queries: Dict) -> Dict:
         # 執行查詢
         print(f"\n測試 {test_id}: '{query}'")
         try:
-            result = mlb_assistant(query)
+            outcome = next(outcomes)
+            if 'error' in outcome:
+                raise RuntimeError(outcome['error'])
             
             results['total'] += 1
             
             # 檢查統計類型
-            if result['data'].get('stat_name'):
-                actual_stat = result['data']['stat_name']
+            if outcome['stat_name']:
+                actual_stat = outcome['stat_name']
                 if expected_stat and expected_stat.lower() in actual_stat.lower():
                     results['correct_stat'] += 1
                     print(f"  ✅ 統計類型正確：{actual_stat}")
@@ -236,9 +368,9 @@ def evaluate_ranking_quality(test_queries: Dict) -> Dict:
                     print(f"  ⚠️  統計類型：Expected {expected_stat}, Got {actual_stat}")
             
             # 檢查 Top 1
-            if result['data'].get('results') and expected_top_1:
+            if outcome['top_1'] and expected_top_1:
                 top_1_test_count += 1
-                top_player = result['data']['results'][0]['name']
+                top_player = outcome['top_1']
                 
                 if expected_top_1.lower() in top_player.lower():
                     results['correct_top_1'] += 1
@@ -279,7 +411,7 @@ def evaluate_ranking_quality(test_queries: Dict) -> Dict:
 # 評估 4: Analysis 查詢
 # ============================================
 
-def evaluate_analysis_queries(test_queries: Dict) -> Dict:
+def evaluate_analysis_queries(test_queries: Dict, checkpoint: Optional[CaseCheckpoint] = None, workers: int = 1) -> Dict:
     """評估 Analysis 查詢"""
     
     print("\n" + "=" * 80)
@@ -292,6 +424,7 @@ def evaluate_analysis_queries(test_queries: Dict) -> Dict:
         'has_multi_season': 0,
         'errors': []
     }
+    outcomes = run_cases('analysis', test_queries['analysis'], _assistant_case, checkpoint, workers)
     
     for test_case in test_queries['analysis']:
         query = test_case['query']
@@ -301,13 +434,15 @@ def evaluate_analysis_queries(test_queries: Dict) -> Dict:
         # 執行查詢
         print(f"\n測試 {test_id}: '{query}'")
         try:
-            result = mlb_assistant(query)
+            outcome = next(outcomes)
+            if 'error' in outcome:
+                raise RuntimeError(outcome['error'])
             
             results['total'] += 1
             
             # 檢查球員
-            if result['data'].get('player_name'):
-                player_name = result['data']['player_name']
+            if outcome['player_name']:
+                player_name = outcome['player_name']
                 
                 if expected_player and expected_player.lower() in player_name.lower():
                     results['correct_player'] += 1
@@ -322,12 +457,12 @@ def evaluate_analysis_queries(test_queries: Dict) -> Dict:
                     print(f"  ❌ 球員錯誤：Expected {expected_player}, Got {player_name}")
                 
                 # 檢查是否收集多賽季數據
-                stats_over_time = result['data'].get('stats_over_time', [])
-                if len(stats_over_time) > 1:
+                season_count = outcome['seasons']
+                if season_count > 1:
                     results['has_multi_season'] += 1
-                    print(f"  ✅ 多賽季數據：{len(stats_over_time)} 個賽季")
+                    print(f"  ✅ 多賽季數據：{season_count} 個賽季")
                 else:
-                    print(f"  ⚠️  只有 {len(stats_over_time)} 個賽季數據")
+                    print(f"  ⚠️  只有 {season_count} 個賽季數據")
         
         except Exception as e:
             print(f"  ❌ 錯誤：{e}")
@@ -353,8 +488,33 @@ def evaluate_analysis_queries(test_queries: Dict) -> Dict:
 # 主執行函數
 # ============================================
 
-def run_evaluation():
-    """執行完整評估"""
+def run_evaluation(cassette_mode: str = None, workers: int = EVAL_WORKERS,
+                   llm_concurrency: int = None, fresh: bool = False):
+    """
+    執行完整評估
+    
+    cassette_mode：'record' / 'replay' / 'auto'（None 時沿用 LLM_CASSETTE_MODE）
+        replay 不呼叫 LLM，調整檢索 / 路由後幾秒內即可重新評估
+    workers：同時執行的測試案例數（檢索 / 格式化並行）
+    llm_concurrency：同時送到 Ollama 的請求上限（None 沿用 llm_scheduler 設定），
+        其餘請求在排程器佇列等待
+    fresh：忽略上次中斷留下的檢查點，從頭執行
+    """
+    
+    checkpoint = CaseCheckpoint()
+    if fresh:
+        checkpoint.clear()
+    if llm_concurrency:
+        llm_scheduler.max_concurrency = llm_concurrency
+    # 批次請求不能因為佇列滿而被拒絕（會變成模板回答，評估結果失真）
+    llm_scheduler.max_queue = max(llm_scheduler.max_queue, workers)
+    print(f"\n[執行設定] {workers} 個 worker，LLM 並行上限 {llm_scheduler.max_concurrency}，"
+          f"檢查點 {checkpoint.path}（已完成 {len(checkpoint.done)} 筆）")
+    
+    if cassette_mode:
+        llm_cassette.set_mode(cassette_mode)
+    if llm_cassette.active:
+        print(f"\n[LLM cassette] {llm_cassette.report()}")
     
     # 載入測試集
     print("\n[載入測試集]")
@@ -365,16 +525,16 @@ def run_evaluation():
     print(f"  ✅ 總計: {len(test_queries['factual']) + len(test_queries['ranking']) + len(test_queries['analysis'])} 筆")
     
     # 評估 1：分類準確率
-    classification_results = evaluate_classification(test_queries)
+    classification_results = evaluate_classification(test_queries, checkpoint, workers)
     
     # 評估 2：Factual 準確性
-    factual_results = evaluate_factual_accuracy(test_queries)
+    factual_results = evaluate_factual_accuracy(test_queries, checkpoint, workers)
     
     # 評估 3：Ranking 質量
-    ranking_results = evaluate_ranking_quality(test_queries)
+    ranking_results = evaluate_ranking_quality(test_queries, checkpoint, workers)
     
     # 評估 4：Analysis 查詢
-    analysis_results = evaluate_analysis_queries(test_queries)
+    analysis_results = evaluate_analysis_queries(test_queries, checkpoint, workers)
     
     # 儲存結果
     output = {
@@ -394,6 +554,11 @@ def run_evaluation():
     print("=" * 80)
     print(f"\n💾 詳細結果已儲存：{output_file}")
     
+    # 完整跑完才刪除檢查點（下次從頭評估）
+    checkpoint.clear()
+    if llm_cassette.active:
+        print(f"📼 {llm_cassette.report()}")
+    
     # 總結報告
     print("\n" + "=" * 80)
     print("📊 總結報告")
@@ -420,4 +585,8 @@ def run_evaluation():
     print("\n" + "=" * 80)
 
 if __name__ == "__main__":
-    run_evaluation()
+    # python week3_evaluation.py [record|replay|auto] [fresh]
+    # EVAL_WORKERS=8 python week3_evaluation.py   # worker 數
+    args = sys.argv[1:]
+    mode = next((a for a in args if a in ('record', 'replay', 'auto')), None)
+    run_evaluation(mode, fresh='fresh' in args)
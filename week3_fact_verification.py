@@ -1,43 +1,62 @@
 """
 Week 3: 事實一致性驗證
 驗證 LLM 生成的答案是否與檢索數據一致
+
+數值提取為單次掃描（一個預先編譯的 pattern，"220.0" 只會得到 220.0，不會再拆成 220 和 0）；
+比對時 ground truth 依數值排序，以 bisect 找最接近的值（每個數字 O(log n)）；
+批量驗證使用 process pool，可每晚驗證 log 中所有線上回答：
+    python week3_fact_verification.py answers.jsonl
 """
 
+import json
+import os
 import re
-from typing import Dict, List, Tuple
+import sys
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# 數值 token：千分位（35,000,000）、小數（220.0、.322）、整數；前後不能緊接數字或小數點
+NUMBER_PATTERN = re.compile(r'(?<![\d.,])(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+\.\d+|\.\d+|\d+)(?![\d])')
+
+CONTEXT_CHARS = 30
+
+# 少於此數量時直接在本程序驗證（process pool 啟動成本較高）
+PARALLEL_MIN_BATCH = 64
 
 # ============================================
 # 數值提取
 # ============================================
 
-def extract_numbers_from_text(text: str) -> List[Tuple[float, str]]:
+def tokenize_numbers(text: str) -> List[Tuple[float, bool, str]]:
     """
-    從文本中提取數值
+    單次掃描提取數值
     
     Returns:
-        List of (number, context) tuples
+        List of (number, is_integer, context)：is_integer 表示原文沒有小數點（用於判斷排名）
     """
     
-    # 數值模式
-    patterns = [
-        r'(\d+\.\d+)',  # 220.0, 3.14
-        r'(\d+)',       # 58, 100
-    ]
-    
     numbers = []
-    
-    for pattern in patterns:
-        matches = re.finditer(pattern, text)
-        for match in matches:
-            number = float(match.group(1))
-            # 提取數值前後的上下文（幫助理解這是什麼數據）
-            start = max(0, match.start() - 30)
-            end = min(len(text), match.end() + 30)
-            context = text[start:end].replace('\n', ' ')
-            numbers.append((number, context))
+    for match in NUMBER_PATTERN.finditer(text):
+        token = match.group(1)
+        # 提取數值前後的上下文（幫助理解這是什麼數據）
+        start = max(0, match.start() - CONTEXT_CHARS)
+        end = min(len(text), match.end() + CONTEXT_CHARS)
+        context = text[start:end].replace('\n', ' ')
+        numbers.append((float(token.replace(',', '')), '.' not in token, context))
     
     return numbers
 
+def extract_numbers_from_text(text: str) -> List[Tuple[float, str]]:
+    """
+    從文本中提取數值
+    
+    Returns:
+        List of (number, context) tuples
+    """
+    
+    return [(number, context) for number, _, context in tokenize_numbers(text)]
+
 def extract_stats_from_data(data: Dict) -> Dict[str, float]:
     """
     從數據中提取統計數值
@@ -62,6 +81,24 @@ def extract_stats_from_data(data: Dict) -> Dict[str, float]:
     
     return stats
 
+def sort_ground_truth(ground_truth: Dict[str, float]) -> Tuple[List[float], List[str]]:
+    """依數值排序 → (values, stat_names)，供 bisect 比對"""
+    
+    pairs = sorted((value, name) for name, value in ground_truth.items())
+    return [value for value, _ in pairs], [name for _, name in pairs]
+
+def nearest_truth(number: float, values: List[float]) -> Optional[int]:
+    """排序後的 values 中最接近 number 的位置（空列表回傳 None）"""
+    
+    if not values:
+        return None
+    i = bisect_left(values, number)
+    if i == len(values):
+        return i - 1
+    if i > 0 and number - values[i - 1] <= values[i] - number:
+        return i - 1
+    return i
+
 # ============================================
 # 一致性驗證
 # ============================================
@@ -87,38 +124,36 @@ def verify_fact_consistency(answer: str, data: Dict, tolerance: float = 1.0) ->
         }
     """
     
-    # 提取答案中的數值
-    extracted = extract_numbers_from_text(answer)
+    # 提取答案中的數值（單次掃描）
+    tokens = tokenize_numbers(answer)
+    extracted = [(number, context) for number, _, context in tokens]
     
-    # 提取數據中的數值
+    # 提取數據中的數值，依數值排序
     ground_truth = extract_stats_from_data(data)
+    truth_values, truth_names = sort_ground_truth(ground_truth)
     
     matches = []
     mismatches = []
     
-    # 對比每個提取的數值
-    for number, context in extracted:
-        found_match = False
+    # 對比每個提取的數值：二分搜尋最接近的 ground truth
+    for number, is_integer, context in tokens:
+        i = nearest_truth(number, truth_values)
         
-        for stat_name, truth_value in ground_truth.items():
-            # 容忍小誤差（例如四捨五入）
-            if abs(number - truth_value) < tolerance:
-                matches.append({
-                    'number': number,
-                    'stat': stat_name,
-                    'truth': truth_value,
-                    'context': context,
-                    'diff': abs(number - truth_value)
-                })
-                found_match = True
-                break
-        
-        if not found_match:
+        # 容忍小誤差（例如四捨五入）
+        if i is not None and abs(number - truth_values[i]) < tolerance:
+            matches.append({
+                'number': number,
+                'stat': truth_names[i],
+                'truth': truth_values[i],
+                'context': context,
+                'diff': abs(number - truth_values[i])
+            })
+        else:
             # 檢查是否是年份、排名等非統計數字
             if number >= 2020 and number <= 2025:
                 # 年份 - 可能是合理的
                 continue
-            elif number >= 1 and number <= 10 and '.' not in str(number):
+            elif number >= 1 and number <= 10 and is_integer:
                 # 排名 - 可能是合理的
                 continue
             else:
@@ -128,12 +163,13 @@ def verify_fact_consistency(answer: str, data: Dict, tolerance: float = 1.0) ->
                     'reason': '找不到對應的數據'
                 })
     
-    # 計算一致性分數
+    # 計算一致性分數（略過的年份 / 排名不計入分母）
     total = len(extracted)
     correct = len(matches)
+    checked = correct + len(mismatches)
     
     # 如果沒有數字，認為一致性為 100%（可能是描述性回答）
-    score = correct / total if total > 0 else 1.0
+    score = correct / checked if checked > 0 else 1.0
     
     return {
         'score': score,
@@ -149,12 +185,26 @@ def verify_fact_consistency(answer: str, data: Dict, tolerance: float = 1.0) ->
 # 批量驗證
 # ============================================
 
-def batch_verify_consistency(results: List[Dict]) -> Dict:
+def _verify_one(result: Dict) -> Tuple[float, List[Dict]]:
+    """process pool 的工作函數（模組層級才能 pickle）"""
+    verification = verify_fact_consistency(result['answer'], result['data'])
+    return verification['score'], verification['mismatches']
+
+def _run_verifications(results: List[Dict], workers: Optional[int]) -> List[Tuple[float, List[Dict]]]:
+    if workers == 1 or len(results) < PARALLEL_MIN_BATCH:
+        return [_verify_one(result) for result in results]
+    
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_verify_one, results, chunksize=max(1, len(results) // (workers * 4))))
+
+def batch_verify_consistency(results: List[Dict], workers: Optional[int] = None) -> Dict:
     """
     批量驗證多個查詢結果的一致性
     
     Args:
         results: List of {query, answer, data} dicts
+        workers: process 數（None = CPU 核心數；1 或筆數少於 PARALLEL_MIN_BATCH 時不開 process pool）
     
     Returns:
         {
@@ -170,23 +220,18 @@ def batch_verify_consistency(results: List[Dict]) -> Dict:
     perfect_count = 0
     issues = []
     
-    for result in results:
-        verification = verify_fact_consistency(
-            result['answer'], 
-            result['data']
-        )
-        
+    for result, (score, mismatches) in zip(results, _run_verifications(results, workers)):
         total += 1
-        total_score += verification['score']
+        total_score += score
         
-        if verification['score'] == 1.0:
+        if score == 1.0:
             perfect_count += 1
         
-        if verification['score'] < 1.0:
+        if score < 1.0:
             issues.append({
                 'query': result['query'],
-                'score': verification['score'],
-                'mismatches': verification['mismatches']
+                'score': score,
+                'mismatches': mismatches
             })
     
     return {
@@ -197,12 +242,45 @@ def batch_verify_consistency(results: List[Dict]) -> Dict:
         'issues': issues
     }
 
+def load_answer_log(path: str) -> List[Dict]:
+    """讀取回答 log（JSONL，每行 {query, answer, data}），略過格式不符的行"""
+    
+    results = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('answer') and isinstance(record.get('data'), dict):
+                results.append(record)
+    return results
+
+def verify_answer_log(path: str, output_file: Optional[str] = None, workers: Optional[int] = None) -> Dict:
+    """驗證整個 log 檔，報告寫到 <log>.verification.json"""
+    
+    results = load_answer_log(path)
+    report = batch_verify_consistency(results, workers=workers)
+    
+    output_file = output_file or os.path.splitext(path)[0] + ".verification.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    print(f"  驗證 {report['total']} 筆回答：平均分數 {report['average_score']:.1%}，"
+          f"完全一致 {report['perfect_rate']:.1%}，有問題 {len(report['issues'])} 筆")
+    print(f"  💾 報告已儲存：{output_file}")
+    return report
+
 # ============================================
 # 測試範例
 # ============================================
 
 if __name__ == "__main__":
     
+    if len(sys.argv) > 1:
+        verify_answer_log(sys.argv[1])
+        sys.exit(0)
+    
     print("=" * 80)
     print("事實一致性驗證 - 測試")
     print("=" * 80)
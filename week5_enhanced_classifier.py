@@ -7,6 +7,11 @@ import ollama
 import json
 from typing import Dict, Tuple
 
+from week6_llm_cassette import patch_ollama_chat
+
+# LLM_CASSETTE_MODE 啟用時錄製 / 重播 ollama.chat
+patch_ollama_chat()
+
 
 class EnhancedQueryClassifier:
     """
@@ -38,7 +43,9 @@ class EnhancedQueryClassifier:
         self.statcast_keywords = [
             'exit velocity', 'launch angle', 'sprint speed', 
             'hard hit', 'barrel', 'xba', 'xwoba', 'xslg',
-            'expected', 'statcast'
+            'expected', 'statcast',
+            # 逐球拆分（球種 / 揮空率）
+            'whiff', 'slider', 'sweeper', 'changeup', 'curveball', 'splitter', 'sinker', 'cutter'
         ]
     
     
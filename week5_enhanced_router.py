@@ -4,15 +4,27 @@ Week 5: 擴展智能路由器
 """
 
 import json
+import re
 import ollama
-from typing import Dict, List, Optional
+from typing import Dict, Optional
+
+from week6_llm_cassette import patch_ollama_chat
+from week6_enhanced_store import EnhancedDocumentStore, memory_report
+from week6_award_index import AwardIndex, parse_award_query
+from week6_pitch_store import PITCH_DIR, PitchStore, parse_pitch_query
+from week6_salary_index import SalaryIndex, parse_salary_query
+from week6_statcast_leaderboard import StatcastLeaderboards, parse_statcast_query
+from week6_side_tables import SIDE_TABLES_DIR, KeyedTable, SideTables, side_tables_from_store
+
+# LLM_CASSETTE_MODE 啟用時錄製 / 重播 ollama.chat
+patch_ollama_chat()
 
 
 class EnhancedSmartRouter:
     """
     擴展智能路由器
     
-    處理 6 種查詢類型：
+    處理 6 種查詢類型（Statcast 另有逐球拆分路由）：
     1. Factual - 事實查詢
     2. Ranking - 排名查詢
     3. Analysis - 分析查詢
@@ -21,22 +33,81 @@ class EnhancedSmartRouter:
     6. Statcast - Statcast 查詢 ✨
     """
     
-    def __init__(self, documents_path: str, model_name: str = "llama3.2"):
+    def __init__(self, documents_path: str, model_name: str = "llama3.2", tables_dir: str = SIDE_TABLES_DIR,
+                 pitch_dir: str = PITCH_DIR):
         self.documents_path = documents_path
         self.model_name = model_name
-        self.documents = self.load_documents()
+        self.tables_dir = tables_dir
+        self.store = self.load_documents()
+        self.tables = self.load_side_tables()
+        self.award_index = AwardIndex.from_table(self.tables.awards.df)
+        self.salary_index = SalaryIndex.from_table(self.tables.salaries.df, self.store.corpus)
+        self.statcast_boards = StatcastLeaderboards.from_table(self.tables.statcast.df)
+        self.pitch_store = PitchStore.open(pitch_dir)
+        self.known_players = self.build_player_lookup()
     
     
-    def load_documents(self) -> List[Dict]:
-        """載入球員文檔"""
+    def load_documents(self) -> EnhancedDocumentStore:
+        """
+        載入球員文檔（精簡表示：賽季列為欄式陣列，獎項 / 合約每位球員一份）
+        """
         try:
             with open(self.documents_path, 'r', encoding='utf-8') as f:
                 docs = json.load(f)
-            print(f"✅ 載入 {len(docs)} 筆球員文檔")
-            return docs
+            store = EnhancedDocumentStore.from_documents(docs)
+            print(f"✅ 載入 {len(docs)} 筆球員文檔（{len(store.players)} 位球員）")
+            return store
         except Exception as e:
             print(f"❌ 載入文檔失敗: {e}")
-            return []
+            return EnhancedDocumentStore.from_documents([])
+    
+    
+    def load_side_tables(self) -> SideTables:
+        """
+        載入獎項 / 薪資 / Statcast 副表（week6_side_tables）
+
+        副表檔案不存在時，從文檔中舊的 awards / contract / statcast 欄位建立（相容舊的整合文檔）
+        """
+        tables = SideTables.load(self.tables_dir)
+        missing = [name for name, rows in tables.available().items() if rows == 0]
+        if missing:
+            legacy = side_tables_from_store(self.store)
+            for name in missing:
+                if not legacy[name].empty:
+                    tables.tables[name] = KeyedTable(name, legacy[name])
+            tables = SideTables(tables.tables)
+        print(f"✅ 副表：{tables.available()}")
+        return tables
+    
+    
+    def build_player_lookup(self) -> Dict[str, str]:
+        """已知球員名字（球員文檔 + 三張副表）：小寫全名 → 名字"""
+        names = list(self.store.players)
+        for table in self.tables.tables.values():
+            names.extend(str(name) for name in table.keys)
+        return {name.lower(): name for name in names if name}
+    
+    
+    def find_known_player(self, query: str) -> Optional[str]:
+        """
+        查詢中出現的已知球員全名（"How many times has Mike Trout won MVP?" → Mike Trout）
+        
+        以查詢的連續詞組查字典（最長的詞組優先），不經過 LLM；找不到時回傳 None
+        """
+        words = [re.sub(r"['’]s?$", '', word) for word in re.findall(r"[^\s?!,;:()\"]+", query)]
+        for size in range(min(4, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                phrase = ' '.join(words[start:start + size]).lower()
+                name = self.known_players.get(phrase) or self.known_players.get(phrase.rstrip('.'))
+                if name:
+                    return name
+        return None
+    
+    
+    def memory_report(self) -> Dict:
+        """與原本 list of dict 表示的記憶體比較（重新讀取文檔檔案）"""
+        with open(self.documents_path, 'r', encoding='utf-8') as f:
+            return memory_report(json.load(f), self.store)
     
     
     def handle_award_query(self, query: str, player_name: Optional[str] = None) -> Dict:
@@ -54,8 +125,19 @@ class EnhancedSmartRouter:
                 'awards': {...},
                 'answer': str
             }
+            反向查詢（"Who won the Cy Young in 2023?" / "most All-Star selections"）
+            回傳 AwardIndex.answer 的結果（'winners' 或 'leaderboard'）
         """
         
+        # 得主 / 次數排行查詢直接查反向索引，不需要 LLM 提取球員名字
+        # 查詢中有已知球員名字時（"How many times has Mike Trout won MVP?"）走球員路徑
+        if not player_name:
+            player_name = self.find_known_player(query)
+        if not player_name:
+            spec = parse_award_query(query)
+            if spec:
+                return self.award_index.answer(spec)
+        
         # 如果沒有指定球員，嘗試從查詢中提取
         if not player_name:
             player_name = self.extract_player_name(query)
@@ -67,19 +149,15 @@ class EnhancedSmartRouter:
                 'answer': '請指定球員名字，例如："Has Aaron Judge won MVP?"'
             }
         
-        # 搜尋球員
-        player_docs = [doc for doc in self.documents if doc['player_name'] == player_name]
-        
-        if not player_docs:
+        # 搜尋球員，獎項在查詢時才從 awards 副表取出
+        if player_name not in self.store and player_name not in self.tables.awards:
             return {
                 'type': 'award',
                 'error': '找不到球員',
                 'answer': f'找不到球員 {player_name} 的數據'
             }
         
-        # 取第一筆（任一年份都可以，因為獎項數據是累積的）
-        player = player_docs[0]
-        awards = player.get('awards', {'total_count': 0})
+        awards = self.tables.player_awards(player_name)
         
         # 生成回答
         if awards.get('total_count', 0) == 0:
@@ -115,8 +193,19 @@ class EnhancedSmartRouter:
                 'contract': {...},
                 'answer': str
             }
+            排行查詢（"Who has the highest salary in MLB?" / "best WAR per $M"）
+            回傳 SalaryIndex.answer 的結果（'leaderboard'）
         """
         
+        # 薪資 / 每百萬美元 WAR 排行直接查薪資索引，不需要 LLM 提取球員名字
+        # 查詢中有已知球員名字時（"Is Aaron Judge's contract good value?"）走球員路徑
+        if not player_name:
+            player_name = self.find_known_player(query)
+        if not player_name:
+            spec = parse_salary_query(query)
+            if spec:
+                return self.salary_index.answer(spec)
+        
         # 如果沒有指定球員，嘗試從查詢中提取
         if not player_name:
             player_name = self.extract_player_name(query)
@@ -128,19 +217,15 @@ class EnhancedSmartRouter:
                 'answer': '請指定球員名字，例如："What is Aaron Judge\'s salary?"'
             }
         
-        # 搜尋球員
-        player_docs = [doc for doc in self.documents if doc['player_name'] == player_name]
-        
-        if not player_docs:
+        # 搜尋球員，薪資在查詢時才從 salaries 副表取出
+        if player_name not in self.store and player_name not in self.tables.salaries:
             return {
                 'type': 'contract',
                 'error': '找不到球員',
                 'answer': f'找不到球員 {player_name} 的數據'
             }
         
-        # 取第一筆
-        player = player_docs[0]
-        contract = player.get('contract', None)
+        contract = self.tables.player_contract(player_name)
         
         # 生成回答
         if not contract:
@@ -177,8 +262,19 @@ class EnhancedSmartRouter:
                 'statcast': {...},
                 'answer': str
             }
+            排行 / 區間查詢（"Who has the fastest sprint speed?" / "exit velo > 95 and barrel % > 15"）
+            回傳 StatcastLeaderboards.answer 的結果（'leaderboard'）
         """
         
+        # 排行 / 區間過濾直接查預先排序的索引，不需要 LLM 提取球員名字
+        # 查詢中有已知球員名字時（"What is Aaron Judge's best exit velocity?"）走球員路徑
+        if not player_name:
+            player_name = self.find_known_player(query)
+        if not player_name:
+            spec = parse_statcast_query(query)
+            if spec:
+                return self.statcast_boards.answer(spec)
+        
         # 如果沒有指定球員，嘗試從查詢中提取
         if not player_name:
             player_name = self.extract_player_name(query)
@@ -190,28 +286,24 @@ class EnhancedSmartRouter:
                 'answer': '請指定球員名字，例如："What is Aaron Judge\'s exit velocity?"'
             }
         
-        # 搜尋球員
-        player_docs = [doc for doc in self.documents if doc['player_name'] == player_name]
-        
-        if not player_docs:
+        # 搜尋球員，Statcast 在查詢時才從 statcast 副表取出
+        if player_name not in self.store and player_name not in self.tables.statcast:
             return {
                 'type': 'statcast',
                 'error': '找不到球員',
                 'answer': f'找不到球員 {player_name} 的數據'
             }
         
-        # 取第一筆
-        player = player_docs[0]
-        statcast = player.get('statcast', None)
+        statcast = self.tables.player_statcast(player_name)
         
         # 生成回答
-        if not statcast or statcast.get('note') == 'Statcast 數據待補充':
+        if not statcast or len(statcast) == 1:
             answer = f"{player_name} 的 Statcast 數據尚未完全收集。\n"
             answer += "Statcast 數據收集需要較長時間，建議使用批量處理。"
         else:
-            answer = f"{player_name} 的 Statcast 指標：\n\n"
+            answer = f"{player_name} 的 {statcast['season']} Statcast 指標：\n\n"
             for metric, value in statcast.items():
-                if metric not in ['note', 'years_available', 'metrics']:
+                if metric != 'season':
                     answer += f"• {metric}: {value}\n"
         
         return {
@@ -222,6 +314,49 @@ class EnhancedSmartRouter:
         }
     
     
+    def handle_pitch_query(self, query: str, spec: Optional[Dict] = None) -> Dict:
+        """
+        處理逐球拆分查詢（"Judge's xwOBA vs sliders in 2024" / "Skubal whiff rate on changeups by month"）
+        
+        Args:
+            query: 查詢字串
+            spec: parse_pitch_query 的結果（如果已解析）
+        
+        Returns:
+            {
+                'type': 'pitch',
+                'player': str,
+                'role': 'batter' | 'pitcher',
+                'rows': [...],
+                'answer': str
+            }
+        """
+        
+        if self.pitch_store is None:
+            return {
+                'type': 'pitch',
+                'error': '沒有逐球數據',
+                'answer': '逐球 Statcast 數據尚未建立，請先執行: python week6_pitch_store.py ingest 2024-03-28 2024-09-30'
+            }
+        
+        spec = spec or parse_pitch_query(query, self.pitch_store.batters, self.pitch_store.pitchers)
+        if spec is None:
+            return {
+                'type': 'pitch',
+                'error': '無法解析逐球查詢',
+                'answer': '請指定球員與拆分條件，例如："Judge\'s xwOBA vs sliders in 2024"'
+            }
+        
+        return self.pitch_store.answer(spec)
+    
+    
+    def pitch_spec(self, query: str) -> Optional[Dict]:
+        """Statcast 查詢中的逐球拆分條件（沒有逐球數據或不是拆分查詢時為 None）"""
+        if self.pitch_store is None:
+            return None
+        return parse_pitch_query(query, self.pitch_store.batters, self.pitch_store.pitchers)
+    
+    
     def extract_player_name(self, query: str) -> Optional[str]:
         """
         從查詢中提取球員名字
@@ -282,8 +417,15 @@ class EnhancedSmartRouter:
             return self.handle_contract_query(query)
         
         elif query_type == 'statcast':
+            # 球種 / 月份 / 左右投打拆分 → 逐球查詢引擎，其餘使用賽季聚合
+            spec = self.pitch_spec(query)
+            if spec:
+                return self.handle_pitch_query(query, spec)
             return self.handle_statcast_query(query)
         
+        elif query_type == 'pitch':
+            return self.handle_pitch_query(query)
+        
         else:
             return {
                 'type': query_type,
@@ -297,15 +439,27 @@ class EnhancedSmartRouter:
 
 if __name__ == "__main__":
     
-    # 假設已有整合後的文檔
-    documents_path = "./mlb_data/week5_mlb_documents_enhanced.json"
+    # 球員文檔 + 副表（week5_integrate_data.py / week5_integrate_awards_simple.py 建立）
+    documents_path = "./mlb_data/mlb_documents.json"
     
     router = EnhancedSmartRouter(documents_path)
     
     test_queries = [
         ("Has Aaron Judge won MVP?", "award"),
+        ("Who won the Cy Young in 2023?", "award"),
+        ("Most All-Star selections 2022-2025", "award"),
+        ("How many times has Mike Trout won MVP?", "award"),
         ("What is Aaron Judge's salary?", "contract"),
+        ("Who has the highest salary in MLB?", "contract"),
+        ("Best value players by WAR per $M", "contract"),
+        ("Is Aaron Judge's contract good value?", "contract"),
+        ("What is Shohei Ohtani's highest salary?", "contract"),
         ("What is Aaron Judge's exit velocity?", "statcast"),
+        ("What is Aaron Judge's best exit velocity?", "statcast"),
+        ("Who has the fastest sprint speed?", "statcast"),
+        ("Which hitters have exit velo > 95 and barrel % > 15?", "statcast"),
+        ("Judge's xwOBA vs sliders in 2024", "statcast"),
+        ("Skubal whiff rate on changeups by month", "statcast"),
     ]
     
     print("=" * 80)
@@ -319,3 +473,6 @@ if __name__ == "__main__":
         
         result = router.route(query, query_type)
         print(result['answer'])
+    
+    report = router.memory_report()
+    print(f"\n📊 文檔記憶體：list of dict {report['documents_mb']} MB → 精簡表示 {report['compact_mb']} MB（{report['ratio']}x）")
@@ -1,16 +1,21 @@
 """
 Week 5: 簡化獎項整合（不使用 Lahman）
 
-直接基於球員名字匹配
+直接基於球員名字匹配，寫入 awards 副表（week6_side_tables），查詢時才依球員 join
 """
 
 import json
-from typing import Dict, List
+
+from week5_awards_simple import KNOWN_AWARDS
+from week6_side_tables import (
+    KeyedTable, SideTables, award_leagues_from_known, award_records_from_player_awards,
+    awards_frame, save_side_table
+)
 
 
 def integrate_awards_simple() -> int:
     """
-    整合獎項數據到球員文檔（簡化版）
+    整合獎項數據（簡化版）：建立 awards 副表
     
     Returns:
         整合成功的球員數量
@@ -41,60 +46,36 @@ def integrate_awards_simple() -> int:
         print("   請先執行: python week5_awards_simple.py")
         return 0
     
-    # 3. 整合獎項
-    print("\n[整合獎項]")
+    # 3. 建立 awards 副表（player, award, year, league）
+    print("\n[建立獎項副表]")
     
-    integrated_count = 0
+    records = award_records_from_player_awards(awards_data, award_leagues_from_known(KNOWN_AWARDS))
+    awards_df = awards_frame(records)
     
-    for doc in documents:
-        player_name = doc['player_name']
-        
-        if player_name in awards_data:
-            # 有獎項數據
-            doc['awards'] = awards_data[player_name]
-            integrated_count += 1
-        else:
-            # 沒有獎項數據
-            doc['awards'] = {'total_count': 0}
-    
-    print(f"✅ 整合完成: {integrated_count}/{len(documents)} 位球員有獎項")
-    
-    # 4. 加入薪資和 Statcast 欄位（空的）
-    print("\n[加入其他欄位]")
-    
-    for doc in documents:
-        # 薪資欄位
-        doc['contract'] = None
-        
-        # Statcast 欄位
-        doc['statcast'] = {
-            'note': 'Statcast 數據待補充',
-            'years_available': [2020, 2021, 2022, 2023, 2024, 2025]
-        }
+    document_players = set(doc['player_name'] for doc in documents)
+    integrated_count = len(document_players & set(awards_df['player']))
     
-    print("✅ 已加入 contract 和 statcast 欄位")
+    print(f"✅ 整合完成: {integrated_count}/{len(document_players)} 位球員有獎項")
     
-    # 5. 儲存整合後的文檔
+    # 4. 儲存副表（只重寫 awards.parquet，不再重寫整份文檔）
     print("\n[儲存數據]")
     
-    output_file = "./mlb_data/week5_mlb_documents_enhanced.json"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
-    
-    print(f"✅ 已儲存: {output_file}")
+    output_file = save_side_table('awards', awards_df)
+    print(f"✅ 已儲存: {output_file}（{len(awards_df)} 筆獎項）")
     
-    # 6. 顯示樣本
+    # 5. 顯示樣本（查詢時的 join 方式）
     print("\n[樣本球員]")
     
-    # 找出有獎項的球員樣本
-    players_with_awards = [doc for doc in documents if doc['awards']['total_count'] > 0]
+    tables = SideTables({'awards': KeyedTable('awards', awards_df)})
+    players_with_awards = [name for name in tables.awards.keys if name in document_players]
     
     if players_with_awards:
         sample = players_with_awards[0]
-        print(f"\n球員: {sample['player_name']} ({sample['season']})")
-        print(f"獎項: {sample['awards']['total_count']} 個")
+        awards = tables.player_awards(sample)
+        print(f"\n球員: {sample}")
+        print(f"獎項: {awards['total_count']} 個")
         
-        for award_type, years in sample['awards'].items():
+        for award_type, years in awards.items():
             if award_type != 'total_count':
                 print(f"  {award_type}: {years}")
     
@@ -111,7 +92,7 @@ if __name__ == "__main__":
     
     if integrated > 0:
         print(f"\n✅ 成功整合 {integrated} 位球員的獎項數據")
-        print("\n整合後的文檔: ./mlb_data/week5_mlb_documents_enhanced.json")
+        print("\n獎項副表: ./mlb_data/side_tables/awards.parquet")
         print("\n下一步：")
         print("  python week5_test.py  # 測試整合結果")
     else:
@@ -1,11 +1,18 @@
 """
 Week 5: 數據整合腳本
-將獎項、薪資、Statcast 數據整合到現有球員文檔
+將獎項、薪資數據整理成以球員為 key 的副表（week6_side_tables），查詢時才 join，
+不再複製到每一筆球員文檔
 """
 
 import json
-from typing import Dict, List
-import os
+from typing import Dict
+
+import pandas as pd
+
+from week6_side_tables import (
+    SIDE_TABLES_DIR, KeyedTable, SideTables, award_records_from_player_awards,
+    awards_frame, salaries_frame, save_side_table
+)
 
 
 def load_json(filepath: str) -> any:
@@ -28,110 +35,53 @@ def save_json(data: any, filepath: str):
     print(f"✅ 已儲存: {filepath}")
 
 
-def integrate_awards(documents: List[Dict], awards_data: Dict, mapping: Dict) -> int:
+def resolve_player_names(player_data: Dict, mapping: Dict) -> Dict:
+    """playerID -> 資料 轉成 球員名字 -> 資料（找不到映射的 playerID 略過）"""
+    id_to_name = mapping['id_to_name']
+    return {id_to_name[pid]: value for pid, value in player_data.items() if pid in id_to_name}
+
+
+def integrate_awards(awards_data: Dict, mapping: Dict) -> pd.DataFrame:
     """
-    整合獎項數據到球員文檔
+    建立 awards 副表（player, award, year, league）
     
     Args:
-        documents: 球員文檔列表
         awards_data: 獎項數據 (playerID -> awards)
         mapping: playerID 映射表
     
     Returns:
-        整合成功的球員數量
+        awards 副表
     """
     
     print("\n整合獎項數據...")
     
-    integrated_count = 0
-    id_to_name = mapping['id_to_name']
+    awards_df = awards_frame(award_records_from_player_awards(resolve_player_names(awards_data, mapping)))
     
-    for doc in documents:
-        player_name = doc['player_name']
-        
-        # 嘗試找到對應的 playerID
-        player_id = None
-        for pid, name in id_to_name.items():
-            if name == player_name:
-                player_id = pid
-                break
-        
-        if player_id and player_id in awards_data:
-            doc['awards'] = awards_data[player_id]
-            integrated_count += 1
-        else:
-            # 沒有獎項數據
-            doc['awards'] = {'total_count': 0}
-    
-    print(f"✅ 獎項整合: {integrated_count}/{len(documents)} 位球員")
-    return integrated_count
+    print(f"✅ 獎項整合: {awards_df['player'].nunique()} 位球員，{len(awards_df)} 筆獎項")
+    return awards_df
 
 
-def integrate_salaries(documents: List[Dict], salary_data: Dict, mapping: Dict) -> int:
+def integrate_salaries(salary_data: Dict, mapping: Dict) -> pd.DataFrame:
     """
-    整合薪資數據到球員文檔
+    建立 salaries 副表（player, year, team, amount）
     
     Args:
-        documents: 球員文檔列表
         salary_data: 薪資數據 (playerID -> salary)
         mapping: playerID 映射表
     
     Returns:
-        整合成功的球員數量
+        salaries 副表
     """
     
     print("\n整合薪資數據...")
     
-    integrated_count = 0
-    id_to_name = mapping['id_to_name']
-    
-    for doc in documents:
-        player_name = doc['player_name']
-        
-        # 嘗試找到對應的 playerID
-        player_id = None
-        for pid, name in id_to_name.items():
-            if name == player_name:
-                player_id = pid
-                break
-        
-        if player_id and player_id in salary_data:
-            doc['contract'] = salary_data[player_id]
-            integrated_count += 1
-        else:
-            # 沒有薪資數據
-            doc['contract'] = None
+    salaries_df = salaries_frame(
+        (name, contract['year'], contract['team'], contract['current_salary'])
+        for name, contract in resolve_player_names(salary_data, mapping).items()
+    )
     
-    print(f"✅ 薪資整合: {integrated_count}/{len(documents)} 位球員")
-    return integrated_count
-
-
-def integrate_statcast(documents: List[Dict], statcast_data: Dict) -> int:
-    """
-    整合 Statcast 數據到球員文檔
-    
-    注意：Statcast 數據需要另外處理，這裡先建立欄位結構
-    
-    Args:
-        documents: 球員文檔列表
-        statcast_data: Statcast 數據結構
-    
-    Returns:
-        整合成功的球員數量
-    """
-    
-    print("\n整合 Statcast 數據結構...")
-    
-    # 先建立空的 Statcast 欄位
-    for doc in documents:
-        doc['statcast'] = {
-            'note': 'Statcast 數據待補充',
-            'years_available': statcast_data['years'],
-            'metrics': statcast_data['metrics']
-        }
-    
-    print(f"✅ Statcast 結構已加入所有球員文檔")
-    return len(documents)
+    print(f"✅ 薪資整合: {len(salaries_df)} 位球員")
+    return salaries_df
 
 
 def main():
@@ -167,73 +117,72 @@ def main():
     print(f"✅ Statcast 結構: 已載入")
     print(f"✅ 映射表: {len(mapping['id_to_name'])} 位球員")
     
-    # 3. 整合數據
+    # 3. 建立副表（每張表各自一個檔案，更新其中一項不需重寫整份文檔）
     print("\n" + "=" * 80)
     print("整合數據")
     print("=" * 80)
     
-    awards_count = 0
-    salary_count = 0
-    statcast_count = 0
+    tables = {}
     
     if awards_data and mapping:
-        awards_count = integrate_awards(documents, awards_data, mapping)
+        tables['awards'] = integrate_awards(awards_data, mapping)
     
     if salary_data and mapping:
-        salary_count = integrate_salaries(documents, salary_data, mapping)
+        tables['salaries'] = integrate_salaries(salary_data, mapping)
     
     if statcast_data:
-        statcast_count = integrate_statcast(documents, statcast_data)
+        # 結構檔只有指標名稱，數值由 week6_side_tables.py statcast <年份> 從 Baseball Savant 建立
+        print(f"\nStatcast 指標: {', '.join(statcast_data['metrics'])}")
+        print("   數值副表請執行: python week6_side_tables.py statcast 2024 2025")
     
-    # 4. 儲存整合後的文檔
+    # 4. 儲存副表
     print("\n" + "=" * 80)
     print("儲存數據")
     print("=" * 80)
     
-    output_file = "./mlb_data/week5_mlb_documents_enhanced.json"
-    save_json(documents, output_file)
+    for name, df in tables.items():
+        output_file = save_side_table(name, df)
+        print(f"✅ 已儲存: {output_file}")
     
     # 5. 統計
+    document_players = set(doc['player_name'] for doc in documents)
+    
     print("\n" + "=" * 80)
     print("整合完成統計")
     print("=" * 80)
-    print(f"總文檔數: {len(documents)}")
-    print(f"獎項數據: {awards_count} 位球員")
-    print(f"薪資數據: {salary_count} 位球員")
-    print(f"Statcast 結構: {statcast_count} 位球員")
+    print(f"總球員數: {len(document_players)}")
+    for name, df in tables.items():
+        matched = len(document_players & set(df['player']))
+        print(f"{name}: {len(df)} 筆（{matched} 位球員在文檔中）")
     
-    # 6. 顯示樣本
+    # 6. 顯示樣本（查詢時依球員 join）
     print("\n[整合後樣本]")
-    sample_count = min(3, len(documents))
+    side_tables = SideTables({name: KeyedTable(name, df) for name, df in tables.items()})
     
-    for i in range(sample_count):
-        doc = documents[i]
-        print(f"\n球員: {doc['player_name']} ({doc['season']})")
+    for player_name in sorted(document_players)[:3]:
+        print(f"\n球員: {player_name}")
         
         # 獎項
-        if 'awards' in doc and doc['awards'].get('total_count', 0) > 0:
-            print(f"  獎項: {doc['awards']['total_count']} 個")
-            for award_type, years in doc['awards'].items():
+        awards = side_tables.player_awards(player_name)
+        if awards['total_count'] > 0:
+            print(f"  獎項: {awards['total_count']} 個")
+            for award_type, years in awards.items():
                 if award_type != 'total_count':
                     print(f"    {award_type}: {years}")
         else:
             print(f"  獎項: 無")
         
         # 薪資
-        if 'contract' in doc and doc['contract']:
-            salary = doc['contract']['current_salary']
-            print(f"  薪資: ${salary:,} ({doc['contract']['year']})")
+        contract = side_tables.player_contract(player_name)
+        if contract:
+            print(f"  薪資: ${contract['current_salary']:,} ({contract['year']})")
         else:
             print(f"  薪資: 無數據")
-        
-        # Statcast
-        if 'statcast' in doc:
-            print(f"  Statcast: 結構已建立")
     
     print("\n" + "=" * 80)
     print("✨ Week 5 數據整合完成")
     print("=" * 80)
-    print(f"\n整合後文檔: {output_file}")
+    print(f"\n副表目錄: {SIDE_TABLES_DIR}")
 
 
 if __name__ == "__main__":
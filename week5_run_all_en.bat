@@ -27,7 +27,7 @@ if %errorlevel% neq 0 (
 )
 echo.
 
-echo [Step 3/4] Integrate data into existing documents
+echo [Step 3/4] Build awards / salary side tables
 echo ----------------------------------------
 python week5_integrate_data.py
 if %errorlevel% neq 0 (
@@ -48,7 +48,7 @@ if /i "%rebuild%"=="y" (
     echo Rebuilding vector database...
     python week4_build_vector_db.py
     if %errorlevel% neq 0 (
-        echo WARNING: Vector DB rebuild failed, but data is integrated
+        echo WARNING: Vector DB rebuild failed, but side tables are built
     )
 )
 
@@ -62,7 +62,7 @@ echo   - mlb_data/week5_player_mapping.json (playerID mapping)
 echo   - mlb_data/week5_awards.json (awards data)
 echo   - mlb_data/week5_salaries.json (salary data)
 echo   - mlb_data/week5_statcast_structure.json (statcast structure)
-echo   - mlb_data/week5_mlb_documents_enhanced.json (integrated documents)
+echo   - mlb_data/side_tables/*.parquet (awards / salary side tables)
 echo.
 echo Next steps:
 echo   - Run week5_test.py to test the new features
@@ -6,6 +6,8 @@ Week 5: 測試腳本
 import json
 import os
 
+from week6_side_tables import SIDE_TABLES_DIR, SideTables
+
 
 def test_file_exists(filepath: str) -> bool:
     """測試文件是否存在"""
@@ -27,8 +29,8 @@ def test_json_valid(filepath: str) -> bool:
         return False
 
 
-def test_data_integration(documents_path: str) -> dict:
-    """測試數據整合"""
+def test_data_integration(documents_path: str, tables_dir: str = SIDE_TABLES_DIR) -> dict:
+    """測試數據整合（球員文檔 + 副表，依球員 join）"""
     
     print("\n" + "=" * 80)
     print("測試數據整合")
@@ -38,29 +40,34 @@ def test_data_integration(documents_path: str) -> dict:
         with open(documents_path, 'r', encoding='utf-8') as f:
             documents = json.load(f)
         
+        tables = SideTables.load(tables_dir)
+        players = sorted(set(doc['player_name'] for doc in documents))
+        
         stats = {
             'total_documents': len(documents),
+            'total_players': len(players),
             'with_awards': 0,
             'with_contract': 0,
             'with_statcast': 0,
             'sample_player': None
         }
         
-        for doc in documents:
+        for player_name in players:
             # 檢查獎項
-            if 'awards' in doc and doc['awards'].get('total_count', 0) > 0:
+            if player_name in tables.awards:
                 stats['with_awards'] += 1
                 if not stats['sample_player']:
-                    stats['sample_player'] = doc
+                    stats['sample_player'] = player_name
             
             # 檢查合約
-            if 'contract' in doc and doc['contract']:
+            if player_name in tables.salaries:
                 stats['with_contract'] += 1
             
             # 檢查 Statcast
-            if 'statcast' in doc:
+            if player_name in tables.statcast:
                 stats['with_statcast'] += 1
         
+        stats['tables'] = tables
         return stats
         
     except Exception as e:
@@ -82,7 +89,6 @@ def main():
         "./mlb_data/week5_awards.json",
         "./mlb_data/week5_salaries.json",
         "./mlb_data/week5_statcast_structure.json",
-        "./mlb_data/week5_mlb_documents_enhanced.json"
     ]
     
     all_exists = True
@@ -90,6 +96,10 @@ def main():
         if not test_file_exists(filepath):
             all_exists = False
     
+    for table in ('awards', 'salaries'):
+        if not test_file_exists(os.path.join(SIDE_TABLES_DIR, f"{table}.parquet")):
+            all_exists = False
+    
     if not all_exists:
         print("\n❌ 某些文件缺失，請先執行 week5_run_all.bat")
         return
@@ -100,34 +110,36 @@ def main():
         test_json_valid(filepath)
     
     # 測試數據整合
-    stats = test_data_integration("./mlb_data/week5_mlb_documents_enhanced.json")
+    stats = test_data_integration("./mlb_data/mlb_documents.json")
     
     if stats:
-        print(f"\n總文檔數: {stats['total_documents']}")
+        print(f"\n總文檔數: {stats['total_documents']}（{stats['total_players']} 位球員）")
         print(f"有獎項數據: {stats['with_awards']} 位球員")
         print(f"有合約數據: {stats['with_contract']} 位球員")
-        print(f"有 Statcast 結構: {stats['with_statcast']} 位球員")
+        print(f"有 Statcast 數據: {stats['with_statcast']} 位球員")
         
         # 顯示樣本
         if stats['sample_player']:
             print("\n[樣本球員]")
-            player = stats['sample_player']
-            print(f"球員: {player['player_name']} ({player['season']})")
+            player_name = stats['sample_player']
+            tables = stats['tables']
+            print(f"球員: {player_name}")
             
-            if 'awards' in player:
-                print(f"\n獎項: {player['awards']['total_count']} 個")
-                for award_type, years in player['awards'].items():
-                    if award_type != 'total_count':
-                        print(f"  {award_type}: {years}")
+            awards = tables.player_awards(player_name)
+            print(f"\n獎項: {awards['total_count']} 個")
+            for award_type, years in awards.items():
+                if award_type != 'total_count':
+                    print(f"  {award_type}: {years}")
             
-            if 'contract' in player and player['contract']:
+            contract = tables.player_contract(player_name)
+            if contract:
                 print(f"\n合約:")
-                print(f"  薪資: ${player['contract']['current_salary']:,}")
-                print(f"  年份: {player['contract']['year']}")
-                print(f"  球隊: {player['contract']['team']}")
+                print(f"  薪資: ${contract['current_salary']:,}")
+                print(f"  年份: {contract['year']}")
+                print(f"  球隊: {contract['team']}")
             
-            if 'statcast' in player:
-                print(f"\nStatcast: {player['statcast'].get('note', '已建立')}")
+            statcast = tables.player_statcast(player_name)
+            print(f"\nStatcast: {statcast if statcast else '待補充'}")
     
     # 總結
     print("\n" + "=" * 80)
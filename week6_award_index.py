@@ -0,0 +1,267 @@
+"""
+Week 6: 獎項反向索引（award → year → league → players）
+
+原本：handle_award_query 一定要有球員名字（LLM 提取），
+      "Who won the Cy Young in 2023?" 會回答「無法識別球員名字」
+現在：從 awards 副表（week6_side_tables）建立反向索引，
+    1. 得主查詢："Who won the Cy Young in 2023?" / "AL MVP 2022" → index[award][year][league]
+    2. 次數排行："most All-Star selections 2022–2025" → 區間內各年份的得主計數
+    兩者都是字典查找 + 計數，不經過 LLM
+
+用法：
+    index = AwardIndex.from_table(side_tables.awards.df)
+    spec = parse_award_query("Who won the Cy Young in 2023?")
+    if spec: result = index.answer(spec)
+"""
+
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from week6_ranking_engine import DEFAULT_TOP_N, parse_seasons, parse_top_n
+
+# ============================================
+# 配置
+# ============================================
+
+# 查詢中的獎項說法 → 副表中可能的獎項名稱（week5_awards_simple 與 Lahman awardID）
+AWARD_PATTERNS = [
+    (r'\bmvps?\b|most valuable', ['MVP', 'Most Valuable Player']),
+    (r'cy young', ['Cy Young', 'Cy Young Award']),
+    (r'rookie of the year|\broy\b|新人王', ['Rookie of the Year', 'Rookie of the Year Award']),
+    (r'all[- ]?stars?|明星賽', ['All-Star']),
+    (r'gold glove|金手套', ['Gold Glove']),
+    (r'silver slugger|銀棒', ['Silver Slugger']),
+]
+
+# AL / NL 區分大小寫（避免 "all" 之類的字），全名不區分
+LEAGUE_PATTERNS = [
+    (r'\bAL\b|(?i:american league)|美聯', 'AL'),
+    (r'\bNL\b|(?i:national league)|國聯', 'NL'),
+]
+
+# 沒有聯盟資訊的獎項（例如 KNOWN_AWARDS 的 All-Star 名單）
+NO_LEAGUE = ''
+
+# ============================================
+# 查詢解析
+# ============================================
+
+def parse_award_query(query: str) -> Optional[Dict]:
+    """
+    解析反向獎項查詢；不是「誰得獎 / 次數排行」的查詢回傳 None（交給球員查詢）
+
+    "Who won the Cy Young in 2023?"        → {'mode': 'winners', 'award': 'Cy Young', 'seasons': [2023]}
+    "Most All-Star selections 2022–2025"   → {'mode': 'leaderboard', 'award': 'All-Star', 'seasons': [2022, ..., 2025]}
+    "Has Aaron Judge won MVP?"             → None
+
+    "How many times has Mike Trout won MVP?" 也會被解析成次數排行：
+    呼叫端需先排除提到已知球員的查詢（EnhancedSmartRouter.find_known_player）
+    """
+
+    query_lower = query.lower()
+
+    award_names = None
+    for pattern, names in AWARD_PATTERNS:
+        if re.search(pattern, query_lower):
+            award_names = names
+            break
+    if award_names is None:
+        return None
+
+    # "most valuable" 是獎項名稱，不是排行
+    mode_text = query_lower.replace('most valuable', '')
+    if re.search(r'\bmost\b|how many times|leaders?\b|leaderboard|\btop\s*\d*|最多|次數|排行', mode_text):
+        mode = 'leaderboard'
+    elif re.search(r'^\s*(?:who|which)\b|winners?\b|得主|誰', mode_text):
+        mode = 'winners'
+    else:
+        return None
+
+    league = None
+    for pattern, name in LEAGUE_PATTERNS:
+        if re.search(pattern, query):
+            league = name
+            break
+
+    return {
+        'mode': mode,
+        'award_names': award_names,
+        'seasons': parse_seasons(query),
+        'league': league,
+        'top_n': parse_top_n(query) or DEFAULT_TOP_N,
+    }
+
+# ============================================
+# 反向索引
+# ============================================
+
+class AwardIndex:
+    """
+    index[award][year][league] → [players]
+
+    league 為 'AL' / 'NL'，沒有聯盟資訊的獎項為 ''
+    """
+
+    def __init__(self, index: Dict[str, Dict[int, Dict[str, List[str]]]]):
+        self.index = index
+
+    @classmethod
+    def from_table(cls, awards_df: pd.DataFrame) -> 'AwardIndex':
+        """awards 副表（player, award, year, league）→ 反向索引"""
+
+        index: Dict[str, Dict[int, Dict[str, List[str]]]] = {}
+        for player, award, year, league in awards_df[['player', 'award', 'year', 'league']].itertuples(index=False):
+            players = index.setdefault(award, {}).setdefault(int(year), {}).setdefault(league or NO_LEAGUE, [])
+            if player not in players:
+                players.append(player)
+        return cls(index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def resolve_award(self, award_names: List[str]) -> Optional[str]:
+        """查詢中的獎項 → 索引中實際存在的名稱"""
+        for name in award_names:
+            if name in self.index:
+                return name
+        return None
+
+    def years(self, award: str) -> List[int]:
+        return sorted(self.index.get(award, {}))
+
+    def winners(self, award: str, year: int, league: Optional[str] = None) -> Dict[str, List[str]]:
+        """{league: [players]}；指定 league 時只保留該聯盟"""
+        by_league = self.index.get(award, {}).get(year, {})
+        if league is None:
+            return by_league
+        return {league: by_league[league]} if league in by_league else {}
+
+    def leaderboard(self, award: str, seasons: List[int], league: Optional[str] = None,
+                    top_n: int = 10) -> List[Dict]:
+        """區間內得獎次數排行（同次數依名字排序）"""
+
+        counts: Counter = Counter()
+        years_won: Dict[str, List[int]] = {}
+        for year in seasons:
+            for players in self.winners(award, year, league).values():
+                for player in players:
+                    counts[player] += 1
+                    years_won.setdefault(player, []).append(year)
+
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+        return [{'player': player, 'count': count, 'years': years_won[player]} for player, count in ranked]
+
+    # ---------- 回答 ----------
+
+    def answer(self, spec: Dict) -> Dict:
+        """
+        回答 parse_award_query 的結果
+
+        Returns:
+            {'type': 'award', 'mode', 'award', 'seasons', 'winners' 或 'leaderboard', 'answer'}
+        """
+
+        award = self.resolve_award(spec['award_names'])
+        if award is None:
+            return {
+                'type': 'award',
+                'error': '找不到獎項',
+                'answer': f"獎項記錄中沒有 {spec['award_names'][0]} 的數據"
+            }
+
+        # 沒有指定年份：得主查詢用最新一年，次數排行用所有年份
+        available = self.years(award)
+        default_seasons = available if spec['mode'] == 'leaderboard' else available[-1:]
+        seasons = [year for year in (spec['seasons'] or default_seasons) if year in self.index[award]]
+
+        # 資料來源沒有聯盟資訊（Lahman 整理後的 week5_awards.json）時不過濾聯盟
+        league = spec['league']
+        note = ""
+        if league and not any(league in self.index[award][year] for year in seasons):
+            note = f"\n\n（記錄中沒有 {award} 的聯盟資訊，列出所有得主）"
+            league = None
+        label = f"{league} {award}" if league else award
+
+        if not seasons:
+            requested = spec['seasons'] or []
+            return {
+                'type': 'award',
+                'award': award,
+                'error': '找不到年份',
+                'answer': f"{label} 沒有 {', '.join(map(str, requested))} 的記錄"
+                          f"（記錄年份：{', '.join(map(str, available))}）"
+            }
+
+        if spec['mode'] == 'leaderboard':
+            leaderboard = self.leaderboard(award, seasons, league, spec['top_n'])
+            span = f"{seasons[0]}–{seasons[-1]}" if len(seasons) > 1 else str(seasons[0])
+            answer = f"{span} {label} 次數排行：\n\n"
+            for rank, entry in enumerate(leaderboard, 1):
+                answer += f"{rank}. {entry['player']}: {entry['count']} 次 ({', '.join(map(str, entry['years']))})\n"
+            return {
+                'type': 'award',
+                'mode': 'leaderboard',
+                'award': award,
+                'seasons': seasons,
+                'leaderboard': leaderboard,
+                'answer': answer.rstrip() + note
+            }
+
+        winners = {year: self.winners(award, year, league) for year in seasons}
+        answer = ""
+        for year, by_league in winners.items():
+            answer += f"{year} {label} 得主：\n"
+            if not by_league:
+                answer += "• 無記錄\n"
+            for league_name in sorted(by_league):
+                players = ', '.join(by_league[league_name])
+                answer += f"• {league_name}: {players}\n" if league_name else f"• {players}\n"
+            answer += "\n"
+        return {
+            'type': 'award',
+            'mode': 'winners',
+            'award': award,
+            'seasons': seasons,
+            'winners': winners,
+            'answer': answer.rstrip() + note
+        }
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import time
+
+    from week6_side_tables import SideTables
+
+    tables = SideTables.load()
+    index = AwardIndex.from_table(tables.awards.df)
+
+    print("=" * 80)
+    print(f"獎項反向索引：{len(index)} 種獎項 / {len(tables.awards)} 筆記錄")
+    print("=" * 80)
+
+    test_queries = [
+        "Who won the Cy Young in 2023?",
+        "Who won the AL MVP in 2022?",
+        "Which players were All-Stars in 2024?",
+        "Most All-Star selections 2022-2025",
+        "Has Aaron Judge won MVP?",
+    ]
+
+    for query in test_queries:
+        print(f"\n查詢: {query}")
+        print("-" * 80)
+        start_time = time.perf_counter()
+        spec = parse_award_query(query)
+        if spec is None:
+            print("（球員查詢，交給 EnhancedSmartRouter）")
+            continue
+        result = index.answer(spec)
+        print(result['answer'])
+        print(f"⏱️  {(time.perf_counter() - start_time) * 1000:.3f} ms")
@@ -0,0 +1,402 @@
+"""
+Week 6: 端到端延遲與吞吐量基準測試
+week3_evaluation.py 只量準確率；這裡量「多快」與「撐得住多少併發」
+
+流程：
+    1. 合成查詢：6 種類型（factual / ranking / analysis / award / contract / statcast）× 英文 / 中文，
+       球員與賽季取自文檔，以 seed 決定 → 每次產生相同的查詢集
+    2. 以指定併發數執行：
+       - factual / ranking / analysis → mlb_assistant（各階段時間取自 result['timings']）
+       - award / contract / statcast → EnhancedQueryClassifier.classify + EnhancedSmartRouter.route
+    3. 報告每個階段與每種類型的 p50 / p95 / p99、QPS、錯誤數、模板回答比例、峰值 RSS
+    4. 結果存成 JSON（含 git commit），不同 commit 的結果可用 compare_benchmarks 比較
+
+不需要真實模型時可搭配：
+    python week6_ollama_stub.py                         # 替身 LLM（固定延遲）
+    LLM_CASSETTE_MODE=replay                            # 或重播錄製的回應
+
+執行：
+    python week6_benchmark.py [查詢數=60] [併發數=4]
+    python week6_benchmark.py compare 舊結果.json 新結果.json
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from week6_ollama_stub import ollama_base_url
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+DOCUMENTS_FILE = os.path.join(DATA_DIR, "mlb_documents.json")
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmarks")
+
+QUERY_TYPES = ['factual', 'ranking', 'analysis', 'award', 'contract', 'statcast']
+ASSISTANT_TYPES = {'factual', 'ranking', 'analysis'}
+PERCENTILES = (50, 95, 99)
+
+# 找不到文檔時使用的球員
+FALLBACK_PLAYERS = [
+    {'player_name': 'Aaron Judge', 'type': 'batter'},
+    {'player_name': 'Shohei Ohtani', 'type': 'batter'},
+    {'player_name': 'Juan Soto', 'type': 'batter'},
+    {'player_name': 'Gerrit Cole', 'type': 'pitcher'},
+    {'player_name': 'Zack Wheeler', 'type': 'pitcher'},
+]
+
+BENCHMARK_STATS = {
+    'batter': ['HR', 'AVG', 'OPS', 'wRC+', 'WAR', 'RBI'],
+    'pitcher': ['ERA', 'WHIP', 'SO', 'FIP', 'WAR'],
+}
+
+# {player} / {stat} / {season} 由產生器填入
+QUERY_TEMPLATES = {
+    'factual': {
+        'en': ["What is {player}'s {stat} in {season}?", "Show {player}'s {stat} for {season}"],
+        'zh': ["{player} {season} 年的 {stat} 是多少？", "{player} 在 {season} 賽季的 {stat}"],
+    },
+    'ranking': {
+        'en': ["Who had the highest {stat} in {season}?", "Top 5 {stat} leaders in {season}"],
+        'zh': ["{season} 年 {stat} 最高的球員是誰？", "{season} 賽季 {stat} 排名前 5"],
+    },
+    'analysis': {
+        'en': ["How has {player} performed over the years?", "Analyze {player}'s career trend"],
+        'zh': ["分析 {player} 的表現趨勢", "{player} 這幾年的表現如何？"],
+    },
+    'award': {
+        'en': ["Has {player} won MVP?", "What awards has {player} won?"],
+        'zh': ["{player} 得過 MVP 嗎？", "{player} 得過什麼獎？"],
+    },
+    'contract': {
+        'en': ["What is {player}'s salary?", "How much is {player}'s contract?"],
+        'zh': ["{player} 的薪資是多少？", "{player} 的合約多少錢？"],
+    },
+    'statcast': {
+        'en': ["What is {player}'s exit velocity?", "What is {player}'s barrel rate?"],
+        'zh': ["{player} 的 exit velocity 是多少？", "{player} 的 barrel 率"],
+    },
+}
+
+
+# ============================================
+# 合成查詢
+# ============================================
+
+def load_players(documents_path: str = DOCUMENTS_FILE) -> List[Dict]:
+    """每位球員一筆（player_name / type / seasons）"""
+
+    if not os.path.exists(documents_path):
+        return [dict(p, seasons=[2024]) for p in FALLBACK_PLAYERS]
+
+    with open(documents_path, 'r', encoding='utf-8') as f:
+        docs = json.load(f)
+
+    players: Dict[str, Dict] = {}
+    for doc in docs:
+        entry = players.setdefault(doc['player_name'], {
+            'player_name': doc['player_name'],
+            'type': doc.get('type', 'batter'),
+            'seasons': set(),
+        })
+        entry['seasons'].add(doc['season'])
+
+    return [dict(p, seasons=sorted(p['seasons'])) for p in players.values()]
+
+
+def generate_queries(n: int = 60, seed: int = 42, players: Optional[List[Dict]] = None,
+                     query_types: List[str] = QUERY_TYPES) -> List[Dict]:
+    """
+    產生 n 筆查詢，類型與語言輪流分配（每種類型 / 語言數量相同）
+
+    Returns:
+        [{'id', 'query', 'type', 'lang', 'player'}, ...]
+    """
+
+    rng = random.Random(seed)
+    players = players or load_players()
+    queries = []
+
+    for i in range(n):
+        query_type = query_types[i % len(query_types)]
+        lang = 'en' if (i // len(query_types)) % 2 == 0 else 'zh'
+        player = rng.choice(players)
+        stat = rng.choice(BENCHMARK_STATS.get(player['type'], BENCHMARK_STATS['batter']))
+        season = rng.choice(player['seasons'])
+        template = rng.choice(QUERY_TEMPLATES[query_type][lang])
+
+        queries.append({
+            'id': f"{query_type}_{lang}_{i:04d}",
+            'query': template.format(player=player['player_name'], stat=stat, season=season),
+            'type': query_type,
+            'lang': lang,
+            'player': player['player_name'],
+        })
+
+    return queries
+
+
+# ============================================
+# 執行目標
+# ============================================
+
+def make_runner() -> Callable[[Dict], Dict]:
+    """
+    建立執行函數（延遲載入：只載入查詢集需要的系統）
+
+    Returns:
+        run(query) -> {'stages': {階段: 毫秒}, 'fallback': bool}
+    """
+
+    from week2_mlb_assistant import mlb_assistant
+    from week6_llm_scheduler import PRIORITY_BATCH
+
+    router = classifier = None
+    if os.path.exists(DOCUMENTS_FILE):
+        from week5_enhanced_classifier import EnhancedQueryClassifier
+        from week5_enhanced_router import EnhancedSmartRouter
+        classifier = EnhancedQueryClassifier()
+        router = EnhancedSmartRouter(DOCUMENTS_FILE)
+
+    def run(query: Dict) -> Dict:
+        if query['type'] in ASSISTANT_TYPES:
+            result = mlb_assistant(query['query'], priority=PRIORITY_BATCH)
+            return {'stages': dict(result.get('timings', {})), 'fallback': result.get('fallback', False)}
+
+        if router is None:
+            raise FileNotFoundError(f"找不到 {DOCUMENTS_FILE}，無法測試 {query['type']} 查詢")
+
+        start = time.perf_counter()
+        query_type, _ = classifier.classify(query['query'])
+        classified = time.perf_counter()
+        router.route(query['query'], query_type)
+        routed = time.perf_counter()
+        return {
+            'stages': {'classify_ms': (classified - start) * 1000, 'route_ms': (routed - classified) * 1000},
+            'fallback': False,
+        }
+
+    return run
+
+
+# ============================================
+# 量測
+# ============================================
+
+def peak_rss_mb() -> Optional[float]:
+    """程序峰值常駐記憶體（MB）；Windows 沒有 resource 模組時回傳 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位為 KB，macOS 為 bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(values: List[float]) -> Dict:
+    if not values:
+        return {'count': 0}
+    array = np.asarray(values, dtype=float)
+    summary = {'count': len(values), 'mean': round(float(array.mean()), 3), 'max': round(float(array.max()), 3)}
+    for p, value in zip(PERCENTILES, np.percentile(array, PERCENTILES)):
+        summary[f"p{p}"] = round(float(value), 3)
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(queries: List[Dict], concurrency: int = 4, warmup: int = 3,
+                  run: Optional[Callable[[Dict], Dict]] = None, quiet: bool = True) -> Dict:
+    """
+    以固定併發執行查詢集
+
+    warmup：正式量測前先執行的查詢數（載入模型 / 填滿快取，不計入結果）
+    quiet：隱藏 mlb_assistant 的逐步輸出
+    """
+
+    run = run or make_runner()
+    output = io.StringIO() if quiet else sys.stdout
+
+    def timed(query: Dict) -> Dict:
+        start = time.perf_counter()
+        try:
+            result = run(query)
+            error = None
+        except Exception as e:
+            result, error = {'stages': {}, 'fallback': False}, f"{type(e).__name__}: {e}"
+        result['total_ms'] = (time.perf_counter() - start) * 1000
+        result['query'] = query
+        result['error'] = error
+        return result
+
+    with contextlib.redirect_stdout(output):
+        for query in queries[:warmup]:
+            timed(query)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            records = list(pool.map(timed, queries))
+        wall_s = time.perf_counter() - start
+
+    stages = defaultdict(list)
+    by_type = defaultdict(list)
+    by_lang = defaultdict(list)
+    errors = []
+    fallbacks = 0
+
+    for record in records:
+        query = record['query']
+        if record['error']:
+            errors.append({'id': query['id'], 'query': query['query'], 'error': record['error']})
+            continue
+        fallbacks += record['fallback']
+        stages['total_ms'].append(record['total_ms'])
+        by_type[query['type']].append(record['total_ms'])
+        by_lang[query['lang']].append(record['total_ms'])
+        for stage, ms in record['stages'].items():
+            stages[stage].append(ms)
+
+    completed = len(records) - len(errors)
+    return {
+        'metadata': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'queries': len(queries),
+            'concurrency': concurrency,
+            'warmup': warmup,
+            'ollama_host': ollama_base_url(),
+            'cassette_mode': os.environ.get("LLM_CASSETTE_MODE", "off"),
+        },
+        'overall': {
+            'completed': completed,
+            'errors': len(errors),
+            'wall_s': round(wall_s, 3),
+            'qps': round(completed / wall_s, 3) if wall_s > 0 else None,
+            'fallback_rate': round(fallbacks / completed, 4) if completed else None,
+            'peak_rss_mb': peak_rss_mb(),
+        },
+        'stages': {stage: summarize(values) for stage, values in stages.items()},
+        'by_type': {t: summarize(by_type[t]) for t in QUERY_TYPES if t in by_type},
+        'by_lang': {lang: summarize(values) for lang, values in by_lang.items()},
+        'errors': errors,
+    }
+
+
+def save_benchmark(results: Dict, output_dir: str = BENCHMARK_DIR) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    meta = results['metadata']
+    stamp = meta['timestamp'].replace(':', '').replace('-', '')
+    path = os.path.join(output_dir, f"benchmark_{meta['commit'] or 'nogit'}_{stamp}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return path
+
+
+# ============================================
+# 報告
+# ============================================
+
+def print_report(results: Dict):
+    overall = results['overall']
+    meta = results['metadata']
+
+    print(f"\ncommit {meta['commit']}，{meta['queries']} 筆查詢，併發 {meta['concurrency']}")
+    print(f"  完成 {overall['completed']}，錯誤 {overall['errors']}，耗時 {overall['wall_s']:.2f} 秒")
+    print(f"  QPS：{overall['qps']}")
+    if overall['fallback_rate'] is not None:
+        print(f"  模板回答比例：{overall['fallback_rate']:.1%}")
+    if overall['peak_rss_mb'] is not None:
+        print(f"  峰值 RSS：{overall['peak_rss_mb']:.0f} MB")
+
+    def table(title: str, rows: Dict):
+        print(f"\n{title:<16}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+        print("-" * 66)
+        for name, s in rows.items():
+            if s['count']:
+                print(f"{name:<16}{s['count']:>6}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+
+    table("階段", results['stages'])
+    table("查詢類型", results['by_type'])
+    table("語言", results['by_lang'])
+
+    for error in results['errors'][:5]:
+        print(f"  ❌ {error['id']}: {error['error']}")
+
+
+def compare_benchmarks(old_path: str, new_path: str):
+    """比較兩次結果的 p50 / p95 / QPS（負數 = 變快）"""
+
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f"\n{old['metadata']['commit']} → {new['metadata']['commit']}")
+    print(f"  QPS：{old['overall']['qps']} → {new['overall']['qps']}")
+
+    print(f"\n{'階段':<16}{'p50 舊':>10}{'p50 新':>10}{'變化':>9}{'p95 舊':>10}{'p95 新':>10}{'變化':>9}")
+    print("-" * 74)
+    for group in ('stages', 'by_type'):
+        for name, s_new in new[group].items():
+            s_old = old[group].get(name)
+            if not s_old or not s_old.get('count') or not s_new.get('count'):
+                continue
+            cells = []
+            for p in ('p50', 'p95'):
+                change = (s_new[p] - s_old[p]) / s_old[p] if s_old[p] else 0.0
+                cells.append(f"{s_old[p]:>10.1f}{s_new[p]:>10.1f}{change:>+9.0%}")
+            print(f"{name:<16}{''.join(cells)}")
+
+
+# ============================================
+# 主程式
+# ============================================
+
+if __name__ == "__main__":
+
+    if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare_benchmarks(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    print("=" * 80)
+    print("Week 6: 端到端延遲與吞吐量基準測試")
+    print("=" * 80)
+
+    queries = generate_queries(n)
+    print(f"\n[1] 產生 {len(queries)} 筆查詢（{len(QUERY_TYPES)} 種類型 × 英文 / 中文）")
+    for query in queries[:len(QUERY_TYPES) * 2]:
+        print(f"  {query['type']:<10}{query['lang']:<4}{query['query']}")
+
+    print(f"\n[2] 載入系統...")
+    runner = make_runner()
+
+    print(f"\n[3] 執行（併發 {concurrency}）...")
+    results = run_benchmark(queries, concurrency=concurrency, run=runner)
+    print_report(results)
+
+    path = save_benchmark(results)
+    print(f"\n💾 結果已儲存：{path}")
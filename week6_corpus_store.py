@@ -0,0 +1,365 @@
+"""
+Week 6: 共享的語料陣列（多程序服務時每個 worker 不再各持一份語料）
+
+原本：docs_df 是 pandas DataFrame，stats 欄位是每列一個 Python dict；
+      fork 出來的 worker 讀取時會更新這些物件的 refcount → copy-on-write 分頁被複製，
+      每個 worker 的記憶體逐漸長到接近一整份語料
+現在：服務用的語料全部存成欄式 NumPy 陣列（沒有逐列的 Python 物件），並以 .npy 檔 mmap 載入
+    - 球員 / 球隊 / 類型 / 位置 → 排序後的字典（固定寬度字串陣列）+ 整數代碼
+    - 統計 → float64 矩陣 [列, 統計]（NaN = 缺值）+ 是否為整數的 bool 矩陣（還原 58 而不是 58.0）
+    - 列依 (球員, 賽季) 排序，player_start 記錄每位球員的區間 → 二分搜尋找球員
+    - embeddings（選用）→ float32 矩陣
+    mmap 的分頁屬於 page cache，所有程序（fork 的 worker、獨立的 Streamlit 程序）共用同一份；
+    CORPUS_DIR 指向 /dev/shm 時整份語料常駐記憶體
+
+建置（mlb_documents.json 更新後自動重建，也可手動執行）：
+    python week6_corpus_store.py
+    python week6_corpus_store.py embeddings      # 一併計算文檔 embeddings
+
+使用：
+    corpus = load_or_build_corpus(docs_file)
+    corpus.player_span("Aaron Judge")   → (start, end)
+    corpus.row_stats(i)                 → {'HR': 58, 'AVG': 0.322, ...}
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+CORPUS_DIR = os.environ.get("CORPUS_DIR", os.path.join(DATA_DIR, "corpus"))
+MANIFEST_FILE = "manifest.json"
+CORPUS_VERSION = 1
+
+# 字典編碼的字串欄位：欄位名稱 → 代碼陣列 / 字典陣列
+VOCAB_COLUMNS = ('team', 'type', 'position')
+
+# ============================================
+# 建置
+# ============================================
+
+def _encode_vocab(values) -> Tuple[np.ndarray, np.ndarray]:
+    """字串欄位 → (排序後的字典, int32 代碼)"""
+    strings = np.array(['' if v is None or (isinstance(v, float) and np.isnan(v)) else str(v) for v in values])
+    vocab, codes = np.unique(strings, return_inverse=True)
+    return vocab, codes.astype(np.int32)
+
+
+def build_corpus_arrays(docs_df: pd.DataFrame, embeddings: Optional[np.ndarray] = None) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    docs_df → 欄式陣列
+
+    Returns:
+        (arrays, extras)：extras 為非數值的統計 {排序後列號: {欄位: 值}}（一般不會有）
+    """
+
+    n = len(docs_df)
+    player_names, player_codes = _encode_vocab(docs_df['player_name'])
+    seasons = docs_df['season'].to_numpy(dtype=np.int32)
+
+    # 依 (球員, 賽季) 排序；lexsort 為穩定排序，同賽季保留原本順序
+    order = np.lexsort((seasons, player_codes))
+    sorted_codes = player_codes[order]
+
+    arrays = {
+        'doc_idx': order.astype(np.int64),
+        'player_names': player_names,
+        'player_start': np.searchsorted(sorted_codes, np.arange(len(player_names) + 1)).astype(np.int64),
+        'season': seasons[order],
+        'age': (pd.to_numeric(docs_df['age'], errors='coerce').to_numpy(dtype=np.float32)[order]
+                if 'age' in docs_df.columns else np.full(n, np.nan, dtype=np.float32)),
+    }
+    for column in VOCAB_COLUMNS:
+        values = docs_df[column] if column in docs_df.columns else [''] * n
+        vocab, codes = _encode_vocab(values)
+        arrays[f'{column}_names'] = vocab
+        arrays[f'{column}_code'] = codes[order]
+
+    # 統計矩陣（欄位依第一次出現的順序）
+    stats_records = [s if isinstance(s, dict) else {} for s in docs_df['stats'].to_numpy(dtype=object)[order]]
+    stat_names: Dict[str, int] = {}
+    for record in stats_records:
+        for key in record:
+            if key not in stat_names:
+                stat_names[key] = len(stat_names)
+
+    matrix = np.full((n, len(stat_names)), np.nan, dtype=np.float64)
+    is_int = np.zeros((n, len(stat_names)), dtype=bool)
+    extras: Dict[str, Dict] = {}
+    for row, record in enumerate(stats_records):
+        for key, value in record.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float, np.integer, np.floating)):
+                if value is not None:
+                    extras.setdefault(str(row), {})[key] = value
+                continue
+            col = stat_names[key]
+            matrix[row, col] = value
+            is_int[row, col] = isinstance(value, (int, np.integer))
+
+    arrays['stat_names'] = np.array(list(stat_names), dtype=str) if stat_names else np.empty(0, dtype='<U1')
+    arrays['stats'] = matrix
+    arrays['stats_int'] = is_int
+
+    if embeddings is not None:
+        arrays['embeddings'] = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32)[order])
+
+    return arrays, extras
+
+
+def save_corpus(arrays: Dict[str, np.ndarray], extras: Dict, directory: str = CORPUS_DIR,
+                source_file: Optional[str] = None):
+    """
+    寫成 .npy + manifest.json
+
+    先寫到暫存目錄再換名：已 mmap 舊檔的 worker 不受影響（POSIX 上舊 inode 會保留到關閉為止）
+    """
+
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array, allow_pickle=False)
+
+    manifest = {
+        'version': CORPUS_VERSION,
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'rows': int(len(arrays['season'])),
+        'players': int(len(arrays['player_names'])),
+        'arrays': sorted(arrays),
+        'extras': extras,
+    }
+    if source_file:
+        stat = os.stat(source_file)
+        manifest['source'] = {'path': os.path.abspath(source_file), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+# ============================================
+# 語料
+# ============================================
+
+class CorpusStore:
+    """
+    欄式語料（陣列可以是一般 NumPy 陣列或 mmap）
+
+    列已依 (球員, 賽季) 排序；doc_idx[i] 為第 i 列在原始 mlb_documents.json 中的位置
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], extras: Optional[Dict] = None, mmap: bool = False):
+        self.arrays = arrays
+        self.mmap = mmap
+        self.manifest: Dict = {}
+        self.extras = {int(row): values for row, values in (extras or {}).items()}
+
+        self.player_names = arrays['player_names']
+        self.player_start = arrays['player_start']
+        self.season = arrays['season']
+        self.doc_idx = arrays['doc_idx']
+        self.stats = arrays['stats']
+        self.stats_int = arrays['stats_int']
+        self.embeddings = arrays.get('embeddings')
+
+        # 統計名稱只有數百個，保留成 Python list 供組 dict
+        self.stat_names: List[str] = [str(name) for name in arrays['stat_names']]
+        self._stat_columns = {name: i for i, name in enumerate(self.stat_names)}
+
+    @classmethod
+    def from_documents(cls, docs_df: pd.DataFrame, embeddings: Optional[np.ndarray] = None) -> 'CorpusStore':
+        arrays, extras = build_corpus_arrays(docs_df, embeddings)
+        return cls(arrays, extras)
+
+    @classmethod
+    def load(cls, directory: str = CORPUS_DIR, mmap: bool = True) -> Optional['CorpusStore']:
+        """載入 save_corpus 的輸出；不存在或版本不符時回傳 None"""
+
+        manifest_file = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            return None
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != CORPUS_VERSION:
+            return None
+
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None, allow_pickle=False)
+            for name in manifest['arrays']
+        }
+        store = cls(arrays, manifest.get('extras'), mmap=mmap)
+        store.manifest = manifest
+        return store
+
+    def __len__(self) -> int:
+        return len(self.season)
+
+    @property
+    def n_players(self) -> int:
+        return len(self.player_names)
+
+    # ---------- 查詢 ----------
+
+    def player_span(self, player_name: str) -> Optional[Tuple[int, int]]:
+        """球員的 [start, end) 列區間（二分搜尋排序後的球員字典）"""
+
+        code = int(np.searchsorted(self.player_names, player_name))
+        if code >= len(self.player_names) or self.player_names[code] != player_name:
+            return None
+        return int(self.player_start[code]), int(self.player_start[code + 1])
+
+    def vocab_values(self, column: str, start: int, end: int) -> np.ndarray:
+        """字典編碼欄位（team / type / position）的一段列"""
+        return self.arrays[f'{column}_names'][self.arrays[f'{column}_code'][start:end]]
+
+    def vocab_value(self, column: str, row: int) -> str:
+        return str(self.arrays[f'{column}_names'][self.arrays[f'{column}_code'][row]])
+
+    def stat_column(self, aliases: List[str]) -> np.ndarray:
+        """
+        統計欄位（多個別名時每列取第一個有值的欄位）
+
+        只有一個別名存在時回傳 view（不複製）；都不存在時為 NaN 陣列
+        """
+
+        columns = [self.stats[:, self._stat_columns[name]] for name in aliases if name in self._stat_columns]
+        if not columns:
+            return np.full(len(self), np.nan)
+        result = columns[0]
+        for column in columns[1:]:
+            result = np.where(np.isnan(result), column, result)
+        return result
+
+    def row_stats(self, row: int) -> Dict:
+        """第 row 列的統計 dict（與原本 docs_df['stats'] 相同的欄位與型別，缺值不列出）"""
+
+        values = self.stats[row]
+        ints = self.stats_int[row]
+        stats = {}
+        for col in np.flatnonzero(~np.isnan(values)):
+            value = values[col]
+            stats[self.stat_names[col]] = int(value) if ints[col] else float(value)
+        if row in self.extras:
+            stats.update(self.extras[row])
+        return stats
+
+    def to_wide(self) -> pd.DataFrame:
+        """
+        攤平成 week6_derived_metrics.flatten_documents 的寬表格式（依 doc_idx 排序）
+
+        暫時使用（例如即時建置球隊立方體），不要在服務中保留
+        """
+
+        order = np.argsort(self.doc_idx, kind='stable')
+        name_code = np.repeat(np.arange(self.n_players), np.diff(self.player_start))
+        wide = pd.DataFrame({
+            'doc_idx': np.asarray(self.doc_idx)[order],
+            'player_name': self.player_names[name_code[order]],
+            'season': np.asarray(self.season)[order],
+            'team': self.vocab_values('team', 0, len(self))[order],
+            'age': np.asarray(self.arrays['age'])[order],
+            'type': self.vocab_values('type', 0, len(self))[order],
+            'position': self.vocab_values('position', 0, len(self))[order],
+        })
+        stats = pd.DataFrame(np.asarray(self.stats)[order], columns=[f"stat_{name}" for name in self.stat_names])
+        return pd.concat([wide, stats], axis=1)
+
+    def memory_report(self) -> Dict:
+        sizes = {name: int(array.nbytes) for name, array in self.arrays.items()}
+        return {
+            'rows': len(self),
+            'players': self.n_players,
+            'stats': len(self.stat_names),
+            'mmap': self.mmap,
+            'arrays_mb': {name: round(size / 1024 / 1024, 3) for name, size in sizes.items()},
+            'total_mb': round(sum(sizes.values()) / 1024 / 1024, 2),
+        }
+
+
+def _is_fresh(manifest: Dict, source_file: str) -> bool:
+    source = manifest.get('source')
+    if not source or not os.path.exists(source_file):
+        return source is not None
+    stat = os.stat(source_file)
+    return source['size'] == stat.st_size and source['mtime'] == stat.st_mtime
+
+
+def load_or_build_corpus(docs_file: str, directory: str = CORPUS_DIR) -> CorpusStore:
+    """
+    載入 mmap 語料；不存在或 mlb_documents.json 已更新時重新建置並寫入
+
+    目錄無法寫入時改用記憶體中的陣列（功能相同，只是無法跨程序共用）
+    """
+
+    store = CorpusStore.load(directory)
+    if store is not None and _is_fresh(store.manifest, docs_file):
+        return store
+
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+
+    arrays, extras = build_corpus_arrays(docs_df)
+    del docs_df
+    try:
+        save_corpus(arrays, extras, directory, source_file=docs_file)
+    except OSError as e:
+        print(f"  ⚠️  無法寫入語料陣列（{e}），改用記憶體中的陣列")
+        return CorpusStore(arrays, extras)
+
+    print(f"  ✅ 語料陣列已建置：{directory}")
+    return CorpusStore.load(directory)
+
+# ============================================
+# 建置 / 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    docs_file = os.path.join(DATA_DIR, "mlb_documents.json")
+
+    print("=" * 80)
+    print("建置共享語料陣列")
+    print("=" * 80)
+
+    if not os.path.exists(docs_file):
+        print(f"❌ 找不到數據文件：{docs_file}")
+        exit(1)
+
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+    print(f"\n[1] 載入 {len(docs_df)} 筆文檔")
+
+    embeddings = None
+    if len(sys.argv) > 1 and sys.argv[1] == "embeddings":
+        from week6_embedding_sidecar import load_embedding_model
+        with open(os.path.join(DATA_DIR, "search_config.json"), 'r') as f:
+            model = load_embedding_model(json.load(f)['embedding_model'])
+        embeddings = model.encode(docs_df['text'].fillna('').tolist(), batch_size=64)
+        print(f"  ✅ embeddings：{embeddings.shape}")
+
+    start_time = time.perf_counter()
+    arrays, extras = build_corpus_arrays(docs_df, embeddings)
+    save_corpus(arrays, extras, CORPUS_DIR, source_file=docs_file)
+    print(f"\n[2] 建置完成（{(time.perf_counter() - start_time) * 1000:.0f} ms）：{CORPUS_DIR}")
+
+    corpus = CorpusStore.load(CORPUS_DIR)
+    report = corpus.memory_report()
+    print(f"  {report['rows']} 列 / {report['players']} 位球員 / {report['stats']} 個統計，共 {report['total_mb']} MB")
+
+    # 與原始 stats dict 比對
+    mismatches = sum(
+        corpus.row_stats(row) != {k: v for k, v in (docs_df['stats'].iloc[int(corpus.doc_idx[row])] or {}).items() if v is not None}
+        for row in range(len(corpus))
+    )
+    print(f"\n[3] 還原檢查：{len(corpus) - mismatches}/{len(corpus)} 列與原始 stats 相同")
@@ -0,0 +1,305 @@
+"""
+Week 6: 衍生指標層（建置階段）
+預先計算每個 (season, type) 的聯盟排名、百分位、z-score 與逐年變化
+
+原本：generate_analysis_answer 只拿到原始 wRC+/OPS/HR 或 ERA/WHIP/K/9，
+      由 LLM 自己做算術 → 浪費 token 且容易算錯
+現在：建置時用向量化 groupby 一次算好，存在語料旁邊，
+      Analysis / Ranking 路徑直接讀取
+
+輸出欄位（每個統計欄位 stat_X 皆有）：
+    stat_X_rank  聯盟排名（1 = 最好，依方向）
+    stat_X_pct   聯盟百分位（0-100，越高越好）
+    stat_X_z     z-score（原始方向）
+    stat_X_yoy   與前一賽季的差值（前一賽季不存在則為 NaN）
+
+比率統計（AVG / ERA / wRC+ 等）的 rank / pct / z 只在達到規定打席 / 局數（qual_qualified）的列之間計算，
+未達門檻的列為 NaN（語料以 qual=0 收集，1 PA 的 1.000 打擊率不會排第一）；累計統計使用全部球員
+
+另含 team_games 與 qual_<名稱> 布林欄位（見 week6_qualification）
+同時建置球隊聚合立方體 mlb_team_cube.parquet（見 week6_team_cube）
+
+執行：python week6_derived_metrics.py
+"""
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from week6_stat_registry import lower_is_better_columns, rate_stat_columns
+from week6_qualification import DEFAULT_QUALIFIER, add_qualification_flags, qual_column
+from week6_team_cube import TEAM_CUBE_FILE, build_team_cube, save_team_cube
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+DOCS_FILE = os.path.join(DATA_DIR, "mlb_documents.json")
+DERIVED_FILE = os.path.join(DATA_DIR, "mlb_derived_metrics.parquet")
+
+# 基本欄位（其餘 stats 攤平成 stat_ 欄位）
+BASE_COLUMNS = ['player_name', 'season', 'team', 'age', 'type', 'position']
+
+# 越低越好的統計（依球員類型）：統計註冊表 + 註冊表以外的 FanGraphs 欄位
+LOWER_IS_BETTER = {
+    'batter': lower_is_better_columns('batter') | {'SO', 'GDP', 'CS', 'O-Swing%', 'SwStr%'},
+    'pitcher': lower_is_better_columns('pitcher') | {'SIERA', 'HR/9', 'HR_9', 'BB%', 'BB_pct',
+                                                     'H', 'ER', 'R', 'BB', 'HR', 'L', 'AVG', 'BABIP', 'HR/FB'},
+}
+
+# 比率統計（依球員類型）：註冊表 + 註冊表以外的 FanGraphs 比率欄位（百分比、每九局、指數、打擊率類）
+RATE_STATS = {
+    'batter': rate_stat_columns('batter'),
+    'pitcher': rate_stat_columns('pitcher'),
+}
+RATE_STAT_PATTERN = r'%|/|\+$|-$|_pct$|^x?(?:AVG|OBP|SLG|OPS|ISO|BABIP|wOBA|ERA|FIP|SIERA|WHIP)$'
+
+DERIVED_SUFFIXES = ['_rank', '_pct', '_z', '_yoy']
+
+
+# ============================================
+# 攤平文檔
+# ============================================
+
+def flatten_documents(docs_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    將 stats dict 攤平成 stat_ 欄位（與 LanceDB 欄位命名一致）
+
+    Returns:
+        DataFrame，含 doc_idx（對應 docs_df 的列位置）+ 基本欄位 + stat_ 欄位
+    """
+
+    base = docs_df[[c for c in BASE_COLUMNS if c in docs_df.columns]].reset_index(drop=True)
+
+    stats_records = [s if isinstance(s, dict) else {} for s in docs_df['stats']]
+    stats = pd.DataFrame.from_records(stats_records)
+    stats = stats.apply(pd.to_numeric, errors='coerce').astype(np.float64)
+    stats.columns = [f"stat_{c}" for c in stats.columns]
+
+    wide = pd.concat([base, stats], axis=1)
+    wide.insert(0, 'doc_idx', np.arange(len(wide), dtype=np.int64))
+    return wide
+
+
+def get_stat_columns(wide: pd.DataFrame) -> List[str]:
+    """取得原始統計欄位（排除衍生欄位）"""
+    return [
+        c for c in wide.columns
+        if c.startswith('stat_') and not any(c.endswith(s) for s in DERIVED_SUFFIXES)
+    ]
+
+
+def is_lower_better(stat_name: str, player_type: str) -> bool:
+    """判斷統計方向（stat_name 不含 stat_ 前綴）"""
+    return stat_name in LOWER_IS_BETTER.get(player_type, set())
+
+
+def is_rate_stat(stat_name: str, player_type: str) -> bool:
+    """比率統計（需要樣本門檻才能比較）；stat_name 不含 stat_ 前綴"""
+    return stat_name in RATE_STATS.get(player_type, set()) or bool(re.search(RATE_STAT_PATTERN, stat_name))
+
+
+# ============================================
+# 衍生指標計算
+# ============================================
+
+def compute_derived_metrics(wide: pd.DataFrame) -> pd.DataFrame:
+    """
+    以向量化 groupby 計算排名、百分位、z-score、逐年變化
+
+    排名 / 百分位：依 (season, type) 分組，方向由 is_lower_better 決定
+    z-score：依 (season, type) 分組，保持原始方向
+    比率統計的排名 / 百分位 / z-score 只計入達到規定門檻（qual_qualified）的列，其餘為 NaN
+    逐年變化：依 (player_name, type) 分組，只與前一個連續賽季比較
+    """
+
+    if qual_column(DEFAULT_QUALIFIER) not in wide.columns:
+        wide = add_qualification_flags(wide)
+
+    stat_cols = get_stat_columns(wide)
+    group_keys = [wide['season'], wide['type']]
+
+    # 比較池：比率統計只保留達到規定門檻的列（未達門檻設為 NaN，不參與排名 / 平均 / 標準差）
+    qualified = wide[qual_column(DEFAULT_QUALIFIER)].to_numpy(dtype=bool)
+    pool = wide[stat_cols].copy()
+
+    # 方向：越低越好的欄位取負號，讓排名 / 百分位統一「越高越好」
+    types = wide['type'].to_numpy()
+    for player_type in LOWER_IS_BETTER:
+        unqualified = (types == player_type) & ~qualified
+        rate_cols = [c for c in stat_cols if is_rate_stat(c[len('stat_'):], player_type)]
+        if rate_cols and unqualified.any():
+            pool.loc[unqualified, rate_cols] = np.nan
+
+    signed = pool.copy()
+    for player_type in LOWER_IS_BETTER:
+        mask = types == player_type
+        flip = [c for c in stat_cols if is_lower_better(c[len('stat_'):], player_type)]
+        if flip and mask.any():
+            signed.loc[mask, flip] = -signed.loc[mask, flip]
+
+    grouped_signed = signed.groupby(group_keys)
+    ranks = grouped_signed.rank(method='min', ascending=False)
+    pcts = grouped_signed.rank(method='average', pct=True) * 100
+
+    grouped_raw = pool.groupby(group_keys)
+    means = grouped_raw.transform('mean')
+    stds = grouped_raw.transform('std').replace(0, np.nan)
+    zs = (pool - means) / stds
+
+    # 逐年變化：排序後 diff，前一列不是同一球員的前一賽季則設為 NaN
+    order = wide.sort_values(['player_name', 'type', 'season']).index
+    ordered = wide.loc[order]
+    yoy = ordered[stat_cols].groupby([ordered['player_name'], ordered['type']]).diff()
+    prev_season = ordered.groupby([ordered['player_name'], ordered['type']])['season'].shift()
+    yoy[(ordered['season'] - prev_season) != 1] = np.nan
+    yoy = yoy.reindex(wide.index)
+
+    derived = {}
+    for col in stat_cols:
+        derived[f"{col}_rank"] = ranks[col].astype(np.float32)
+        derived[f"{col}_pct"] = pcts[col].astype(np.float32)
+        derived[f"{col}_z"] = zs[col].astype(np.float32)
+        derived[f"{col}_yoy"] = yoy[col].astype(np.float32)
+
+    return pd.concat([wide, pd.DataFrame(derived, index=wide.index)], axis=1)
+
+
+# ============================================
+# 儲存 / 載入
+# ============================================
+
+def build_derived_metrics(
+    docs_file: str = DOCS_FILE,
+    output_file: str = DERIVED_FILE,
+    team_cube_file: Optional[str] = TEAM_CUBE_FILE
+) -> pd.DataFrame:
+    """建置衍生指標並儲存（Parquet 列式儲存）；team_cube_file 為 None 時不建置球隊立方體"""
+
+    print(f"\n[衍生指標] 載入文檔：{docs_file}")
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+    print(f"  ✅ {len(docs_df)} 筆文檔")
+
+    wide = flatten_documents(docs_df)
+    print(f"  ✅ 攤平完成：{len(get_stat_columns(wide))} 個統計欄位")
+
+    wide = add_qualification_flags(wide)
+    qual_counts = {c: int(wide[c].sum()) for c in wide.columns if c.startswith('qual_')}
+    print(f"  ✅ 資格旗標完成：{qual_counts}")
+
+    derived = compute_derived_metrics(wide)
+    print(f"  ✅ 衍生指標完成：{derived.shape[1]} 個欄位")
+
+    derived.to_parquet(output_file, index=False)
+    print(f"  💾 已儲存：{output_file}")
+
+    if team_cube_file:
+        cube = build_team_cube(wide)
+        save_team_cube(cube, team_cube_file)
+        print(f"  💾 球隊立方體已儲存：{team_cube_file}（{len(cube)} 列）")
+
+    return derived
+
+
+def load_derived_metrics(path: str = DERIVED_FILE, expected_rows: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """
+    載入衍生指標（不存在或與語料列數不符時回傳 None，呼叫端退回原始數據）
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        derived = pd.read_parquet(path)
+    except Exception as e:
+        print(f"  ⚠️  衍生指標載入失敗：{e}")
+        return None
+
+    if expected_rows is not None and len(derived) != expected_rows:
+        print(f"  ⚠️  衍生指標列數 ({len(derived)}) 與語料 ({expected_rows}) 不符，請重新建置")
+        return None
+
+    return derived.set_index('doc_idx', drop=False).sort_index()
+
+
+def derived_value_columns(derived: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """
+    只保留 stat_X_rank / _pct / _z / _yoy 欄位（單一 float64 區塊，依 doc_idx 索引）
+
+    服務載入後用來取代完整的衍生指標表：player_name / team 等字串欄位是逐列的 Python 物件，
+    fork 出來的 worker 讀取時會更新 refcount → copy-on-write 分頁被複製
+    """
+
+    if derived is None:
+        return None
+    columns = [c for c in derived.columns if c.startswith('stat_') and any(c.endswith(s) for s in DERIVED_SUFFIXES)]
+    return derived[columns].astype(np.float64)
+
+
+def get_derived_values(derived: Optional[pd.DataFrame], doc_idx: int, stat_name: str) -> Dict:
+    """
+    取得單一文檔某統計的衍生指標
+
+    Returns:
+        {'rank': float, 'pct': float, 'z': float, 'yoy': float}，缺值則為 {}
+    """
+
+    if derived is None:
+        return {}
+
+    col = f"stat_{stat_name}"
+    if f"{col}_rank" not in derived.columns or doc_idx not in derived.index:
+        return {}
+
+    row = derived.loc[doc_idx]
+    values = {}
+    for suffix in DERIVED_SUFFIXES:
+        value = row[f"{col}{suffix}"]
+        if pd.notna(value):
+            values[suffix[1:]] = float(value)
+    return values
+
+
+def format_derived(values: Dict) -> str:
+    """格式化衍生指標給 prompt 使用，例如 "(#3, P97, YoY +12.0)" """
+
+    parts = []
+    if 'rank' in values:
+        parts.append(f"#{values['rank']:.0f}")
+    if 'pct' in values:
+        parts.append(f"P{values['pct']:.0f}")
+    if 'yoy' in values:
+        parts.append(f"YoY {values['yoy']:+.3g}")
+    return f"({', '.join(parts)})" if parts else ""
+
+
+# ============================================
+# 主程式
+# ============================================
+
+if __name__ == "__main__":
+
+    print("=" * 80)
+    print("Week 6: 衍生指標建置")
+    print("=" * 80)
+
+    if not os.path.exists(DOCS_FILE):
+        print(f"❌ 找不到數據文件：{DOCS_FILE}")
+        exit(1)
+
+    derived = build_derived_metrics()
+
+    # 樣本
+    sample = derived[derived['player_name'] == 'Aaron Judge']
+    for _, row in sample.iterrows():
+        values = {s[1:]: row.get(f"stat_HR{s}") for s in DERIVED_SUFFIXES}
+        print(f"  Aaron Judge {row['season']}: HR {row.get('stat_HR')} {values}")
+
+    print("\n" + "=" * 80)
+    print("✨ 衍生指標建置完成")
+    print("=" * 80)
@@ -0,0 +1,444 @@
+"""
+Week 6: Embedding sidecar（所有 worker 共用一個模型 + 微批次編碼）
+
+原本：每個 Streamlit 程序 / 腳本 / 服務 worker 各自載入 SentenceTransformer（每個程序 100MB+ RSS），
+      單一查詢的 encode 無法充分利用 CPU
+現在：
+    1. 獨立程序載入模型，監聽 Unix socket
+    2. 批次器：第一個請求到達後等待 BATCH_WINDOW_MS（或累積到 MAX_BATCH 筆），
+       期間的所有請求合併成一次 model.encode
+    3. 向量經由共享記憶體回傳：每條連線由用戶端建立一塊 SharedMemory，
+       sidecar 直接把結果寫進去，socket 上只傳小小的 JSON 標頭
+    4. metrics：批次大小分布、排隊等待時間、encode 時間（p50 / p95 / p99）
+
+協定（每個 frame = 8 bytes 長度 (header, payload) + JSON header + payload）：
+    {"op": "hello"}                          → {"model", "dim", "max_request"}
+    {"op": "attach", "shm": name}            → {"ok": true}
+    {"op": "encode", "texts": [...]}         → {"rows", "dim", "shm": true}（或 payload 帶原始 bytes）
+    {"op": "metrics"}                        → 批次 / 等待時間統計
+
+用法：
+    python week6_embedding_sidecar.py                        # 啟動 sidecar
+    python week6_embedding_sidecar.py metrics                # 查看統計
+    EMBEDDING_SOCKET=/tmp/mlb_embedding.sock python week6_query_service.py
+
+    model = load_embedding_model('all-MiniLM-L6-v2')   # 有 EMBEDDING_SOCKET → 用戶端，否則本機模型
+    model.encode("Aaron Judge 2024")                    # 與 SentenceTransformer.encode 相同的回傳格式
+
+Windows（沒有 AF_UNIX）或未設定 EMBEDDING_SOCKET 時維持在程序內載入模型
+"""
+
+import atexit
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from collections import Counter, deque
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+# ============================================
+# 配置（可用環境變數覆寫）
+# ============================================
+
+DATA_DIR = "./mlb_data"
+EMBEDDING_SOCKET = os.environ.get("EMBEDDING_SOCKET", "")
+DEFAULT_SOCKET = "/tmp/mlb_embedding.sock"
+BATCH_WINDOW_MS = float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "3"))
+MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", "64"))
+MAX_REQUEST_TEXTS = 256  # 單次請求的上限（用戶端會自動切分），決定共享記憶體大小
+
+_FRAME = struct.Struct(">II")
+
+# 本程序建立的共享記憶體（sidecar 與用戶端在同一程序時，不可取消用戶端的 resource tracker 登記）
+_created_segments = set()
+
+# ============================================
+# Frame 讀寫
+# ============================================
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("連線已關閉")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock: socket.socket, header: Dict, payload: bytes = b""):
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data + payload)
+
+
+def recv_frame(sock: socket.socket):
+    header_len, payload_len = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_len))
+    payload = _recv_exact(sock, payload_len) if payload_len else b""
+    return header, payload
+
+# ============================================
+# 統計
+# ============================================
+
+def _percentiles(samples) -> Dict:
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None}
+    values = np.fromiter(samples, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3)}
+
+
+class EmbeddingMetrics:
+    """批次大小 / 排隊等待 / encode 時間（保留最近 10000 筆樣本）"""
+
+    def __init__(self, window: int = 10000):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.batch_sizes: Counter = Counter()
+        self.queue_wait_ms = deque(maxlen=window)
+        self.encode_ms = deque(maxlen=window)
+
+    def record_batch(self, requests: int, texts: int, waits_ms: List[float], encode_ms: float):
+        with self._lock:
+            self.requests += requests
+            self.texts += texts
+            self.batches += 1
+            self.batch_sizes[texts] += 1
+            self.queue_wait_ms.extend(waits_ms)
+            self.encode_ms.append(encode_ms)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'texts': self.texts,
+                'batches': self.batches,
+                'avg_batch_size': round(self.texts / self.batches, 2) if self.batches else None,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                'queue_wait_ms': _percentiles(self.queue_wait_ms),
+                'encode_ms': _percentiles(self.encode_ms),
+            }
+
+# ============================================
+# 微批次
+# ============================================
+
+class _Pending:
+    __slots__ = ('texts', 'enqueued', 'event', 'vectors', 'error')
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.enqueued = time.perf_counter()
+        self.event = threading.Event()
+        self.vectors = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    合併並行的 encode 請求
+
+    批次在第一個請求到達後 window_ms 內關閉（或累積到 max_batch 筆文字），
+    一次 encode 後依請求切分結果
+    """
+
+    def __init__(self, encode_fn, window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH,
+                 metrics: Optional[EmbeddingMetrics] = None):
+        self.encode_fn = encode_fn
+        self.window_s = window_ms / 1000
+        self.max_batch = max_batch
+        self.metrics = metrics or EmbeddingMetrics()
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        pending = _Pending(texts)
+        self._queue.put(pending)
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.vectors
+
+    def _collect(self) -> List[_Pending]:
+        first = self._queue.get()
+        batch = [first]
+        size = len(first.texts)
+        close_at = first.enqueued + self.window_s
+
+        while size < self.max_batch:
+            remaining = close_at - time.perf_counter()
+            try:
+                pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            texts = [text for pending in batch for text in pending.texts]
+            try:
+                vectors = np.asarray(self.encode_fn(texts), dtype=np.float32)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+                    pending.event.set()
+                continue
+
+            encode_ms = (time.perf_counter() - started) * 1000
+            offset = 0
+            for pending in batch:
+                pending.vectors = vectors[offset:offset + len(pending.texts)]
+                offset += len(pending.texts)
+                pending.event.set()
+
+            self.metrics.record_batch(len(batch), len(texts),
+                                      [(started - pending.enqueued) * 1000 for pending in batch], encode_ms)
+
+# ============================================
+# Sidecar 伺服器
+# ============================================
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """連接用戶端建立的共享記憶體（由用戶端負責 unlink，不登記到本程序的 resource tracker）"""
+    shm = shared_memory.SharedMemory(name=name)
+    if name not in _created_segments:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server: EmbeddingServer = self.server
+        shm = None
+        try:
+            while True:
+                try:
+                    header, _ = recv_frame(self.request)
+                except (ConnectionError, struct.error):
+                    return
+
+                op = header.get('op')
+                if op == 'hello':
+                    send_frame(self.request, {'model': server.model_name, 'dim': server.dim,
+                                              'max_request': MAX_REQUEST_TEXTS})
+                elif op == 'attach':
+                    if shm is not None:
+                        shm.close()
+                    shm = _attach_shared_memory(header['shm'])
+                    send_frame(self.request, {'ok': True})
+                elif op == 'encode':
+                    try:
+                        vectors = server.batcher.encode(list(header['texts']))
+                    except Exception as e:
+                        send_frame(self.request, {'error': str(e)})
+                        continue
+                    rows, dim = vectors.shape
+                    if shm is not None and vectors.nbytes <= shm.size:
+                        np.ndarray(vectors.shape, dtype=np.float32, buffer=shm.buf)[:] = vectors
+                        send_frame(self.request, {'rows': rows, 'dim': dim, 'shm': True})
+                    else:
+                        send_frame(self.request, {'rows': rows, 'dim': dim, 'shm': False}, vectors.tobytes())
+                elif op == 'metrics':
+                    send_frame(self.request, server.batcher.metrics.snapshot())
+                else:
+                    send_frame(self.request, {'error': f"未知的操作：{op}"})
+        finally:
+            if shm is not None:
+                shm.close()
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """每條連線一個執行緒（只負責收發），encode 全部交給同一個批次器"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, model, model_name: str,
+                 window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # 上次未正常結束留下的 socket
+        super().__init__(socket_path, _ConnectionHandler)
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.dim = int(model.get_sentence_embedding_dimension())
+        self.batcher = MicroBatcher(
+            lambda texts: model.encode(texts, batch_size=max(len(texts), 1), convert_to_numpy=True),
+            window_ms=window_ms, max_batch=max_batch,
+        )
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+# ============================================
+# 用戶端
+# ============================================
+
+class _Connection:
+    def __init__(self, socket_path: str):
+        self.pid = os.getpid()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        send_frame(self.sock, {'op': 'hello'})
+        self.info, _ = recv_frame(self.sock)
+        self.dim = self.info['dim']
+        self.shm = shared_memory.SharedMemory(create=True, size=self.info['max_request'] * self.dim * 4)
+        _created_segments.add(self.shm.name)
+        send_frame(self.sock, {'op': 'attach', 'shm': self.shm.name})
+        recv_frame(self.sock)
+
+    def request(self, header: Dict):
+        send_frame(self.sock, header)
+        return recv_frame(self.sock)
+
+    def close(self):
+        try:
+            self.sock.close()
+        finally:
+            self.shm.close()
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class EmbeddingClient:
+    """
+    sidecar 用戶端，encode() 介面與 SentenceTransformer 相同
+
+    每個執行緒一條連線（各自的共享記憶體），同一程序內的並行查詢也能在 sidecar 合併成一批；
+    fork 之後子程序會自動重新連線
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET):
+        self.socket_path = socket_path
+        self._local = threading.local()
+        self._connections: List[_Connection] = []
+        self._lock = threading.Lock()
+        info = self._connection().info
+        self.model_name = info['model']
+        self.dim = info['dim']
+        atexit.register(self.close)
+
+    def _connection(self) -> _Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or connection.pid != os.getpid():
+            connection = _Connection(self.socket_path)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _encode_chunk(self, texts: List[str]) -> np.ndarray:
+        connection = self._connection()
+        header, payload = connection.request({'op': 'encode', 'texts': texts})
+        if 'error' in header:
+            raise RuntimeError(f"Embedding sidecar 錯誤：{header['error']}")
+        shape = (header['rows'], header['dim'])
+        if header['shm']:
+            return np.ndarray(shape, dtype=np.float32, buffer=connection.shm.buf).copy()
+        return np.frombuffer(payload, dtype=np.float32).reshape(shape).copy()
+
+    def encode(self, sentences: Union[str, List[str]], normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """batch_size / show_progress_bar 等參數由 sidecar 決定，忽略"""
+
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        vectors = np.concatenate([
+            self._encode_chunk(texts[i:i + MAX_REQUEST_TEXTS])
+            for i in range(0, len(texts), MAX_REQUEST_TEXTS)
+        ])
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+    def metrics(self) -> Dict:
+        header, _ = self._connection().request({'op': 'metrics'})
+        return header
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            if connection.pid == os.getpid():
+                connection.close()
+
+
+def load_embedding_model(model_name: str, socket_path: Optional[str] = None):
+    """
+    取得 embedding 模型：有設定 EMBEDDING_SOCKET（且 sidecar 可連線）→ EmbeddingClient，
+    否則在本程序載入 SentenceTransformer
+    """
+
+    socket_path = socket_path or EMBEDDING_SOCKET
+    if socket_path and hasattr(socket, 'AF_UNIX'):
+        try:
+            client = EmbeddingClient(socket_path)
+            if client.model_name == model_name:
+                print(f"  ✅ 使用 embedding sidecar：{socket_path}")
+                return client
+            print(f"  ⚠️  sidecar 模型（{client.model_name}）與設定（{model_name}）不同，改用本機模型")
+            client.close()
+        except OSError as e:
+            print(f"  ⚠️  無法連線 embedding sidecar（{e}），改用本機模型")
+
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+# ============================================
+# 執行
+# ============================================
+
+if __name__ == "__main__":
+
+    socket_path = EMBEDDING_SOCKET or DEFAULT_SOCKET
+
+    if len(sys.argv) > 1 and sys.argv[1] == "metrics":
+        print(json.dumps(EmbeddingClient(socket_path).metrics(), ensure_ascii=False, indent=2))
+        sys.exit(0)
+
+    from sentence_transformers import SentenceTransformer
+
+    with open(os.path.join(DATA_DIR, "search_config.json"), 'r') as f:
+        model_name = json.load(f)['embedding_model']
+
+    print("=" * 80)
+    print("Embedding Sidecar")
+    print("=" * 80)
+    model = SentenceTransformer(model_name)
+    server = EmbeddingServer(socket_path, model, model_name)
+    print(f"  模型：{model_name}（{server.dim} 維）")
+    print(f"  Socket：{socket_path}")
+    print(f"  批次：{BATCH_WINDOW_MS} ms 視窗 / 最多 {MAX_BATCH} 筆")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n📊 統計：")
+        print(json.dumps(server.batcher.metrics.snapshot(), ensure_ascii=False, indent=2))
+    finally:
+        server.server_close()
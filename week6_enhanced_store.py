@@ -0,0 +1,219 @@
+"""
+Week 6: EnhancedSmartRouter 的精簡文檔表示
+
+原本：load_documents 把整份 week5_mlb_documents_enhanced.json 保留成 list of dict；
+      每一列（球員 × 賽季）都有自己的 awards dict、contract dict，
+      以及列出所有指標名稱的 statcast 佔位 dict → 同一球員的每個賽季各複製一份
+現在：
+    - 賽季列 → CorpusStore 欄式陣列（week6_corpus_store：球隊 / 位置 / 類型為字典代碼，統計為矩陣）
+    - 球員層級資料 → 每位球員一個 PlayerRecord（__slots__），awards / contract / statcast
+      由該球員所有賽季共用；內容相同的 dict（沒有獎項的 {'total_count': 0}、statcast 佔位）
+      全語料只保留一份
+    - 球員名字 sys.intern
+    memory_report() 以深度 sizeof 比較兩種表示
+
+用法：
+    store = EnhancedDocumentStore.from_documents(documents)
+    player = store.player("Aaron Judge")   → PlayerRecord（awards / contract / statcast / span）
+    store.seasons("Aaron Judge")           → [{'season', 'team', 'position', 'type', 'stats'}, ...]
+"""
+
+import json
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from week6_corpus_store import CorpusStore
+
+# 沒有獎項的球員共用的 awards
+NO_AWARDS = {'total_count': 0}
+
+# 賽季列的欄位（其餘欄位如 awards / contract / statcast 屬於球員層級）
+SEASON_COLUMNS = ('player_name', 'season', 'team', 'age', 'type', 'position', 'stats')
+
+
+class PlayerRecord:
+    """球員層級資料（所有賽季共用）；span 為該球員在 CorpusStore 中的 [start, end) 列區間"""
+
+    __slots__ = ('name', 'awards', 'contract', 'statcast', 'span')
+
+    def __init__(self, name: str, awards: Dict, contract: Optional[Dict], statcast: Optional[Dict],
+                 span: Tuple[int, int]):
+        self.name = name
+        self.awards = awards
+        self.contract = contract
+        self.statcast = statcast
+        self.span = span
+
+
+class _SharedValues:
+    """內容相同的 dict / list 只保留第一個物件"""
+
+    def __init__(self):
+        self._values: Dict[str, object] = {}
+
+    def get(self, value):
+        if value is None:
+            return None
+        key = json.dumps(value, sort_keys=True, ensure_ascii=False)
+        return self._values.setdefault(key, value)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class EnhancedDocumentStore:
+    """
+    精簡的增強文檔：賽季列（CorpusStore）+ 球員記錄（PlayerRecord）
+    """
+
+    def __init__(self, corpus: CorpusStore, players: Dict[str, PlayerRecord], shared_values: int = 0):
+        self.corpus = corpus
+        self.players = players
+        self.shared_values = shared_values
+
+    @classmethod
+    def from_documents(cls, documents: List[Dict]) -> 'EnhancedDocumentStore':
+        """
+        documents：week5 整合後的文檔 list
+
+        球員層級欄位取該球員在檔案中的第一筆（與原本 player_docs[0] 相同）
+        """
+
+        frame = pd.DataFrame(
+            [{column: doc.get(column) for column in SEASON_COLUMNS} for doc in documents],
+            columns=list(SEASON_COLUMNS)
+        )
+        corpus = CorpusStore.from_documents(frame)
+        del frame
+
+        shared = _SharedValues()
+        players: Dict[str, PlayerRecord] = {}
+        for doc in documents:
+            name = doc['player_name']
+            if name in players:
+                continue
+            name = sys.intern(name)
+            players[name] = PlayerRecord(
+                name,
+                shared.get(doc.get('awards') or NO_AWARDS),
+                shared.get(doc.get('contract')),
+                shared.get(doc.get('statcast')),
+                corpus.player_span(name),
+            )
+
+        return cls(corpus, players, len(shared))
+
+    def __len__(self) -> int:
+        return len(self.corpus)
+
+    def __contains__(self, player_name: str) -> bool:
+        return player_name in self.players
+
+    def player(self, player_name: str) -> Optional[PlayerRecord]:
+        return self.players.get(player_name)
+
+    def seasons(self, player_name: str) -> List[Dict]:
+        """球員的各賽季資料（依賽季排序）"""
+
+        record = self.players.get(player_name)
+        if record is None:
+            return []
+        start, end = record.span
+        return [
+            {
+                'season': int(self.corpus.season[i]),
+                'team': self.corpus.vocab_value('team', i),
+                'position': self.corpus.vocab_value('position', i),
+                'type': self.corpus.vocab_value('type', i),
+                'stats': self.corpus.row_stats(i),
+            }
+            for i in range(start, end)
+        ]
+
+# ============================================
+# 記憶體比較
+# ============================================
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """
+    物件及其所有子物件的大小（bytes）；共用的物件只計算一次
+
+    NumPy 陣列計算資料緩衝區，mmap 的陣列不計入（不屬於程序私有記憶體）
+    """
+
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        # 擁有資料時 getsizeof 已包含緩衝區；view 計入其 base（mmap 的 base 只有物件本身）
+        size = sys.getsizeof(obj)
+        if isinstance(obj.base, np.ndarray):
+            size += deep_sizeof(obj.base, seen)
+        return size
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        pass
+    else:
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                size += deep_sizeof(getattr(obj, slot), seen)
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def memory_report(documents: Iterable[Dict], store: EnhancedDocumentStore) -> Dict:
+    """list of dict 與精簡表示的記憶體比較"""
+
+    documents = list(documents)
+    original = deep_sizeof(documents)
+    compact = deep_sizeof(store)
+    return {
+        'rows': len(store),
+        'players': len(store.players),
+        'shared_values': store.shared_values,
+        'documents_mb': round(original / 1024 / 1024, 2),
+        'compact_mb': round(compact / 1024 / 1024, 2),
+        'ratio': round(original / compact, 1) if compact else None,
+    }
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import os
+    import time
+
+    documents_path = "./mlb_data/week5_mlb_documents_enhanced.json"
+
+    print("=" * 80)
+    print("測試精簡文檔表示")
+    print("=" * 80)
+
+    if not os.path.exists(documents_path):
+        print(f"❌ 找不到數據文件：{documents_path}")
+        exit(1)
+
+    with open(documents_path, 'r', encoding='utf-8') as f:
+        documents = json.load(f)
+
+    start_time = time.perf_counter()
+    store = EnhancedDocumentStore.from_documents(documents)
+    print(f"✅ 建立完成：{len(store)} 列 / {len(store.players)} 位球員"
+          f"（{(time.perf_counter() - start_time) * 1000:.0f} ms）")
+
+    report = memory_report(documents, store)
+    print(f"\n📊 記憶體：list of dict {report['documents_mb']} MB → 精簡表示 {report['compact_mb']} MB"
+          f"（{report['ratio']}x），共用 {report['shared_values']} 個不重複的 awards / contract / statcast")
@@ -0,0 +1,371 @@
+"""
+Week 6: LLM 呼叫錄製 / 重播（cassette）
+讓評估與路由實驗不必每次都等待真實 LLM，且每次結果相同
+
+原本：run_evaluation 每一筆查詢都經過真實 LLM（含 classify_query 的 LLM 後備分類），
+      跑一次要好幾分鐘，每次數字還不一樣
+現在：以請求雜湊（request_key）為 key，把回應存進本機 SQLite（zlib 壓縮）
+    - record：照常呼叫 LLM，並記錄回應（已存在則覆寫）
+    - replay：只從 cassette 讀取（開啟時整個載入記憶體，查詢只是 dict 查找）；
+              找不到時拋出 CassetteMiss，不會偷偷呼叫 LLM
+    - auto：有記錄就重播，沒有就呼叫並記錄
+    - off：不介入（預設）
+
+涵蓋：
+    call_llm / call_llm_stream（week2_mlb_assistant.py）
+    ollama.chat（week5 分類器 / 路由器，透過 patch_ollama_chat）
+
+用法：
+    LLM_CASSETTE_MODE=record python week3_evaluation.py   # 錄一次
+    LLM_CASSETTE_MODE=replay python week3_evaluation.py   # 之後幾秒內重跑
+    python week3_evaluation.py replay                       # 同上
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from week6_llm_singleflight import request_key
+
+# ============================================
+# 配置
+# ============================================
+
+CASSETTE_MODES = ('off', 'record', 'replay', 'auto')
+DEFAULT_CASSETTE_FILE = os.environ.get("LLM_CASSETTE_FILE", "./mlb_data/llm_cassette.sqlite")
+DEFAULT_CASSETTE_MODE = os.environ.get("LLM_CASSETTE_MODE", "off").lower()
+
+
+# 每種呼叫的回應型別：call_llm 存 dict（response + prompt_eval_count），
+# 串流存 dict（合併後的文字 text + 是否被消費端中止 partial）
+CASSETTE_KINDS = {
+    'generate': dict,
+    'generate_stream': dict,
+    'chat': dict,
+}
+
+
+class CassetteMiss(KeyError):
+    """replay 模式下找不到對應的記錄"""
+
+    def __init__(self, kind: str, key: str, message: str = ""):
+        super().__init__(message or f"cassette 沒有 {kind} 記錄：{key[:12]}")
+        self.kind = kind
+        self.key = key
+
+
+class CassetteMismatch(CassetteMiss):
+    """記錄的回應型別與呼叫種類不符（舊版 cassette 或 key 衝突），需要重新錄製"""
+
+    def __init__(self, kind: str, key: str, value: Any):
+        super().__init__(kind, key, f"cassette 的 {kind} 記錄型別不符（{type(value).__name__}，"
+                                    f"應為 {CASSETTE_KINDS[kind].__name__}）：{key[:12]}，請重新錄製")
+
+
+def _pack(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def _unpack(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+# ============================================
+# Cassette
+# ============================================
+
+class LLMCassette:
+    """
+    LLM 請求 → 回應 記錄檔（執行緒安全）
+
+    SQLite 表 calls(key, kind, response, created_at)
+        key       "<kind>:<request_key 雜湊>"（同一個 prompt 的 call_llm 與 call_llm_stream 分開記錄）
+        kind      'generate' / 'generate_stream' / 'chat'（CASSETTE_KINDS）
+        response  zlib 壓縮的 JSON
+
+    stats:
+        hits      重播次數
+        misses    沒有記錄的次數（auto / record 會改為呼叫 LLM）
+        recorded  新寫入的記錄數
+    """
+
+    def __init__(self, path: str = DEFAULT_CASSETTE_FILE, mode: str = 'off'):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"未知的 cassette 模式：{mode}（可用：{', '.join(CASSETTE_MODES)}）")
+
+        self.path = path
+        self.mode = mode
+        self.stats = {'hits': 0, 'misses': 0, 'recorded': 0}
+        self._lock = threading.Lock()
+        self._entries: Dict[str, bytes] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+
+        if mode != 'off':
+            self._open()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, response BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        # 重播時不碰磁碟：整個 cassette 載入記憶體（保留壓縮後的 blob）
+        self._entries = dict(self._conn.execute("SELECT key, response FROM calls"))
+
+    @property
+    def active(self) -> bool:
+        return self.mode != 'off'
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_mode(self, mode: str):
+        """切換模式（例如評估腳本依命令列參數切換）"""
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"未知的 cassette 模式：{mode}（可用：{', '.join(CASSETTE_MODES)}）")
+        self.mode = mode
+        if mode != 'off' and self._conn is None:
+            self._open()
+
+    # ---------- 讀寫 ----------
+
+    @staticmethod
+    def _entry_key(key: str, kind: str) -> str:
+        return f"{kind}:{key}"
+
+    def lookup(self, key: str, kind: str) -> Optional[Any]:
+        """
+        讀取記錄（沒有則 None）
+
+        Raises:
+            CassetteMismatch：記錄的型別與 kind 不符
+        """
+        blob = self._entries.get(self._entry_key(key, kind))
+        if blob is None:
+            return None
+        value = _unpack(blob)
+        if kind in CASSETTE_KINDS and not isinstance(value, CASSETTE_KINDS[kind]):
+            raise CassetteMismatch(kind, key, value)
+        return value
+
+    def store(self, key: str, kind: str, response: Any):
+        blob = _pack(response)
+        entry_key = self._entry_key(key, kind)
+        with self._lock:
+            self._entries[entry_key] = blob
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calls (key, kind, response, created_at) VALUES (?, ?, ?, ?)",
+                (entry_key, kind, blob, time.time())
+            )
+            self._conn.commit()
+            self.stats['recorded'] += 1
+
+    # ---------- 包裝呼叫 ----------
+
+    def call(self, key: str, kind: str, fn: Callable[[], Any]) -> Any:
+        """
+        依模式重播或呼叫 fn（回應需可 JSON 序列化）
+
+        Raises:
+            CassetteMiss：replay 模式下沒有記錄
+            CassetteMismatch：記錄的型別與 kind 不符
+        """
+
+        if self.mode in ('replay', 'auto'):
+            cached = self.lookup(key, kind)
+            if cached is not None:
+                self.stats['hits'] += 1
+                return cached
+            self.stats['misses'] += 1
+            if self.mode == 'replay':
+                raise CassetteMiss(kind, key)
+
+        response = fn()
+        self.store(key, kind, response)
+        return response
+
+    def stream(self, key: str, kind: str, fn: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """
+        串流版本：重播時一次輸出記錄的文字；錄製時串流結束才寫入
+
+        消費端提前關閉串流（例如 week6_stream_verifier 以 FactViolation 中止）時，
+        已輸出的部分記為 {'partial': True}：重播時輸出同一段前綴，消費端在同一處中止，
+        重播結果與錄製時相同；若消費端要更多內容，replay 拋出 CassetteMiss，auto 改為呼叫並重新錄製
+        """
+
+        skip = 0
+        if self.mode in ('replay', 'auto'):
+            cached = self.lookup(key, kind)
+            if cached is not None:
+                self.stats['hits'] += 1
+                yield cached['text']
+                if not cached['partial']:
+                    return
+                if self.mode == 'replay':
+                    raise CassetteMiss(kind, key, f"cassette 的 {kind} 記錄不完整（錄製時串流被中止）：{key[:12]}")
+                skip = len(cached['text'])
+            else:
+                self.stats['misses'] += 1
+                if self.mode == 'replay':
+                    raise CassetteMiss(kind, key)
+
+        # auto 重新呼叫部分記錄時，略過已輸出的前綴
+        chunks = []
+        received = 0
+        upstream = iter(fn())
+        try:
+            for chunk in upstream:
+                chunks.append(chunk)
+                received += len(chunk)
+                if received <= skip:
+                    continue
+                yield chunk[max(skip - (received - len(chunk)), 0):]
+        except GeneratorExit:
+            text = "".join(chunks)
+            if len(text) > skip:
+                self.store(key, kind, {'text': text, 'partial': True})
+            raise
+        finally:
+            close = getattr(upstream, 'close', None)
+            if close is not None:
+                close()
+        self.store(key, kind, {'text': "".join(chunks), 'partial': False})
+
+    def report(self) -> str:
+        return (f"cassette[{self.mode}] {self.path}：{len(self)} 筆記錄，"
+                f"重播 {self.stats['hits']}，未命中 {self.stats['misses']}，新錄 {self.stats['recorded']}")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# ============================================
+# 共用實例與 ollama.chat 包裝
+# ============================================
+
+_default_cassette: Optional[LLMCassette] = None
+_default_lock = threading.Lock()
+
+
+def get_cassette() -> LLMCassette:
+    """程序內共用的 cassette（模式 / 路徑來自 LLM_CASSETTE_MODE / LLM_CASSETTE_FILE）"""
+    global _default_cassette
+    with _default_lock:
+        if _default_cassette is None:
+            _default_cassette = LLMCassette(DEFAULT_CASSETTE_FILE, DEFAULT_CASSETTE_MODE)
+        return _default_cassette
+
+
+def chat_key(model: str, messages: list, options: Optional[Dict] = None) -> str:
+    """ollama.chat 的請求 key：messages 序列化後當作 prompt"""
+    return request_key(model, json.dumps(messages, ensure_ascii=False, sort_keys=True), options)
+
+
+def patch_ollama_chat(cassette: Optional[LLMCassette] = None):
+    """
+    包裝 ollama.chat（week5 模組以 ollama.chat(...) 呼叫，替換模組屬性即可）
+
+    只處理非串流呼叫；重播時回傳 {'message': {'role', 'content'}}，與 ChatResponse 的取值方式相同
+    重複呼叫不會重複包裝
+    """
+
+    import ollama
+
+    if getattr(ollama.chat, '_cassette_wrapped', False):
+        return
+
+    original_chat = ollama.chat
+    if cassette is None:
+        cassette = get_cassette()
+
+    def chat(model: str = '', messages=None, **kwargs):
+        if kwargs.get('stream') or not cassette.active:
+            return original_chat(model=model, messages=messages, **kwargs)
+
+        def live_call():
+            response = original_chat(model=model, messages=messages, **kwargs)
+            return {'message': {'role': 'assistant', 'content': response['message']['content']}}
+
+        key = chat_key(model, messages or [], kwargs.get('options'))
+        return cassette.call(key, 'chat', live_call)
+
+    chat._cassette_wrapped = True
+    ollama.chat = chat
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import tempfile
+
+    print("=" * 80)
+    print("測試 LLM cassette")
+    print("=" * 80)
+
+    path = os.path.join(tempfile.mkdtemp(), "cassette.sqlite")
+    key = request_key("llama3.2", "Who has the highest wRC+ in 2024?", {'temperature': 0.7, 'num_predict': 200})
+
+    def slow_llm():
+        time.sleep(0.5)
+        return {'response': "Aaron Judge", 'prompt_eval_count': 42}
+
+    recorder = LLMCassette(path, 'record')
+    start = time.perf_counter()
+    recorder.call(key, 'generate', slow_llm)
+    print(f"\n錄製：{(time.perf_counter() - start) * 1000:.0f} ms")
+    recorder.close()
+
+    player = LLMCassette(path, 'replay')
+    start = time.perf_counter()
+    for _ in range(10000):
+        result = player.call(key, 'generate', slow_llm)
+    print(f"重播：{(time.perf_counter() - start) / 10000 * 1e6:.1f} µs / 次 → {result}")
+
+    try:
+        player.call(request_key("llama3.2", "unknown"), 'generate', slow_llm)
+    except CassetteMiss as e:
+        print(f"未錄製的請求：{e}")
+
+    # 同一個請求的串流版本是另一筆記錄（不會重播成 call_llm 的 dict）
+    try:
+        list(player.stream(key, 'generate_stream', lambda: iter(["Aaron", " Judge"])))
+    except CassetteMiss as e:
+        print(f"串流與非串流分開記錄：{e}")
+
+    # 錄製時被中止的串流（事實驗證 FactViolation）：重播輸出同一段前綴，消費端在同一處中止
+    stream_key = request_key("llama3.2", "Judge 2024 HR?", {'stream': True})
+    recorder = LLMCassette(path, 'record')
+    recorded = []
+    for chunk in recorder.stream(stream_key, 'generate_stream', lambda: iter(["Judge hit ", "58", " HR", " in 2024"])):
+        recorded.append(chunk)
+        if "58" in chunk:
+            break
+    recorder.close()
+
+    player = LLMCassette(path, 'replay')
+    replayed = ""
+    stream = player.stream(stream_key, 'generate_stream', slow_llm)
+    for chunk in stream:
+        replayed += chunk
+        if "58" in chunk:
+            stream.close()
+            break
+    print(f"中止的串流：錄製 {''.join(recorded)!r} → 重播 {replayed!r}（{'相同' if replayed == ''.join(recorded) else '不同'}）")
+    try:
+        list(player.stream(stream_key, 'generate_stream', slow_llm))
+    except CassetteMiss as e:
+        print(f"要求超過記錄的內容：{e}")
+
+    print(f"\n{player.report()}")
+    print(f"檔案大小：{os.path.getsize(path)} bytes")
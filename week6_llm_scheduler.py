@@ -0,0 +1,410 @@
+"""
+Week 6: LLM 准入控制（有界優先佇列 + 截止時間 + 熔斷器）
+
+原本：call_llm 固定 60 秒 timeout、沒有排隊策略
+      → 負載高時請求全部堆在 Ollama 後面，使用者等滿一分鐘才看到「LLM 調用失敗」
+現在：
+    1. 同時執行數上限（CPU 上的 Ollama 一次只處理一個請求最有效率）
+    2. 有界優先佇列：互動（Streamlit）優先於批次（評估）；
+       佇列已滿時，較高優先的請求會擠掉最低優先的等待者
+    3. 每個請求有截止時間：依平均服務時間預估排隊 + 執行時間，
+       趕不上截止時間就立即拒絕，不必等到 timeout
+    4. 熔斷器：連續失敗達門檻後暫停呼叫一段時間，之後放行一個探測請求
+    被拒絕時拋出 LLMUnavailable，呼叫端改用純資料的模板回答
+
+用法：
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=16)
+    with scheduler.request_context(priority=PRIORITY_INTERACTIVE, deadline_s=20):
+        result = scheduler.run(lambda timeout: post_to_ollama(..., timeout=timeout))
+"""
+
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# ============================================
+# 配置
+# ============================================
+
+# 數字越小越優先
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+DEFAULT_DEADLINES = {
+    PRIORITY_INTERACTIVE: 20.0,
+    PRIORITY_BATCH: 120.0,
+}
+
+# 平均服務時間的 EWMA 權重
+EWMA_ALPHA = 0.2
+
+
+class LLMUnavailable(Exception):
+    """
+    LLM 無法在期限內服務（呼叫端應改用模板回答）
+
+    reason: 'circuit_open' | 'queue_full' | 'evicted' | 'deadline'（排程器）
+            'error'（上游錯誤，由呼叫端包裝）
+    """
+
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+# ============================================
+# 熔斷器
+# ============================================
+
+class CircuitBreaker:
+    """
+    closed → (連續失敗 failure_threshold 次) → open
+    open → (經過 cooldown_s) → half_open：放行一個探測請求
+    half_open → 探測成功 → closed；探測失敗 → open
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """探測名額未實際使用（請求在准入階段被拒絕）"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+# ============================================
+# 排程器
+# ============================================
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'deadline', 'event', 'granted', 'rejected')
+
+    def __init__(self, priority: int, seq: int, deadline: float):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.granted = False
+        self.rejected: Optional[str] = None
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+_request_priority = contextvars.ContextVar('llm_request_priority', default=PRIORITY_INTERACTIVE)
+_request_deadline = contextvars.ContextVar('llm_request_deadline', default=None)
+
+
+class LLMScheduler:
+    """
+    LLM 准入控制
+
+    run(fn) 在取得執行名額後呼叫 fn(timeout)，timeout 為距離截止時間的剩餘秒數
+    """
+
+    def __init__(self, max_concurrency: int = 1, max_queue: int = 16,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.breaker = breaker or CircuitBreaker()
+
+        self._lock = threading.Lock()
+        self._queue: List[_Waiter] = []
+        self._active = 0
+        self._seq = itertools.count()
+        self.avg_service_s: Optional[float] = None
+
+        self.stats = {
+            'admitted': 0, 'completed': 0, 'failed': 0,
+            'circuit_open': 0, 'queue_full': 0, 'evicted': 0, 'deadline': 0,
+        }
+
+    # ---------- 請求情境 ----------
+
+    @contextmanager
+    def request_context(self, priority: int = PRIORITY_INTERACTIVE, deadline_s: Optional[float] = None):
+        """設定目前請求（同一執行緒 / 情境內所有 LLM 呼叫）的優先序與截止時間"""
+
+        if deadline_s is None:
+            deadline_s = DEFAULT_DEADLINES.get(priority, DEFAULT_DEADLINES[PRIORITY_BATCH])
+        priority_token = _request_priority.set(priority)
+        deadline_token = _request_deadline.set(time.monotonic() + deadline_s)
+        try:
+            yield
+        finally:
+            _request_priority.reset(priority_token)
+            _request_deadline.reset(deadline_token)
+
+    @staticmethod
+    def current_priority() -> int:
+        return _request_priority.get()
+
+    @staticmethod
+    def current_deadline() -> float:
+        deadline = _request_deadline.get()
+        if deadline is None:
+            deadline = time.monotonic() + DEFAULT_DEADLINES[_request_priority.get()]
+        return deadline
+
+    # ---------- 准入 ----------
+
+    def _reject(self, reason: str, message: str = ""):
+        self.stats[reason] += 1
+        raise LLMUnavailable(reason, message)
+
+    def _expected_wait(self, priority: int) -> float:
+        """預估排隊 + 執行時間（尚無樣本時為 0）"""
+        if self.avg_service_s is None:
+            return 0.0
+        if self._active < self.max_concurrency:
+            return self.avg_service_s
+        ahead = sum(1 for w in self._queue if w.priority <= priority) + 1
+        return self.avg_service_s * (1 + ahead / self.max_concurrency)
+
+    def _admit(self, priority: int, deadline: float) -> _Waiter:
+        """取得執行名額（或拋出 LLMUnavailable）"""
+
+        if not self.breaker.allow():
+            self._reject('circuit_open', 'LLM 暫停服務（熔斷中）')
+
+        with self._lock:
+            now = time.monotonic()
+            if now + self._expected_wait(priority) > deadline:
+                self._reject('deadline', 'LLM 無法在期限內完成')
+
+            waiter = _Waiter(priority, next(self._seq), deadline)
+
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                waiter.granted = True
+                self.stats['admitted'] += 1
+                return waiter
+
+            if len(self._queue) >= self.max_queue:
+                lowest = max(self._queue)
+                if lowest.priority <= priority:
+                    self._reject('queue_full', 'LLM 佇列已滿')
+                # 擠掉最低優先的等待者
+                self._queue.remove(lowest)
+                heapq.heapify(self._queue)
+                lowest.rejected = 'evicted'
+                lowest.event.set()
+
+            heapq.heappush(self._queue, waiter)
+
+        if not waiter.event.wait(timeout=max(0.0, deadline - time.monotonic())):
+            with self._lock:
+                if not waiter.granted:
+                    if waiter in self._queue:
+                        self._queue.remove(waiter)
+                        heapq.heapify(self._queue)
+                    self._reject('deadline', 'LLM 排隊超過期限')
+
+        if waiter.rejected:
+            with self._lock:
+                self._reject(waiter.rejected, 'LLM 請求被較高優先的請求擠出佇列')
+
+        return waiter
+
+    def _release(self):
+        """釋放名額並交給最高優先、尚未過期的等待者"""
+        with self._lock:
+            self._active -= 1
+            now = time.monotonic()
+            while self._queue and self._active < self.max_concurrency:
+                waiter = heapq.heappop(self._queue)
+                if waiter.deadline <= now:
+                    waiter.rejected = 'deadline'
+                    waiter.event.set()
+                    continue
+                waiter.granted = True
+                self._active += 1
+                self.stats['admitted'] += 1
+                waiter.event.set()
+
+    # ---------- 執行 ----------
+
+    @contextmanager
+    def slot(self, priority: Optional[int] = None, deadline: Optional[float] = None):
+        """
+        取得執行名額的 context manager，yield 距離截止時間的剩餘秒數
+
+        區塊內的例外計入熔斷器（LLMUnavailable 與 GeneratorExit 除外），
+        因此串流生成可以在整段讀取期間持有名額
+        """
+
+        priority = self.current_priority() if priority is None else priority
+        deadline = self.current_deadline() if deadline is None else deadline
+
+        try:
+            self._admit(priority, deadline)
+        except LLMUnavailable as e:
+            if e.reason != 'circuit_open':
+                self.breaker.release_probe()
+            raise
+
+        start = time.monotonic()
+        # 'success' / 'failure'；None = 沒有結果（LLMUnavailable、串流被提前關閉的 GeneratorExit）
+        outcome = None
+        try:
+            remaining = deadline - start
+            if remaining <= 0:
+                self._reject('deadline', 'LLM 無法在期限內完成')
+            yield remaining
+            outcome = 'success'
+        except LLMUnavailable:
+            raise
+        except Exception:
+            outcome = 'failure'
+            self.breaker.record_failure()
+            with self._lock:
+                self.stats['failed'] += 1
+            raise
+        finally:
+            if outcome == 'success':
+                elapsed = time.monotonic() - start
+                self.breaker.record_success()
+                with self._lock:
+                    self.stats['completed'] += 1
+                    self.avg_service_s = elapsed if self.avg_service_s is None else (
+                        EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.avg_service_s
+                    )
+            elif outcome is None:
+                # 沒有記錄成功 / 失敗：若這是半開狀態的探測請求，釋放名額讓下一個請求探測
+                self.breaker.release_probe()
+            self._release()
+
+    def run(self, fn: Callable[[float], Any], priority: Optional[int] = None,
+            deadline: Optional[float] = None) -> Any:
+        """
+        在准入控制下執行 fn(timeout)
+
+        Args:
+            fn: 接受剩餘秒數（作為 HTTP timeout）的呼叫
+            priority / deadline: 未指定時使用 request_context 的設定（deadline 為 time.monotonic() 時間點）
+
+        Raises:
+            LLMUnavailable: 熔斷、佇列已滿、被擠出或趕不上截止時間
+            其他例外：fn 本身的錯誤（計入熔斷器）
+        """
+
+        with self.slot(priority, deadline) as timeout:
+            return fn(timeout)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'active': self._active,
+                'queued': len(self._queue),
+                'avg_service_s': self.avg_service_s,
+                'breaker': self.breaker.state,
+                **self.stats,
+            }
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    print("=" * 80)
+    print("測試 LLM 准入控制")
+    print("=" * 80)
+
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=3)
+
+    def fake_llm(timeout: float) -> str:
+        time.sleep(min(0.3, timeout))
+        return "ok"
+
+    results = {}
+
+    def worker(name: str, priority: int, deadline_s: float):
+        with scheduler.request_context(priority=priority, deadline_s=deadline_s):
+            try:
+                results[name] = scheduler.run(fake_llm)
+            except LLMUnavailable as e:
+                results[name] = f"fallback ({e.reason})"
+
+    threads = [threading.Thread(target=worker, args=(f"batch{i}", PRIORITY_BATCH, 10)) for i in range(4)]
+    threads += [threading.Thread(target=worker, args=(f"interactive{i}", PRIORITY_INTERACTIVE, 1.0)) for i in range(3)]
+    for t in threads:
+        t.start()
+        time.sleep(0.01)
+    for t in threads:
+        t.join()
+
+    for name, value in results.items():
+        print(f"  {name}: {value}")
+    print(f"\n📊 {scheduler.snapshot()}")
+
+    # 熔斷器
+    def broken_llm(timeout: float) -> str:
+        raise ConnectionError("Ollama 未啟動")
+
+    for i in range(5):
+        try:
+            scheduler.run(broken_llm, priority=PRIORITY_INTERACTIVE, deadline=time.monotonic() + 5)
+        except LLMUnavailable as e:
+            print(f"  呼叫 {i + 1}: 拒絕（{e.reason}）")
+        except ConnectionError as e:
+            print(f"  呼叫 {i + 1}: 失敗（{e}）")
+    print(f"  熔斷器狀態：{scheduler.breaker.state}")
+
+    # 半開探測的串流被提前關閉（驗證器中止 / 使用者斷線）→ 探測名額釋放，熔斷器仍可恢復
+    probe_scheduler = LLMScheduler(breaker=CircuitBreaker(failure_threshold=1, cooldown_s=0.1))
+    try:
+        probe_scheduler.run(broken_llm, deadline=time.monotonic() + 5)
+    except ConnectionError:
+        pass
+    time.sleep(0.15)
+
+    def probe_stream():
+        with probe_scheduler.slot(deadline=time.monotonic() + 5):
+            for token in ["Aaron", " Judge", " leads"]:
+                yield token
+
+    stream = probe_stream()
+    next(stream)
+    stream.close()
+    probe_free = not probe_scheduler.breaker._probe_in_flight
+    probe_scheduler.run(fake_llm, deadline=time.monotonic() + 5)
+    recovered = probe_scheduler.breaker.state == 'closed'
+    print(f"\n  探測串流提前關閉：探測名額已釋放 {'✅' if probe_free else '❌'}，"
+          f"下一個請求關閉熔斷器 {'✅' if recovered else '❌'}（{probe_scheduler.breaker.state}）")
@@ -0,0 +1,284 @@
+"""
+Week 6: 相同 LLM 請求的 Single-flight 合併
+多位使用者同時問同一個熱門問題時，只向 Ollama 發出一次請求
+
+原本：每個 Streamlit session 各自 call_llm → CPU 上的 Ollama 逐一處理，
+      第 N 位使用者要等前面 N-1 次完全相同的生成
+現在：以 (model, prompt, options) 的雜湊為 key
+    - 非串流：第一位呼叫者（leader）實際發出請求，其餘等待並共用結果
+    - 串流：背景執行緒讀取上游串流並寫入共用緩衝區，
+            後加入者先重播已產生的 token，再跟著即時輸出
+    - 請求完成後即從表中移除（只合併「進行中」的請求，不是快取）
+    - 所有訂閱者都離開（例如串流驗證中止）時關閉上游串流，Ollama 不再繼續生成
+
+用法：
+    flight = SingleFlight()
+    key = request_key(model, prompt, options, system)
+    result, shared = flight.do(key, lambda: post_to_ollama(...))
+    for chunk in flight.stream(key, lambda: iter_ollama_stream(...)):
+        ...
+"""
+
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def request_key(model: str, prompt: str, options: Optional[Dict] = None, system: Optional[str] = None) -> str:
+    """請求 key：sha256(model, system, prompt, options)，options 依 key 排序後序列化"""
+
+    payload = json.dumps(
+        {'model': model, 'system': system or '', 'prompt': prompt, 'options': options or {}},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# ============================================
+# 非串流
+# ============================================
+
+class _Call:
+    """進行中的非串流請求"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+# ============================================
+# 串流
+# ============================================
+
+class _Broadcast:
+    """
+    進行中的串流請求
+
+    chunks 只會附加；每位訂閱者各自維護讀取位置，
+    因此後加入者會先讀到已產生的內容，再等待新內容
+    最後一位訂閱者提前離開時標記 cancelled，pump 在下一段關閉上游
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self.cancelled = False
+        self.subscribers = 0
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+
+    def pump(self, source: Iterable[str]):
+        """背景執行緒：讀取上游並廣播"""
+        try:
+            for chunk in source:
+                with self.condition:
+                    if self.cancelled:
+                        break
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            close = getattr(source, 'close', None)
+            if close:
+                close()
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def subscribe(self) -> Iterator[str]:
+        """讀取廣播內容；呼叫端需先在同一把鎖內將 subscribers 加 1（見 SingleFlight.stream）"""
+        position = 0
+        try:
+            while True:
+                with self.condition:
+                    while position >= len(self.chunks) and not self.finished:
+                        self.condition.wait()
+                    pending = self.chunks[position:]
+                    finished = self.finished
+                for chunk in pending:
+                    yield chunk
+                position += len(pending)
+                if finished and position >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+                if self.subscribers == 0 and not self.finished:
+                    self.cancelled = True
+
+
+# ============================================
+# Single-flight
+# ============================================
+
+class SingleFlight:
+    """
+    合併相同 key 的進行中請求（執行緒安全）
+
+    stats:
+        calls     總呼叫數
+        upstream  實際發出的上游請求數
+        shared    共用結果的呼叫數（calls - upstream）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.stats = {'calls': 0, 'upstream': 0, 'shared': 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        執行 fn，或等待相同 key 的進行中請求
+
+        Returns:
+            (結果, shared)：shared 為 True 表示使用了其他呼叫者的結果
+            leader 的例外會同樣拋給所有等待者
+        """
+
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats['shared'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['upstream'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.value, False
+
+    def stream(self, key: str, fn: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """
+        串流版本：相同 key 的請求共用同一條上游串流
+
+        上游由背景執行緒讀取，不受個別訂閱者的讀取速度影響；所有訂閱者都離開時關閉上游
+        訂閱在第一次 next() 時才登記（產生後從未迭代的 generator 不會佔住訂閱數，讓上游無法關閉）
+        """
+
+        with self._lock:
+            self.stats['calls'] += 1
+            broadcast = self._streams.get(key)
+            if broadcast is not None and not broadcast.cancelled:
+                self.stats['shared'] += 1
+            else:
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+                self.stats['upstream'] += 1
+                threading.Thread(
+                    target=self._run_stream, args=(key, broadcast, fn),
+                    name=f"singleflight-{key[:8]}", daemon=True
+                ).start()
+            with broadcast.condition:
+                broadcast.subscribers += 1
+
+        # 登記與讀取之間沒有 yield：subscribe 的 finally 一定會執行到，訂閱數必定扣回
+        yield from broadcast.subscribe()
+
+    def _run_stream(self, key: str, broadcast: _Broadcast, fn: Callable[[], Iterable[str]]):
+        try:
+            broadcast.pump(fn())
+        except BaseException as e:
+            # fn() 本身失敗（例如連線錯誤）
+            with broadcast.condition:
+                broadcast.error = e
+                broadcast.finished = True
+                broadcast.condition.notify_all()
+        finally:
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._streams)
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("=" * 80)
+    print("測試 Single-flight 合併")
+    print("=" * 80)
+
+    flight = SingleFlight()
+    key = request_key("llama3.2", "Who has the highest wRC+ in 2024?", {'temperature': 0.7, 'num_predict': 200})
+
+    def slow_generate():
+        time.sleep(0.5)
+        return "Aaron Judge"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: flight.do(key, slow_generate), range(8)))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n非串流：8 個相同請求 → {flight.stats['upstream']} 次上游呼叫，{elapsed:.2f} 秒")
+    print(f"  結果：{set(r[0] for r in results)}，共用結果 {sum(r[1] for r in results)} 次")
+
+    def slow_stream():
+        for token in ["Aaron", " Judge", " leads", " with", " 220", "."]:
+            time.sleep(0.1)
+            yield token
+
+    outputs = {}
+
+    def reader(name: str, delay: float):
+        time.sleep(delay)
+        outputs[name] = "".join(flight.stream(key, slow_stream))
+
+    threads = [threading.Thread(target=reader, args=(f"user{i}", i * 0.25)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"\n串流：{outputs}")
+    print(f"  統計：{flight.stats}")
+
+    # 從未迭代的訂閱者不影響關閉上游：唯一的讀者提前離開後，上游在下一段就關閉
+    upstream_tokens = []
+
+    def counted_stream():
+        for token in slow_stream():
+            upstream_tokens.append(token)
+            yield token
+
+    idle = flight.stream(key, counted_stream)
+    reader_stream = flight.stream(key, counted_stream)
+    first = next(reader_stream)
+    reader_stream.close()
+    time.sleep(0.5)
+    print(f"\n提前離開：讀到 {first!r}，上游只產生 {len(upstream_tokens)}/6 段（未迭代的訂閱者不計入），"
+          f"進行中 {flight.in_flight()}")
@@ -0,0 +1,469 @@
+"""
+Week 6: 本機 Ollama 替身伺服器（確定性回應 + 可設定延遲模型）
+不需要 llama3.2 模型，就能跑評估、系統檢查、Streamlit demo 與端到端吞吐量測試
+
+實作的 API（與 Ollama 相同格式）：
+    POST /api/generate   串流（NDJSON）/ 非串流，call_llm 使用
+    POST /api/chat       串流 / 非串流，ollama.chat 使用（week5 模組）
+    GET  /api/tags       模型列表
+    GET  /api/version
+    GET  /               "Ollama is running"
+
+延遲模型（每個請求）：
+    首 token 時間 = ttft_ms + prompt token 數 / prefill_tps
+    之後每個 token = 1 / tokens_per_sec
+    - system prompt 與上一個請求相同時只計算動態部分的 prefill（模擬 KV cache 前綴重用）
+    - parallel 控制同時生成的請求數（預設 1，與 CPU 上的 Ollama 一樣排隊）
+    - jitter 為延遲的隨機比例，依 seed + prompt 決定 → 相同輸入得到相同延遲
+
+回應：
+    1. 預錄回應（responses 檔：{"prompt 子字串": "回應"}）
+    2. 規則回應：分類器（單字 / week5 JSON）、球員名字擷取、Factual / Ranking / Analysis 摘要
+    3. 其他 → "OK"
+
+執行：
+    python week6_ollama_stub.py                      # 監聽 11434（取代 Ollama）
+    STUB_PORT=11500 STUB_TOKENS_PER_SEC=15 python week6_ollama_stub.py
+    OLLAMA_HOST=http://localhost:11500 python week2_mlb_assistant.py
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from week6_prompt_builder import estimate_tokens
+
+# ============================================
+# 配置（可用環境變數覆寫）
+# ============================================
+
+STUB_HOST = os.environ.get("STUB_HOST", "127.0.0.1")
+STUB_PORT = int(os.environ.get("STUB_PORT", "11434"))
+STUB_MODEL = os.environ.get("STUB_MODEL", "llama3.2")
+
+DEFAULT_LATENCY = {
+    'ttft_ms': float(os.environ.get("STUB_TTFT_MS", "150")),
+    'prefill_tps': float(os.environ.get("STUB_PREFILL_TPS", "400")),
+    'tokens_per_sec': float(os.environ.get("STUB_TOKENS_PER_SEC", "20")),
+    'jitter': float(os.environ.get("STUB_JITTER", "0")),
+    'parallel': int(os.environ.get("STUB_PARALLEL", "1")),
+    'seed': int(os.environ.get("STUB_SEED", "42")),
+}
+
+STUB_RESPONSES_FILE = os.environ.get("STUB_RESPONSES_FILE", "")
+
+OLLAMA_DEFAULT_PORT = 11434
+
+
+def ollama_base_url(host: Optional[str] = None) -> str:
+    """
+    OLLAMA_HOST → base URL（與 ollama 套件的解析方式一致）
+
+    "http://localhost" → "http://localhost:11434"（沒有埠號時用 Ollama 的 11434，不是 HTTP 的 80）
+    "localhost:11500"  → "http://localhost:11500"
+    "https://example.com" → "https://example.com:443"
+    """
+
+    host = (host if host is not None else os.environ.get("OLLAMA_HOST", "")).strip().rstrip("/")
+    if not host:
+        return f"http://localhost:{OLLAMA_DEFAULT_PORT}"
+    if "://" not in host:
+        host = f"http://{host}"
+
+    parts = urlsplit(host)
+    port = parts.port or (443 if parts.scheme == "https" else OLLAMA_DEFAULT_PORT)
+    hostname = parts.hostname or "localhost"
+    if ":" in hostname:
+        hostname = f"[{hostname}]"
+    return f"{parts.scheme}://{hostname}:{port}{parts.path}"
+
+# 回應切成 token 的規則（單字 / 數字 / 中文字 / 標點，保留前導空白）
+_PIECE_PATTERN = re.compile(r'\s*(?:[A-Za-z]+|\d+(?:\.\d+)?|[　-鿿＀-￯]|\S)|\s+')
+
+
+# ============================================
+# 延遲模型
+# ============================================
+
+class LatencyModel:
+    """
+    確定性延遲模型
+
+    ttft_ms          固定首 token 延遲
+    prefill_tps      prompt 處理速度（token / 秒）
+    tokens_per_sec   生成速度（token / 秒）
+    jitter           隨機比例（0.1 = ±10%），以 seed + prompt 雜湊決定
+    parallel         同時生成的請求數
+    """
+
+    def __init__(self, ttft_ms: float = 150, prefill_tps: float = 400, tokens_per_sec: float = 20,
+                 jitter: float = 0.0, parallel: int = 1, seed: int = 42):
+        self.ttft_ms = ttft_ms
+        self.prefill_tps = prefill_tps
+        self.tokens_per_sec = tokens_per_sec
+        self.jitter = jitter
+        self.seed = seed
+        self.slots = threading.BoundedSemaphore(max(1, parallel))
+        self._last_system: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _factor(self, prompt: str) -> float:
+        if not self.jitter:
+            return 1.0
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode('utf-8')).digest()
+        rng = random.Random(int.from_bytes(digest[:8], 'big'))
+        return 1.0 + rng.uniform(-self.jitter, self.jitter)
+
+    def prefill_seconds(self, system: str, prompt: str) -> Tuple[float, int]:
+        """
+        Returns:
+            (首 token 秒數, 實際處理的 prompt token 數)
+        """
+        with self._lock:
+            cached = system and system == self._last_system
+            self._last_system = system
+
+        tokens = estimate_tokens(prompt) + (0 if cached else estimate_tokens(system or ""))
+        seconds = self.ttft_ms / 1000 + tokens / self.prefill_tps
+        return seconds * self._factor(prompt), tokens
+
+    def token_seconds(self, prompt: str) -> float:
+        return self._factor(prompt) / self.tokens_per_sec
+
+
+# ============================================
+# 規則回應
+# ============================================
+
+CLASSIFY_RULES = [
+    ('award', ['award', 'mvp', 'cy young', '獎', 'rookie of the year', 'gold glove']),
+    ('contract', ['salary', 'contract', 'paid', '薪資', '合約']),
+    ('statcast', ['exit velocity', 'barrel', 'hard hit', 'launch angle', 'sprint speed', 'statcast']),
+    ('ranking', ['highest', 'lowest', 'best', 'worst', 'top', 'most', 'least', 'leader', 'compare',
+                 '最高', '最低', '最多', '最少', '最好', '排名', '前']),
+    ('analysis', ['why', 'how', 'explain', 'analyze', 'trend', '為什麼', '如何', '分析', '表現']),
+]
+
+_NAME_PATTERN = re.compile(r"\b([A-Z][a-z]+(?:\s+(?:[A-Z][a-z]+|Jr\.|[A-Z]\.)){1,2})\b")
+_NAME_STOPWORDS = {'Who', 'What', 'Which', 'Why', 'How', 'Has', 'Top', 'Show', 'List', 'Compare'}
+
+
+def _classify(text: str, allowed: List[str]) -> str:
+    text_lower = text.lower()
+    for query_type, keywords in CLASSIFY_RULES:
+        if query_type in allowed and any(k in text_lower for k in keywords):
+            return query_type
+    return 'factual'
+
+
+def _extract_query(prompt: str) -> str:
+    match = re.search(r'Query:\s*"?(.+?)"?\s*$', prompt, re.MULTILINE)
+    if match:
+        return match.group(1)
+    match = re.search(r'查詢[:：]\s*(.+)$', prompt, re.MULTILINE)
+    return match.group(1) if match else prompt
+
+
+def _extract_player_name(text: str) -> Optional[str]:
+    for match in _NAME_PATTERN.finditer(text):
+        name = match.group(1)
+        if name.split()[0] not in _NAME_STOPWORDS:
+            return name
+    return None
+
+
+def rule_based_response(system: str, prompt: str) -> str:
+    """依 prompt 內容產生確定性的回應"""
+
+    context = f"{system}\n{prompt}"
+
+    # week2 分類器：單字回答
+    if 'ONLY ONE WORD' in context:
+        return _classify(_extract_query(prompt), ['ranking', 'analysis'])
+
+    # week5 分類器：JSON 回答
+    if 'JSON' in context and '分類' in context:
+        query = _extract_query(prompt)
+        query_type = _classify(query, ['award', 'contract', 'statcast', 'ranking', 'analysis'])
+        return json.dumps({'type': query_type, 'confidence': 0.9, 'reasoning': 'stub rule match'}, ensure_ascii=False)
+
+    # week5 球員名字擷取
+    if '提取球員名字' in context:
+        return _extract_player_name(prompt) or "NONE"
+
+    # Ranking：重述排名列表
+    ranking_match = re.search(r'Top (?:Players|Teams) by (.+?)(?: \((.*?)\))?:\n((?:\d+\..*\n?)+)', prompt)
+    if ranking_match:
+        stat, scope, rows = ranking_match.group(1), ranking_match.group(2) or '', ranking_match.group(3).strip()
+        first = re.match(r'1\.\s*(.+?)\s+-\s+([\d.]+)', rows)
+        summary = f"\n\n{first.group(1)} 以 {first.group(2)} 的 {stat} 領先。" if first else ""
+        return f"根據 {scope} {stat} 數據，排名如下：\n{rows}{summary}".replace("  ", " ")
+
+    # Analysis：第一季與最後一季比較
+    if 'Performance Over Time' in prompt:
+        player = re.search(r'Player:\s*(.+)', prompt)
+        seasons = re.findall(r'^(\d{4}) .*?: (.+)$', prompt, re.MULTILINE)
+        name = player.group(1).strip() if player else "This player"
+        if len(seasons) >= 2:
+            return (f"{name} has shown a clear trend over time. "
+                    f"In {seasons[0][0]} he posted {seasons[0][1]}, and in {seasons[-1][0]} he posted {seasons[-1][1]}.")
+        if seasons:
+            return f"{name} posted {seasons[0][1]} in {seasons[0][0]}."
+        return f"{name} has limited data available."
+
+    # Factual：第一個統計就是被問到的統計
+    stat_match = re.search(r'^- (.+?): (.+)$', prompt, re.MULTILINE)
+    if stat_match:
+        player = re.search(r'Player:\s*(.+?) \((\w+), (\d{4})', prompt)
+        if player:
+            return (f"{player.group(1)}'s {stat_match.group(1)} is {stat_match.group(2)} "
+                    f"in the {player.group(3)} season ({player.group(2)}).")
+        return f"The {stat_match.group(1)} is {stat_match.group(2)}."
+
+    return "OK"
+
+
+class ResponseBook:
+    """預錄回應（prompt 子字串 → 回應），找不到時使用規則回應"""
+
+    def __init__(self, responses: Optional[Dict[str, str]] = None):
+        self.responses = responses or {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ResponseBook':
+        if not path or not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def respond(self, system: str, prompt: str) -> str:
+        for needle, response in self.responses.items():
+            if needle in prompt:
+                return response
+        return rule_based_response(system, prompt)
+
+
+def split_tokens(text: str) -> List[str]:
+    """將回應切成串流用的 token（合併回去等於原文）"""
+    return _PIECE_PATTERN.findall(text)
+
+
+# ============================================
+# HTTP 伺服器
+# ============================================
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    """Ollama API 替身（server 上掛 latency / book / model）"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # ---------- 共用 ----------
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _generate(self, system: str, prompt: str, options: Dict) -> Tuple[Iterator[Tuple[str, float]], Dict]:
+        """
+        Returns:
+            (token 迭代器（token, 該 token 前的等待秒數）, 統計欄位)
+        """
+
+        latency: LatencyModel = self.server.latency
+        text = self.server.book.respond(system, prompt)
+        tokens = split_tokens(text)
+        num_predict = options.get('num_predict')
+        if num_predict is not None and num_predict >= 0:
+            tokens = tokens[:num_predict]
+
+        prefill_s, prompt_tokens = latency.prefill_seconds(system, prompt)
+        per_token_s = latency.token_seconds(prompt)
+
+        def iterate():
+            for i, token in enumerate(tokens):
+                yield token, prefill_s if i == 0 else per_token_s
+
+        stats = {
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(prefill_s * 1e9),
+            'eval_count': len(tokens),
+            'eval_duration': int(per_token_s * len(tokens) * 1e9),
+        }
+        return iterate(), stats
+
+    def _respond(self, system: str, prompt: str, options: Dict, stream: bool, chat: bool):
+        start = time.perf_counter()
+        model = self.server.model
+
+        def frame(content: str, done: bool, extra: Optional[Dict] = None) -> Dict:
+            payload = {'model': model, 'created_at': _now(), 'done': done}
+            if chat:
+                payload['message'] = {'role': 'assistant', 'content': content}
+            else:
+                payload['response'] = content
+            if extra:
+                payload.update(extra)
+            return payload
+
+        with self.server.latency.slots:
+            tokens, stats = self._generate(system, prompt, options)
+
+            if not stream:
+                pieces = []
+                for token, wait_s in tokens:
+                    time.sleep(wait_s)
+                    pieces.append(token)
+                stats['total_duration'] = int((time.perf_counter() - start) * 1e9)
+                extra = dict(stats, done_reason='stop')
+                if not chat:
+                    extra['context'] = []
+                self._send_json(frame("".join(pieces), True, extra))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            def write_chunk(payload: Dict):
+                data = (json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8')
+                self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                for token, wait_s in tokens:
+                    time.sleep(wait_s)
+                    write_chunk(frame(token, False))
+                stats['total_duration'] = int((time.perf_counter() - start) * 1e9)
+                write_chunk(frame("", True, dict(stats, done_reason='stop')))
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # 用戶端中途斷線（例如串流驗證提早中止）
+                self.close_connection = True
+
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+
+    # ---------- 路由 ----------
+
+    def do_GET(self):
+        if self.path == '/':
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/api/tags':
+            self._send_json({'models': [{
+                'name': f"{self.server.model}:latest", 'model': f"{self.server.model}:latest",
+                'modified_at': _now(), 'size': 0, 'digest': 'stub',
+                'details': {'format': 'gguf', 'family': 'stub', 'parameter_size': '0B', 'quantization_level': 'none'},
+            }]})
+        elif self.path == '/api/version':
+            self._send_json({'version': '0.0.0-stub'})
+        else:
+            self._send_json({'error': f"not found: {self.path}"}, status=404)
+
+    def do_POST(self):
+        try:
+            request = self._read_json()
+        except json.JSONDecodeError as e:
+            self._send_json({'error': f"invalid JSON: {e}"}, status=400)
+            return
+
+        options = request.get('options') or {}
+        if 'num_predict' not in options and 'num_predict' in request:
+            options['num_predict'] = request['num_predict']
+        stream = request.get('stream', True)
+
+        if self.path == '/api/generate':
+            self._respond(request.get('system') or "", request.get('prompt', ""), options, stream, chat=False)
+        elif self.path == '/api/chat':
+            messages = request.get('messages') or []
+            system = "\n".join(m.get('content', '') for m in messages if m.get('role') == 'system')
+            prompt = "\n".join(m.get('content', '') for m in messages if m.get('role') != 'system')
+            self._respond(system, prompt, options, stream, chat=True)
+        else:
+            self._send_json({'error': f"not found: {self.path}"}, status=404)
+
+
+class OllamaStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = STUB_HOST, port: int = STUB_PORT, latency: Optional[LatencyModel] = None,
+                 book: Optional[ResponseBook] = None, model: str = STUB_MODEL, verbose: bool = False):
+        super().__init__((host, port), OllamaStubHandler)
+        self.latency = latency or LatencyModel(**DEFAULT_LATENCY)
+        self.book = book or ResponseBook.from_file(STUB_RESPONSES_FILE)
+        self.model = model
+        self.verbose = verbose
+        self.stats = {'requests': 0}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(port: int = 0, **kwargs) -> OllamaStubServer:
+    """
+    在背景執行緒啟動替身伺服器（port=0 使用隨機可用埠），給測試 / 基準測試使用
+
+    用完呼叫 server.shutdown()
+    """
+    server = OllamaStubServer(port=port, **kwargs)
+    threading.Thread(target=server.serve_forever, name="ollama-stub", daemon=True).start()
+    return server
+
+
+# ============================================
+# 主程式
+# ============================================
+
+if __name__ == "__main__":
+
+    print("=" * 80)
+    print("Ollama 替身伺服器")
+    print("=" * 80)
+
+    server = OllamaStubServer(verbose=True)
+    latency = server.latency
+    print(f"  模型：{server.model}")
+    print(f"  延遲：首 token {latency.ttft_ms:.0f} ms + prefill {latency.prefill_tps:.0f} tok/s，"
+          f"生成 {latency.tokens_per_sec:.0f} tok/s，並行 {DEFAULT_LATENCY['parallel']}，jitter {latency.jitter}")
+    print(f"  預錄回應：{len(server.book.responses)} 筆")
+    print(f"\n✅ 監聽 {server.base_url}（Ctrl+C 結束）")
+    print(f"   其他程式請設定 OLLAMA_HOST={server.base_url}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n已處理 {server.stats['requests']} 個請求")
+        server.shutdown()
@@ -0,0 +1,502 @@
+"""
+Week 6: 逐球 Statcast 儲存 + 查詢引擎（分區裁剪 / 謂詞與投影下推 / 串流聚合）
+
+賽季聚合（week6_statcast_leaderboard）回答不了拆分問題：
+    "Judge's xwOBA vs sliders in 2024"、"Skubal whiff rate on changeups by month"
+這類問題需要掃描數百萬筆逐球資料
+
+儲存：mlb_data/pitches/season=YYYY/month=MM/data.parquet（hive 分區）
+    - 每球一列：打者 / 投手名字、球種、結果描述、球速、擊球初速、xwOBA 等（PITCH_COLUMNS）
+    - 分區內依打者名字排序 → parquet row group 的 min/max 統計可以跳過不相關的 row group
+    - manifest.json 記錄分區列數與打者 / 投手名單（解析查詢中的球員不需要掃資料）
+
+查詢（PitchStore.run）：
+    1. 分區裁剪：season / month 條件只開啟相關的分區目錄
+    2. 謂詞下推：球員 / 球種 / 左右投條件交給 pyarrow.dataset 掃描時過濾
+    3. 投影下推：只讀取條件、分組、指標需要的欄位
+    4. 串流：逐個 record batch 計算分子 / 分母並 group-by 加總，最後合併部分結果
+       → 記憶體只需要一個 batch，不會載入整季
+
+建置：
+    python week6_pitch_store.py ingest 2024-03-28 2024-09-30   # pybaseball.statcast → 分區檔
+    python week6_pitch_store.py "Judge's xwOBA vs sliders in 2024"
+"""
+
+import json
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from week6_ranking_engine import parse_seasons
+from week6_side_tables import savant_player_name
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+PITCH_DIR = os.environ.get("PITCH_DIR", os.path.join(DATA_DIR, "pitches"))
+MANIFEST_FILE = "manifest.json"
+PARTITION_FILE = "data.parquet"
+
+# 每球儲存的欄位（Baseball Savant 逐球資料的欄位名稱；名字欄位由 ingest 補上）
+PITCH_COLUMNS = [
+    'game_date', 'batter_name', 'pitcher_name', 'pitch_type', 'stand', 'p_throws',
+    'description', 'events', 'release_speed', 'launch_speed', 'launch_angle',
+    'estimated_woba_using_speedangle', 'woba_value', 'woba_denom',
+]
+
+ROW_GROUP_SIZE = 64 * 1024
+BATCH_SIZE = 128 * 1024
+
+WHIFF_DESCRIPTIONS = ['swinging_strike', 'swinging_strike_blocked', 'missed_bunt']
+CONTACT_DESCRIPTIONS = ['foul', 'foul_tip', 'foul_bunt', 'hit_into_play']
+
+# 指標 = 分子加總 / 分母加總（ratio=False 時只取分子加總）；每個指標需要的欄位（投影下推）
+PITCH_METRICS = {
+    'pitches': {'columns': [], 'label': '球數', 'format': '{:,.0f}', 'ratio': False},
+    'xwOBA': {'columns': ['estimated_woba_using_speedangle', 'woba_value', 'woba_denom'], 'label': 'xwOBA', 'format': '{:.3f}'},
+    'wOBA': {'columns': ['woba_value', 'woba_denom'], 'label': 'wOBA', 'format': '{:.3f}'},
+    'whiff_rate': {'columns': ['description'], 'label': '揮空率', 'format': '{:.1%}'},
+    'avg_velo': {'columns': ['release_speed'], 'label': '平均球速', 'format': '{:.1f} mph'},
+    'avg_exit_velo': {'columns': ['description', 'launch_speed'], 'label': '平均擊球初速', 'format': '{:.1f} mph'},
+    'hard_hit_rate': {'columns': ['description', 'launch_speed'], 'label': '強擊球率', 'format': '{:.1%}'},
+}
+
+# Baseball Savant 的球種代碼與分組
+PITCH_TYPE_PATTERNS = [
+    (r'four[- ]seam|4[- ]seam', ['FF'], '四縫線速球'),
+    (r'sinkers?|two[- ]seam', ['SI'], '伸卡球'),
+    (r'cutters?', ['FC'], '卡特球'),
+    (r'sweepers?', ['ST'], '橫掃球'),
+    (r'sliders?', ['SL'], '滑球'),
+    (r'knuckle[- ]?curves?', ['KC'], '彈指曲球'),
+    (r'curve ?balls?|curves?', ['CU'], '曲球'),
+    (r'change[- ]?ups?', ['CH'], '變速球'),
+    (r'splitters?|splitty|split[- ]finger', ['FS'], '指叉球'),
+    (r'fastballs?|heaters?', ['FF', 'SI', 'FC'], '速球類'),
+    (r'breaking balls?|breaking pitches', ['SL', 'ST', 'CU', 'KC', 'SV', 'CS'], '變化球類'),
+    (r'off[- ]?speed', ['CH', 'FS', 'FO', 'SC'], '變速類'),
+]
+
+METRIC_PATTERNS = [
+    (r'xwoba', 'xwOBA'),
+    (r'\bwoba\b', 'wOBA'),
+    (r'whiff|swing(?:ing)? (?:and )?miss|揮空', 'whiff_rate'),
+    (r'exit velo(?:city)?', 'avg_exit_velo'),
+    (r'hard[- ]hit', 'hard_hit_rate'),
+    (r'(?<!exit )velo(?:city)?|pitch speed|球速', 'avg_velo'),
+    (r'how many pitches|pitch count|usage|球數', 'pitches'),
+]
+
+GROUP_PATTERNS = [
+    (r'by month|monthly|per month|each month|每月|逐月', 'month'),
+    (r'by pitch(?: type)?|per pitch(?: type)?|each pitch|pitch mix|arsenal|各球種', 'pitch_type'),
+    (r'by (?:season|year)|per (?:season|year)|each (?:season|year)|逐年', 'season'),
+]
+
+MONTH_NAMES = {
+    'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7,
+    'august': 8, 'september': 9, 'october': 10,
+}
+
+# ============================================
+# 寫入分區
+# ============================================
+
+def partition_path(directory: str, season: int, month: int) -> str:
+    return os.path.join(directory, f"season={season}", f"month={month:02d}", PARTITION_FILE)
+
+
+def _load_manifest(directory: str) -> Dict:
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'partitions': {}, 'batters': [], 'pitchers': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_pitch_partitions(pitches: pd.DataFrame, directory: str = PITCH_DIR) -> Dict:
+    """
+    逐球資料 → season / month 分區檔
+
+    重新寫入涉及的分區：同分區中日期與新資料重疊的舊列會被取代（重複執行同一日期區間不會重複）
+    """
+
+    pitches = pitches.copy()
+    game_date = pd.to_datetime(pitches['game_date'])
+    pitches['game_date'] = game_date.dt.strftime('%Y-%m-%d')
+    pitches = pitches.reindex(columns=PITCH_COLUMNS)
+    manifest = _load_manifest(directory)
+
+    for (season, month), part in pitches.groupby([game_date.dt.year, game_date.dt.month]):
+        path = partition_path(directory, int(season), int(month))
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            existing = existing[~existing['game_date'].isin(set(part['game_date']))]
+            part = pd.concat([existing, part], ignore_index=True)
+        part = part.sort_values(['batter_name', 'game_date'], kind='stable')
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        pq.write_table(pa.Table.from_pandas(part, preserve_index=False), tmp_path, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp_path, path)
+        manifest['partitions'][f"{int(season)}-{int(month):02d}"] = len(part)
+        print(f"  ✅ {int(season)}-{int(month):02d}：{len(part):,} 球 → {path}")
+
+    manifest['batters'] = sorted(set(manifest['batters']) | set(pitches['batter_name'].dropna()))
+    manifest['pitchers'] = sorted(set(manifest['pitchers']) | set(pitches['pitcher_name'].dropna()))
+    with open(os.path.join(directory, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def ingest_statcast(start_date: str, end_date: str, directory: str = PITCH_DIR) -> Dict:
+    """pybaseball.statcast 逐球資料 → 分區檔（打者 MLBAM ID 轉成名字）"""
+
+    from pybaseball import playerid_reverse_lookup, statcast
+
+    raw = statcast(start_dt=start_date, end_dt=end_date)
+    print(f"  📥 {start_date} ~ {end_date}：{len(raw):,} 球")
+
+    lookup = playerid_reverse_lookup(raw['batter'].dropna().unique().tolist(), key_type='mlbam')
+    names = {
+        int(row.key_mlbam): f"{row.name_first.title()} {row.name_last.title()}"
+        for row in lookup.itertuples()
+    }
+    raw['batter_name'] = raw['batter'].map(names)
+    raw['pitcher_name'] = raw['player_name'].map(savant_player_name)
+    return write_pitch_partitions(raw, directory)
+
+# ============================================
+# 查詢解析
+# ============================================
+
+def parse_pitch_query(query: str, batters: List[str], pitchers: List[str]) -> Optional[Dict]:
+    """
+    解析逐球拆分查詢；沒有球員或沒有逐球層級的條件時回傳 None（交給賽季聚合）
+
+    "Judge's xwOBA vs sliders in 2024"
+        → {'player': 'Aaron Judge', 'role': 'batter', 'pitch_types': ['SL'], 'metrics': ['pitches', 'xwOBA'], ...}
+    "Skubal whiff rate on changeups by month"
+        → {'player': 'Tarik Skubal', 'role': 'pitcher', 'pitch_types': ['CH'], 'group_by': ['month'], ...}
+    """
+
+    query_lower = query.lower()
+
+    pitch_types, pitch_label = None, None
+    for pattern, codes, label in PITCH_TYPE_PATTERNS:
+        if re.search(pattern, query_lower):
+            pitch_types, pitch_label = codes, label
+            break
+
+    group_by = [column for pattern, column in GROUP_PATTERNS if re.search(pattern, query_lower)]
+    months = sorted({number for name, number in MONTH_NAMES.items() if re.search(rf'\b{name}\b', query_lower)})
+    handedness = None
+    if re.search(r'lefties|left[- ]handed|\blhp\b|\blhh\b|\bvs\.? l\b|左投|左打', query_lower):
+        handedness = 'L'
+    elif re.search(r'righties|right[- ]handed|\brhp\b|\brhh\b|\bvs\.? r\b|右投|右打', query_lower):
+        handedness = 'R'
+    metrics = [name for pattern, name in METRIC_PATTERNS if re.search(pattern, query_lower)]
+
+    # 逐球層級的訊號：球種、分組、月份、左右投打、揮空率
+    if not (pitch_types or group_by or months or handedness or 'whiff_rate' in metrics):
+        return None
+
+    player, role = resolve_pitch_player(query, batters, pitchers)
+    if player is None:
+        return None
+
+    return {
+        'player': player,
+        'role': role,
+        'pitch_types': pitch_types,
+        'pitch_label': pitch_label,
+        'seasons': parse_seasons(query),
+        'months': months or None,
+        'handedness': handedness,
+        'group_by': group_by,
+        'metrics': ['pitches'] + ([m for m in metrics if m != 'pitches'] or ['xwOBA', 'whiff_rate']),
+    }
+
+
+def resolve_pitch_player(query: str, batters: List[str], pitchers: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    查詢中的球員 → (名字, 'batter' / 'pitcher')
+
+    先比對全名，再比對唯一的姓氏（"Judge's" → Aaron Judge）；同時是打者與投手時，
+    提到 pitching / throw / allow 視為投手
+    """
+
+    query_lower = query.lower()
+    candidates = [(name, 'batter') for name in batters] + [(name, 'pitcher') for name in pitchers]
+
+    matches = [(name, role) for name, role in candidates if name.lower() in query_lower]
+    if not matches:
+        words = set(re.findall(r"[a-z][a-z\.\-]+", query_lower.replace("'s", "")))
+        matches = [(name, role) for name, role in candidates if name.split()[-1].lower() in words]
+    if not matches:
+        return None, None
+    if len({name for name, _ in matches}) > 1:
+        # 多個候選：取最長的名字（"Will Smith" 與 "Will Smith Jr." 這類情形）
+        longest = max(len(name) for name, _ in matches)
+        matches = [(name, role) for name, role in matches if len(name) == longest]
+
+    roles = {role for _, role in matches}
+    if len(roles) > 1:
+        role = 'pitcher' if re.search(r'pitch(?:ing|er)|throw|allow', query_lower) else 'batter'
+    else:
+        role = roles.pop()
+    return matches[0][0], role
+
+# ============================================
+# 查詢引擎
+# ============================================
+
+def _metric_parts(metric: str, batch: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """每列的 (分子, 分母)；指標 = 分組後 sum(分子) / sum(分母)"""
+
+    n = len(batch)
+    if metric == 'pitches':
+        return np.ones(n), np.ones(n)
+
+    if metric in ('xwOBA', 'wOBA'):
+        denom = np.nan_to_num(batch['woba_denom'].to_numpy(dtype=np.float64))
+        value = batch['woba_value'].to_numpy(dtype=np.float64)
+        if metric == 'xwOBA':
+            # 擊出球用預期值，其餘（保送、三振、觸身球）用實際 wOBA 值
+            expected = batch['estimated_woba_using_speedangle'].to_numpy(dtype=np.float64)
+            value = np.where(np.isnan(expected), value, expected)
+        return np.nan_to_num(value) * (denom > 0), denom
+
+    if metric == 'whiff_rate':
+        description = batch['description']
+        whiff = description.isin(WHIFF_DESCRIPTIONS).to_numpy()
+        swing = whiff | description.isin(CONTACT_DESCRIPTIONS).to_numpy()
+        return whiff.astype(np.float64), swing.astype(np.float64)
+
+    if metric == 'avg_velo':
+        speed = batch['release_speed'].to_numpy(dtype=np.float64)
+        return np.nan_to_num(speed), (~np.isnan(speed)).astype(np.float64)
+
+    # avg_exit_velo / hard_hit_rate：只計擊進場內的球
+    speed = batch['launch_speed'].to_numpy(dtype=np.float64)
+    in_play = (batch['description'] == 'hit_into_play').to_numpy() & ~np.isnan(speed)
+    if metric == 'avg_exit_velo':
+        return np.where(in_play, speed, 0.0), in_play.astype(np.float64)
+    return (in_play & (speed >= 95)).astype(np.float64), in_play.astype(np.float64)
+
+
+class PitchStore:
+    """season / month 分區的逐球資料集（pyarrow.dataset）"""
+
+    def __init__(self, directory: str = PITCH_DIR):
+        self.directory = directory
+        self.manifest = _load_manifest(directory)
+        self.dataset = ds.dataset(
+            directory, format='parquet', partitioning='hive',
+            exclude_invalid_files=True, ignore_prefixes=['.', '_', MANIFEST_FILE],
+        )
+
+    @classmethod
+    def open(cls, directory: str = PITCH_DIR) -> Optional['PitchStore']:
+        """分區檔不存在時回傳 None"""
+        if not os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            return None
+        return cls(directory)
+
+    @property
+    def batters(self) -> List[str]:
+        return self.manifest['batters']
+
+    @property
+    def pitchers(self) -> List[str]:
+        return self.manifest['pitchers']
+
+    @property
+    def seasons(self) -> List[int]:
+        return sorted({int(key.split('-')[0]) for key in self.manifest['partitions']})
+
+    def total_rows(self) -> int:
+        return sum(self.manifest['partitions'].values())
+
+    # ---------- 掃描 ----------
+
+    def _filter(self, spec: Dict) -> ds.Expression:
+        """查詢規格 → pyarrow 過濾式（分區欄位負責裁剪目錄，其餘下推到 parquet 掃描）"""
+
+        player_column = 'batter_name' if spec['role'] == 'batter' else 'pitcher_name'
+        expression = ds.field(player_column) == spec['player']
+        if spec.get('seasons'):
+            expression &= ds.field('season').isin(spec['seasons'])
+        if spec.get('months'):
+            expression &= ds.field('month').isin(spec['months'])
+        if spec.get('pitch_types'):
+            expression &= ds.field('pitch_type').isin(spec['pitch_types'])
+        if spec.get('handedness'):
+            # 打者看對手投手的慣用手，投手看對手打者的打席
+            side_column = 'p_throws' if spec['role'] == 'batter' else 'stand'
+            expression &= ds.field(side_column) == spec['handedness']
+        return expression
+
+    def scan(self, spec: Dict, columns: List[str]) -> Iterator[pa.RecordBatch]:
+        """串流符合條件的 record batch（只讀取 columns）"""
+        scanner = self.dataset.scanner(columns=columns, filter=self._filter(spec), batch_size=BATCH_SIZE)
+        return scanner.to_batches()
+
+    def run(self, spec: Dict) -> Dict:
+        """
+        執行查詢：逐 batch 計算分子 / 分母 → group-by 加總 → 合併
+
+        Returns:
+            {'rows': DataFrame（分組欄位 + 各指標）, 'matched': 符合的球數, 'batches': 批次數, 'ms': 毫秒}
+        """
+
+        start = time.perf_counter()
+        group_by = spec.get('group_by') or []
+        metrics = spec['metrics']
+        columns = sorted(set(group_by) | {c for m in metrics for c in PITCH_METRICS[m]['columns']})
+
+        partials = []
+        matched = batches = 0
+        for batch in self.scan(spec, columns):
+            if batch.num_rows == 0:
+                continue
+            frame = batch.to_pandas()
+            parts = {}
+            for metric in metrics:
+                numerator, denominator = _metric_parts(metric, frame)
+                parts[f'{metric}__num'] = numerator
+                parts[f'{metric}__den'] = denominator
+            sums = pd.DataFrame(parts)
+            if group_by:
+                sums[group_by] = frame[group_by].to_numpy()
+                partials.append(sums.groupby(group_by, sort=False).sum())
+            else:
+                partials.append(sums.sum().to_frame().T)
+            matched += batch.num_rows
+            batches += 1
+
+        if partials:
+            combined = pd.concat(partials)
+            combined = combined.groupby(level=group_by).sum().sort_index() if group_by else combined.sum().to_frame().T
+            rows = pd.DataFrame(index=combined.index)
+            for metric in metrics:
+                if not PITCH_METRICS[metric].get('ratio', True):
+                    rows[metric] = combined[f'{metric}__num'].to_numpy()
+                    continue
+                denominator = combined[f'{metric}__den'].to_numpy()
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    rows[metric] = np.where(denominator > 0, combined[f'{metric}__num'].to_numpy() / denominator, np.nan)
+            rows = rows.reset_index() if group_by else rows.reset_index(drop=True)
+        else:
+            rows = pd.DataFrame(columns=group_by + metrics)
+
+        return {'rows': rows, 'matched': matched, 'batches': batches, 'ms': (time.perf_counter() - start) * 1000}
+
+    # ---------- 回答 ----------
+
+    def answer(self, spec: Dict) -> Dict:
+        """
+        回答 parse_pitch_query 的結果
+
+        Returns:
+            {'type': 'pitch', 'player', 'role', 'rows': [...], 'answer'}
+        """
+
+        result = self.run(spec)
+        rows = result['rows']
+
+        scope = []
+        if spec.get('seasons'):
+            scope.append('/'.join(map(str, spec['seasons'])))
+        if spec.get('months'):
+            scope.append('、'.join(f"{m} 月" for m in spec['months']))
+        if spec.get('pitch_label'):
+            scope.append(('面對' if spec['role'] == 'batter' else '') + spec['pitch_label'])
+        if spec.get('handedness'):
+            hand = '左' if spec['handedness'] == 'L' else '右'
+            scope.append(f"對{hand}投" if spec['role'] == 'batter' else f"對{hand}打")
+        title = f"{spec['player']}（{'打者' if spec['role'] == 'batter' else '投手'}）" + (
+            f" {' '.join(scope)}" if scope else "")
+
+        if result['matched'] == 0:
+            answer = f"{title}：沒有符合條件的逐球記錄"
+        else:
+            answer = f"{title}：\n\n"
+            for record in rows.to_dict('records'):
+                label = ' / '.join(
+                    f"{record[c]:02d} 月" if c == 'month' else str(record[c]) for c in spec.get('group_by') or []
+                )
+                values = '，'.join(
+                    f"{PITCH_METRICS[m]['label']} "
+                    + ('—' if pd.isna(record[m]) else PITCH_METRICS[m]['format'].format(record[m]))
+                    for m in spec['metrics']
+                )
+                answer += f"• {label}: {values}\n" if label else f"• {values}\n"
+
+        return {
+            'type': 'pitch',
+            'player': spec['player'],
+            'role': spec['role'],
+            'rows': rows.to_dict('records'),
+            'matched': result['matched'],
+            'answer': answer.rstrip()
+        }
+
+# ============================================
+# 建置 / 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import sys
+
+    print("=" * 80)
+    print("逐球 Statcast 查詢引擎")
+    print("=" * 80)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'ingest':
+        # python week6_pitch_store.py ingest 2024-03-28 2024-09-30
+        if len(sys.argv) < 4:
+            print("用法：python week6_pitch_store.py ingest <開始日期> <結束日期>")
+            exit(1)
+        try:
+            ingest_statcast(sys.argv[2], sys.argv[3])
+        except ImportError:
+            print("❌ 請先安裝 pybaseball: pip install pybaseball")
+            exit(1)
+        exit(0)
+
+    store = PitchStore.open()
+    if store is None:
+        print(f"❌ 找不到逐球資料：{PITCH_DIR}")
+        print("   請先執行: python week6_pitch_store.py ingest 2024-03-28 2024-09-30")
+        exit(1)
+
+    print(f"📊 {store.total_rows():,} 球 / {len(store.manifest['partitions'])} 個分區 / 賽季 {store.seasons}")
+
+    test_queries = sys.argv[1:] or [
+        "Judge's xwOBA vs sliders in 2024",
+        "Skubal whiff rate on changeups by month",
+        "Aaron Judge by pitch type",
+    ]
+
+    for query in test_queries:
+        print(f"\n查詢: {query}")
+        print("-" * 80)
+        spec = parse_pitch_query(query, store.batters, store.pitchers)
+        if spec is None:
+            print("（不是逐球拆分查詢）")
+            continue
+        start_time = time.perf_counter()
+        result = store.answer(spec)
+        print(result['answer'])
+        print(f"⏱️  {(time.perf_counter() - start_time) * 1000:.1f} ms（{result['matched']:,} 球）")
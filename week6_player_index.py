@@ -0,0 +1,218 @@
+"""
+Week 6: 球員賽季時間軸索引
+載入時預先建立 player → 依賽季排序的陣列索引，讓 Analysis 查詢 O(1) 取得生涯數據
+
+原本做法（每次查詢）：
+    docs_df[docs_df['player_name'] == name].sort_values('season') + iterrows()
+    → 整欄字串比對 + 排序 + 逐列轉換
+
+新做法：
+    載入時排序一次，每位球員對應一段連續區間 (start, end)
+    → 查詢時只做二分搜尋 + 陣列切片（NumPy view，不複製）
+    資料來自 week6_corpus_store 的欄式語料（可 mmap，多個 worker 共用）
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from week6_corpus_store import CorpusStore
+
+# ============================================
+# 配置
+# ============================================
+
+# 時間軸保留的關鍵統計（打者 + 投手）
+# 值為可能的欄位名稱（Week 4 FanGraphs 原始欄位 / Week 1 舊欄位）
+TIMELINE_STATS = {
+    'wRC+': ['wRC+', 'wRC_plus'],
+    'OPS': ['OPS'],
+    'HR': ['HR'],
+    'PA': ['PA'],
+    'ERA': ['ERA'],
+    'WHIP': ['WHIP'],
+    'K/9': ['K/9', 'K_9'],
+    'IP': ['IP'],
+    'WAR': ['WAR'],
+}
+
+
+# ============================================
+# 球員時間軸索引
+# ============================================
+
+class PlayerTimelineIndex:
+    """
+    球員賽季時間軸索引
+
+    結構：
+        建立在 CorpusStore 上（列已依 (player_name, season) 排序，球員區間以二分搜尋取得），
+        關鍵統計為統計矩陣的欄位（view），沒有逐列的 Python 物件 → fork 的 worker 共用同一份
+
+    查詢：
+        get_timeline(name)        → 各欄位陣列切片（可直接格式化）
+        get_stats_over_time(name) → 與原本 stats_over_time 相同格式的 list
+
+    若提供 derived（week6_derived_metrics 的輸出），關鍵統計的
+    排名 / 百分位 / 逐年變化也會一併排入陣列
+    """
+
+    def __init__(self, docs_df: Optional[pd.DataFrame] = None, derived: Optional[pd.DataFrame] = None,
+                 corpus: Optional[CorpusStore] = None):
+        if corpus is None and docs_df is not None and len(docs_df) > 0:
+            corpus = CorpusStore.from_documents(docs_df)
+
+        self.corpus = corpus
+        self.seasons = corpus.season if corpus is not None else np.empty(0, dtype=np.int32)
+        self.stat_arrays: Dict[str, np.ndarray] = {}
+        self.derived_arrays: Dict[str, Dict[str, np.ndarray]] = {}
+
+        if corpus is not None and len(corpus) > 0:
+            self._build(corpus, derived)
+
+    def _build(self, corpus: CorpusStore, derived: Optional[pd.DataFrame] = None):
+        """關鍵統計 / 衍生指標轉成與語料列對齊的連續陣列"""
+
+        for stat_name, aliases in TIMELINE_STATS.items():
+            self.stat_arrays[stat_name] = corpus.stat_column(aliases)
+
+        # 衍生指標（derived 依 doc_idx 排序，與 mlb_documents.json 的列位置對齊）
+        if derived is not None:
+            for stat_name, aliases in TIMELINE_STATS.items():
+                col = next((f"stat_{a}" for a in aliases if f"stat_{a}_rank" in derived.columns), None)
+                if col is None:
+                    continue
+                self.derived_arrays[stat_name] = {
+                    metric: derived[f"{col}_{metric}"].to_numpy(dtype=np.float64)[corpus.doc_idx]
+                    for metric in ('rank', 'pct', 'yoy')
+                }
+
+    def _span(self, player_name: str) -> Optional[tuple]:
+        return self.corpus.player_span(player_name) if self.corpus is not None else None
+
+    def __len__(self) -> int:
+        return self.corpus.n_players if self.corpus is not None else 0
+
+    def __contains__(self, player_name: str) -> bool:
+        return self._span(player_name) is not None
+
+    def get_timeline(self, player_name: str) -> Optional[Dict]:
+        """
+        取得球員生涯時間軸（陣列切片，不複製）
+
+        Returns:
+            {
+                'player_name': str,
+                'seasons': np.ndarray,
+                'teams': np.ndarray,
+                'types': np.ndarray,
+                'stats': {'wRC+': np.ndarray, 'ERA': np.ndarray, ...},
+                'derived': {'wRC+': {'rank': np.ndarray, 'pct': ..., 'yoy': ...}, ...}
+            }
+            找不到球員時回傳 None
+        """
+
+        span = self._span(player_name)
+        if span is None:
+            return None
+
+        start, end = span
+        return {
+            'player_name': player_name,
+            'seasons': self.seasons[start:end],
+            'teams': self.corpus.vocab_values('team', start, end),
+            'types': self.corpus.vocab_values('type', start, end),
+            'stats': {name: arr[start:end] for name, arr in self.stat_arrays.items()},
+            'derived': {
+                name: {metric: arr[start:end] for metric, arr in metrics.items()}
+                for name, metrics in self.derived_arrays.items()
+            }
+        }
+
+    def get_stats_over_time(self, player_name: str) -> List[Dict]:
+        """
+        取得與原本 iterrows() 相同格式的多賽季數據
+
+        Returns:
+            [{'season': int, 'team': str, 'type': str, 'stats': dict, 'derived': dict}, ...]
+            derived: {'wRC+': {'rank': 1.0, 'pct': 99.5, 'yoy': 47.0}, ...}（無衍生指標時為空 dict）
+        """
+
+        span = self._span(player_name)
+        if span is None:
+            return []
+
+        start, end = span
+        return [
+            {
+                'season': int(self.seasons[i]),
+                'team': self.corpus.vocab_value('team', i),
+                'type': self.corpus.vocab_value('type', i),
+                'stats': self.corpus.row_stats(i),
+                'derived': self._derived_at(i)
+            }
+            for i in range(start, end)
+        ]
+
+    def _derived_at(self, i: int) -> Dict[str, Dict[str, float]]:
+        """取出第 i 列的衍生指標（略過 NaN）"""
+        result = {}
+        for stat_name, metrics in self.derived_arrays.items():
+            values = {m: float(arr[i]) for m, arr in metrics.items() if not np.isnan(arr[i])}
+            if values:
+                result[stat_name] = values
+        return result
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import json
+    import os
+    import time
+
+    docs_file = "./mlb_data/mlb_documents.json"
+
+    print("=" * 80)
+    print("測試球員時間軸索引")
+    print("=" * 80)
+
+    if not os.path.exists(docs_file):
+        print(f"❌ 找不到數據文件：{docs_file}")
+        exit(1)
+
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+
+    start_time = time.perf_counter()
+    index = PlayerTimelineIndex(docs_df)
+    build_ms = (time.perf_counter() - start_time) * 1000
+    print(f"✅ 索引建立完成：{len(index)} 位球員（{build_ms:.1f} ms）")
+
+    player_name = "Aaron Judge"
+
+    # 舊做法
+    start_time = time.perf_counter()
+    player_data = docs_df[docs_df['player_name'] == player_name].sort_values('season')
+    old_result = [
+        {'season': row['season'], 'team': row['team'], 'type': row['type'], 'stats': row['stats']}
+        for _, row in player_data.iterrows()
+    ]
+    old_ms = (time.perf_counter() - start_time) * 1000
+
+    # 新做法
+    start_time = time.perf_counter()
+    new_result = index.get_stats_over_time(player_name)
+    new_ms = (time.perf_counter() - start_time) * 1000
+
+    print(f"\n{player_name}：{len(new_result)} 個賽季")
+    print(f"  舊做法：{old_ms:.3f} ms")
+    print(f"  新做法：{new_ms:.3f} ms")
+
+    timeline = index.get_timeline(player_name)
+    if timeline:
+        for i, season in enumerate(timeline['seasons']):
+            print(f"  {season}: wRC+ {timeline['stats']['wRC+'][i]:.0f}, HR {timeline['stats']['HR'][i]:.0f}")
@@ -0,0 +1,385 @@
+"""
+Week 6: Prompt 組裝與 Token 預算
+只放入與查詢相關的統計，估算 prompt token 數，並依路由限制 token 預算
+
+原本：
+    - generate_factual_answer 放入最多 15-20 行 stat_*（包含以 0 填補的無關欄位）+ 長範例
+    - generate_ranking_answer 每次呼叫都重複一大段指令
+    → CPU 上 Ollama 的 prompt 處理時間與 token 數成正比
+
+現在：
+    1. 靜態指令與範例移到各路由固定的 system prompt
+       （內容完全不變 → Ollama 可重用同一前綴的 KV cache，只需處理動態部分）
+    2. 動態部分只保留：查詢 + 實體資訊 + 相關統計
+       - Factual：查詢中提到的統計優先，其次該球員類型的核心統計，略過 0 / NaN
+       - Analysis：賽季超出預算時保留最近的賽季
+    3. 每個路由有 token 預算，超出時依重要性由後往前刪除
+    4. 記錄估算 token 數與 Ollama 回報的實際 prompt_eval_count
+"""
+
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from week6_stat_registry import STAT_REGISTRY, match_stat, stat_display_name
+
+# ============================================
+# 配置
+# ============================================
+
+# 各路由動態 prompt 的 token 預算（不含 system prompt）
+TOKEN_BUDGETS = {
+    'classify': 80,
+    'factual': 220,
+    'ranking': 320,
+    'analysis': 420,
+}
+
+# Factual 最多放入的統計數
+MAX_FACTUAL_STATS = 8
+
+# 各球員類型的核心統計（依重要性排序）
+CORE_STATS = {
+    'batter': ['wRC+', 'OPS', 'HR', 'AVG', 'OBP', 'SLG', 'RBI', 'WAR', 'PA'],
+    'pitcher': ['ERA', 'WHIP', 'FIP', 'K/9', 'BB/9', 'SO', 'IP', 'WAR', 'W'],
+}
+
+# Analysis 每個賽季放入的統計
+ANALYSIS_STATS = {
+    'batter': ['wRC+', 'OPS', 'HR'],
+    'pitcher': ['ERA', 'WHIP', 'K/9'],
+}
+
+# 固定的 system prompt（逐字不變，才能命中 KV cache）
+SYSTEM_PROMPTS = {
+    'classify': """You are a query classifier for a baseball statistics system.
+Classify the query into ONE of these types:
+1. factual: asks for specific data about a specific player
+2. ranking: asks for top/best/worst players or comparisons
+3. analysis: asks for explanation, reasoning, or deep analysis
+Respond with ONLY ONE WORD: factual, ranking, or analysis""",
+
+    'factual': """You are a baseball statistics assistant.
+Rules:
+1. Start with the direct answer (the specific number) in one short sentence.
+2. Then add 1-2 sentences of context if helpful.
+3. Use only the statistics provided. Do NOT say data is unavailable.
+4. Use ONLY Chinese or English.
+Example (format only; [brackets] = values from the provided data):
+Q: What is [player]'s wRC+?
+A: [player]'s wRC+ is [value] in the [season] season, [one short comparison].""",
+
+    'ranking': """You are a baseball statistics assistant that presents rankings.
+Rules:
+1. Start with "根據 [stat] 數據，排名如下："
+2. List the top 3-5 entries concisely, using the numbers provided.
+3. Then give 2-3 sentences of objective analysis; no negative comments about anyone listed.
+4. Use ONLY Chinese or English, simple words, no other languages.
+P = league percentile, YoY = change vs previous season.
+Example (format only; [brackets] = values from the provided data):
+根據 [season] 賽季 [stat] 數據，排名如下：
+1. [player] ([team]) - [value]
+2. [player] ([team]) - [value]
+[player] 以 [value] 的 [stat] 領先全聯盟。""",
+
+    'analysis': """You are a baseball analyst.
+Rules:
+1. Start with a one-sentence conclusion.
+2. Then 2-3 sentences of analysis citing the statistics provided; focus on trends and patterns.
+3. Be objective and data-driven.
+#N = league rank, PN = league percentile, YoY = change vs previous season; use these numbers directly, do not recompute.
+Example (format only; [brackets] = values from the provided data):
+[player]'s performance is driven by elite power. His wRC+ rose from [value] ([season]) to [value] ([season], #[rank], P[percentile]) while his HR total jumped from [value] to [value].""",
+}
+
+
+# ============================================
+# Token 估算
+# ============================================
+
+_CJK = r'\u3000-\u9fff\uff00-\uffef'
+_TOKEN_PATTERN = re.compile(rf'[{_CJK}]|[A-Za-z]+|\d+|[^\sA-Za-z\d]')
+_CJK_PATTERN = re.compile(rf'[{_CJK}]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算 token 數（不需載入 tokenizer）
+
+    Llama 3 系列的經驗值：英文單字約 1.3 token，數字每 3 位 1 token，
+    標點 1 token，中日文字約 1.5 token。實際值以 Ollama 回報的 prompt_eval_count 為準
+    """
+
+    total = 0.0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if piece[0].isdigit():
+            total += math.ceil(len(piece) / 3)
+        elif piece[0].isascii() and piece[0].isalpha():
+            total += 1.3 if len(piece) > 3 else 1
+        elif _CJK_PATTERN.match(piece):
+            total += 1.5
+        else:
+            total += 1
+    return int(math.ceil(total))
+
+
+# ============================================
+# 統計挑選
+# ============================================
+
+def format_value(value) -> str:
+    """統計值格式化（比率取 3 位小數並去除尾端 0，大數值取 1 位）"""
+    if isinstance(value, float):
+        return f"{value:.3f}".rstrip('0').rstrip('.') if abs(value) < 10 else f"{value:.1f}"
+    return str(value)
+
+
+def _is_present(value) -> bool:
+    """略過 None / NaN / 以 0 填補的欄位"""
+    if value is None or isinstance(value, (str, bytes)):
+        return False
+    try:
+        return value == value and float(value) != 0
+    except (TypeError, ValueError):
+        return False
+
+
+def select_relevant_stats(stats: Dict, query: str, player_type: str, limit: int = MAX_FACTUAL_STATS) -> List[Tuple[str, object]]:
+    """
+    依相關性挑選統計
+
+    Args:
+        stats: {欄位名稱: 值}（不含 stat_ 前綴）
+        query: 使用者查詢（用來偵測被問到的統計）
+        player_type: batter / pitcher
+
+    Returns:
+        [(顯示名稱, 值), ...]，查詢提到的統計排第一
+    """
+
+    wanted: List[List[str]] = []
+
+    stat_key = match_stat(query)
+    if stat_key is not None:
+        wanted.append(STAT_REGISTRY[stat_key]['columns'])
+
+    for name in CORE_STATS.get(player_type, []):
+        entry = next(
+            (e for k, e in STAT_REGISTRY.items() if stat_display_name(k) == name and e['type'] == player_type),
+            None
+        )
+        wanted.append(entry['columns'] if entry else [name])
+
+    selected = []
+    seen = set()
+    for columns in wanted:
+        column = next((c for c in columns if c in stats and _is_present(stats[c])), None)
+        if column is None or column in seen:
+            continue
+        seen.add(column)
+        selected.append((columns[0], stats[column]))
+        if len(selected) >= limit:
+            break
+
+    return selected
+
+
+# ============================================
+# Prompt Builder
+# ============================================
+
+class PromptBuilder:
+    """
+    各路由的 prompt 組裝器
+
+    每個方法回傳 (system, prompt)：
+        system → 傳給 Ollama 的 system 欄位（固定內容，可被 KV cache 重用）
+        prompt → 動態內容，已裁切到路由的 token 預算內
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = dict(TOKEN_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+
+        self.system_tokens = {route: estimate_tokens(text) for route, text in SYSTEM_PROMPTS.items()}
+        self.usage: Dict[str, Dict[str, int]] = {}
+
+    # ---------- 預算 ----------
+
+    def _fit(self, route: str, head: List[str], body: List[str], tail: List[str], keep_order: bool = False) -> str:
+        """
+        組合 head + body + tail，超出預算時由 body 尾端開始刪除
+
+        body 需依重要性排序（最重要的在前）；keep_order=True 時保留的行依原本的相反順序輸出
+        （Analysis：依新到舊挑選，輸出時還原為時間順序）
+        """
+
+        budget = self.budgets.get(route)
+        fixed = estimate_tokens("\n".join(head + tail))
+        kept = []
+        used = fixed
+        dropped = 0
+
+        for line in body:
+            cost = estimate_tokens(line) + 1
+            if budget is not None and used + cost > budget and kept:
+                dropped += 1
+                continue
+            kept.append(line)
+            used += cost
+
+        if keep_order:
+            kept.reverse()
+        prompt = "\n".join(head + kept + tail)
+        self._record(route, estimate_tokens(prompt), dropped)
+        return prompt
+
+    def _record(self, route: str, tokens: int, dropped: int):
+        usage = self.usage.setdefault(route, {
+            'calls': 0, 'estimated_tokens': 0, 'dropped_lines': 0,
+            'actual_calls': 0, 'actual_tokens': 0,
+        })
+        usage['calls'] += 1
+        usage['estimated_tokens'] += tokens
+        usage['dropped_lines'] += dropped
+
+    def record_actual(self, route: str, prompt_eval_count: Optional[int]):
+        """記錄 Ollama 回報的實際 prompt token 數（含 system；命中 KV cache 時會較少）"""
+        if route not in self.usage or prompt_eval_count is None:
+            return
+        self.usage[route]['actual_calls'] += 1
+        self.usage[route]['actual_tokens'] += int(prompt_eval_count)
+
+    def report(self) -> Dict[str, Dict]:
+        """各路由平均 token 數"""
+        report = {}
+        for route, usage in self.usage.items():
+            report[route] = {
+                'calls': usage['calls'],
+                'avg_prompt_tokens': usage['estimated_tokens'] / max(usage['calls'], 1),
+                'system_tokens': self.system_tokens.get(route, 0),
+                'budget': self.budgets.get(route),
+                'dropped_lines': usage['dropped_lines'],
+                'avg_actual_tokens': (
+                    usage['actual_tokens'] / usage['actual_calls'] if usage['actual_calls'] else None
+                ),
+            }
+        return report
+
+    # ---------- 各路由 ----------
+
+    def classify(self, query: str) -> Tuple[str, str]:
+        prompt = self._fit('classify', [f'Query: "{query}"'], [], ["Type:"])
+        return SYSTEM_PROMPTS['classify'], prompt
+
+    def factual(self, query: str, player: Dict) -> Tuple[str, str]:
+        """player：LanceDB 搜尋結果（含 stat_ 欄位）"""
+
+        stats = {k[len('stat_'):]: v for k, v in player.items() if k.startswith('stat_')}
+        selected = select_relevant_stats(stats, query, player.get('type', 'batter'))
+
+        head = [
+            f"Query: {query}",
+            f"Player: {player['player_name']} ({player['team']}, {player['season']}, "
+            f"{player.get('position', 'N/A')}, {player.get('type', '')})",
+            "Statistics:",
+        ]
+        body = [f"- {name}: {format_value(value)}" for name, value in selected]
+        return SYSTEM_PROMPTS['factual'], self._fit('factual', head, body, ["Answer:"])
+
+    def ranking(self, query: str, ranking_results: Dict) -> Tuple[str, str]:
+        is_team_ranking = ranking_results.get('source') == 'team_cube'
+
+        seasons = ranking_results.get('seasons') or []
+        scope = f"{min(seasons)}-{max(seasons)}" if len(seasons) > 1 else (str(seasons[0]) if seasons else "")
+        filters = {k: v for k, v in ranking_results.get('filters', {}).items() if v is not None}
+        if filters:
+            scope += " " + ", ".join(f"{k}={v}" for k, v in filters.items())
+
+        body = []
+        for r in ranking_results['results']:
+            label = r['name'] if is_team_ranking else f"{r['name']} ({r['team']})"
+            line = f"{r['rank']}. {label} - {format_value(r['stat_value'])}"
+            if r.get('percentile') is not None:
+                line += f" (P{r['percentile']:.0f}"
+                line += f", YoY {r['yoy']:+.3g})" if r.get('yoy') is not None else ")"
+            body.append(line)
+
+        head = [
+            f"Query: {query}",
+            f"Top {'Teams' if is_team_ranking else 'Players'} by {ranking_results['stat_name']} ({scope.strip()}):",
+        ]
+        if ranking_results.get('partial'):
+            # 交易球員未計入球隊合計：要求回答說明數字為下限
+            head.insert(1, f"Note: team totals exclude {ranking_results['excluded_players']} players traded "
+                           f"mid-season (no per-team split), so values are lower bounds. State this in the answer.")
+        return SYSTEM_PROMPTS['ranking'], self._fit('ranking', head, body, ["Answer:"])
+
+    def analysis(self, query: str, player_name: str, stats_over_time: List[Dict]) -> Tuple[str, str]:
+        """賽季由新到舊挑選，超出預算時捨棄最舊的賽季"""
+
+        season_lines = []
+        for season_data in stats_over_time:
+            stats = season_data['stats'] or {}
+            derived = season_data.get('derived', {})
+            parts = []
+            for name in ANALYSIS_STATS.get(season_data['type'], []):
+                value = stats.get(name)
+                if value is None:
+                    continue
+                part = f"{name} {format_value(value)}"
+                values = derived.get(name, {})
+                extras = []
+                if 'rank' in values:
+                    extras.append(f"#{values['rank']:.0f}")
+                if 'pct' in values:
+                    extras.append(f"P{values['pct']:.0f}")
+                if 'yoy' in values:
+                    extras.append(f"YoY {values['yoy']:+.3g}")
+                if extras:
+                    part += f" ({', '.join(extras)})"
+                parts.append(part)
+            season_lines.append(f"{season_data['season']} {season_data['team']}: {', '.join(parts) or 'N/A'}")
+
+        head = [f"Query: {query}", f"Player: {player_name}", "Performance Over Time:"]
+        prompt = self._fit('analysis', head, list(reversed(season_lines)), ["Answer:"], keep_order=True)
+        return SYSTEM_PROMPTS['analysis'], prompt
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    print("=" * 80)
+    print("測試 Prompt Builder")
+    print("=" * 80)
+
+    builder = PromptBuilder()
+
+    player = {
+        'player_name': 'Aaron Judge', 'team': 'NYY', 'season': 2024, 'position': 'OF', 'type': 'batter',
+        'stat_wRC+': 220.0, 'stat_OPS': 1.159, 'stat_HR': 58, 'stat_AVG': 0.322, 'stat_OBP': 0.458,
+        'stat_SLG': 0.701, 'stat_RBI': 144, 'stat_WAR': 10.8, 'stat_PA': 704, 'stat_CS': 0, 'stat_GDP': 0.0,
+        'stat_SH': 0, 'stat_SF': 0, 'stat_IBB': 20, 'stat_HBP': 9, 'stat_SB': 10,
+    }
+
+    for query in ["Aaron Judge 2024 wRC+ 是多少？", "How many stolen bases did Aaron Judge have?"]:
+        system, prompt = builder.factual(query, player)
+        print(f"\n[system {estimate_tokens(system)} tokens]\n{prompt}")
+        print(f"  → 動態 prompt 約 {estimate_tokens(prompt)} tokens")
+
+    stats_over_time = [
+        {'season': s, 'team': 'NYY', 'type': 'batter',
+         'stats': {'wRC+': 150 + i * 10, 'OPS': 0.9 + i * 0.05, 'HR': 30 + i * 5},
+         'derived': {'wRC+': {'rank': 10 - i, 'pct': 90 + i, 'yoy': 10.0}}}
+        for i, s in enumerate(range(2010, 2025))
+    ]
+    system, prompt = builder.analysis("Why is Aaron Judge so good?", "Aaron Judge", stats_over_time)
+    print(f"\n{prompt}")
+
+    print("\n📊 Token 使用：")
+    for route, usage in builder.report().items():
+        print(f"  {route}: {usage}")
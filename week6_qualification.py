@@ -0,0 +1,209 @@
+"""
+Week 6: 賽季感知的規定打席 / 規定局數
+建置階段依 (season, team) 的球隊出賽場次一次算好資格旗標，存成布林欄位
+
+原本：排名路徑寫死 PA >= 100 / IP >= 20，每次查詢用 lambda 逐列判斷
+      → 不是 MLB 的規定門檻，2020 短賽季與進行中的賽季也不適用
+現在：MLB 規定 = 每場球隊比賽 3.1 PA（打者）/ 1.0 IP（投手）
+      球隊場次依 (season, team) 估算，門檻 = 比率 × 球隊場次
+      結果存成 qual_<名稱> 布林欄位，排名查詢直接當遮罩使用
+
+球隊場次估算：
+    同一 (season, team) 球員的最大出賽數 G（每日先發球員接近全勤），
+    以該賽季的表定場次為上限；進行中的賽季自然得到目前已賽場次。
+    交易後合併的列（"- - -" / "2 Tms"）使用該賽季所有球隊的最大值。
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+# ============================================
+# 配置
+# ============================================
+
+# 各賽季表定場次（未列出的賽季為 162）
+SCHEDULE_GAMES = {
+    2020: 60,
+}
+DEFAULT_SCHEDULE_GAMES = 162
+
+# 每場球隊比賽所需的 PA（打者）/ IP（投手）
+# 'qualified' 為 MLB 規定門檻，其餘為自訂門檻（可於建置時覆寫 / 增加）
+QUALIFICATION_THRESHOLDS = {
+    'qualified': {'batter': 3.1, 'pitcher': 1.0},
+    'half': {'batter': 1.55, 'pitcher': 0.5},
+    'reliever': {'batter': None, 'pitcher': 0.1},
+}
+DEFAULT_QUALIFIER = 'qualified'
+
+# 非單一球隊的列（賽季中被交易的合併數據）
+MULTI_TEAM_CODES = {'- - -', '---', 'TOT'}
+
+TEAM_GAMES_COLUMN = 'team_games'
+
+
+def merge_thresholds(
+    thresholds: Optional[Dict[str, Dict[str, Optional[float]]]] = None
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """自訂門檻與 QUALIFICATION_THRESHOLDS 合併（自訂的同名門檻優先）"""
+    merged = dict(QUALIFICATION_THRESHOLDS)
+    if thresholds:
+        merged.update(thresholds)
+    return merged
+
+
+def qual_column(name: str) -> str:
+    """資格旗標欄位名稱"""
+    return f"qual_{name}"
+
+
+def ip_to_innings(ip) -> np.ndarray:
+    """棒球記法局數轉成實際局數（180.1 → 180.333）"""
+    ip = np.asarray(ip, dtype=np.float64)
+    whole = np.floor(ip)
+    return whole + np.round((ip - whole) * 10) / 3
+
+
+def _numeric(wide: pd.DataFrame, column: str) -> np.ndarray:
+    if column not in wide.columns:
+        return np.full(len(wide), np.nan)
+    return pd.to_numeric(wide[column], errors='coerce').to_numpy(dtype=np.float64)
+
+
+def is_multi_team(teams: pd.Series) -> np.ndarray:
+    """是否為交易後的合併列（"- - -" / "2 Tms"）"""
+    teams = teams.astype(str).str.strip()
+    return (teams.isin(MULTI_TEAM_CODES) | teams.str.contains(r'\d\s*Tms', regex=True)).to_numpy()
+
+
+# ============================================
+# 球隊場次
+# ============================================
+
+def compute_team_games(wide: pd.DataFrame) -> np.ndarray:
+    """
+    估算每一列所屬 (season, team) 的球隊場次
+
+    Returns:
+        與 wide 等長的 float 陣列
+    """
+
+    seasons = wide['season'].to_numpy(dtype=np.int64)
+    schedule = np.array([SCHEDULE_GAMES.get(int(s), DEFAULT_SCHEDULE_GAMES) for s in np.unique(seasons)])
+    schedule_by_row = pd.Series(schedule, index=np.unique(seasons)).reindex(seasons).to_numpy(dtype=np.float64)
+
+    games = pd.Series(_numeric(wide, 'stat_G'), index=wide.index)
+    multi_team = is_multi_team(wide['team'])
+
+    # 單一球隊列：依 (season, team) 取最大 G
+    single = games.where(~multi_team)
+    team_max = single.groupby([wide['season'], wide['team']]).transform('max').to_numpy()
+
+    # 合併列：依 season 取所有單一球隊列的最大 G
+    season_max = single.groupby(wide['season']).transform('max').to_numpy()
+    team_games = np.where(multi_team, season_max, team_max)
+
+    # 缺 G 的賽季使用表定場次；不超過表定場次
+    team_games = np.where(np.isnan(team_games) | (team_games <= 0), schedule_by_row, team_games)
+    return np.minimum(team_games, schedule_by_row)
+
+
+# ============================================
+# 資格旗標
+# ============================================
+
+def compute_qualification_flags(
+    wide: pd.DataFrame,
+    thresholds: Optional[Dict[str, Dict[str, Optional[float]]]] = None
+) -> pd.DataFrame:
+    """
+    計算資格旗標（向量化）
+
+    Args:
+        wide: 攤平後的寬表（需含 season, team, type, stat_PA / stat_IP / stat_G）
+        thresholds: 自訂門檻，會與 QUALIFICATION_THRESHOLDS 合併
+                    例如 {'min_2pa': {'batter': 2.0, 'pitcher': None}}
+
+    Returns:
+        DataFrame（與 wide 同 index）：team_games + qual_<名稱> 布林欄位
+    """
+
+    all_thresholds = merge_thresholds(thresholds)
+
+    team_games = compute_team_games(wide)
+    types = wide['type'].astype(str).to_numpy()
+    pa = np.nan_to_num(_numeric(wide, 'stat_PA'))
+    innings = ip_to_innings(np.nan_to_num(_numeric(wide, 'stat_IP')))
+
+    is_batter = types == 'batter'
+    is_pitcher = types == 'pitcher'
+
+    flags = {TEAM_GAMES_COLUMN: team_games.astype(np.float32)}
+    for name, rates in all_thresholds.items():
+        flag = np.zeros(len(wide), dtype=bool)
+        if rates.get('batter') is not None:
+            flag |= is_batter & (pa >= rates['batter'] * team_games)
+        if rates.get('pitcher') is not None:
+            flag |= is_pitcher & (innings >= rates['pitcher'] * team_games)
+        flags[qual_column(name)] = flag
+
+    return pd.DataFrame(flags, index=wide.index)
+
+
+def add_qualification_flags(
+    wide: pd.DataFrame,
+    thresholds: Optional[Dict[str, Dict[str, Optional[float]]]] = None
+) -> pd.DataFrame:
+    """在寬表加上 team_games 與 qual_ 欄位（已存在的欄位會被覆寫）"""
+
+    flags = compute_qualification_flags(wide, thresholds)
+    wide = wide.drop(columns=[c for c in flags.columns if c in wide.columns])
+    return pd.concat([wide, flags], axis=1)
+
+
+def qualification_rate(
+    qualifier: str,
+    player_type: str,
+    thresholds: Optional[Dict[str, Dict[str, Optional[float]]]] = None
+) -> Optional[float]:
+    """
+    取得每場球隊比賽所需的 PA / IP（不存在則 None）
+
+    thresholds 為呼叫端的門檻表（通常是 merge_thresholds 的結果）；None 時使用 QUALIFICATION_THRESHOLDS
+    """
+    table = QUALIFICATION_THRESHOLDS if thresholds is None else thresholds
+    return table.get(qualifier, {}).get(player_type)
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import json
+    import os
+
+    from week6_derived_metrics import flatten_documents
+
+    docs_file = "./mlb_data/mlb_documents.json"
+
+    print("=" * 80)
+    print("測試規定打席 / 規定局數")
+    print("=" * 80)
+
+    if not os.path.exists(docs_file):
+        print(f"❌ 找不到數據文件：{docs_file}")
+        exit(1)
+
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+
+    wide = add_qualification_flags(flatten_documents(docs_df))
+
+    summary = wide.groupby(['season', 'type'])[[qual_column(n) for n in QUALIFICATION_THRESHOLDS]].sum()
+    print(summary.to_string())
+
+    team_games = wide.groupby('season')[TEAM_GAMES_COLUMN].max()
+    print(f"\n各賽季球隊場次（最大值）：{team_games.to_dict()}")
@@ -0,0 +1,566 @@
+"""
+Week 6: MLB Assistant HTTP 查詢服務（asyncio）
+在同一份引擎（embedding 模型、LanceDB、語料、排名引擎）上提供 HTTP API，取代只能單人使用的 Streamlit demo
+
+API：
+    POST /query            {"query": "..."} → mlb_assistant 完整結果（GET /query?q=... 亦可）
+    GET  /query/stream?q=  SSE：meta（分類 / 檢索結果）→ token × N → done
+                           串流驗證發現錯誤數字時送出 retract，再送出重新生成 / 模板的完整 answer
+    GET  /rank?q=&top_n=5  排名引擎（不經過 LLM）
+    GET  /player/{name}    球員多賽季數據（時間軸索引）
+    GET  /health           程序 / LLM 排程器 / 進行中請求狀態
+
+執行模型：
+    - 事件迴圈只負責解析 HTTP 與轉送串流內容，不做任何阻塞工作
+    - CPU 工作（encode、pandas 排名、時間軸查詢）→ cpu_executor（執行緒數 ≈ CPU 核心數）
+    - 等待 LLM 的工作 → llm_executor（執行緒只在等待 Ollama，數量可以大很多）；
+      沿用 week2 的排程器 / single-flight / cassette，串流內容以 call_soon_threadsafe 送回事件迴圈
+    - 用戶端中途斷線 → 停止讀取上游串流（single-flight 最後一位訂閱者離開時關閉 Ollama 連線）
+
+多程序（SERVICE_WORKERS > 1，僅限支援 fork 的系統）：
+    主程序先載入引擎（語料 + 索引，不開啟 LanceDB / embedding 模型）並綁定 socket，gc.freeze() 後再 fork；
+    所有 worker 共用同一個 listening socket，
+    語料為 mmap 的欄式陣列（week6_corpus_store.py），所有 worker 共用同一份 page cache
+    LanceDB 與 embedding 模型在 fork 之後由各 worker 開啟（兩者都有背景執行緒，跨 fork 可能死結）；
+    建議同時設定 EMBEDDING_SOCKET 使用 week6_embedding_sidecar.py，否則每個 worker 各載入一份模型
+    注意：LLM 排程器的名額是每個 worker 各自計算，總並行數 = workers × LLM_MAX_CONCURRENCY
+
+執行：
+    python week6_query_service.py
+    SERVICE_PORT=8080 SERVICE_WORKERS=4 OLLAMA_HOST=http://localhost:11500 python week6_query_service.py
+    curl -N "http://localhost:8080/query/stream?q=Aaron%20Judge%202024%20wRC%2B"
+"""
+
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# ============================================
+# 配置（可用環境變數覆寫）
+# ============================================
+
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "0.0.0.0")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", "1"))
+CPU_THREADS = int(os.environ.get("SERVICE_CPU_THREADS", str(os.cpu_count() or 1)))
+LLM_THREADS = int(os.environ.get("SERVICE_LLM_THREADS", "32"))
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 15
+
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+# ============================================
+# 引擎載入（fork 前執行）
+# ============================================
+
+def preload_engine(open_vector_search: bool = True):
+    """
+    載入 week2 引擎（語料、排名引擎、時間軸索引；open_vector_search=True 時也開啟 LanceDB 與模型）
+
+    多 worker 時 open_vector_search=False：fork 前不能有 LanceDB / torch 的執行緒，由 open_worker 在 fork 後開啟
+    """
+
+    if not open_vector_search:
+        os.environ["VECTOR_SEARCH_LAZY"] = "1"
+    import week2_mlb_assistant as engine
+
+    if open_vector_search:
+        open_worker(engine)
+    return engine
+
+
+def open_worker(engine):
+    """在目前程序開啟 LanceDB 與 embedding 模型，並先做一次 encode（模型的延遲初始化不落在第一個請求）"""
+    _, model = engine.open_vector_search()
+    model.encode("warmup")
+
+# ============================================
+# HTTP 基本功能
+# ============================================
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """已解析的 HTTP 請求"""
+
+    def __init__(self, method: str, target: str, version: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        self.body = body
+        parts = urlsplit(target)
+        self.path = unquote(parts.path)
+        self.params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def json(self) -> Dict:
+        if not self.body:
+            return {}
+        try:
+            payload = json.loads(self.body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise HTTPError(400, "請求內容不是有效的 JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "請求內容必須是 JSON 物件")
+        return payload
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """讀取一個請求；連線已關閉（或 keep-alive 逾時）回傳 None"""
+
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "標頭過長")
+    if len(head) > MAX_HEADER_BYTES:
+        raise HTTPError(400, "標頭過長")
+
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "無效的請求行")
+
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPError(400, "無效的 Content-Length")
+    if length < 0:
+        raise HTTPError(400, "無效的 Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "請求內容過大")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, version, headers, body)
+
+
+def _json_default(value):
+    """numpy 純量 / 陣列、pandas Timestamp 等"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(payload) -> str:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default)
+
+
+def response_bytes(status: int, payload, keep_alive: bool) -> bytes:
+    body = dumps(payload).encode('utf-8')
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode('latin-1') + body
+
+
+SSE_HEADERS = (
+    "HTTP/1.1 200 OK\r\n"
+    "Content-Type: text/event-stream; charset=utf-8\r\n"
+    "Cache-Control: no-cache\r\n"
+    "X-Accel-Buffering: no\r\n"
+    "Connection: close\r\n\r\n"
+).encode('latin-1')
+
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {dumps(data)}\n\n".encode('utf-8')
+
+# ============================================
+# 串流回答（在 llm_executor 執行緒中執行的同步產生器）
+# ============================================
+
+def answer_plan(engine, query: str, retrieval: Dict) -> Dict:
+    """
+    依路由準備生成所需的內容（與 week2 的 generate_*_answer 相同的 prompt / 驗證資料 / 模板）
+
+    Returns:
+        {'route', 'data', 'system', 'prompt', 'max_tokens', 'verify_data', 'template'}
+        沒有資料時 prompt 為 None，answer 為固定訊息
+    """
+
+    query_type = retrieval['query_type']
+
+    if query_type == 'ranking':
+        ranking_results = retrieval['ranking_results']
+        if not ranking_results['results']:
+            return {'route': 'ranking', 'data': ranking_results, 'prompt': None,
+                    'answer': "抱歉，找不到符合條件的球員。"}
+        system, prompt = engine.prompt_builder.ranking(query, ranking_results)
+        return {'route': 'ranking', 'data': ranking_results, 'system': system, 'prompt': prompt,
+                'max_tokens': 200, 'verify_data': ranking_results,
+                'template': lambda: engine.ranking_template(ranking_results)}
+
+    search_results = retrieval['vector_results'] or []
+
+    if query_type == 'analysis':
+        if not search_results:
+            return {'route': 'analysis', 'data': None, 'prompt': None,
+                    'answer': '抱歉，找不到相關球員數據。'}
+        player_name = search_results[0]['player_name']
+        stats_over_time = engine.player_index.get_stats_over_time(player_name)
+        system, prompt = engine.prompt_builder.analysis(query, player_name, stats_over_time)
+        return {'route': 'analysis',
+                'data': {'player_name': player_name, 'stats_over_time': stats_over_time},
+                'system': system, 'prompt': prompt, 'max_tokens': 250, 'verify_data': None,
+                'template': lambda: engine.analysis_template(player_name, stats_over_time)}
+
+    data = {'top_result': search_results[0] if search_results else None, 'all_results': search_results}
+    if not search_results:
+        return {'route': 'factual', 'data': data, 'prompt': None,
+                'answer': "抱歉，我找不到相關的球員數據。"}
+    system, prompt = engine.prompt_builder.factual(query, search_results[0])
+    return {'route': 'factual', 'data': data, 'system': system, 'prompt': prompt,
+            'max_tokens': 150, 'verify_data': {'top_result': search_results[0]},
+            'template': lambda: engine.factual_template(query, search_results[0])}
+
+
+def stream_answer_events(engine, query: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    分類 → 檢索 → 串流生成，逐一產生 SSE 事件 (event, data)
+
+    meta → token × N → done
+    錯誤數字：token … → retract → answer（限制 prompt 重新生成，仍失敗則模板）→ done
+    LLM 不可用：answer（模板）→ done
+    """
+
+    start = time.perf_counter()
+    with engine.llm_scheduler.request_context(priority=engine.PRIORITY_INTERACTIVE):
+        retrieval = engine.classify_and_retrieve(query)
+        plan = answer_plan(engine, query, retrieval)
+        yield 'meta', {
+            'query': query,
+            'query_type': retrieval['query_type'],
+            'data': plan['data'],
+            'timings': {'classify_ms': retrieval['classify_ms'], 'retrieve_ms': retrieval['retrieve_ms']},
+        }
+
+        if plan['prompt'] is None:
+            yield 'answer', {'text': plan['answer'], 'fallback': False}
+            yield 'done', {'total_ms': (time.perf_counter() - start) * 1000}
+            return
+
+        engine.fact_check_stats['generations'] += 1
+        verifier = engine.StreamingFactVerifier(plan['verify_data'], reference_texts=[plan['prompt']])
+        answer = None
+        try:
+            chunks = engine.call_llm_stream(plan['prompt'], plan['max_tokens'], plan['system'], plan['route'])
+            for chunk in engine.verify_stream(chunks, verifier):
+                yield 'token', {'text': chunk}
+        except engine.FactViolation as e:
+            engine.fact_check_stats['aborted'] += 1
+            yield 'retract', {'number': e.number, 'context': e.context}
+            try:
+                answer = {'text': engine.regenerate_constrained(
+                    plan['prompt'], plan['max_tokens'], plan['system'], plan['route'], plan['verify_data']),
+                    'fallback': False}
+            except (engine.FactViolation, engine.LLMUnavailable):
+                answer = {'text': plan['template'](), 'fallback': True}
+        except engine.LLMUnavailable as e:
+            answer = {'text': plan['template'](), 'fallback': True, 'reason': e.reason}
+
+        if answer is not None:
+            yield 'answer', answer
+        yield 'done', {'total_ms': (time.perf_counter() - start) * 1000}
+
+# ============================================
+# 服務
+# ============================================
+
+_DONE = object()
+
+
+class QueryService:
+    """
+    路由與執行器
+
+    handle(request) → (status, payload)；串流路由由 stream(request, writer) 直接寫入
+    """
+
+    def __init__(self, engine, cpu_threads: int = CPU_THREADS, llm_threads: int = LLM_THREADS):
+        self.engine = engine
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_threads, thread_name_prefix="svc-cpu")
+        self.llm_executor = ThreadPoolExecutor(max_workers=llm_threads, thread_name_prefix="svc-llm")
+        self.started_at = time.time()
+        self.stats = {'requests': 0, 'in_flight': 0, 'streams': 0, 'errors': 0, 'disconnects': 0}
+
+    async def run_cpu(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, fn, *args)
+
+    async def run_llm(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.llm_executor, fn, *args)
+
+    async def iterate_in_thread(self, make_iter: Callable[[], Iterator]):
+        """
+        在 llm_executor 執行緒中迭代同步產生器，逐項交給事件迴圈
+
+        消費端提前結束（用戶端斷線）→ 執行緒在下一項停止並關閉產生器（連帶關閉上游串流）
+        """
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def pump():
+            iterator = make_iter()
+            try:
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                iterator.close()
+                loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+        self.llm_executor.submit(pump)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    # ---------- 路由 ----------
+
+    async def handle(self, request: Request) -> Tuple[int, Dict]:
+        path = request.path.rstrip("/") or "/"
+
+        if path == "/health":
+            return 200, self.health()
+        if path == "/query":
+            if request.method not in ("GET", "POST"):
+                raise HTTPError(405, "只支援 GET / POST")
+            return 200, await self.query(self._query_text(request))
+        if path == "/rank":
+            self._require_get(request)
+            return 200, await self.rank(self._query_text(request), request.params.get('top_n', '5'))
+        if path.startswith("/player/"):
+            self._require_get(request)
+            return 200, await self.player(path[len("/player/"):])
+        raise HTTPError(404, f"找不到路徑：{request.path}")
+
+    async def query(self, query: str) -> Dict:
+        return await self.run_llm(self.engine.mlb_assistant, query)
+
+    async def rank(self, query: str, top_n: str) -> Dict:
+        try:
+            top_n = max(1, min(int(top_n), 100))
+        except ValueError:
+            raise HTTPError(400, "top_n 必須是整數")
+        return await self.run_cpu(self.engine.ranking_search, query, top_n)
+
+    async def player(self, name: str) -> Dict:
+        name = name.strip()
+        if not name:
+            raise HTTPError(400, "缺少球員名字")
+        seasons = await self.run_cpu(self.engine.player_index.get_stats_over_time, name)
+        if not seasons:
+            raise HTTPError(404, f"找不到球員：{name}")
+        return {'player_name': name, 'stats_over_time': seasons}
+
+    def health(self) -> Dict:
+        return {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'service': dict(self.stats),
+            'llm_scheduler': self.engine.llm_scheduler.snapshot(),
+            'fact_check': dict(self.engine.fact_check_stats),
+        }
+
+    async def stream(self, request: Request, writer: asyncio.StreamWriter):
+        """GET /query/stream?q=...（SSE，送完後關閉連線）"""
+
+        self._require_get(request)
+        query = self._query_text(request)
+        self.stats['streams'] += 1
+
+        writer.write(SSE_HEADERS)
+        try:
+            async for event, data in self.iterate_in_thread(lambda: stream_answer_events(self.engine, query)):
+                writer.write(sse_event(event, data))
+                await writer.drain()
+        except ConnectionError:
+            self.stats['disconnects'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            writer.write(sse_event('error', {'error': str(e)}))
+
+    # ---------- 輔助 ----------
+
+    @staticmethod
+    def _require_get(request: Request):
+        if request.method != "GET":
+            raise HTTPError(405, "只支援 GET")
+
+    @staticmethod
+    def _query_text(request: Request) -> str:
+        query = request.params.get('q') or request.params.get('query')
+        if query is None and request.method == "POST":
+            query = request.json().get('query')
+        if not query or not str(query).strip():
+            raise HTTPError(400, "缺少查詢（q 參數或 JSON 的 query 欄位）")
+        return str(query).strip()
+
+    # ---------- 連線 ----------
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    writer.write(response_bytes(e.status, {'error': e.message}, keep_alive=False))
+                    break
+                if request is None:
+                    break
+
+                self.stats['requests'] += 1
+                self.stats['in_flight'] += 1
+                try:
+                    if request.path.rstrip("/") == "/query/stream":
+                        await self.stream(request, writer)
+                        break
+                    status, payload = await self.handle(request)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': e.message}
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    status, payload = 500, {'error': str(e)}
+                finally:
+                    self.stats['in_flight'] -= 1
+
+                writer.write(response_bytes(status, payload, request.keep_alive))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            self.stats['disconnects'] += 1
+        finally:
+            writer.close()
+
+    def close(self):
+        self.cpu_executor.shutdown(wait=False)
+        self.llm_executor.shutdown(wait=False)
+
+# ============================================
+# 啟動（預先載入 → 綁定 → fork）
+# ============================================
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+async def serve_socket(engine, sock: socket.socket):
+    """單一 worker：在已綁定的 socket 上執行事件迴圈（執行器在 fork 之後才建立）"""
+
+    service = QueryService(engine)
+    server = await asyncio.start_server(service.serve_connection, sock=sock)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows
+
+    async with server:
+        await stop.wait()
+    service.close()
+
+
+def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, workers: int = SERVICE_WORKERS, engine=None):
+    """
+    啟動服務
+
+    engine 由呼叫端提供時，多 worker 模式需要是尚未開啟 LanceDB / 模型的引擎（VECTOR_SEARCH_LAZY=1）
+    """
+
+    multi_process = workers > 1 and hasattr(os, 'fork')
+    engine = engine or preload_engine(open_vector_search=not multi_process)
+    sock = bind_socket(host, port)
+    print(f"\n🚀 查詢服務：http://{host}:{sock.getsockname()[1]}（workers: {workers}）")
+
+    if not multi_process:
+        asyncio.run(serve_socket(engine, sock))
+        return
+
+    if not os.environ.get("EMBEDDING_SOCKET"):
+        print("  ⚠️  未設定 EMBEDDING_SOCKET：每個 worker 各載入一份 embedding 模型（建議使用 week6_embedding_sidecar.py）")
+
+    # 已載入的物件移出 GC 追蹤，避免 worker 的 GC 掃描觸發 copy-on-write
+    gc.freeze()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                open_worker(engine)
+                asyncio.run(serve_socket(engine, sock))
+            finally:
+                os._exit(0)
+        children.append(pid)
+        print(f"  ✅ worker {pid}")
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    serve()
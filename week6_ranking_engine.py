@@ -0,0 +1,564 @@
+"""
+Week 6: 排名引擎
+基於統計註冊表 + 列式儲存（CorpusStore 統計矩陣 / 攤平後的 stat_ 欄位）的排名查詢
+
+支援：
+1. 球隊 / 守備位置 / 年齡過濾
+2. 多賽季區間（"2022-2025 HR leaders"），依球員 group-by 聚合
+   - 累計統計：加總
+   - 比率統計：依 PA / IP 加權平均
+3. 比率統計的規定打席 / 局數（week6_qualification 預先算好的 qual_ 布林欄位）
+4. Top-k 使用 np.argpartition（部分排序）
+
+所有欄位在建立時轉成 NumPy 陣列，查詢只做布林遮罩 + bincount，維持毫秒等級
+"""
+
+import re
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+from week6_stat_registry import (
+    STAT_REGISTRY,
+    resolve_stat,
+    resolve_team,
+    resolve_position,
+    team_codes,
+    stat_display_name,
+)
+from week6_qualification import (
+    DEFAULT_QUALIFIER,
+    TEAM_GAMES_COLUMN,
+    add_qualification_flags,
+    compute_qualification_flags,
+    ip_to_innings,
+    merge_thresholds,
+    qual_column,
+    qualification_rate,
+)
+
+# ============================================
+# 配置
+# ============================================
+
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 50
+
+OUTFIELD_POSITIONS = {'OF', 'LF', 'CF', 'RF'}
+
+
+# ============================================
+# 查詢解析
+# ============================================
+
+def parse_seasons(query: str) -> Optional[List[int]]:
+    """
+    解析賽季範圍
+
+    "2022-2025" / "2022–2025" / "2022 to 2025" / "2022到2025" → [2022, 2023, 2024, 2025]
+    "2023 and 2024" → [2023, 2024]
+    無年份 → None（使用最新賽季）
+    """
+
+    range_match = re.search(r'(20\d{2})\s*(?:-|–|—|~|to|through|至|到)\s*(20\d{2})', query)
+    if range_match:
+        start, end = sorted((int(range_match.group(1)), int(range_match.group(2))))
+        return list(range(start, end + 1))
+
+    years = sorted({int(y) for y in re.findall(r'(?<!\d)(20\d{2})(?!\d)', query)})
+    return years or None
+
+
+def parse_top_n(query: str) -> Optional[int]:
+    """
+    解析 Top N（"top 10" / "前10名" / "10 best"）；查詢沒有指定時回傳 None（由呼叫端套用預設）
+
+    "N best" 只接受 1-2 位數，且前面不能是數字或縮寫年份的撇號（"2024 highest ERA" / "'24 best" 不是 Top N）
+    """
+
+    patterns = [
+        r'top\s*(\d+)',
+        r'前\s*(\d+)',
+        r"(?<![\d'’])(\d{1,2})\s*(?:best|leaders|highest|lowest)",
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, query.lower())
+        if match:
+            return max(1, min(int(match.group(1)), MAX_TOP_N))
+    return None
+
+
+def parse_age_range(query: str) -> Dict:
+    """解析年齡條件（"under 25" / "25歲以下" / "over 30" / "age <= 27"）"""
+
+    query_lower = query.lower()
+    result = {}
+
+    max_patterns = [
+        (r'(?:under|younger than|below)\s*(\d{2})', -1),
+        (r'(\d{2})\s*(?:and under|or younger)', 0),
+        (r'(\d{2})\s*歲以下', 0),
+        (r'age\s*<=\s*(\d{2})', 0),
+        (r'age\s*<\s*(\d{2})', -1),
+    ]
+    min_patterns = [
+        (r'(?:over|older than|above)\s*(\d{2})', 1),
+        (r'(\d{2})\s*(?:and over|or older)', 0),
+        (r'(\d{2})\s*歲以上', 0),
+        (r'age\s*>=\s*(\d{2})', 0),
+        (r'age\s*>\s*(\d{2})', 1),
+    ]
+
+    for pattern, offset in max_patterns:
+        match = re.search(pattern, query_lower)
+        if match:
+            result['max_age'] = int(match.group(1)) + offset
+            break
+
+    for pattern, offset in min_patterns:
+        match = re.search(pattern, query_lower)
+        if match:
+            result['min_age'] = int(match.group(1)) + offset
+            break
+
+    return result
+
+
+def parse_qualifier(query: str, position: Optional[str] = None) -> Optional[str]:
+    """
+    解析樣本門檻
+
+    "no minimum" / "all players" / "不限打席" → None（不設門檻）
+    "half qualified" / "半規定" → 'half'
+    救援投手 → 'reliever'（救援投手不可能達到每場 1.0 IP）
+    其餘 → 'qualified'（MLB 規定門檻）
+    """
+
+    query_lower = query.lower()
+    if re.search(r'no minimum|no qualif|unqualified|all players|不限|不設門檻', query_lower):
+        return None
+    if re.search(r'half[- ]qualified|半規定', query_lower):
+        return 'half'
+    if position == 'RP':
+        return 'reliever'
+    return DEFAULT_QUALIFIER
+
+
+def parse_ranking_query(query: str, default_top_n: int = DEFAULT_TOP_N) -> Dict:
+    """
+    將自然語言排名查詢解析成查詢規格
+
+    default_top_n：查詢沒有指定 N（"top 10" / "10 best"）時的筆數（例如 /rank 的 top_n 參數）
+
+    Returns:
+        {
+            'stat': str, 'entry': dict, 'player_type': str,
+            'seasons': List[int] | None, 'team': str | None, 'position': str | None,
+            'min_age': int | None, 'max_age': int | None, 'top_n': int,
+            'qualifier': str | None
+        }
+    """
+
+    stat_key, entry = resolve_stat(query)
+    position = resolve_position(query)
+
+    player_type = entry['type']
+    if position in ('SP', 'RP') and player_type != 'pitcher':
+        # "best starting pitchers" 等未指定統計的查詢
+        stat_key, entry = 'pitcher WAR', STAT_REGISTRY['pitcher WAR']
+        player_type = 'pitcher'
+
+    age_range = parse_age_range(query)
+
+    return {
+        'stat': stat_key,
+        'entry': entry,
+        'player_type': player_type,
+        'seasons': parse_seasons(query),
+        'team': resolve_team(query),
+        'position': position,
+        'min_age': age_range.get('min_age'),
+        'max_age': age_range.get('max_age'),
+        'top_n': parse_top_n(query) or default_top_n,
+        'qualifier': parse_qualifier(query, position),
+    }
+
+
+# ============================================
+# 排名引擎
+# ============================================
+
+def _encode(values) -> Tuple[np.ndarray, np.ndarray]:
+    """字串欄位 → (排序後的字典, int32 代碼)"""
+    vocab, codes = np.unique(pd.Series(values).fillna('').astype(str).to_numpy(dtype=str), return_inverse=True)
+    return vocab, codes.astype(np.int32)
+
+
+def _vocab_codes(vocab: np.ndarray, values: List[str]) -> np.ndarray:
+    """字典中符合 values 的代碼"""
+    return np.flatnonzero(np.isin(vocab, values))
+
+
+def _primary_positions(positions: pd.Series) -> np.ndarray:
+    """"SS/2B" → "SS"（多守位取第一個）"""
+    return positions.str.split(r'[/-]').str[0].str.upper().to_numpy(dtype=str)
+
+
+class RankingEngine:
+    """
+    排名引擎
+
+    輸入：CorpusStore（week6_corpus_store，服務用）或攤平後的寬表
+          （week6_derived_metrics.flatten_documents 或衍生指標檔，建置 / 測試用）
+    球員 / 球隊 / 類型 / 位置存成字典（固定寬度字串陣列）+ 整數代碼，不保留逐列的 Python 物件：
+    fork 出來的 worker 查詢時不會觸碰 refcount，stat 欄位直接是 CorpusStore 統計矩陣的 view（mmap 時共用分頁）
+    衍生指標檔已含 qual_ 欄位；語料 / 舊檔 / 原始寬表則在建立時補算一次
+    thresholds：自訂門檻（與 QUALIFICATION_THRESHOLDS 合併），單季遮罩與多賽季門檻使用同一份
+    """
+
+    def __init__(self, wide: Optional[pd.DataFrame] = None,
+                 thresholds: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                 corpus=None):
+        self.thresholds = merge_thresholds(thresholds)
+        if corpus is not None:
+            self._from_corpus(corpus, thresholds)
+        else:
+            self._from_wide(wide, thresholds)
+        self.size = len(self.seasons)
+
+        # 球員分組代碼（同名打者 / 投手分開）
+        self.player_codes = self.name_code.astype(np.int64) * max(len(self.type_names), 1) + self.type_code
+
+        self._type_masks = {str(t): self.type_code == code for code, t in enumerate(self.type_names)}
+        self._column_cache: Dict[str, np.ndarray] = {}
+
+        # 樣本量（PA / 實際局數）
+        self.pa = self._column('PA')
+        self.innings = ip_to_innings(np.nan_to_num(self._column('IP')))
+
+    def _from_wide(self, wide: pd.DataFrame, thresholds) -> None:
+        wide = wide.reset_index(drop=True)
+        if TEAM_GAMES_COLUMN not in wide.columns or thresholds or any(
+            qual_column(name) not in wide.columns for name in self.thresholds
+        ):
+            wide = add_qualification_flags(wide, thresholds)
+
+        self.player_names, self.name_code = _encode(wide['player_name'])
+        self.type_names, self.type_code = _encode(wide['type'])
+        self.team_names, self.team_code = _encode(wide['team'])
+        positions = wide['position'] if 'position' in wide.columns else pd.Series('N/A', index=wide.index)
+        self.position_names, self.position_code = _encode(_primary_positions(positions.astype(str)))
+
+        self.seasons = wide['season'].to_numpy(dtype=np.int64)
+        self.ages = pd.to_numeric(wide.get('age', pd.Series(np.nan, index=wide.index)), errors='coerce').to_numpy(dtype=np.float64)
+        self.doc_idx = wide['doc_idx'].to_numpy(dtype=np.int64) if 'doc_idx' in wide.columns else np.arange(len(wide))
+
+        self._stats = {
+            c[len('stat_'):]: pd.to_numeric(wide[c], errors='coerce').to_numpy(dtype=np.float64)
+            for c in wide.columns if c.startswith('stat_')
+        }
+        self._set_flags(wide)
+
+    def _from_corpus(self, corpus, thresholds) -> None:
+        arrays = corpus.arrays
+        self.player_names = corpus.player_names
+        self.name_code = np.repeat(np.arange(corpus.n_players, dtype=np.int32), np.diff(corpus.player_start))
+        self.type_names, self.type_code = arrays['type_names'], arrays['type_code']
+        self.team_names, self.team_code = arrays['team_names'], arrays['team_code']
+
+        # 主要守備位置：只在字典（數十個值）上計算，再以代碼對應
+        primary, vocab_map = _encode(_primary_positions(pd.Series(arrays['position_names'], dtype=str)))
+        self.position_names, self.position_code = primary, vocab_map[arrays['position_code']]
+
+        self.seasons = corpus.season
+        self.ages = arrays['age']
+        self.doc_idx = corpus.doc_idx
+
+        # 統計矩陣的欄位 view（不複製）
+        self._stats = {name: corpus.stats[:, i] for i, name in enumerate(corpus.stat_names)}
+
+        # 資格旗標：以暫時的寬表計算一次（team_games 需要 (season, team) 分組）
+        wide = pd.DataFrame({
+            'season': self.seasons,
+            'team': self.team_names[self.team_code],
+            'type': self.type_names[self.type_code],
+            **{f"stat_{name}": self._stats[name] for name in ('G', 'PA', 'IP') if name in self._stats},
+        })
+        self._set_flags(compute_qualification_flags(wide, thresholds))
+
+    def _set_flags(self, flags: pd.DataFrame) -> None:
+        """球隊場次與資格旗標（預先算好的布林遮罩）"""
+        self.team_games = flags[TEAM_GAMES_COLUMN].to_numpy(dtype=np.float64)
+        self._qual_masks = {
+            c[len('qual_'):]: flags[c].to_numpy(dtype=bool)
+            for c in flags.columns if c.startswith('qual_')
+        }
+
+    # ---------- 欄位存取 ----------
+
+    def _column(self, name: str) -> np.ndarray:
+        """取得 stat_ 欄位的 float 陣列（不存在則全為 NaN）"""
+        if name not in self._column_cache:
+            values = self._stats.get(name)
+            self._column_cache[name] = values if values is not None else np.full(self.size, np.nan)
+        return self._column_cache[name]
+
+    def _stat_values(self, entry: Dict) -> np.ndarray:
+        """依註冊表的候選欄位取第一個存在的欄位"""
+        for name in entry['columns']:
+            if name in self._stats:
+                return self._column(name)
+        return np.full(self.size, np.nan)
+
+    def _weights(self, entry: Dict) -> np.ndarray:
+        return self.innings if entry.get('weight') == 'IP' else np.nan_to_num(self.pa)
+
+    @staticmethod
+    def _needs_qualifier(entry: Dict, qualifier: Optional[str]) -> bool:
+        return entry.get('qualifier') == 'rate' and qualifier is not None
+
+    def _qualified(self, entry: Dict, qualifier: Optional[str]) -> np.ndarray:
+        """比率統計的樣本門檻（預先算好的布林遮罩）"""
+        if not self._needs_qualifier(entry, qualifier):
+            return np.ones(self.size, dtype=bool)
+        return self._qual_masks.get(qualifier, np.ones(self.size, dtype=bool))
+
+    # ---------- 過濾 ----------
+
+    def _filter_mask(self, spec: Dict, seasons: List[int]) -> np.ndarray:
+        mask = self._type_masks.get(spec['player_type'], np.zeros(self.size, dtype=bool)).copy()
+
+        mask &= np.isin(self.seasons, seasons)
+
+        if spec.get('team'):
+            mask &= np.isin(self.team_code, _vocab_codes(self.team_names, team_codes(spec['team'])))
+
+        position = spec.get('position')
+        if position in ('SP', 'RP'):
+            games = np.nan_to_num(self._column('G'))
+            starts = np.nan_to_num(self._column('GS'))
+            is_starter = starts * 2 >= np.maximum(games, 1)
+            mask &= is_starter if position == 'SP' else ~is_starter
+        elif position == 'OF':
+            mask &= np.isin(self.position_code, _vocab_codes(self.position_names, list(OUTFIELD_POSITIONS)))
+        elif position:
+            mask &= np.isin(self.position_code, _vocab_codes(self.position_names, [position]))
+
+        if spec.get('min_age') is not None:
+            mask &= self.ages >= spec['min_age']
+        if spec.get('max_age') is not None:
+            mask &= self.ages <= spec['max_age']
+
+        return mask
+
+    def latest_season(self, player_type: str) -> Optional[int]:
+        type_mask = self._type_masks.get(player_type)
+        if type_mask is None or not type_mask.any():
+            return None
+        return int(self.seasons[type_mask].max())
+
+    # ---------- Top-k ----------
+
+    @staticmethod
+    def _top_k(values: np.ndarray, k: int, higher_is_better: bool) -> np.ndarray:
+        """部分排序取前 k 名，回傳 values 的位置"""
+        if len(values) == 0:
+            return np.empty(0, dtype=np.int64)
+        score = values if higher_is_better else -values
+        k = min(k, len(score))
+        top = np.argpartition(-score, k - 1)[:k]
+        return top[np.argsort(-score[top], kind='stable')]
+
+    # ---------- 主查詢 ----------
+
+    def run(self, spec: Dict) -> Dict:
+        """
+        執行排名查詢
+
+        Args:
+            spec: parse_ranking_query 的輸出（可手動指定）
+
+        Returns:
+            {
+                'success': bool,
+                'query_type': 'ranking',
+                'stat_name': str,
+                'player_type': str,
+                'seasons': List[int],
+                'filters': dict,
+                'top_n': int,
+                'results': [{'rank', 'name', 'team', 'season', 'stat_value', 'stat_name', 'type', ...}],
+                'elapsed_ms': float
+            }
+        """
+
+        start_time = time.perf_counter()
+
+        entry = spec['entry']
+        stat_name = stat_display_name(spec['stat'])
+        seasons = spec.get('seasons') or [self.latest_season(spec['player_type'])]
+        top_n = spec.get('top_n', DEFAULT_TOP_N)
+        qualifier = spec.get('qualifier', DEFAULT_QUALIFIER)
+
+        values = self._stat_values(entry)
+        mask = self._filter_mask(spec, seasons) & ~np.isnan(values)
+        if not entry['higher_is_better']:
+            # 越低越好的統計：0 代表缺值（原始數據以 0 填補）
+            mask &= values > 0
+
+        if len(seasons) == 1:
+            results = self._rank_single_season(entry, values, mask, top_n, stat_name, qualifier)
+        else:
+            results = self._rank_multi_season(entry, values, mask, top_n, stat_name, seasons, qualifier)
+
+        return {
+            'success': True,
+            'query_type': 'ranking',
+            'stat_name': stat_name,
+            'player_type': spec['player_type'],
+            'seasons': seasons,
+            'filters': {
+                'team': spec.get('team'),
+                'position': spec.get('position'),
+                'min_age': spec.get('min_age'),
+                'max_age': spec.get('max_age'),
+            },
+            'qualifier': qualifier if self._needs_qualifier(entry, qualifier) else None,
+            'top_n': top_n,
+            'results': results,
+            'elapsed_ms': (time.perf_counter() - start_time) * 1000
+        }
+
+    def _rank_single_season(self, entry, values, mask, top_n, stat_name, qualifier) -> List[Dict]:
+        rows = np.flatnonzero(mask & self._qualified(entry, qualifier))
+        top = rows[self._top_k(values[rows], top_n, entry['higher_is_better'])]
+
+        return [
+            {
+                'rank': rank,
+                'name': str(self.player_names[self.name_code[i]]),
+                'team': str(self.team_names[self.team_code[i]]),
+                'season': int(self.seasons[i]),
+                'stat_value': float(values[i]),
+                'stat_name': stat_name,
+                'type': str(self.type_names[self.type_code[i]]),
+                'doc_idx': int(self.doc_idx[i]),
+            }
+            for rank, i in enumerate(top, 1)
+        ]
+
+    def _rank_multi_season(self, entry, values, mask, top_n, stat_name, seasons, qualifier) -> List[Dict]:
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return []
+
+        # 依 (球員, 賽季) 排序，讓每組最後一列為最近賽季
+        rows = rows[np.lexsort((self.seasons[rows], self.player_codes[rows]))]
+        _, group_start, inverse = np.unique(self.player_codes[rows], return_index=True, return_inverse=True)
+        group_last = np.append(group_start[1:], len(rows)) - 1
+        n_groups = len(group_start)
+
+        row_values = values[rows]
+        row_weights = self._weights(entry)[rows]
+        weight_total = np.bincount(inverse, weights=row_weights, minlength=n_groups)
+        season_count = np.bincount(inverse, minlength=n_groups)
+
+        if entry.get('aggregate') == 'weighted':
+            weighted_sum = np.bincount(inverse, weights=row_values * row_weights, minlength=n_groups)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                aggregated = weighted_sum / weight_total
+            valid = ~np.isnan(aggregated)
+            rate = (qualification_rate(qualifier, entry['type'], self.thresholds)
+                    if self._needs_qualifier(entry, qualifier) else None)
+            if rate is not None:
+                # 多賽季門檻：累計 PA / IP ≥ 比率 × 各列球隊場次總和
+                required = np.bincount(inverse, weights=rate * self.team_games[rows], minlength=n_groups)
+                valid &= weight_total >= required
+        else:
+            aggregated = np.bincount(inverse, weights=row_values, minlength=n_groups)
+            valid = np.ones(n_groups, dtype=bool)
+
+        candidates = np.flatnonzero(valid)
+        top = candidates[self._top_k(aggregated[candidates], top_n, entry['higher_is_better'])]
+
+        season_label = f"{min(seasons)}-{max(seasons)}"
+        results = []
+        for rank, g in enumerate(top, 1):
+            last_row = rows[group_last[g]]
+            results.append({
+                'rank': rank,
+                'name': str(self.player_names[self.name_code[last_row]]),
+                'team': str(self.team_names[self.team_code[last_row]]),
+                'season': season_label,
+                'stat_value': float(aggregated[g]),
+                'stat_name': stat_name,
+                'type': str(self.type_names[self.type_code[last_row]]),
+                'seasons_played': int(season_count[g]),
+            })
+        return results
+
+    def rank(self, query: str, top_n: Optional[int] = None) -> Dict:
+        """解析自然語言查詢並執行排名"""
+        return self.run(parse_ranking_query(query, top_n or DEFAULT_TOP_N))
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import json
+    import os
+
+    from week6_derived_metrics import flatten_documents
+
+    docs_file = "./mlb_data/mlb_documents.json"
+
+    print("=" * 80)
+    print("測試排名引擎")
+    print("=" * 80)
+
+    if not os.path.exists(docs_file):
+        print(f"❌ 找不到數據文件：{docs_file}")
+        exit(1)
+
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+
+    engine = RankingEngine(flatten_documents(docs_df))
+    print(f"✅ 排名引擎已建立：{engine.size} 筆")
+
+    # 語料陣列版本（服務使用）應與寬表版本相同
+    from week6_corpus_store import load_or_build_corpus
+    corpus_engine = RankingEngine(corpus=load_or_build_corpus(docs_file))
+
+    test_queries = [
+        "Who has the highest wRC+ in 2024?",
+        "Top 5 pitchers by ERA in 2024",
+        "2022-2025 HR leaders",
+        "Yankees top 3 OPS 2024",
+        "Best shortstops under 27 by WAR 2023",
+        "2024 年防禦率最低的先發投手前 10 名",
+        "Lowest ERA among relievers 2024",
+        "Highest OPS 2024 no minimum",
+        "2024 highest ERA",
+        "Best pitching WAR 2024",
+        "10 best hitters by wRC+ 2024",
+    ]
+
+    for query in test_queries:
+        result = engine.rank(query)
+        print(f"\n查詢：{query}")
+        print(f"  統計：{result['stat_name']}（{result['player_type']}）賽季：{result['seasons']} 過濾：{result['filters']} 門檻：{result['qualifier']}")
+        for r in result['results']:
+            print(f"    {r['rank']}. {r['name']} ({r['team']}, {r['season']}) - {r['stat_value']:.3f}")
+        print(f"  ⏱️  {result['elapsed_ms']:.2f} ms")
+        corpus_results = corpus_engine.rank(query)['results']
+        same = [(r['name'], r['stat_value']) for r in corpus_results] == [(r['name'], r['stat_value']) for r in result['results']]
+        print(f"  {'✅' if same else '⚠️ '} 語料陣列版本{'相同' if same else '不同（可能為同分排序）'}")
+
+    # 呼叫端的 top_n（/rank、ranking_search）只在查詢沒有指定 N 時套用
+    for query in ("10 best hitters by wRC+ 2024", "Who has the highest wRC+ in 2024?"):
+        print(f"\n{query}（top_n=3）→ {len(engine.rank(query, top_n=3)['results'])} 筆")
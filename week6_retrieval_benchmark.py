@@ -0,0 +1,386 @@
+"""
+Week 6: 檢索品質 vs 速度基準測試
+week1_test_retrieval.py 只有 10 筆手寫案例，也沒有量延遲；
+這裡由文檔自動產生數千筆有標註的查詢，量每個檢索器 / 索引配置的品質與速度
+
+查詢變體（標註 = 球員，有賽季時 = 球員 + 賽季）：
+    name              Aaron Judge
+    name_lower        aaron judge
+    last_name         Judge
+    name_no_accent    Jose Ramirez（原名有重音符號時）
+    name_season       Aaron Judge 2024
+    name_stat         Aaron Judge home runs
+    name_season_stat  Aaron Judge 2024 wRC+
+    name_zh_stat      Aaron Judge 的全壘打
+
+檢索器：
+    keyed             球員名字鍵值查找（正規化名字 / 姓氏 → 文檔，不需要 embedding）
+    vector            LanceDB 向量搜尋（有 ANN 索引時測試多組 nprobes / refine_factor）
+    fts               LanceDB 全文檢索
+    hybrid            week1 的 FTS 優先 + 向量補足
+
+指標：Recall@1/3/5/10、MRR@10、每筆查詢延遲 p50 / p95、QPS
+embedding 對所有查詢批次計算一次，單獨列出（向量檢索的延遲只含搜尋）
+最後輸出 Pareto 表（Recall@5 越高越好、p50 越低越好，沒有被其他配置同時勝過者標 ★）
+
+執行：
+    python week6_retrieval_benchmark.py [查詢數=2000]
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+DOCUMENTS_FILE = os.path.join(DATA_DIR, "mlb_documents.json")
+REPORT_FILE = os.path.join(DATA_DIR, "retrieval_benchmark.json")
+
+RECALL_KS = (1, 3, 5, 10)
+MAX_K = max(RECALL_KS)
+PARETO_K = 5
+
+# 有 ANN 索引時測試的配置（None = LanceDB 預設）
+VECTOR_CONFIGS = [
+    {'nprobes': None, 'refine_factor': None},
+    {'nprobes': 5, 'refine_factor': None},
+    {'nprobes': 20, 'refine_factor': None},
+    {'nprobes': 50, 'refine_factor': None},
+    {'nprobes': 20, 'refine_factor': 5},
+]
+
+STAT_WORDS = {
+    'batter': ['home runs', 'HR', 'wRC+', 'batting average', 'OPS', 'WAR'],
+    'pitcher': ['ERA', 'strikeouts', 'WHIP', 'FIP', 'pitching stats'],
+}
+STAT_WORDS_ZH = {
+    'batter': ['全壘打', '打擊率', '打點'],
+    'pitcher': ['防禦率', '三振', '勝投'],
+}
+
+_YEAR_PATTERN = re.compile(r'\b(19|20)\d{2}\b')
+
+
+def normalize_name(text: str) -> str:
+    """去除重音、標點、大小寫（José Ramírez → jose ramirez）"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9 ]+', ' ', text.lower()).strip()
+
+
+# ============================================
+# 標註查詢
+# ============================================
+
+def generate_labelled_queries(docs_df: pd.DataFrame, n: int = 2000, seed: int = 42) -> List[Dict]:
+    """
+    由文檔產生 n 筆有標註的查詢（依 seed 決定）
+
+    Returns:
+        [{'query', 'variant', 'player', 'season'（None = 任一賽季）}, ...]
+    """
+
+    rng = random.Random(seed)
+    rows = docs_df[['player_name', 'season', 'type']].to_dict('records')
+
+    variants = ['name', 'name_lower', 'last_name', 'name_season', 'name_stat', 'name_season_stat', 'name_zh_stat']
+    queries = []
+
+    while len(queries) < n:
+        row = rng.choice(rows)
+        name, season = row['player_name'], int(row['season'])
+        player_type = row['type'] if row['type'] in STAT_WORDS else 'batter'
+        variant = rng.choice(variants)
+
+        # 有重音的名字以一定機率改測無重音版本
+        plain = normalize_name(name).title()
+        if plain != name and rng.random() < 0.5:
+            variant = 'name_no_accent'
+
+        query_season = None
+        if variant == 'name':
+            query = name
+        elif variant == 'name_lower':
+            query = name.lower()
+        elif variant == 'last_name':
+            query = name.split()[-1]
+        elif variant == 'name_no_accent':
+            query = plain
+        elif variant == 'name_season':
+            query, query_season = f"{name} {season}", season
+        elif variant == 'name_stat':
+            query = f"{name} {rng.choice(STAT_WORDS[player_type])}"
+        elif variant == 'name_season_stat':
+            query, query_season = f"{name} {season} {rng.choice(STAT_WORDS[player_type])}", season
+        else:
+            query = f"{name} 的{rng.choice(STAT_WORDS_ZH[player_type])}"
+
+        queries.append({'query': query, 'variant': variant, 'player': name, 'season': query_season})
+
+    return queries
+
+
+def relevant_rank(results: List[Dict], label: Dict) -> Optional[int]:
+    """第一個相關結果的排名（1-based），沒有則 None"""
+    for i, r in enumerate(results[:MAX_K]):
+        if r['player_name'] != label['player']:
+            continue
+        if label['season'] is None or int(r['season']) == label['season']:
+            return i + 1
+    return None
+
+
+# ============================================
+# 檢索器
+# ============================================
+
+class KeyedNameLookup:
+    """
+    球員名字鍵值查找
+
+    索引：正規化全名 → 文檔列、正規化姓氏 → 文檔列
+    查詢：由長到短比對查詢中的連續詞（3 → 2 → 1 個詞），
+          找到全名就不再比對姓氏；查詢有年份時同賽季的文檔排在前面
+    """
+
+    def __init__(self, docs_df: pd.DataFrame):
+        self.docs = docs_df[['player_name', 'season', 'team', 'type']].to_dict('records')
+        self.by_name: Dict[str, List[int]] = defaultdict(list)
+        self.by_last: Dict[str, List[int]] = defaultdict(list)
+
+        # 同一球員由新到舊
+        order = np.lexsort((-docs_df['season'].to_numpy(), docs_df['player_name'].to_numpy()))
+        for i in order:
+            key = normalize_name(self.docs[i]['player_name'])
+            self.by_name[key].append(int(i))
+            self.by_last[key.split()[-1]].append(int(i))
+
+    def search(self, query: str, k: int = MAX_K) -> List[Dict]:
+        tokens = normalize_name(query).split()
+        hits: List[int] = []
+
+        for size in (3, 2):
+            for start in range(len(tokens) - size + 1):
+                hits = self.by_name.get(' '.join(tokens[start:start + size]), [])
+                if hits:
+                    break
+            if hits:
+                break
+
+        if not hits:
+            for token in tokens:
+                hits = self.by_last.get(token, [])
+                if hits:
+                    break
+
+        year = _YEAR_PATTERN.search(query)
+        if year:
+            season = int(year.group(0))
+            hits = sorted(hits, key=lambda i: self.docs[i]['season'] != season)
+
+        return [self.docs[i] for i in hits[:k]]
+
+
+def load_lancedb_retrievers(queries: List[Dict]) -> Tuple[Dict[str, Callable], Optional[Dict]]:
+    """
+    載入 LanceDB 檢索器（缺少依賴或資料庫時回傳空）
+
+    Returns:
+        ({配置名稱: search(i, query, k)}, embedding 統計)
+        search 的 i 為查詢序號，用來取預先計算的 embedding
+    """
+
+    try:
+        import lancedb
+        from sentence_transformers import SentenceTransformer
+
+        with open(os.path.join(DATA_DIR, "search_config.json"), 'r') as f:
+            config = json.load(f)
+        table = lancedb.connect(config['db_path']).open_table(config['table_name'])
+        model = SentenceTransformer(config['embedding_model'])
+    except Exception as e:
+        print(f"  ⚠️  略過 LanceDB 檢索器：{e}")
+        return {}, None
+
+    texts = [q['query'] for q in queries]
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=64, show_progress_bar=False)
+    embed_s = time.perf_counter() - start
+    embed_stats = {'queries': len(texts), 'total_s': round(embed_s, 3), 'per_query_ms': round(embed_s / len(texts) * 1000, 3)}
+
+    try:
+        has_ann = any('vector' in str(getattr(idx, 'columns', idx)) for idx in table.list_indices())
+    except Exception:
+        has_ann = False
+
+    def columns(builder):
+        return builder.select(['player_name', 'season'])
+
+    def vector(config: Dict):
+        def search(i: int, query: str, k: int) -> List[Dict]:
+            builder = table.search(embeddings[i].tolist()).limit(k)
+            if config['nprobes']:
+                builder = builder.nprobes(config['nprobes'])
+            if config['refine_factor']:
+                builder = builder.refine_factor(config['refine_factor'])
+            return columns(builder).to_list()
+        return search
+
+    def fts(i: int, query: str, k: int) -> List[Dict]:
+        try:
+            return columns(table.search(query, query_type="fts").limit(k)).to_list()
+        except Exception:
+            return []
+
+    def hybrid(i: int, query: str, k: int) -> List[Dict]:
+        # 與 week1_test_retrieval.hybrid_search 相同：有人名時 FTS 優先，不足再以向量補足
+        names = re.findall(r'\b[A-Z][a-z]+ [A-Z][a-z]+\b', query)
+        if names:
+            fts_results = fts(i, names[0], k * 2)
+            if len(fts_results) >= k:
+                return fts_results[:k]
+            vector_results = vector(VECTOR_CONFIGS[0])(i, query, k * 2)
+            seen = {(r['player_name'], r['season']) for r in fts_results}
+            return (fts_results + [r for r in vector_results if (r['player_name'], r['season']) not in seen])[:k]
+        return vector(VECTOR_CONFIGS[0])(i, query, k)
+
+    retrievers = {}
+    for config in (VECTOR_CONFIGS if has_ann else VECTOR_CONFIGS[:1]):
+        label = 'vector' if not config['nprobes'] else f"vector[nprobes={config['nprobes']}" + (
+            f",refine={config['refine_factor']}]" if config['refine_factor'] else "]")
+        retrievers[label] = vector(config)
+    retrievers['fts'] = fts
+    retrievers['hybrid'] = hybrid
+    return retrievers, embed_stats
+
+
+# ============================================
+# 量測
+# ============================================
+
+def evaluate_retriever(search: Callable[[int, str, int], List[Dict]], queries: List[Dict]) -> Dict:
+    """逐筆執行（單執行緒），記錄排名與延遲"""
+
+    latencies = np.empty(len(queries))
+    ranks: List[Optional[int]] = []
+    by_variant = defaultdict(list)
+
+    start_all = time.perf_counter()
+    for i, label in enumerate(queries):
+        start = time.perf_counter()
+        results = search(i, label['query'], MAX_K)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        rank = relevant_rank(results, label)
+        ranks.append(rank)
+        by_variant[label['variant']].append(rank)
+    wall_s = time.perf_counter() - start_all
+
+    def recall(rank_list: List[Optional[int]], k: int) -> float:
+        return sum(1 for r in rank_list if r is not None and r <= k) / len(rank_list) if rank_list else 0.0
+
+    return {
+        **{f"recall@{k}": round(recall(ranks, k), 4) for k in RECALL_KS},
+        'mrr': round(sum(1 / r for r in ranks if r) / len(ranks), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 4),
+        'qps': round(len(queries) / wall_s, 1) if wall_s > 0 else None,
+        'recall_by_variant': {v: round(recall(r, PARETO_K), 4) for v, r in sorted(by_variant.items())},
+    }
+
+
+def pareto_front(metrics: Dict[str, Dict]) -> List[str]:
+    """Recall@PARETO_K 越高越好、p50 越低越好；沒有被其他配置同時勝過的配置"""
+
+    key = f"recall@{PARETO_K}"
+    front = []
+    for name, m in metrics.items():
+        dominated = any(
+            o[key] >= m[key] and o['p50_ms'] <= m['p50_ms'] and (o[key] > m[key] or o['p50_ms'] < m['p50_ms'])
+            for other, o in metrics.items() if other != name
+        )
+        if not dominated:
+            front.append(name)
+    return front
+
+
+def print_pareto_table(metrics: Dict[str, Dict], front: List[str]):
+    header = ''.join(f"{'R@' + str(k):>8}" for k in RECALL_KS)
+    print(f"\n{'檢索器':<28}{header}{'MRR':>8}{'p50 ms':>10}{'p95 ms':>10}{'QPS':>10}")
+    print("-" * 106)
+    key = f"recall@{PARETO_K}"
+    for name, m in sorted(metrics.items(), key=lambda item: (-item[1][key], item[1]['p50_ms'])):
+        mark = "★ " if name in front else "  "
+        recalls = ''.join(f"{m[f'recall@{k}']:>8.1%}" for k in RECALL_KS)
+        print(f"{mark}{name:<26}{recalls}{m['mrr']:>8.3f}{m['p50_ms']:>10.3f}{m['p95_ms']:>10.3f}{m['qps']:>10.0f}")
+
+
+# ============================================
+# 主程式
+# ============================================
+
+if __name__ == "__main__":
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print("=" * 80)
+    print("Week 6: 檢索品質 vs 速度基準測試")
+    print("=" * 80)
+
+    with open(DOCUMENTS_FILE, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+    print(f"\n[1] 載入 {len(docs_df)} 筆文檔，{docs_df['player_name'].nunique()} 位球員")
+
+    queries = generate_labelled_queries(docs_df, n)
+    variant_counts = pd.Series([q['variant'] for q in queries]).value_counts()
+    print(f"\n[2] 產生 {len(queries)} 筆標註查詢")
+    for variant, count in variant_counts.items():
+        example = next(q['query'] for q in queries if q['variant'] == variant)
+        print(f"  {variant:<18}{count:>6}  例：{example}")
+
+    print(f"\n[3] 載入檢索器...")
+    keyed = KeyedNameLookup(docs_df)
+    retrievers: Dict[str, Callable] = {'keyed': lambda i, query, k: keyed.search(query, k)}
+    lancedb_retrievers, embed_stats = load_lancedb_retrievers(queries)
+    retrievers.update(lancedb_retrievers)
+    if embed_stats:
+        print(f"  ✅ embedding：{embed_stats['per_query_ms']:.2f} ms / 筆（批次計算，未計入向量檢索延遲）")
+    print(f"  ✅ {len(retrievers)} 個檢索器：{', '.join(retrievers)}")
+
+    print(f"\n[4] 執行...")
+    metrics = {}
+    for name, search in retrievers.items():
+        metrics[name] = evaluate_retriever(search, queries)
+        print(f"  ✅ {name}：Recall@{PARETO_K} {metrics[name][f'recall@{PARETO_K}']:.1%}，p50 {metrics[name]['p50_ms']:.3f} ms")
+
+    front = pareto_front(metrics)
+    print_pareto_table(metrics, front)
+
+    print(f"\nRecall@{PARETO_K} 依查詢變體：")
+    variants = sorted(variant_counts.index)
+    print(f"{'檢索器':<28}" + ''.join(f"{v[:14]:>16}" for v in variants))
+    for name, m in metrics.items():
+        print(f"{name:<28}" + ''.join(f"{m['recall_by_variant'].get(v, 0):>16.1%}" for v in variants))
+
+    report = {
+        'test_date': pd.Timestamp.now().isoformat(),
+        'queries': len(queries),
+        'variants': variant_counts.to_dict(),
+        'embedding': embed_stats,
+        'metrics': metrics,
+        'pareto_front': front,
+    }
+    with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 報告已儲存：{REPORT_FILE}")
@@ -0,0 +1,322 @@
+"""
+Week 6: 薪資索引（依年份 / 球隊排序的陣列）+ 每百萬美元 WAR
+
+原本：handle_contract_query 只能查單一球員，"Who has the highest salary in MLB?" 無法回答
+現在：salaries 副表（week6_side_tables）載入時建立兩組排序：
+    - by_year：依 (年份, 薪資由高到低) 排序，year_spans[year] → 區間，單一年份 Top-N 直接切片 O(k)
+    - by_team：依 (年份, 球隊, 薪資由高到低) 排序，team_spans[(year, team)] → 區間
+    建立時以 (球員, 賽季) 對 CorpusStore 的 WAR 做一次向量化 join（searchsorted），
+    每百萬美元 WAR = WAR / (該年薪資合計 / 1e6)（交易球員各隊的薪資列加總），查詢時只做遮罩 + argpartition
+
+用法：
+    index = SalaryIndex.from_table(side_tables.salaries.df, corpus)
+    spec = parse_salary_query("Who has the highest salary in MLB?")
+    if spec: result = index.answer(spec)
+"""
+
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from week6_ranking_engine import DEFAULT_TOP_N, parse_seasons, parse_top_n
+from week6_stat_registry import resolve_team, team_codes
+
+# ============================================
+# 配置
+# ============================================
+
+# 每百萬美元 WAR 排行的最低 WAR（排除 WAR ≤ 0 的球員）
+MIN_VALUE_WAR = 0.0
+
+VALUE_PATTERN = r'war per|per (?:\$|dollar|million)|value|bargain|efficien|cost[- ]effective|划算|性價比|每百萬'
+RANK_PATTERN = r'highest|lowest|top\s*\d*|most|least|best|worst|cheapest|biggest|largest|leaders?\b|最高|最低|排行'
+
+# ============================================
+# 查詢解析
+# ============================================
+
+def parse_salary_query(query: str) -> Optional[Dict]:
+    """
+    解析薪資排行查詢；沒有排行 / 性價比字眼的查詢回傳 None
+
+    只看字眼，不認得球員名字："Is Aaron Judge's contract good value?" 也會被解析成排行，
+    呼叫端需先排除提到已知球員的查詢（EnhancedSmartRouter.find_known_player）
+
+    "Who has the highest salary in MLB?"       → {'metric': 'salary', 'ascending': False, ...}
+    "Best value players by WAR per $M in 2024" → {'metric': 'war_per_million', ...}
+    "Top 5 Yankees salaries 2025"              → {'metric': 'salary', 'team': 'NYY', 'top_n': 5, ...}
+    """
+
+    query_lower = query.lower()
+    value = bool(re.search(VALUE_PATTERN, query_lower))
+    if not value and not re.search(RANK_PATTERN, query_lower):
+        return None
+
+    return {
+        'metric': 'war_per_million' if value else 'salary',
+        'ascending': bool(re.search(r'lowest|least|cheapest|worst|最低', query_lower)) and not value,
+        'seasons': parse_seasons(query),
+        'team': resolve_team(query),
+        'top_n': parse_top_n(query) or DEFAULT_TOP_N,
+    }
+
+# ============================================
+# 薪資索引
+# ============================================
+
+def _spans(keys: List) -> Dict:
+    """已排序的 key 序列 → {key: (start, end)}"""
+    spans: Dict = {}
+    start = 0
+    for i in range(1, len(keys) + 1):
+        if i == len(keys) or keys[i] != keys[start]:
+            spans[keys[start]] = (start, i)
+            start = i
+    return spans
+
+
+def join_war(players: np.ndarray, years: np.ndarray, corpus) -> np.ndarray:
+    """
+    (球員, 年份) → 該賽季 WAR（同賽季多列時加總；找不到為 NaN）
+
+    CorpusStore 的列依 (球員, 賽季) 排序：以 (球員代碼, 賽季) 組合 key 做 searchsorted
+    """
+
+    war = np.full(len(players), np.nan)
+    if corpus is None or corpus.n_players == 0 or len(players) == 0:
+        return war
+
+    row_codes = np.repeat(np.arange(corpus.n_players), np.diff(corpus.player_start))
+    row_keys = row_codes.astype(np.int64) * 10000 + corpus.season.astype(np.int64)
+    row_war = corpus.stat_column(['WAR'])
+
+    # 同一 (球員, 賽季) 的多列（例如同時有打者 / 投手列）加總
+    has_war = ~np.isnan(row_war)
+    unique_keys, inverse = np.unique(row_keys[has_war], return_inverse=True)
+    if len(unique_keys) == 0:
+        return war
+    season_war = np.bincount(inverse, weights=row_war[has_war], minlength=len(unique_keys))
+
+    codes = np.minimum(np.searchsorted(corpus.player_names, players), corpus.n_players - 1)
+    keys = codes.astype(np.int64) * 10000 + years.astype(np.int64)
+    pos = np.minimum(np.searchsorted(unique_keys, keys), len(unique_keys) - 1)
+
+    found = (corpus.player_names[codes] == players) & (unique_keys[pos] == keys)
+    war[found] = season_war[pos[found]]
+    return war
+
+
+class SalaryIndex:
+    """
+    薪資排行索引
+
+    by_year / by_team 為列位置的排列，year_spans / team_spans 為排序後的區間
+    """
+
+    def __init__(self, salaries_df: pd.DataFrame, corpus=None):
+        df = salaries_df.reset_index(drop=True)
+        self.player = df['player'].to_numpy(dtype=str)
+        self.year = df['year'].to_numpy(dtype=np.int32)
+        self.team = df['team'].fillna('').to_numpy(dtype=str)
+        self.amount = df['amount'].to_numpy(dtype=np.float64)
+
+        # 依 (年份, 薪資由高到低) / (年份, 球隊, 薪資由高到低)
+        self.by_year = np.lexsort((-self.amount, self.year))
+        self.by_team = np.lexsort((-self.amount, self.team, self.year))
+        self.year_spans = _spans(self.year[self.by_year].tolist())
+        self.team_spans = _spans(list(zip(self.year[self.by_team].tolist(), self.team[self.by_team].tolist())))
+
+        # 同一 (球員, 年份) 的多列（賽季中被交易，各隊各一筆薪資）：WAR 是整季數字，
+        # 每百萬美元 WAR 以該年薪資合計計算；first_of_year 標記每組薪資最高的一列（價值排行每組只取一列）
+        player_year, inverse = np.unique(
+            np.char.add(np.char.add(self.player, '\x00'), self.year.astype(str)), return_inverse=True
+        )
+        self.season_amount = np.bincount(inverse, weights=self.amount, minlength=len(player_year))[inverse]
+        self.first_of_year = np.zeros(len(df), dtype=bool)
+        by_amount = np.lexsort((-self.amount, inverse))
+        self.first_of_year[by_amount[np.r_[True, inverse[by_amount][1:] != inverse[by_amount][:-1]]]] = True
+
+        # 與統計語料 join：每列的 WAR 與每百萬美元 WAR
+        self.war = join_war(self.player, self.year, corpus)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.war_per_million = np.where(self.season_amount > 0, self.war / (self.season_amount / 1e6), np.nan)
+
+    @classmethod
+    def from_table(cls, salaries_df: pd.DataFrame, corpus=None) -> 'SalaryIndex':
+        return cls(salaries_df, corpus)
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    @property
+    def years(self) -> List[int]:
+        return sorted(self.year_spans)
+
+    # ---------- 查詢 ----------
+
+    def rows(self, seasons: List[int], team: Optional[str] = None) -> np.ndarray:
+        """符合年份 / 球隊的列位置（每個區間內已依薪資由高到低排序）"""
+
+        if team is None:
+            slices = [self.by_year[slice(*self.year_spans[y])] for y in seasons if y in self.year_spans]
+        else:
+            slices = [self.by_team[slice(*self.team_spans[(y, code)])]
+                      for y in seasons for code in team_codes(team) if (y, code) in self.team_spans]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    def top_salaries(self, seasons: List[int], team: Optional[str] = None, top_n: int = 5,
+                     ascending: bool = False) -> np.ndarray:
+        """
+        薪資 Top-N 的列位置
+
+        單一區間（單一年份、單一球隊代碼）已排序，直接取頭或尾；多個區間時合併後部分排序
+        """
+
+        rows = self.rows(seasons, team)
+        if len(rows) == 0:
+            return rows
+        if len(seasons) == 1 and (team is None or len(team_codes(team)) == 1):
+            return rows[::-1][:top_n] if ascending else rows[:top_n]
+        return self._top_k(rows, self.amount[rows], top_n, higher_is_better=not ascending)
+
+    def top_value(self, seasons: List[int], team: Optional[str] = None, top_n: int = 5,
+                  min_war: float = MIN_VALUE_WAR) -> np.ndarray:
+        """每百萬美元 WAR Top-N 的列位置（只計 WAR > min_war 的球員；同一球員 / 年份只取一列）"""
+
+        rows = self.rows(seasons, team)
+        if team is None:
+            rows = rows[self.first_of_year[rows]]
+        rows = rows[self.war[rows] > min_war]
+        return self._top_k(rows, self.war_per_million[rows], top_n, higher_is_better=True)
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, values: np.ndarray, k: int, higher_is_better: bool) -> np.ndarray:
+        if len(rows) == 0:
+            return rows
+        score = values if higher_is_better else -values
+        k = min(k, len(score))
+        top = np.argpartition(-score, k - 1)[:k]
+        return rows[top[np.argsort(-score[top], kind='stable')]]
+
+    def entry(self, row: int) -> Dict:
+        war = self.war[row]
+        return {
+            'player': str(self.player[row]),
+            'year': int(self.year[row]),
+            'team': str(self.team[row]),
+            'salary': int(self.amount[row]),
+            'season_salary': int(self.season_amount[row]),
+            'WAR': None if np.isnan(war) else round(float(war), 1),
+            'war_per_million': None if np.isnan(self.war_per_million[row]) else round(float(self.war_per_million[row]), 2),
+        }
+
+    # ---------- 回答 ----------
+
+    def answer(self, spec: Dict) -> Dict:
+        """
+        回答 parse_salary_query 的結果
+
+        Returns:
+            {'type': 'contract', 'metric', 'seasons', 'team', 'leaderboard', 'answer'}
+        """
+
+        if len(self) == 0:
+            return {
+                'type': 'contract',
+                'error': '沒有薪資數據',
+                'answer': '薪資數據暫無記錄，請先執行 week5_integrate_data.py 建立薪資副表'
+            }
+
+        # 沒有指定年份時使用最新一年
+        seasons = [y for y in (spec['seasons'] or self.years[-1:]) if y in self.year_spans]
+        if not seasons:
+            return {
+                'type': 'contract',
+                'error': '找不到年份',
+                'answer': f"沒有 {', '.join(map(str, spec['seasons']))} 的薪資記錄"
+                          f"（記錄年份：{', '.join(map(str, self.years))}）"
+            }
+
+        team = spec['team']
+        if spec['metric'] == 'war_per_million':
+            rows = self.top_value(seasons, team, spec['top_n'])
+        else:
+            rows = self.top_salaries(seasons, team, spec['top_n'], spec['ascending'])
+        leaderboard = [self.entry(int(row)) for row in rows]
+
+        span = f"{seasons[0]}–{seasons[-1]}" if len(seasons) > 1 else str(seasons[0])
+        scope = f"{team} " if team else "MLB "
+        if spec['metric'] == 'war_per_million':
+            title = f"{span} {scope}每百萬美元 WAR 排行"
+        else:
+            title = f"{span} {scope}薪資{'最低' if spec['ascending'] else '最高'}排行"
+
+        if not leaderboard:
+            answer = f"{title}：沒有符合條件的球員"
+        else:
+            answer = f"{title}：\n\n"
+            for rank, entry in enumerate(leaderboard, 1):
+                line = f"{rank}. {entry['player']} ({entry['team']}, {entry['year']}): ${entry['salary']:,}"
+                if entry['WAR'] is not None:
+                    line += f"，WAR {entry['WAR']}"
+                if spec['metric'] == 'war_per_million':
+                    if entry['season_salary'] != entry['salary']:
+                        line += f"（全年合計 ${entry['season_salary']:,}）"
+                    line += f"，每百萬美元 {entry['war_per_million']} WAR"
+                answer += line + "\n"
+
+        return {
+            'type': 'contract',
+            'metric': spec['metric'],
+            'seasons': seasons,
+            'team': team,
+            'leaderboard': leaderboard,
+            'answer': answer.rstrip()
+        }
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import time
+
+    from week6_corpus_store import load_or_build_corpus
+    from week6_side_tables import SideTables
+
+    tables = SideTables.load()
+    corpus = load_or_build_corpus("./mlb_data/mlb_documents.json")
+
+    start_time = time.perf_counter()
+    index = SalaryIndex.from_table(tables.salaries.df, corpus)
+
+    print("=" * 80)
+    print(f"薪資索引：{len(index)} 筆 / 年份 {index.years}"
+          f"（建立 {(time.perf_counter() - start_time) * 1000:.1f} ms，"
+          f"{int((~np.isnan(index.war)).sum())} 筆對應到 WAR）")
+    print("=" * 80)
+
+    test_queries = [
+        "Who has the highest salary in MLB?",
+        "Top 10 Yankees salaries",
+        "Lowest paid Dodgers 2024",
+        "Best value players by WAR per $M",
+        "What is Aaron Judge's salary?",
+    ]
+
+    for query in test_queries:
+        print(f"\n查詢: {query}")
+        print("-" * 80)
+        start_time = time.perf_counter()
+        spec = parse_salary_query(query)
+        if spec is None:
+            print("（球員查詢，交給 EnhancedSmartRouter）")
+            continue
+        result = index.answer(spec)
+        print(result['answer'])
+        print(f"⏱️  {(time.perf_counter() - start_time) * 1000:.3f} ms")
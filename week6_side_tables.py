@@ -0,0 +1,366 @@
+"""
+Week 6: 獎項 / 薪資 / Statcast 正規化副表（查詢時才依球員 join）
+
+原本：week5_integrate_data.py / week5_integrate_awards_simple.py 把獎項、薪資複製到每一筆賽季文檔，
+      更新任何一項都要重寫整份 week5_mlb_documents_enhanced.json
+現在：三張欄式副表，各自一個 parquet 檔（mlb_data/side_tables/），以球員名字為 key：
+    awards    (player, award, year, league)
+    salaries  (player, year, team, amount)
+    statcast  (player, season, bbe, competitive_runs, exit_velocity_avg, ..., xwOBA)
+    - 載入時依 player 排序，每位球員對應一段連續區間（排序後的 key 陣列 + 二分搜尋）
+    - router 只在查詢需要時取出該球員的列組成回答（player_awards / player_contract / player_statcast）
+    - 更新獎項只需重寫 awards.parquet
+
+建置：
+    python week5_integrate_awards_simple.py        # week5_awards.json → awards.parquet
+    python week5_integrate_data.py                 # Lahman 獎項 + 薪資 → awards / salaries.parquet
+    python week6_side_tables.py statcast 2024 2025 # Baseball Savant 排行榜 → statcast.parquet
+    python week6_side_tables.py                    # 從舊的 week5_mlb_documents_enhanced.json 轉換
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+SIDE_TABLES_DIR = os.path.join(DATA_DIR, "side_tables")
+
+# Statcast 聚合指標（week5_data_collection 的 metrics）+ 樣本數欄位
+STATCAST_METRICS = [
+    'exit_velocity_avg', 'max_exit_velocity', 'launch_angle_avg', 'sprint_speed',
+    'hard_hit_pct', 'barrel_pct', 'xBA', 'xwOBA',
+]
+STATCAST_SAMPLE_COLUMNS = ['bbe', 'competitive_runs']
+
+# week5_awards_simple 處理獎項的順序（player_awards 的 key 依第一次獲獎年份、再依此順序）
+AWARD_ORDER = ['MVP', 'Cy Young', 'Rookie of the Year', 'All-Star']
+
+TABLE_SCHEMAS = {
+    'awards': ['player', 'award', 'year', 'league'],
+    'salaries': ['player', 'year', 'team', 'amount'],
+    'statcast': ['player', 'season'] + STATCAST_SAMPLE_COLUMNS + STATCAST_METRICS,
+}
+
+# 每張表在同一球員區間內的排序
+TABLE_ORDER = {
+    'awards': ['year', 'award'],
+    'salaries': ['year'],
+    'statcast': ['season'],
+}
+
+# ============================================
+# 以球員為 key 的欄式表
+# ============================================
+
+class KeyedTable:
+    """
+    依 player 排序的欄式表
+
+    keys：排序後的不重複球員名字；starts[i]:starts[i+1] 為第 i 位球員的列區間
+    """
+
+    def __init__(self, name: str, df: Optional[pd.DataFrame] = None):
+        self.name = name
+        columns = TABLE_SCHEMAS[name]
+        if df is None:
+            df = pd.DataFrame(columns=columns)
+        df = df[[c for c in columns if c in df.columns]]
+        self.df = df.sort_values(['player'] + TABLE_ORDER[name], kind='stable').reset_index(drop=True)
+
+        keys = self.df['player'].to_numpy(dtype=str)
+        self.keys, starts = np.unique(keys, return_index=True)
+        self.starts = np.append(starts, len(self.df)).astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def __contains__(self, player: str) -> bool:
+        return self.span(player) is not None
+
+    def span(self, player: str) -> Optional[Tuple[int, int]]:
+        i = int(np.searchsorted(self.keys, player))
+        if i >= len(self.keys) or self.keys[i] != player:
+            return None
+        return int(self.starts[i]), int(self.starts[i + 1])
+
+    def rows(self, player: str) -> pd.DataFrame:
+        """球員的所有列（依 TABLE_ORDER 排序）；沒有資料時為空表"""
+        span = self.span(player)
+        if span is None:
+            return self.df.iloc[0:0]
+        return self.df.iloc[span[0]:span[1]]
+
+# ============================================
+# 副表集合
+# ============================================
+
+class SideTables:
+    """awards / salaries / statcast 三張副表 + 依球員 join 的查詢"""
+
+    def __init__(self, tables: Optional[Dict[str, KeyedTable]] = None):
+        tables = tables or {}
+        self.tables = {name: tables.get(name) or KeyedTable(name) for name in TABLE_SCHEMAS}
+        self.awards = self.tables['awards']
+        self.salaries = self.tables['salaries']
+        self.statcast = self.tables['statcast']
+
+    @classmethod
+    def load(cls, directory: str = SIDE_TABLES_DIR) -> 'SideTables':
+        """載入存在的副表（缺少的表為空表）"""
+        tables = {}
+        for name in TABLE_SCHEMAS:
+            path = os.path.join(directory, f"{name}.parquet")
+            if os.path.exists(path):
+                tables[name] = KeyedTable(name, pd.read_parquet(path))
+        return cls(tables)
+
+    def available(self) -> Dict[str, int]:
+        return {name: len(table) for name, table in self.tables.items()}
+
+    def player_awards(self, player: str) -> Dict:
+        """與原本文檔中 awards 欄位相同的格式：{'MVP': [2022, 2024], ..., 'total_count': 3}"""
+
+        rows = self.awards.rows(player)
+        rank = {award: i for i, award in enumerate(AWARD_ORDER)}
+        ordered = sorted(zip(rows['year'], rows['award']), key=lambda item: (item[0], rank.get(item[1], len(rank))))
+        awards: Dict = {}
+        for year, award in ordered:
+            years = awards.setdefault(award, [])
+            if int(year) not in years:
+                years.append(int(year))
+        awards['total_count'] = sum(len(years) for years in awards.values())
+        return awards
+
+    def player_contract(self, player: str) -> Optional[Dict]:
+        """最新一年的薪資：{'current_salary', 'year', 'team'}；沒有資料時為 None"""
+
+        rows = self.salaries.rows(player)
+        if rows.empty:
+            return None
+        latest = rows.sort_values('year', kind='stable').iloc[-1]
+        return {'current_salary': int(latest['amount']), 'year': int(latest['year']), 'team': latest['team']}
+
+    def player_statcast(self, player: str) -> Optional[Dict]:
+        """最新賽季的 Statcast 指標（略過缺值）；沒有資料時為 None"""
+
+        rows = self.statcast.rows(player)
+        if rows.empty:
+            return None
+        latest = rows.sort_values('season', kind='stable').iloc[-1]
+        statcast = {'season': int(latest['season'])}
+        for metric in STATCAST_METRICS:
+            if metric in latest and pd.notna(latest[metric]):
+                statcast[metric] = round(float(latest[metric]), 3)
+        return statcast
+
+# ============================================
+# 建置 / 儲存
+# ============================================
+
+def save_side_table(name: str, df: pd.DataFrame, directory: str = SIDE_TABLES_DIR) -> str:
+    """寫入單一副表（只重寫這一個檔案）"""
+
+    os.makedirs(directory, exist_ok=True)
+    df = df[[c for c in TABLE_SCHEMAS[name] if c in df.columns]].reset_index(drop=True)
+    path = os.path.join(directory, f"{name}.parquet")
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def awards_frame(records: Iterable[Tuple[str, str, int, str]]) -> pd.DataFrame:
+    """(player, award, year, league) → awards 表（重複的列只保留一筆）"""
+    df = pd.DataFrame(list(records), columns=TABLE_SCHEMAS['awards'])
+    df['year'] = df['year'].astype(np.int32)
+    df['league'] = df['league'].fillna('')
+    return df.drop_duplicates(ignore_index=True)
+
+
+def award_records_from_player_awards(player_awards: Dict[str, Dict],
+                                     leagues: Optional[Dict[Tuple[str, str, int], str]] = None) -> List[Tuple]:
+    """
+    week5_awards.json 格式 {player: {award: [years], 'total_count': n}} → 列
+
+    leagues：{(player, award, year): 'AL' / 'NL'}（week5_awards_simple.KNOWN_AWARDS 才有聯盟）
+    """
+    leagues = leagues or {}
+    return [
+        (player, award, int(year), leagues.get((player, award, int(year)), ''))
+        for player, awards in player_awards.items()
+        for award, years in awards.items() if award != 'total_count'
+        for year in years
+    ]
+
+
+def award_leagues_from_known(known_awards: Dict[int, Dict]) -> Dict[Tuple[str, str, int], str]:
+    """KNOWN_AWARDS（年份 → 獎項 → {聯盟: 球員} 或 [球員]）→ {(player, award, year): league}"""
+    leagues = {}
+    for year, awards in known_awards.items():
+        for award, winners in awards.items():
+            if isinstance(winners, dict):
+                for league, player in winners.items():
+                    leagues[(player, award, int(year))] = league
+    return leagues
+
+
+def salaries_frame(records: Iterable[Tuple[str, int, str, float]]) -> pd.DataFrame:
+    """(player, year, team, amount) → salaries 表"""
+    df = pd.DataFrame(list(records), columns=TABLE_SCHEMAS['salaries'])
+    df['year'] = df['year'].astype(np.int32)
+    df['amount'] = df['amount'].astype(np.float64)
+    return df.drop_duplicates(['player', 'year', 'team'], keep='last', ignore_index=True)
+
+
+def savant_player_name(value: str) -> str:
+    """Baseball Savant 排行榜的 'last_name, first_name' → 'First Last'"""
+    if isinstance(value, str) and ',' in value:
+        last, first = value.split(',', 1)
+        return f"{first.strip()} {last.strip()}"
+    return value
+
+
+def statcast_frame_from_savant(season: int, exitvelo: Optional[pd.DataFrame] = None,
+                               sprint: Optional[pd.DataFrame] = None,
+                               expected: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    pybaseball 的 Savant 排行榜 → statcast 表的一個賽季
+
+    exitvelo：statcast_batter_exitvelo_barrels(season)
+    sprint：statcast_sprint_speed(season, min_opp=...)
+    expected：statcast_batter_expected_stats(season)
+    """
+
+    columns = {
+        'exitvelo': {'attempts': 'bbe', 'avg_hit_speed': 'exit_velocity_avg', 'max_hit_speed': 'max_exit_velocity',
+                     'avg_hit_angle': 'launch_angle_avg', 'ev95percent': 'hard_hit_pct', 'brl_percent': 'barrel_pct'},
+        'sprint': {'competitive_runs': 'competitive_runs', 'sprint_speed': 'sprint_speed'},
+        'expected': {'est_ba': 'xBA', 'est_woba': 'xwOBA'},
+    }
+
+    parts = []
+    for key, frame in (('exitvelo', exitvelo), ('sprint', sprint), ('expected', expected)):
+        if frame is None or frame.empty:
+            continue
+        part = frame.rename(columns=columns[key])
+        part['player'] = part['last_name, first_name'].map(savant_player_name)
+        part['season'] = np.int32(season)
+        parts.append((part, [c for c in columns[key].values() if c in part.columns]))
+
+    if not parts:
+        return pd.DataFrame(columns=TABLE_SCHEMAS['statcast'])
+
+    # 以 (player_id, season) 合併：只用顯示名字時，同名的兩位球員會交叉相乘
+    # 缺 player_id 時退回名字，同名的列只保留第一筆
+    by_id = all('player_id' in part.columns for part, _ in parts)
+    keys = ['player_id', 'season'] if by_id else ['player', 'season']
+    merged = None
+    for part, metrics in parts:
+        part = part.drop_duplicates(keys)[keys + metrics]
+        merged = part if merged is None else merged.merge(part, on=keys, how='outer')
+
+    if by_id:
+        names = pd.concat([part.set_index('player_id')['player'] for part, _ in parts])
+        merged['player'] = merged['player_id'].map(names[~names.index.duplicated()])
+    return merged.reindex(columns=TABLE_SCHEMAS['statcast'])
+
+
+def side_tables_from_store(store) -> Dict[str, pd.DataFrame]:
+    """
+    舊的整合文檔（每列都帶 awards / contract / statcast）→ 副表
+
+    store：week6_enhanced_store.EnhancedDocumentStore（每位球員的欄位已合併成一份）
+    """
+
+    award_rows, salary_rows, statcast_rows = [], [], []
+    for name, record in store.players.items():
+        award_rows.extend(award_records_from_player_awards({name: record.awards or {}}))
+        if record.contract:
+            contract = record.contract
+            salary_rows.append((name, contract['year'], contract['team'], contract['current_salary']))
+        statcast = record.statcast or {}
+        metrics = {m: statcast[m] for m in STATCAST_METRICS if m in statcast}
+        if metrics:
+            start, end = record.span
+            statcast_rows.append({'player': name, 'season': int(store.corpus.season[end - 1]), **metrics})
+
+    return {
+        'awards': awards_frame(award_rows),
+        'salaries': salaries_frame(salary_rows),
+        'statcast': pd.DataFrame(statcast_rows, columns=TABLE_SCHEMAS['statcast']),
+    }
+
+def collect_statcast_table(seasons: Iterable[int]) -> pd.DataFrame:
+    """從 Baseball Savant 排行榜（pybaseball）建立 statcast 副表"""
+
+    from pybaseball import (statcast_batter_exitvelo_barrels, statcast_batter_expected_stats,
+                            statcast_sprint_speed)
+
+    frames = []
+    for season in seasons:
+        print(f"  📥 {season} Statcast 排行榜...")
+        frames.append(statcast_frame_from_savant(
+            season,
+            exitvelo=statcast_batter_exitvelo_barrels(season, minBBE=1),
+            sprint=statcast_sprint_speed(season, min_opp=1),
+            expected=statcast_batter_expected_stats(season, minPA=1),
+        ))
+    return pd.concat(frames, ignore_index=True)
+
+# ============================================
+# 建立副表
+# ============================================
+
+if __name__ == "__main__":
+
+    import json
+    import sys
+    import time
+
+    from week6_enhanced_store import EnhancedDocumentStore
+
+    documents_path = os.path.join(DATA_DIR, "week5_mlb_documents_enhanced.json")
+
+    print("=" * 80)
+    print("建立獎項 / 薪資 / Statcast 副表")
+    print("=" * 80)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'statcast':
+        # python week6_side_tables.py statcast 2024 2025
+        seasons = [int(year) for year in sys.argv[2:]] or [2024, 2025]
+        try:
+            df = collect_statcast_table(seasons)
+        except ImportError:
+            print("❌ 請先安裝 pybaseball: pip install pybaseball")
+            exit(1)
+        print(f"  ✅ statcast：{len(df)} 列 → {save_side_table('statcast', df)}")
+
+    else:
+        # 從舊的整合文檔轉換
+        if not os.path.exists(documents_path):
+            print(f"❌ 找不到數據文件：{documents_path}")
+            exit(1)
+
+        with open(documents_path, 'r', encoding='utf-8') as f:
+            store = EnhancedDocumentStore.from_documents(json.load(f))
+
+        for name, df in side_tables_from_store(store).items():
+            if df.empty:
+                print(f"  ⚠️  {name}：沒有資料")
+                continue
+            path = save_side_table(name, df)
+            print(f"  ✅ {name}：{len(df)} 列 → {path}")
+
+    tables = SideTables.load()
+    print(f"\n📊 副表：{tables.available()}")
+    player = next(iter(tables.awards.keys), None)
+    if player:
+        start_time = time.perf_counter()
+        awards = tables.player_awards(player)
+        print(f"{player}：{awards}（{(time.perf_counter() - start_time) * 1000:.3f} ms）")
@@ -0,0 +1,357 @@
+"""
+Week 6: 宣告式統計項目註冊表
+集中定義每個統計項目的別名（英文 + 中文）、來源欄位、排序方向、門檻與多賽季聚合方式
+
+取代原本散落在 ranking_search / handle_ranking_query 的兩組 dict
+（K_9 vs K/9、wRC+ vs wRC_plus、方向不一致等問題）
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+# ============================================
+# 統計項目註冊表
+# ============================================
+#
+# 欄位說明：
+#   type        球員類型（batter / pitcher）
+#   columns     可能的來源欄位（Week 4 FanGraphs 原始欄位優先，其次 Week 1 舊欄位）
+#   higher_is_better  排序方向
+#   qualifier   'rate' = 比率統計，需要樣本門檻；None = 累計統計
+#   aggregate   多賽季聚合：'sum' 加總；'weighted' 依 weight 欄位加權平均
+#   weight      加權欄位（打者 PA、投手 IP）
+#   aliases     查詢關鍵字（英文以單字邊界比對，中文以子字串比對）
+
+STAT_REGISTRY: Dict[str, Dict] = {
+    # ---------- 打者 ----------
+    'wRC+': {
+        'type': 'batter', 'columns': ['wRC+', 'wRC_plus'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['wrc+', 'wrc plus', 'wrc', '加權得分創造'],
+    },
+    'wOBA': {
+        'type': 'batter', 'columns': ['wOBA'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['woba', '加權上壘率'],
+    },
+    'OPS': {
+        'type': 'batter', 'columns': ['OPS'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['ops', '整體攻擊指數'],
+    },
+    'AVG': {
+        'type': 'batter', 'columns': ['AVG'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['avg', 'batting average', 'average', '打擊率'],
+    },
+    'OBP': {
+        'type': 'batter', 'columns': ['OBP'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['obp', 'on-base', 'on base percentage', '上壘率'],
+    },
+    'SLG': {
+        'type': 'batter', 'columns': ['SLG'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['slg', 'slugging', '長打率'],
+    },
+    'ISO': {
+        'type': 'batter', 'columns': ['ISO'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['iso', 'isolated power', '純長打率'],
+    },
+    'HR': {
+        'type': 'batter', 'columns': ['HR'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['home run', 'home runs', 'homer', 'homers', 'hr', '全壘打'],
+    },
+    'RBI': {
+        'type': 'batter', 'columns': ['RBI'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['rbi', 'rbis', 'runs batted in', '打點'],
+    },
+    'R': {
+        'type': 'batter', 'columns': ['R'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['runs scored', '得分'],
+    },
+    'H': {
+        'type': 'batter', 'columns': ['H'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['hits', '安打'],
+    },
+    'SB': {
+        'type': 'batter', 'columns': ['SB'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['stolen base', 'stolen bases', 'steals', 'sb', '盜壘'],
+    },
+    'BB%': {
+        'type': 'batter', 'columns': ['BB%', 'BB_pct'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['walk rate', 'bb%', '保送率'],
+    },
+    'K%': {
+        'type': 'batter', 'columns': ['K%', 'K_pct'], 'higher_is_better': False,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'PA',
+        'aliases': ['strikeout rate', 'k%', '三振率'],
+    },
+    'WAR': {
+        'type': 'batter', 'columns': ['WAR'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['war', 'wins above replacement', '勝場貢獻'],
+    },
+
+    # ---------- 投手 ----------
+    'ERA': {
+        'type': 'pitcher', 'columns': ['ERA'], 'higher_is_better': False,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'IP',
+        'aliases': ['era', 'earned run average', '防禦率', '自責分率'],
+    },
+    'WHIP': {
+        'type': 'pitcher', 'columns': ['WHIP'], 'higher_is_better': False,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'IP',
+        'aliases': ['whip', '每局被上壘率'],
+    },
+    'FIP': {
+        'type': 'pitcher', 'columns': ['FIP'], 'higher_is_better': False,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'IP',
+        'aliases': ['fip', '獨立防禦率'],
+    },
+    'xFIP': {
+        'type': 'pitcher', 'columns': ['xFIP'], 'higher_is_better': False,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'IP',
+        'aliases': ['xfip'],
+    },
+    'K/9': {
+        'type': 'pitcher', 'columns': ['K/9', 'K_9'], 'higher_is_better': True,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'IP',
+        'aliases': ['k/9', 'k9', 'strikeouts per nine', '每九局三振'],
+    },
+    'BB/9': {
+        'type': 'pitcher', 'columns': ['BB/9', 'BB_9'], 'higher_is_better': False,
+        'qualifier': 'rate', 'aggregate': 'weighted', 'weight': 'IP',
+        'aliases': ['bb/9', 'bb9', 'walks per nine', '每九局保送'],
+    },
+    'SO': {
+        'type': 'pitcher', 'columns': ['SO'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['strikeout', 'strikeouts', '三振'],
+    },
+    'W': {
+        'type': 'pitcher', 'columns': ['W'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['wins', '勝投'],
+    },
+    'SV': {
+        'type': 'pitcher', 'columns': ['SV'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['saves', 'save', 'sv', '救援成功', '救援'],
+    },
+    'IP': {
+        'type': 'pitcher', 'columns': ['IP'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': ['innings pitched', 'innings', '投球局數'],
+    },
+    'pitcher WAR': {
+        'type': 'pitcher', 'columns': ['WAR'], 'higher_is_better': True,
+        'qualifier': None, 'aggregate': 'sum',
+        'aliases': [],
+    },
+}
+
+# 未偵測到統計項目時的預設（與原本行為一致：WAR 排序）
+DEFAULT_STAT = {'batter': 'WAR', 'pitcher': 'pitcher WAR'}
+
+# 投手 / 打者關鍵字
+PITCHER_KEYWORDS = ['pitcher', 'pitchers', 'pitching', 'starter', 'reliever', '投手']
+BATTER_KEYWORDS = ['batter', 'batters', 'hitter', 'hitters', 'hitting', '打者', '打擊']
+
+# ============================================
+# 球隊 / 守備位置別名
+# ============================================
+
+TEAM_ALIASES: Dict[str, List[str]] = {
+    'NYY': ['yankees', 'new york yankees', 'nyy', '洋基'],
+    'BOS': ['red sox', 'boston', 'bos', '紅襪'],
+    'TOR': ['blue jays', 'toronto', 'tor', '藍鳥'],
+    'TBR': ['rays', 'tampa bay', 'tbr', 'tb', '光芒'],
+    'BAL': ['orioles', 'baltimore', 'bal', '金鶯'],
+    'CLE': ['guardians', 'cleveland', 'cle', '守護者'],
+    'DET': ['tigers', 'detroit', 'det', '老虎'],
+    'KCR': ['royals', 'kansas city', 'kcr', 'kc', '皇家'],
+    'MIN': ['twins', 'minnesota', '雙城'],
+    'CHW': ['white sox', 'chw', 'cws', '白襪'],
+    'HOU': ['astros', 'houston', 'hou', '太空人'],
+    'SEA': ['mariners', 'seattle', '水手'],
+    'TEX': ['rangers', 'texas', 'tex', '遊騎兵'],
+    'LAA': ['angels', 'laa', '天使'],
+    'OAK': ['athletics', "a's", 'oakland', 'oak', 'ath', '運動家'],
+    'ATL': ['braves', 'atlanta', 'atl', '勇士'],
+    'NYM': ['mets', 'new york mets', 'nym', '大都會'],
+    'PHI': ['phillies', 'philadelphia', 'phi', '費城人'],
+    'MIA': ['marlins', 'miami', 'mia', '馬林魚'],
+    'WSN': ['nationals', 'washington', 'wsn', 'wsh', '國民'],
+    'MIL': ['brewers', 'milwaukee', 'mil', '釀酒人'],
+    'STL': ['cardinals', 'st. louis', 'st louis', 'stl', '紅雀'],
+    'CHC': ['cubs', 'chc', '小熊'],
+    'CIN': ['reds', 'cincinnati', 'cin', '紅人'],
+    'PIT': ['pirates', 'pittsburgh', '海盜'],
+    'LAD': ['dodgers', 'lad', '道奇'],
+    'SDP': ['padres', 'san diego', 'sdp', 'sd', '教士'],
+    'SFG': ['giants', 'san francisco', 'sfg', 'sf', '巨人'],
+    'ARI': ['diamondbacks', 'd-backs', 'arizona', 'ari', '響尾蛇'],
+    'COL': ['rockies', 'colorado', '洛磯'],
+}
+
+# 同一球隊在不同資料來源的代碼
+TEAM_CODE_VARIANTS: Dict[str, List[str]] = {
+    'OAK': ['OAK', 'ATH'],
+    'TBR': ['TBR', 'TB', 'TBA'],
+    'KCR': ['KCR', 'KC', 'KCA'],
+    'SDP': ['SDP', 'SD', 'SDN'],
+    'SFG': ['SFG', 'SF', 'SFN'],
+    'WSN': ['WSN', 'WSH', 'WAS'],
+    'CHW': ['CHW', 'CWS', 'CHA'],
+    'NYY': ['NYY', 'NYA'],
+    'NYM': ['NYM', 'NYN'],
+    'LAD': ['LAD', 'LAN'],
+    'LAA': ['LAA', 'ANA'],
+    'CHC': ['CHC', 'CHN'],
+    'STL': ['STL', 'SLN'],
+}
+
+POSITION_ALIASES: Dict[str, List[str]] = {
+    'C': ['catcher', 'catchers', '捕手'],
+    '1B': ['first baseman', 'first base', '1b', '一壘手'],
+    '2B': ['second baseman', 'second base', '2b', '二壘手'],
+    '3B': ['third baseman', 'third base', '3b', '三壘手'],
+    'SS': ['shortstop', 'shortstops', 'ss', '游擊手'],
+    'OF': ['outfielder', 'outfielders', '外野手'],
+    'DH': ['designated hitter', 'dh', '指定打擊'],
+    'SP': ['starting pitcher', 'starting pitchers', 'starter', 'starters', 'sp', '先發投手', '先發'],
+    'RP': ['relief pitcher', 'relievers', 'reliever', 'bullpen', 'rp', '後援投手', '牛棚', '中繼'],
+}
+
+
+# ============================================
+# 別名比對
+# ============================================
+
+def _is_ascii(text: str) -> bool:
+    return all(ord(ch) < 128 for ch in text)
+
+
+def _compile_alias(alias: str) -> re.Pattern:
+    """英文別名以單字邊界比對（避免 'hr' 命中 'three'），中文以子字串比對"""
+    if _is_ascii(alias):
+        return re.compile(r'(?<![a-z0-9])' + re.escape(alias) + r'(?![a-z0-9+%/])')
+    return re.compile(re.escape(alias))
+
+
+def _build_alias_table(mapping: Dict[str, List[str]]) -> List[Tuple[re.Pattern, str, int]]:
+    """(pattern, key, alias 長度)，依長度遞減排序：較長的別名優先（'k/9' 先於 'k'）"""
+    table = [
+        (_compile_alias(alias), key, len(alias))
+        for key, aliases in mapping.items()
+        for alias in aliases
+    ]
+    table.sort(key=lambda item: -item[2])
+    return table
+
+
+_STAT_ALIAS_TABLE = _build_alias_table({k: v['aliases'] for k, v in STAT_REGISTRY.items()})
+_TEAM_ALIAS_TABLE = _build_alias_table(TEAM_ALIASES)
+_POSITION_ALIAS_TABLE = _build_alias_table(POSITION_ALIASES)
+
+
+def _first_match(table, text: str) -> Optional[str]:
+    for pattern, key, _ in table:
+        if pattern.search(text):
+            return key
+    return None
+
+
+def detect_player_type(query: str) -> Optional[str]:
+    """從查詢中判斷打者 / 投手（無法判斷回傳 None）"""
+    query_lower = query.lower()
+    if any(kw in query_lower for kw in PITCHER_KEYWORDS):
+        return 'pitcher'
+    if any(kw in query_lower for kw in BATTER_KEYWORDS):
+        return 'batter'
+    return None
+
+
+def match_stat(query: str) -> Optional[str]:
+    """查詢中明確提到的統計項目（未提到則 None，不套用預設）"""
+    return _first_match(_STAT_ALIAS_TABLE, query.lower())
+
+
+def match_stat_prefix(text: str) -> Optional[str]:
+    """text 開頭就是統計項目時回傳該項目（"era 2024" → 'ERA'，"in war" → None）"""
+    text = text.lower()
+    for pattern, key, _ in _STAT_ALIAS_TABLE:
+        if pattern.match(text):
+            return key
+    return None
+
+
+def resolve_stat(query: str) -> Tuple[str, Dict]:
+    """
+    從查詢中解析統計項目
+
+    Returns:
+        (stat_key, registry_entry)；未偵測到時依球員類型回傳預設 WAR
+    """
+
+    player_type = detect_player_type(query)
+
+    stat_key = match_stat(query)
+
+    if stat_key is None:
+        stat_key = DEFAULT_STAT[player_type or 'batter']
+    elif stat_key == 'WAR' and player_type == 'pitcher':
+        stat_key = 'pitcher WAR'
+    elif stat_key == 'SO' and player_type == 'batter':
+        # 打者三振數：越少越好
+        return 'SO', dict(STAT_REGISTRY['SO'], type='batter', higher_is_better=False)
+
+    return stat_key, STAT_REGISTRY[stat_key]
+
+
+def resolve_team(query: str) -> Optional[str]:
+    """從查詢中解析球隊代碼（例如 'Yankees' → 'NYY'）"""
+    return _first_match(_TEAM_ALIAS_TABLE, query.lower())
+
+
+def resolve_position(query: str) -> Optional[str]:
+    """從查詢中解析守備位置（例如 'shortstop' → 'SS'）"""
+    return _first_match(_POSITION_ALIAS_TABLE, query.lower())
+
+
+def team_codes(team: str) -> List[str]:
+    """取得球隊在各資料來源的所有代碼"""
+    return TEAM_CODE_VARIANTS.get(team, [team])
+
+
+def stat_display_name(stat_key: str) -> str:
+    """顯示名稱（'pitcher WAR' → 'WAR'）"""
+    return STAT_REGISTRY[stat_key]['columns'][0] if stat_key in STAT_REGISTRY else stat_key
+
+
+def rate_stat_columns(player_type: str) -> set:
+    """註冊表中比率統計（qualifier == 'rate'）的來源欄位（給衍生指標使用）"""
+    return {
+        col
+        for entry in STAT_REGISTRY.values()
+        if entry['type'] == player_type and entry.get('qualifier') == 'rate'
+        for col in entry['columns']
+    }
+
+
+def lower_is_better_columns(player_type: str) -> set:
+    """註冊表中越低越好的來源欄位（給衍生指標使用）"""
+    return {
+        col
+        for entry in STAT_REGISTRY.values()
+        if entry['type'] == player_type and not entry['higher_is_better']
+        for col in entry['columns']
+    }
@@ -0,0 +1,339 @@
+"""
+Week 6: Statcast 排行引擎（每賽季預先排序的索引陣列）
+
+原本：handle_statcast_query 只能描述單一球員，"Who has the fastest sprint speed?" 無法回答
+現在：statcast 副表（week6_side_tables）載入時，為每個 (賽季, 指標, 門檻) 建立一個排序好的列位置陣列：
+    - 門檻依樣本數：擊球類指標看 bbe（batted-ball events），sprint_speed 看 competitive_runs
+    - Top-k：直接取排序陣列的前 k 個 → O(k)
+    - 區間過濾（"exit velo > 95 and barrel % > 15"）：排序陣列上的值單調，
+      每個條件以 searchsorted 找到切點 → 取前段 / 後段，多個條件取交集
+
+用法：
+    boards = StatcastLeaderboards.from_table(side_tables.statcast.df)
+    spec = parse_statcast_query("Who has the fastest sprint speed?")
+    if spec: result = boards.answer(spec)
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from week6_ranking_engine import DEFAULT_TOP_N, parse_qualifier, parse_seasons, parse_top_n
+from week6_side_tables import STATCAST_METRICS
+
+# ============================================
+# 配置
+# ============================================
+
+# 指標 → 樣本數欄位、單位、顯示名稱
+METRIC_INFO = {
+    'exit_velocity_avg': {'sample': 'bbe', 'unit': ' mph', 'label': '平均擊球初速', 'digits': 1},
+    'max_exit_velocity': {'sample': 'bbe', 'unit': ' mph', 'label': '最高擊球初速', 'digits': 1},
+    'launch_angle_avg': {'sample': 'bbe', 'unit': '°', 'label': '平均仰角', 'digits': 1},
+    'hard_hit_pct': {'sample': 'bbe', 'unit': '%', 'label': '強擊球率', 'digits': 1},
+    'barrel_pct': {'sample': 'bbe', 'unit': '%', 'label': 'Barrel%', 'digits': 1},
+    'xBA': {'sample': 'bbe', 'unit': '', 'label': 'xBA', 'digits': 3},
+    'xwOBA': {'sample': 'bbe', 'unit': '', 'label': 'xwOBA', 'digits': 3},
+    'sprint_speed': {'sample': 'competitive_runs', 'unit': ' ft/s', 'label': '衝刺速度', 'digits': 1},
+}
+
+# 查詢說法 → 指標（先比對較長的說法："max exit velocity" 在 "exit velocity" 之前）
+METRIC_PATTERNS = [
+    (r'max(?:imum)? exit velo(?:city)?|hardest[- ]hit ball|max ev', 'max_exit_velocity'),
+    (r'exit velo(?:city)?|\bev\b|hits? the ball hardest', 'exit_velocity_avg'),
+    (r'launch angle', 'launch_angle_avg'),
+    # "fastest" 單獨出現不代表跑速（"fastest fastball"）：需要跑壘的說法
+    (r'sprint speed|sprint|(?:fastest|slowest|quickest) (?:players?|runners?|baserunners?|guys?|hitters?)'
+     r'|\brunners?\b|running speed|foot speed|跑速|腳程', 'sprint_speed'),
+    (r'hard[- ]hit', 'hard_hit_pct'),
+    (r'barrels?', 'barrel_pct'),
+    (r'xwoba', 'xwOBA'),
+    (r'\bxba\b', 'xBA'),
+]
+
+# 樣本門檻（與 week6_qualification 相同的名稱：qualified / half；None = 不設門檻）
+STATCAST_QUALIFIERS = {
+    'qualified': {'bbe': 100, 'competitive_runs': 10},
+    'half': {'bbe': 50, 'competitive_runs': 5},
+}
+QUALIFIER_KEYS = (None, 'half', 'qualified')
+
+COMPARISON_WORDS = {
+    '>': '>', '>=': '>=', '<': '<', '<=': '<=',
+    'over': '>', 'above': '>', 'greater than': '>', 'more than': '>', 'at least': '>=',
+    'under': '<', 'below': '<', 'less than': '<', 'at most': '<=',
+}
+
+# 投球相關的查詢（球速、被打初速）不是打者的 Statcast 排行榜
+PITCH_PATTERN = r'fastball|heater|\bpitch(?:es|ers?|ing)?\b|\bthrows?\b|\bthrown\b|球速|投手'
+
+RANK_PATTERN = r'highest|lowest|top\s*\d*|\bmost\b|best|worst|fastest|slowest|hardest|leaders?\b|leaderboard|最高|最快|排行'
+
+# ============================================
+# 查詢解析
+# ============================================
+
+def _metric_alternation() -> str:
+    return '|'.join(f'(?:{pattern})' for pattern, _ in METRIC_PATTERNS)
+
+
+def parse_conditions(query: str) -> List[Tuple[str, str, float]]:
+    """
+    解析區間條件
+
+    "exit velo > 95 and barrel % > 15" → [('exit_velocity_avg', '>', 95.0), ('barrel_pct', '>', 15.0)]
+    "sprint speed of at least 29"      → [('sprint_speed', '>=', 29.0)]
+    """
+
+    comparisons = '|'.join(re.escape(word) for word in sorted(COMPARISON_WORDS, key=len, reverse=True))
+    pattern = (rf'({_metric_alternation()})'
+               r'(?:\s*(?:%|pct|percent(?:age)?|rate|avg|average|of|is|mph))*'
+               rf'\s*({comparisons})\s*(\d*\.?\d+)')
+
+    conditions = []
+    for match in re.finditer(pattern, query.lower()):
+        metric = next(m for p, m in METRIC_PATTERNS if re.fullmatch(p, match.group(1)))
+        conditions.append((metric, COMPARISON_WORDS[match.group(2)], float(match.group(3))))
+    return conditions
+
+
+def parse_statcast_query(query: str) -> Optional[Dict]:
+    """
+    解析 Statcast 排行 / 過濾查詢；沒有排行字眼或過濾條件的查詢回傳 None
+
+    只看字眼，不認得球員名字："What is Aaron Judge's best exit velocity?" 也會被解析成排行，
+    呼叫端需先排除提到已知球員的查詢（EnhancedSmartRouter.find_known_player）
+
+    "Who has the fastest sprint speed?"         → {'metric': 'sprint_speed', 'conditions': [], ...}
+    "exit velo > 95 and barrel % > 15 in 2024"  → {'metric': 'exit_velocity_avg', 'conditions': [...], ...}
+    """
+
+    query_lower = query.lower()
+    if re.search(PITCH_PATTERN, query_lower):
+        return None
+    conditions = parse_conditions(query)
+    if not conditions and not re.search(RANK_PATTERN, query_lower):
+        return None
+
+    metric = conditions[0][0] if conditions else None
+    if metric is None:
+        for pattern, name in METRIC_PATTERNS:
+            if re.search(pattern, query_lower):
+                metric = name
+                break
+    if metric is None:
+        return None
+
+    return {
+        'metric': metric,
+        'ascending': bool(re.search(r'lowest|slowest|worst|最低|最慢', query_lower)),
+        'conditions': conditions,
+        'seasons': parse_seasons(query),
+        'qualifier': parse_qualifier(query),
+        'top_n': parse_top_n(query) or DEFAULT_TOP_N,
+    }
+
+# ============================================
+# 排行索引
+# ============================================
+
+class StatcastLeaderboards:
+    """
+    boards[(season, metric, qualifier)] → 由高到低排序的列位置（不含缺值）
+    values[(season, metric, qualifier)] → 對應的負值（遞增，供 searchsorted）
+    """
+
+    def __init__(self, statcast_df: pd.DataFrame):
+        df = statcast_df.reset_index(drop=True)
+        self.player = df['player'].to_numpy(dtype=str)
+        self.season = df['season'].to_numpy(dtype=np.int32)
+        self.samples = {
+            column: np.nan_to_num(df[column].to_numpy(dtype=np.float64)) if column in df else np.zeros(len(df))
+            for column in ('bbe', 'competitive_runs')
+        }
+        self.metrics = {
+            metric: df[metric].to_numpy(dtype=np.float64) if metric in df else np.full(len(df), np.nan)
+            for metric in STATCAST_METRICS
+        }
+
+        self.boards: Dict[Tuple, np.ndarray] = {}
+        self.values: Dict[Tuple, np.ndarray] = {}
+        for season in np.unique(self.season):
+            in_season = np.flatnonzero(self.season == season)
+            for metric, values in self.metrics.items():
+                sample = self.samples[METRIC_INFO[metric]['sample']]
+                for qualifier in QUALIFIER_KEYS:
+                    rows = in_season[~np.isnan(values[in_season])]
+                    if qualifier is not None:
+                        rows = rows[sample[rows] >= STATCAST_QUALIFIERS[qualifier][METRIC_INFO[metric]['sample']]]
+                    order = rows[np.argsort(-values[rows], kind='stable')]
+                    key = (int(season), metric, qualifier)
+                    self.boards[key] = order
+                    self.values[key] = -values[order]
+
+    @classmethod
+    def from_table(cls, statcast_df: pd.DataFrame) -> 'StatcastLeaderboards':
+        return cls(statcast_df)
+
+    def __len__(self) -> int:
+        return len(self.player)
+
+    @property
+    def seasons(self) -> List[int]:
+        return sorted({key[0] for key in self.boards})
+
+    # ---------- 查詢 ----------
+
+    def top(self, season: int, metric: str, k: int, qualifier: Optional[str] = 'qualified',
+            ascending: bool = False) -> np.ndarray:
+        """排序陣列的前 / 後 k 個 → O(k)"""
+        board = self.boards.get((season, metric, qualifier), np.empty(0, dtype=np.int64))
+        return board[::-1][:k] if ascending else board[:k]
+
+    def filter(self, season: int, conditions: List[Tuple[str, str, float]],
+               qualifier: Optional[str] = 'qualified') -> np.ndarray:
+        """
+        符合所有條件的列位置（依第一個條件的指標由高到低）
+
+        每個條件在 (賽季, 指標) 的排序陣列上以 searchsorted 找到切點
+        """
+
+        result = None
+        for metric, op, threshold in conditions:
+            key = (season, metric, qualifier)
+            board, negated = self.boards.get(key), self.values.get(key)
+            if board is None:
+                return np.empty(0, dtype=np.int64)
+            # negated 遞增：value > t ⇔ -value < -t
+            if op in ('>', '>='):
+                cut = np.searchsorted(negated, -threshold, side='left' if op == '>' else 'right')
+                rows = board[:cut]
+            else:
+                cut = np.searchsorted(negated, -threshold, side='right' if op == '<' else 'left')
+                rows = board[cut:]
+            result = rows if result is None else result[np.isin(result, rows)]
+        return result if result is not None else np.empty(0, dtype=np.int64)
+
+    def entry(self, row: int, metrics: List[str]) -> Dict:
+        entry = {'player': str(self.player[row]), 'season': int(self.season[row])}
+        for metric in metrics:
+            entry[metric] = round(float(self.metrics[metric][row]), 3)
+        entry['bbe'] = int(self.samples['bbe'][row])
+        entry['competitive_runs'] = int(self.samples['competitive_runs'][row])
+        return entry
+
+    # ---------- 回答 ----------
+
+    def answer(self, spec: Dict) -> Dict:
+        """
+        回答 parse_statcast_query 的結果；多個賽季時合併各賽季的前 k 名
+
+        Returns:
+            {'type': 'statcast', 'metric', 'seasons', 'conditions', 'leaderboard', 'answer'}
+        """
+
+        if len(self) == 0:
+            return {
+                'type': 'statcast',
+                'error': '沒有 Statcast 數據',
+                'answer': 'Statcast 數據尚未收集，請先執行: python week6_side_tables.py statcast 2024 2025'
+            }
+
+        seasons = [s for s in (spec['seasons'] or self.seasons[-1:]) if s in self.seasons]
+        if not seasons:
+            return {
+                'type': 'statcast',
+                'error': '找不到年份',
+                'answer': f"沒有 {', '.join(map(str, spec['seasons']))} 的 Statcast 記錄"
+                          f"（記錄年份：{', '.join(map(str, self.seasons))}）"
+            }
+
+        metric, conditions, qualifier, top_n = spec['metric'], spec['conditions'], spec['qualifier'], spec['top_n']
+        if conditions:
+            rows = np.concatenate([self.filter(season, conditions, qualifier) for season in seasons])
+        else:
+            rows = np.concatenate([self.top(season, metric, top_n, qualifier, spec['ascending'])
+                                   for season in seasons])
+
+        # 多個賽季：各賽季已排序的候選合併後再取前 k 名
+        if len(seasons) > 1 and len(rows):
+            score = self.metrics[metric][rows] * (1 if spec['ascending'] else -1)
+            rows = rows[np.argsort(score, kind='stable')]
+        if not conditions:
+            rows = rows[:top_n]
+
+        shown = [metric] + [m for m, _, _ in conditions if m != metric]
+        leaderboard = [self.entry(int(row), shown) for row in rows]
+
+        info = METRIC_INFO[metric]
+        span = f"{seasons[0]}–{seasons[-1]}" if len(seasons) > 1 else str(seasons[0])
+        threshold = STATCAST_QUALIFIERS.get(qualifier, {}).get(info['sample'])
+        sample_note = f"（{info['sample']} ≥ {threshold}）" if threshold else "（不設門檻）"
+
+        if conditions:
+            condition_text = ' 且 '.join(f"{METRIC_INFO[m]['label']} {op} {value:g}" for m, op, value in conditions)
+            title = f"{span} {condition_text}：{len(leaderboard)} 位球員{sample_note}"
+        else:
+            order = '最低' if spec['ascending'] else '最高'
+            title = f"{span} {info['label']}{order}排行{sample_note}"
+
+        answer = f"{title}\n\n" if leaderboard else f"{title}\n\n沒有符合條件的球員"
+        for rank, entry in enumerate(leaderboard, 1):
+            values = '，'.join(f"{METRIC_INFO[m]['label']} {entry[m]:.{METRIC_INFO[m]['digits']}f}{METRIC_INFO[m]['unit']}"
+                              for m in shown)
+            season_text = f", {entry['season']}" if len(seasons) > 1 else ""
+            answer += f"{rank}. {entry['player']}{season_text}: {values}\n"
+
+        return {
+            'type': 'statcast',
+            'metric': metric,
+            'seasons': seasons,
+            'conditions': conditions,
+            'qualifier': qualifier,
+            'leaderboard': leaderboard,
+            'answer': answer.rstrip()
+        }
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import time
+
+    from week6_side_tables import SideTables
+
+    tables = SideTables.load()
+
+    start_time = time.perf_counter()
+    boards = StatcastLeaderboards.from_table(tables.statcast.df)
+
+    print("=" * 80)
+    print(f"Statcast 排行索引：{len(boards)} 筆 / 賽季 {boards.seasons} / {len(boards.boards)} 個排序陣列"
+          f"（建立 {(time.perf_counter() - start_time) * 1000:.1f} ms）")
+    print("=" * 80)
+
+    test_queries = [
+        "Who has the fastest sprint speed?",
+        "Top 10 exit velocity leaders",
+        "Highest barrel rate, no minimum",
+        "Which hitters have exit velo > 95 and barrel % > 15?",
+        "What is Aaron Judge's exit velocity?",
+        "Who is the fastest runner in 2024?",
+        "Who throws the fastest fastball?",
+    ]
+
+    for query in test_queries:
+        print(f"\n查詢: {query}")
+        print("-" * 80)
+        start_time = time.perf_counter()
+        spec = parse_statcast_query(query)
+        if spec is None:
+            print("（不是 Statcast 排行查詢，交給 EnhancedSmartRouter）")
+            continue
+        result = boards.answer(spec)
+        print(result['answer'])
+        print(f"⏱️  {(time.perf_counter() - start_time) * 1000:.3f} ms")
@@ -0,0 +1,198 @@
+"""
+Week 6: 串流中的即時事實驗證
+生成過程中逐段檢查數字，發現資料中沒有的數字就立即中止生成
+
+原本：week3_fact_verification 只能離線驗證，錯誤數字已經送到使用者面前，
+      唯一的補救是重問一次（再花一整輪 LLM）
+現在：
+    1. 生成前由檢索資料（data 的 stat_ 欄位）與 prompt 中出現的所有數字建立「允許數字」集合：
+       每個數值在 0-4 位小數的 floor / ceil 取整結果都放進 set（比率 ≤ 1 另加百分比形式）
+    2. 串流時每個「已完整」的數字（後面接著非數字字元）做一次 set 查找 → O(1)
+    3. 第一個不在集合中的數字 → 拋出 FactViolation，關閉上游串流（Ollama 停止生成）
+    4. 呼叫端改用限制 prompt 重新生成一次，仍失敗則使用模板回答
+
+不檢查：4 位數年份（1900-2100）、1-10 的整數（排名 / Top N）
+
+用法：
+    verifier = StreamingFactVerifier(data, reference_texts=[prompt])
+    for chunk in verify_stream(call_llm_stream(prompt, ...), verifier):
+        ...
+"""
+
+import math
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from week3_fact_verification import NUMBER_PATTERN, extract_stats_from_data
+
+MAX_DECIMALS = 4
+CONTEXT_CHARS = 30
+
+# 數字可能尚未結束的字元（"220" 之後可能還有 ".0"，"35" 之後可能還有 ",000"）
+_NUMBER_CONTINUATION = set("0123456789.,")
+
+# 重新生成時附加在 prompt 後的限制
+CONSTRAINED_SUFFIX = (
+    "\n\nIMPORTANT: Only use numbers that appear exactly in the data above. "
+    "Do not calculate, estimate or recall any other numbers."
+)
+
+
+class FactViolation(Exception):
+    """生成內容出現資料中沒有的數字"""
+
+    def __init__(self, number: float, context: str):
+        super().__init__(f"資料中沒有的數字：{number:g}（{context}）")
+        self.number = number
+        self.context = context
+
+
+def _rounding_keys(value: float) -> Iterator[Tuple[int, int]]:
+    """數值在 0..MAX_DECIMALS 位小數下的 floor / ceil 表示（(小數位數, 放大後的整數)）"""
+    for decimals in range(MAX_DECIMALS + 1):
+        scaled = value * 10 ** decimals
+        yield decimals, math.floor(scaled + 1e-9)
+        yield decimals, math.ceil(scaled - 1e-9)
+
+
+def _token_key(token: str) -> Tuple[int, int]:
+    """回答中的數字 token → (小數位數, 放大後的整數)"""
+    token = token.replace(',', '')
+    decimals = min(len(token) - token.index('.') - 1, MAX_DECIMALS) if '.' in token else 0
+    return decimals, round(float(token) * 10 ** decimals)
+
+
+class StreamingFactVerifier:
+    """
+    逐段接收生成內容，檢查每個完整的數字
+
+    allowed：允許的 (小數位數, 整數) 集合
+    feed(chunk) 回傳第一個違規（或 None）；finish() 檢查最後一段
+    """
+
+    def __init__(self, data: Optional[Dict] = None, reference_texts: Iterable[str] = (),
+                 extra_values: Iterable[float] = ()):
+        self.allowed: Set[Tuple[int, int]] = set()
+        self.checked = 0
+        self._buffer = ""
+        self._pos = 0
+
+        values: List[float] = list(extra_values)
+        if data:
+            values.extend(extract_stats_from_data(data).values())
+        for text in reference_texts:
+            values.extend(float(m.group(1).replace(',', '')) for m in NUMBER_PATTERN.finditer(text or ""))
+
+        for value in values:
+            self.allowed.update(_rounding_keys(value))
+            if abs(value) <= 1:
+                self.allowed.update(_rounding_keys(value * 100))
+
+    def is_allowed(self, token: str) -> bool:
+        value = float(token.replace(',', ''))
+        if '.' not in token and ',' not in token:
+            if 1900 <= value <= 2100 and len(token) == 4:
+                return True  # 年份
+            if 1 <= value <= 10:
+                return True  # 排名 / Top N
+        return _token_key(token) in self.allowed
+
+    def _check(self, final: bool) -> Optional[Dict]:
+        for match in NUMBER_PATTERN.finditer(self._buffer, self._pos):
+            end = match.end()
+            # 數字在緩衝區尾端（或後面只接著 "." / ","）→ 可能還沒生成完
+            if not final and (end == len(self._buffer) or (
+                    self._buffer[end] in _NUMBER_CONTINUATION and end + 1 == len(self._buffer))):
+                self._pos = match.start()
+                return None
+
+            self._pos = end
+            self.checked += 1
+            if not self.is_allowed(match.group(1)):
+                start = max(0, match.start() - CONTEXT_CHARS)
+                return {
+                    'number': float(match.group(1).replace(',', '')),
+                    'context': self._buffer[start:end + CONTEXT_CHARS].replace('\n', ' '),
+                }
+
+        # 沒有進行中的數字：保留尾端可能是數字開頭的字元
+        tail = len(self._buffer)
+        while tail > self._pos and self._buffer[tail - 1] in _NUMBER_CONTINUATION:
+            tail -= 1
+        self._pos = max(self._pos, tail)
+        return None
+
+    def feed(self, chunk: str) -> Optional[Dict]:
+        self._buffer += chunk
+        return self._check(final=False)
+
+    def finish(self) -> Optional[Dict]:
+        return self._check(final=True)
+
+    def verify_text(self, text: str) -> Optional[Dict]:
+        """一次驗證完整文字（非串流回答）"""
+        return self.feed(text) or self.finish()
+
+
+def verify_stream(chunks: Iterable[str], verifier: StreamingFactVerifier) -> Iterator[str]:
+    """
+    轉送串流內容，同時驗證
+
+    Raises:
+        FactViolation：出現不允許的數字；上游串流會先被關閉
+    """
+
+    chunks = iter(chunks)
+    try:
+        for chunk in chunks:
+            violation = verifier.feed(chunk)
+            if violation:
+                raise FactViolation(violation['number'], violation['context'])
+            yield chunk
+        violation = verifier.finish()
+        if violation:
+            raise FactViolation(violation['number'], violation['context'])
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import time
+
+    print("=" * 80)
+    print("測試串流事實驗證")
+    print("=" * 80)
+
+    data = {'top_result': {'player_name': 'Aaron Judge', 'stat_HR': 58, 'stat_AVG': 0.322,
+                           'stat_wRC+': 218.4, 'stat_OPS': 1.159, 'stat_K%': 0.251}}
+    prompt = "Player: Aaron Judge (NYY, 2024, RF, batter)\nStatistics:\n- HR: 58\n- wRC+: 218.4 (P99)"
+
+    def fake_stream(text: str):
+        for token in re.findall(r'\s*\S+', text):
+            time.sleep(0.02)
+            yield token
+
+    cases = [
+        ("正確", "Aaron Judge hit 58 home runs in 2024 with a .322 AVG, 218 wRC+ and 25.1% K rate. He ranked #1."),
+        ("錯誤", "Aaron Judge hit 62 home runs in 2024, and his OPS was 1.159 which is elite across the league."),
+    ]
+
+    for label, answer in cases:
+        verifier = StreamingFactVerifier(data, reference_texts=[prompt])
+        output = []
+        start = time.perf_counter()
+        try:
+            for chunk in verify_stream(fake_stream(answer), verifier):
+                output.append(chunk)
+            print(f"\n[{label}] ✅ 通過（檢查 {verifier.checked} 個數字）")
+        except FactViolation as e:
+            print(f"\n[{label}] ❌ 中止：{e}")
+        print(f"  已輸出：{''.join(output)!r}")
+        print(f"  耗時：{(time.perf_counter() - start) * 1000:.0f} ms / 完整生成約 {len(answer.split()) * 20} ms")
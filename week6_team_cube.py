@@ -0,0 +1,432 @@
+"""
+Week 6: 球隊 / 聯盟聚合立方體（team × season × type）
+回答球隊層級問題："Which team hit the most home runs in 2024?"、"Yankees team ERA"
+
+原本：系統只有球員層級的數據，球隊問題只能每次掃描 docs_df 再加總
+現在：建置階段以向量化 groupby 物化聚合結果
+    - 累計統計（HR、RBI、SO、W、SV、WAR ...）：加總
+    - 比率統計：依 PA（打者）/ 實際局數（投手）加權平均
+      （OPS 為 PA 加權，ERA / WHIP 為 IP 加權，與球隊實際數值一致或非常接近）
+    - 聯盟列：team = 'MLB'，由所有球員列聚合（包含交易球員的合併列，見 build_team_cube）
+立方體每個賽季只有約 31 × 2 列，查詢直接在記憶體中完成
+
+統計項目與聚合方式沿用 week6_stat_registry，欄位以顯示名稱命名（ERA、OPS、WAR ...）
+"""
+
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Dict, List, Optional
+
+from week6_stat_registry import (
+    STAT_REGISTRY,
+    TEAM_CODE_VARIANTS,
+    match_stat_prefix,
+    resolve_team,
+    stat_display_name,
+)
+from week6_qualification import ip_to_innings, is_multi_team
+
+# ============================================
+# 配置
+# ============================================
+
+DATA_DIR = "./mlb_data"
+TEAM_CUBE_FILE = os.path.join(DATA_DIR, "mlb_team_cube.parquet")
+
+CUBE_KEYS = ['season', 'team', 'type']
+LEAGUE_TEAM = 'MLB'
+
+# 交易球員的合併列（沒有分隊列時）歸入此列：計入聯盟列，但不參與球隊排名
+TRADED_TEAM = 'TOT'
+
+# parquet metadata：建置時的語料列數
+SOURCE_ROWS_KEY = 'source_rows'
+
+# 每種球員類型的加權欄位
+WEIGHT_COLUMNS = {'batter': 'PA', 'pitcher': 'IP'}
+
+# 球隊層級問題：球隊是主詞（"which team"、"by team"、"best teams"），
+# 而不是球員查詢中的修飾語（"hitters on the Yankees team"、"led the Dodgers team in WAR"）
+_TEAM_WORD = r'(?:teams?|clubs?|franchises?)'
+TEAM_QUERY_PATTERN = re.compile(
+    rf'\b(?:which|what) {_TEAM_WORD}\b'
+    rf'|\b(?:by|per|each|every|all) {_TEAM_WORD}\b'
+    rf'|\b(?:best|worst|top\s*\d*|highest|lowest) {_TEAM_WORD}\b'
+    rf'|\b{_TEAM_WORD}[- ](?:stats?|totals?|level|leaders?|rankings?|standings)\b'
+    r'|\b(?:teams|clubs|franchises) (?:with|that)\b'
+    r'|球隊|哪一?隊|隊伍|全隊'
+)
+# "team <統計>"（"Yankees team ERA"、"team home runs"）
+TEAM_STAT_PATTERN = re.compile(rf'\b{_TEAM_WORD} ')
+
+# 各資料來源球隊代碼 → 統一代碼
+_CANONICAL_TEAM = {variant: code for code, variants in TEAM_CODE_VARIANTS.items() for variant in variants}
+
+
+def canonical_team(team: str) -> str:
+    """統一球隊代碼（'TB' → 'TBR'）"""
+    return _CANONICAL_TEAM.get(team, team)
+
+
+def is_team_query(query: str) -> bool:
+    """
+    查詢是否為球隊層級（"which team"、"team ERA"、"by team"、"哪一隊"）
+
+    只出現 "team" 不算："Top 5 home run hitters on the Yankees team" 是球員排名（球隊過濾）
+    """
+    query_lower = query.lower()
+    if TEAM_QUERY_PATTERN.search(query_lower):
+        return True
+    return any(match_stat_prefix(query_lower[m.end():]) for m in TEAM_STAT_PATTERN.finditer(query_lower))
+
+
+def _cube_stats(player_type: str) -> Dict[str, Dict]:
+    """依註冊表取得該類型的立方體欄位：{顯示名稱: entry}"""
+    return {
+        stat_display_name(key): entry
+        for key, entry in STAT_REGISTRY.items()
+        if entry['type'] == player_type
+    }
+
+
+def _source_column(wide: pd.DataFrame, entry: Dict) -> Optional[str]:
+    return next((f"stat_{c}" for c in entry['columns'] if f"stat_{c}" in wide.columns), None)
+
+
+# ============================================
+# 建置
+# ============================================
+
+def build_team_cube(wide: pd.DataFrame) -> pd.DataFrame:
+    """
+    由攤平後的寬表建立聚合立方體
+
+    Args:
+        wide: week6_derived_metrics.flatten_documents 的輸出（或衍生指標檔）
+
+    Returns:
+        DataFrame：season, team, type, players, weight + 各統計欄位
+        （打者列只有打者統計，投手列只有投手統計，其餘為 NaN）
+
+    交易球員：
+        pyb.batting_stats / pitching_stats（FanGraphs 賽季排行）只給一筆合併列（team = "- - -"），
+        沒有分隊數據，無法拆到各隊 → 歸入 TRADED_TEAM 列：
+        聯盟列（MLB）包含所有球員，球隊列只包含整季待在同一隊的球員（球隊合計為下限）
+        若資料來源同時有分隊列（同一球員 / 賽季），合併列會重複計算，改用分隊列
+    """
+
+    source_rows = len(wide)
+    multi_team = is_multi_team(wide['team'])
+    player_key = wide['player_name'].astype(str) + '\x00' + wide['season'].astype(str) + '\x00' + wide['type'].astype(str)
+    has_split_rows = player_key.isin(set(player_key[~multi_team]))
+    wide = wide.loc[~(multi_team & has_split_rows.to_numpy())]
+    multi_team = is_multi_team(wide['team'])
+    cubes = []
+
+    for player_type, weight_name in WEIGHT_COLUMNS.items():
+        in_type = (wide['type'] == player_type).to_numpy()
+        rows = wide.loc[in_type]
+        if rows.empty:
+            continue
+
+        teams = rows['team'].astype(str).map(canonical_team).to_numpy(dtype=object)
+        teams[multi_team[in_type]] = TRADED_TEAM
+        keys = pd.DataFrame({
+            'season': rows['season'].to_numpy(dtype=np.int64),
+            'team': teams,
+            'type': player_type,
+        })
+
+        weight = pd.to_numeric(rows.get(f"stat_{weight_name}"), errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        if weight_name == 'IP':
+            weight = ip_to_innings(weight)
+
+        sums = {'players': np.ones(len(rows)), 'weight': weight}
+        weighted = []
+        for display, entry in _cube_stats(player_type).items():
+            col = _source_column(rows, entry)
+            if col is None:
+                continue
+            values = pd.to_numeric(rows[col], errors='coerce').to_numpy(dtype=np.float64)
+            if display == 'IP':
+                values = ip_to_innings(values)
+
+            if entry.get('aggregate') == 'weighted':
+                # 加權平均 = Σ(value × weight) / Σ(weight)，只計入有數值的列
+                present = ~np.isnan(values)
+                sums[f"{display}__wsum"] = np.where(present, values * weight, 0.0)
+                sums[f"{display}__w"] = np.where(present, weight, 0.0)
+                weighted.append(display)
+            else:
+                sums[display] = values
+
+        frame = pd.concat([keys, pd.DataFrame(sums)], axis=1)
+        team_level = frame.groupby(CUBE_KEYS, sort=True).sum(min_count=1).reset_index()
+        league_level = frame.drop(columns='team').groupby(['season', 'type'], sort=True).sum(min_count=1).reset_index()
+        league_level.insert(1, 'team', LEAGUE_TEAM)
+        cube = pd.concat([team_level, league_level], ignore_index=True)
+
+        for display in weighted:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cube[display] = cube.pop(f"{display}__wsum") / cube.pop(f"{display}__w").replace(0, np.nan)
+
+        cubes.append(cube)
+
+    if not cubes:
+        cube = pd.DataFrame(columns=CUBE_KEYS)
+    else:
+        cube = pd.concat(cubes, ignore_index=True)
+        cube['players'] = cube['players'].astype(np.int64)
+        cube = cube.sort_values(CUBE_KEYS).reset_index(drop=True)
+    cube.attrs[SOURCE_ROWS_KEY] = source_rows
+    return cube
+
+
+def save_team_cube(cube: pd.DataFrame, path: str = TEAM_CUBE_FILE):
+    """儲存立方體；建置時的語料列數寫入 parquet metadata（供 load_team_cube 檢查是否過期）"""
+    table = pa.Table.from_pandas(cube, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_ROWS_KEY.encode()] = str(cube.attrs.get(SOURCE_ROWS_KEY, '')).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+def load_team_cube(path: str = TEAM_CUBE_FILE, expected_rows: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """載入立方體（不存在、讀取失敗或與語料列數不符時回傳 None，呼叫端可即時建置）"""
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        table = pq.read_table(path)
+    except Exception as e:
+        print(f"  ⚠️  球隊立方體載入失敗：{e}")
+        return None
+
+    source_rows = (table.schema.metadata or {}).get(SOURCE_ROWS_KEY.encode(), b'').decode()
+    if expected_rows is not None and source_rows != str(expected_rows):
+        print(f"  ⚠️  球隊立方體建置時的語料列數 ({source_rows or '未知'}) 與語料 ({expected_rows}) 不符，請重新建置")
+        return None
+
+    return table.to_pandas()
+
+
+# ============================================
+# 查詢
+# ============================================
+
+class TeamCube:
+    """
+    球隊聚合立方體查詢
+
+    rank(spec)    → 球隊排名（與 RankingEngine.run 相同的輸出格式，'name' 為球隊代碼）
+    lookup(...)   → 單一球隊 / 賽季的統計（Factual）
+    """
+
+    def __init__(self, cube: pd.DataFrame):
+        # team / type 轉成 category（代碼 + 數十個字串的字典），不保留逐列的字串物件
+        self.cube = cube.reset_index(drop=True).astype({'team': 'category', 'type': 'category'})
+        self.teams_only = self.cube[~self.cube['team'].isin([LEAGUE_TEAM, TRADED_TEAM])]
+
+    def __len__(self) -> int:
+        return len(self.cube)
+
+    def latest_season(self, player_type: str) -> Optional[int]:
+        seasons = self.cube.loc[self.cube['type'] == player_type, 'season']
+        return int(seasons.max()) if len(seasons) else None
+
+    def traded_players(self, player_type: Optional[str], seasons: List[int]) -> int:
+        """未計入各隊合計的交易球員列數（TRADED_TEAM 列的 players）"""
+        rows = self.cube[(self.cube['team'] == TRADED_TEAM) & self.cube['season'].isin(seasons)]
+        if player_type:
+            rows = rows[rows['type'] == player_type]
+        return int(rows['players'].sum()) if len(rows) else 0
+
+    @staticmethod
+    def _coverage(excluded: int) -> Dict:
+        """
+        交易球員的說明（'partial' / 'excluded_players' / 'note'），附在 rank / answer_factual 的結果中，
+        讓模板與 LLM 回答都說明球隊數字為下限
+        """
+        return {
+            'partial': excluded > 0,
+            'excluded_players': excluded,
+            'note': (f"{excluded} 名賽季中被交易的球員只有合併數據、無法拆到各隊，未計入球隊合計（球隊數字為下限）"
+                     if excluded else ''),
+        }
+
+    def _aggregate(self, rows: pd.DataFrame, stat_name: str, entry: Dict) -> pd.Series:
+        """多賽季聚合（依球隊），單一賽季時等同原值"""
+        grouped = rows.groupby('team', observed=True)
+        if entry.get('aggregate') == 'weighted':
+            wsum = (rows[stat_name] * rows['weight']).groupby(rows['team'], observed=True).sum(min_count=1)
+            return wsum / grouped['weight'].sum().replace(0, np.nan)
+        return grouped[stat_name].sum(min_count=1)
+
+    def rank(self, spec: Dict) -> Dict:
+        """
+        球隊排名
+
+        Args:
+            spec: week6_ranking_engine.parse_ranking_query 的輸出（使用 stat / entry / player_type / seasons / top_n）
+        """
+
+        start_time = time.perf_counter()
+
+        entry = spec['entry']
+        player_type = spec['player_type']
+        stat_name = stat_display_name(spec['stat'])
+        seasons = spec.get('seasons') or [self.latest_season(player_type)]
+        top_n = spec.get('top_n', 5)
+
+        rows = self.teams_only[
+            (self.teams_only['type'] == player_type) & self.teams_only['season'].isin(seasons)
+        ]
+
+        results = []
+        if stat_name in rows.columns:
+            values = self._aggregate(rows, stat_name, entry).dropna()
+            values = values.sort_values(ascending=not entry['higher_is_better'], kind='stable').head(top_n)
+            season_label = int(seasons[0]) if len(seasons) == 1 else f"{min(seasons)}-{max(seasons)}"
+            results = [
+                {
+                    'rank': rank,
+                    'name': team,
+                    'team': team,
+                    'season': season_label,
+                    'stat_value': float(value),
+                    'stat_name': stat_name,
+                    'type': player_type,
+                }
+                for rank, (team, value) in enumerate(values.items(), 1)
+            ]
+
+        return {
+            'success': bool(results),
+            'query_type': 'ranking',
+            'source': 'team_cube',
+            'stat_name': stat_name,
+            'player_type': player_type,
+            'seasons': seasons,
+            'filters': {'level': 'team'},
+            'top_n': top_n,
+            'results': results,
+            **self._coverage(self.traded_players(player_type, seasons) if results else 0),
+            'message': '' if results else f'球隊立方體沒有 {stat_name} 的數據',
+            'elapsed_ms': (time.perf_counter() - start_time) * 1000
+        }
+
+    def lookup(self, team: str, season: Optional[int] = None, player_type: Optional[str] = None) -> List[Dict]:
+        """
+        取得單一球隊（或聯盟 'MLB'）的聚合統計
+
+        Returns:
+            [{'team', 'season', 'type', 'players', 'stats': {...}}, ...]（打者 / 投手各一筆）
+        """
+
+        team = canonical_team(team)
+        rows = self.cube[self.cube['team'] == team]
+        if player_type:
+            rows = rows[rows['type'] == player_type]
+        if season is None and len(rows):
+            season = int(rows['season'].max())
+        rows = rows[rows['season'] == season]
+
+        results = []
+        for _, row in rows.iterrows():
+            stat_names = _cube_stats(row['type']).keys()
+            results.append({
+                'team': str(row['team']),
+                'season': int(row['season']),
+                'type': str(row['type']),
+                'players': int(row['players']),
+                'stats': {s: float(row[s]) for s in stat_names if s in row.index and pd.notna(row[s])},
+            })
+        return results
+
+    def answer_factual(self, query: str, season: Optional[int] = None) -> Optional[Dict]:
+        """Factual 路由：球隊層級查詢（找不到球隊時回傳 None）"""
+
+        team = resolve_team(query)
+        if team is None and re.search(r'\bmlb\b|\bleague\b|聯盟', query.lower()):
+            team = LEAGUE_TEAM
+        if team is None:
+            return None
+
+        rows = self.lookup(team, season)
+        if not rows:
+            return None
+
+        return {
+            'success': True,
+            'query_type': 'factual',
+            'source': 'team_cube',
+            'team': {'name': team, 'season': rows[0]['season']},
+            'stats': {f"{r['type']} {name}": value for r in rows for name, value in r['stats'].items()},
+            'team_rows': rows,
+            # 聯盟列包含所有球員；單一球隊列不含賽季中被交易的球員
+            **self._coverage(0 if team == LEAGUE_TEAM else self.traded_players(None, [rows[0]['season']])),
+        }
+
+
+# ============================================
+# 測試
+# ============================================
+
+if __name__ == "__main__":
+
+    import json
+
+    from week6_derived_metrics import flatten_documents
+    from week6_ranking_engine import parse_ranking_query, parse_seasons
+
+    docs_file = os.path.join(DATA_DIR, "mlb_documents.json")
+
+    print("=" * 80)
+    print("測試球隊聚合立方體")
+    print("=" * 80)
+
+    if not os.path.exists(docs_file):
+        print(f"❌ 找不到數據文件：{docs_file}")
+        exit(1)
+
+    with open(docs_file, 'r', encoding='utf-8') as f:
+        docs_df = pd.DataFrame(json.load(f))
+
+    start_time = time.perf_counter()
+    cube = build_team_cube(flatten_documents(docs_df))
+    print(f"✅ 立方體建置完成：{len(cube)} 列（{(time.perf_counter() - start_time) * 1000:.1f} ms）")
+
+    team_cube = TeamCube(cube)
+
+    # 球隊層級判斷：球隊是主詞才走立方體，球員查詢中的 "team" 只是球隊過濾
+    team_level_cases = [
+        ("Which team hit the most home runs in 2024?", True),
+        ("Yankees team ERA 2024", True),
+        ("Best teams by OPS 2023", True),
+        ("Top 5 home run hitters on the Yankees team in 2024", False),
+        ("Who led the Dodgers team in WAR?", False),
+        ("Is Aaron Judge the best player on his team?", False),
+    ]
+    print("\n球隊層級判斷：")
+    for query, expected in team_level_cases:
+        print(f"  {'✅' if is_team_query(query) == expected else '❌'} {query} → {is_team_query(query)}")
+
+    for query in ["Which team hit the most home runs in 2024?", "Best team ERA 2022-2025", "哪一隊 2024 年 OPS 最高"]:
+        result = team_cube.rank(parse_ranking_query(query))
+        print(f"\n查詢：{query}")
+        for r in result['results']:
+            print(f"    {r['rank']}. {r['team']} ({r['season']}) - {r['stat_name']}: {r['stat_value']:.3f}")
+        if result.get('partial'):
+            print(f"  ⚠️  {result['note']}")
+
+    for query in ["Yankees team ERA 2024", "MLB league OPS 2024"]:
+        seasons = parse_seasons(query)
+        result = team_cube.answer_factual(query, seasons[-1] if seasons else None)
+        print(f"\n查詢：{query}")
+        if result:
+            print(f"  {result['team']} → {result['stats']}")
@@ -0,0 +1,76 @@
+"""
+Week 6: 純資料模板回答（LLM 無法在期限內服務時的後備）
+不經過 LLM，直接由檢索結果組出確定性的回答，毫秒內完成
+
+使用時機：
+    - LLM 排程器拒絕請求（熔斷、佇列已滿、趕不上截止時間）
+    - Ollama 回傳錯誤
+回答內容只包含檢索到的數據，格式與 LLM 回答的開頭一致
+（Factual 先給數字、Ranking 以「根據 ... 數據，排名如下：」開頭）
+"""
+
+from typing import Dict, List
+
+from week6_prompt_builder import ANALYSIS_STATS, format_value, select_relevant_stats
+
+
+FALLBACK_NOTE = "（系統忙碌，以下為資料摘要）"
+
+
+def factual_template(query: str, player: Dict) -> str:
+    """Factual：查詢提到的統計優先，其次核心統計"""
+
+    stats = {k[len('stat_'):]: v for k, v in player.items() if k.startswith('stat_')}
+    selected = select_relevant_stats(stats, query, player.get('type', 'batter'), limit=5)
+
+    header = f"{player['player_name']}（{player['team']}，{player['season']} 賽季）"
+    if not selected:
+        return f"{FALLBACK_NOTE}\n{header}：沒有可用的統計數據。"
+
+    name, value = selected[0]
+    lines = [FALLBACK_NOTE, f"{header}的 {name} 為 {format_value(value)}。"]
+    if len(selected) > 1:
+        lines.append("其他數據：" + "、".join(f"{n} {format_value(v)}" for n, v in selected[1:]))
+    return "\n".join(lines)
+
+
+def ranking_template(ranking_results: Dict) -> str:
+    """Ranking：直接列出排名"""
+
+    results = ranking_results.get('results', [])
+    if not results:
+        return "抱歉，找不到符合條件的球員。"
+
+    seasons = ranking_results.get('seasons') or []
+    scope = f"{min(seasons)}-{max(seasons)} " if len(seasons) > 1 else (f"{seasons[0]} " if seasons else "")
+    is_team_ranking = ranking_results.get('source') == 'team_cube'
+
+    lines = [FALLBACK_NOTE, f"根據 {scope}賽季 {ranking_results['stat_name']} 數據，排名如下："]
+    for r in results:
+        label = r['name'] if is_team_ranking else f"{r['name']} ({r['team']})"
+        lines.append(f"{r['rank']}. {label} - {format_value(r['stat_value'])}")
+    if ranking_results.get('partial'):
+        lines.append(f"註：{ranking_results['note']}")
+    return "\n".join(lines)
+
+
+def analysis_template(player_name: str, stats_over_time: List[Dict]) -> str:
+    """Analysis：逐季列出關鍵統計與逐年變化"""
+
+    if not stats_over_time:
+        return "抱歉，找不到相關球員數據。"
+
+    lines = [FALLBACK_NOTE, f"{player_name} 生涯數據："]
+    for season_data in stats_over_time:
+        stats = season_data['stats'] or {}
+        derived = season_data.get('derived', {})
+        parts = []
+        for name in ANALYSIS_STATS.get(season_data['type'], []):
+            if stats.get(name) is None:
+                continue
+            part = f"{name} {format_value(stats[name])}"
+            if 'pct' in derived.get(name, {}):
+                part += f"（聯盟百分位 {derived[name]['pct']:.0f}）"
+            parts.append(part)
+        lines.append(f"  {season_data['season']} {season_data['team']}：{'、'.join(parts) or 'N/A'}")
+    return "\n".join(lines)